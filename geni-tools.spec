@@ -102,9 +102,15 @@ rm -rf $RPM_BUILD_ROOT
 %{python_sitelib}/gcf/geni/auth/abac_authorizer.py
 %{python_sitelib}/gcf/geni/auth/abac_authorizer.pyc
 %{python_sitelib}/gcf/geni/auth/abac_authorizer.pyo
+%{python_sitelib}/gcf/geni/auth/abac_policy.py
+%{python_sitelib}/gcf/geni/auth/abac_policy.pyc
+%{python_sitelib}/gcf/geni/auth/abac_policy.pyo
 %{python_sitelib}/gcf/geni/auth/abac_resource_manager.py
 %{python_sitelib}/gcf/geni/auth/abac_resource_manager.pyc
 %{python_sitelib}/gcf/geni/auth/abac_resource_manager.pyo
+%{python_sitelib}/gcf/geni/auth/allocation_ledger.py
+%{python_sitelib}/gcf/geni/auth/allocation_ledger.pyc
+%{python_sitelib}/gcf/geni/auth/allocation_ledger.pyo
 %{python_sitelib}/gcf/geni/auth/argument_guard.py
 %{python_sitelib}/gcf/geni/auth/argument_guard.pyc
 %{python_sitelib}/gcf/geni/auth/argument_guard.pyo
@@ -222,6 +228,9 @@ rm -rf $RPM_BUILD_ROOT
 %{python_sitelib}/gcf/omnilib/handler.py
 %{python_sitelib}/gcf/omnilib/handler.pyc
 %{python_sitelib}/gcf/omnilib/handler.pyo
+%{python_sitelib}/gcf/omnilib/importtime.py
+%{python_sitelib}/gcf/omnilib/importtime.pyc
+%{python_sitelib}/gcf/omnilib/importtime.pyo
 %{python_sitelib}/gcf/omnilib/stitch/GENIObject.py
 %{python_sitelib}/gcf/omnilib/stitch/GENIObject.pyc
 %{python_sitelib}/gcf/omnilib/stitch/GENIObject.pyo
@@ -267,6 +276,15 @@ rm -rf $RPM_BUILD_ROOT
 %{python_sitelib}/gcf/omnilib/util/abac.py
 %{python_sitelib}/gcf/omnilib/util/abac.pyc
 %{python_sitelib}/gcf/omnilib/util/abac.pyo
+%{python_sitelib}/gcf/omnilib/util/adcache.py
+%{python_sitelib}/gcf/omnilib/util/adcache.pyc
+%{python_sitelib}/gcf/omnilib/util/adcache.pyo
+%{python_sitelib}/gcf/omnilib/util/aggnickcache.py
+%{python_sitelib}/gcf/omnilib/util/aggnickcache.pyc
+%{python_sitelib}/gcf/omnilib/util/aggnickcache.pyo
+%{python_sitelib}/gcf/omnilib/util/credcache.py
+%{python_sitelib}/gcf/omnilib/util/credcache.pyc
+%{python_sitelib}/gcf/omnilib/util/credcache.pyo
 %{python_sitelib}/gcf/omnilib/util/credparsing.py
 %{python_sitelib}/gcf/omnilib/util/credparsing.pyc
 %{python_sitelib}/gcf/omnilib/util/credparsing.pyo
@@ -279,6 +297,9 @@ rm -rf $RPM_BUILD_ROOT
 %{python_sitelib}/gcf/omnilib/util/faultPrinting.py
 %{python_sitelib}/gcf/omnilib/util/faultPrinting.pyc
 %{python_sitelib}/gcf/omnilib/util/faultPrinting.pyo
+%{python_sitelib}/gcf/omnilib/util/fanout.py
+%{python_sitelib}/gcf/omnilib/util/fanout.pyc
+%{python_sitelib}/gcf/omnilib/util/fanout.pyo
 %{python_sitelib}/gcf/omnilib/util/files.py
 %{python_sitelib}/gcf/omnilib/util/files.pyc
 %{python_sitelib}/gcf/omnilib/util/files.pyo
@@ -334,6 +355,12 @@ rm -rf $RPM_BUILD_ROOT
 %{python_sitelib}/gcf/sfa/trust/rights.py
 %{python_sitelib}/gcf/sfa/trust/rights.pyc
 %{python_sitelib}/gcf/sfa/trust/rights.pyo
+%{python_sitelib}/gcf/sfa/trust/signature_verifier.py
+%{python_sitelib}/gcf/sfa/trust/signature_verifier.pyc
+%{python_sitelib}/gcf/sfa/trust/signature_verifier.pyo
+%{python_sitelib}/gcf/sfa/trust/trust_store.py
+%{python_sitelib}/gcf/sfa/trust/trust_store.pyc
+%{python_sitelib}/gcf/sfa/trust/trust_store.pyo
 %{python_sitelib}/gcf/sfa/util/__init__.py
 %{python_sitelib}/gcf/sfa/util/__init__.pyc
 %{python_sitelib}/gcf/sfa/util/__init__.pyo
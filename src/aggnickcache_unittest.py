@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+""" Unit tests for lazily loaded aggregate nicknames (gcf.omnilib.util.aggnickcache)"""
+
+import ConfigParser
+import logging
+import threading
+import unittest
+from StringIO import StringIO
+
+from gcf.omnilib.util import aggnickcache
+import gcf.oscript as omni
+
+CONFIG = """[aggregate_nicknames]
+b=urn:publicid:IDN+b.example.net+authority+am,https://b.example.net/am
+c=,https://c.example.net/am
+"""
+
+class LazyAggNicknamesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('aggnickcache_unittest')
+        self.loads = 0
+
+    def loader(self):
+        self.loads += 1
+        return {'a' : ['urn:publicid:IDN+a.example.net+authority+am', 'https://a.example.net/am'],
+                'b' : ['', 'https://old.example.net/am']}
+
+    def call_with_timeout(self, func, seconds=10):
+        '''Return func(), failing the test if it does not return in time'''
+        result = []
+        t = threading.Thread(target=lambda: result.append(func()))
+        t.daemon = True
+        t.start()
+        t.join(seconds)
+        self.assertFalse(t.isAlive(), "Timed out: %s" % func)
+        return result[0]
+
+    def test_not_loaded_until_used(self):
+        nicknames = aggnickcache.LazyAggNicknames(self.loader)
+        self.assertEqual(self.loads, 0)
+        self.assertTrue('a' in nicknames)
+        self.assertEqual(len(nicknames), 2)
+        self.assertEqual(self.loads, 1)
+        self.assertTrue(nicknames.loaded)
+
+    def test_when_loaded(self):
+        nicknames = aggnickcache.LazyAggNicknames(self.loader)
+        nicknames.whenLoaded(lambda: nicknames.__setitem__('d', ['', 'https://d.example.net/am']))
+        self.assertFalse(nicknames.loaded)
+        self.assertEqual(sorted(self.call_with_timeout(nicknames.keys)), ['a', 'b', 'd'])
+        # Once loaded, functions are called right away
+        nicknames.whenLoaded(lambda: nicknames.__setitem__('e', ['', 'https://e.example.net/am']))
+        self.assertTrue('e' in nicknames)
+
+    def test_omni_config_nicknames_over_lazy_cache(self):
+        # A compiled agg_nick_cache plus an omni_config [aggregate_nicknames] section
+        nicknames = aggnickcache.LazyAggNicknames(self.loader)
+        config = {'aggregate_nicknames' : nicknames}
+        confparser = ConfigParser.RawConfigParser()
+        confparser.readfp(StringIO(CONFIG))
+        omni.load_aggregate_nicknames(config, confparser, 'omni_config', self.logger, None)
+        self.assertEqual(self.loads, 0)
+        self.assertEqual(sorted(self.call_with_timeout(nicknames.keys)), ['a', 'b', 'c'])
+        self.assertEqual(nicknames['b'], ['urn:publicid:IDN+b.example.net+authority+am', 'https://b.example.net/am'])
+        self.assertEqual(nicknames['c'], ['', 'https://c.example.net/am'])
+        self.assertEqual(self.loads, 1)
+
+    def test_loaded_once_across_threads(self):
+        nicknames = aggnickcache.LazyAggNicknames(self.loader)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(len(nicknames))) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        self.assertEqual(results, [2] * 8)
+        self.assertEqual(self.loads, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+""" Unit tests for parsing credentials once (gcf.omnilib.util.credparsing.CredentialSummary)"""
+
+import datetime
+import logging
+import unittest
+
+from gcf.omnilib.util import credparsing
+from gcf.omnilib.util.credparsing import CredentialSummary, summarize_cred
+from gcf.sfa.trust.credential import Credential
+from gcf.sfa.trust.abac_credential import ABACCredential
+from gcf.sfa.trust.credential_factory import CredentialFactory
+
+USER = 'urn:publicid:IDN+ch.example.net+user+alice'
+DELEGATEE = 'urn:publicid:IDN+ch.example.net+user+bob'
+SLICE = 'urn:publicid:IDN+ch.example.net:proj+slice+s1'
+
+SIGNATURE = '''<Signature xml:id="Sig_%s" xmlns="http://www.w3.org/2000/09/xmldsig#">
+<SignedInfo/><SignatureValue>c2ln</SignatureValue></Signature>'''
+
+def credential(ref, owner, expires, parent='', type='privilege'):
+    '''A credential element as the clearinghouse writes it'''
+    return '''<credential xml:id="%s">
+ <type>%s</type>
+ <serial>8</serial>
+ <owner_gid>OWNERGID</owner_gid>
+ <owner_urn>%s</owner_urn>
+ <target_gid>TARGETGID</target_gid>
+ <target_urn>%s</target_urn>
+ <uuid/>
+ <expires>%s</expires>
+ <privileges><privilege><name>*</name><can_delegate>true</can_delegate></privilege></privileges>%s
+</credential>''' % (ref, type, owner, SLICE, expires, parent)
+
+def signed(cred, refs, declaration=True):
+    xml = ''
+    if declaration:
+        xml = '<?xml version="1.0" encoding="UTF-8"?>\n'
+    return xml + '''<signed-credential xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://www.geni.net/resources/credential/2/credential.xsd">
+%s
+<signatures>%s</signatures>
+</signed-credential>''' % (cred, ''.join([SIGNATURE % ref for ref in refs]))
+
+PLAIN = signed(credential('ref0', USER, '2026-11-16T20:00:00Z'), ['ref0'])
+
+# Bob's credential, delegated by Alice: the parent credential comes last
+# and its fields must not be taken for the delegated credential's
+PARENT = signed(credential('ref0', USER, '2026-11-16T20:00:00Z'), [], declaration=False)
+DELEGATED = signed(credential('ref1', DELEGATEE, '2026-11-01T10:00:00Z',
+                              parent='\n <parent>%s</parent>' % PARENT),
+                   ['ref0', 'ref1'])
+
+UNSIGNED = '<?xml version="1.0" encoding="UTF-8"?>\n' + \
+    credential('ref0', USER, '2026-11-16T20:00:00Z')
+
+ABAC = signed(credential('ref0', USER, '2026-11-16T20:00:00Z', type='abac'), ['ref0'])
+
+MALFORMED = PLAIN.replace('</target_urn>', '</target_urm>')
+
+class CredentialSummaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('credparsing_unittest')
+
+    def test_plain(self):
+        summary = CredentialSummary(PLAIN)
+        self.assertTrue(summary.error is None)
+        self.assertTrue(summary.signed)
+        self.assertEqual(summary.typeCount, 1)
+        self.assertEqual(summary.typeText, 'privilege')
+        self.assertEqual(summary.field('owner_urn'), USER)
+        self.assertEqual(summary.field('target_urn'), SLICE)
+        self.assertEqual(summary.field('target_gid'), 'TARGETGID')
+        self.assertEqual(summary.field('expires'), '2026-11-16T20:00:00Z')
+
+        self.assertTrue(credparsing.is_cred_xml(PLAIN))
+        self.assertTrue(credparsing.is_valid_v3(self.logger, PLAIN))
+        self.assertEqual(credparsing.get_cred_type(PLAIN), (Credential.SFA_CREDENTIAL_TYPE, "3"))
+        self.assertEqual(credparsing.get_cred_owner_urn(self.logger, PLAIN), USER)
+        self.assertEqual(credparsing.get_cred_target_urn(self.logger, PLAIN), SLICE)
+        expires = credparsing.get_cred_exp(self.logger, PLAIN)
+        self.assertEqual(expires.replace(tzinfo=None), datetime.datetime(2026, 11, 16, 20, 0, 0))
+        self.assertEqual(expires.utcoffset(), datetime.timedelta(0))
+
+    def test_delegated(self):
+        summary = CredentialSummary(DELEGATED)
+        self.assertTrue(summary.error is None)
+        self.assertTrue(summary.signed)
+        # The delegated credential and its parent
+        self.assertEqual(summary.typeCount, 2)
+        self.assertEqual(summary.typeText, 'privilege')
+        self.assertEqual(summary.field('owner_urn'), DELEGATEE)
+        self.assertEqual(summary.field('expires'), '2026-11-01T10:00:00Z')
+
+        self.assertTrue(credparsing.is_cred_xml(DELEGATED))
+        self.assertTrue(credparsing.is_valid_v3(self.logger, DELEGATED))
+        self.assertEqual(credparsing.get_cred_owner_urn(self.logger, DELEGATED), DELEGATEE)
+        self.assertEqual(credparsing.get_cred_target_urn(self.logger, DELEGATED), SLICE)
+        self.assertEqual(credparsing.get_cred_exp(self.logger, DELEGATED).replace(tzinfo=None),
+                         datetime.datetime(2026, 11, 1, 10, 0, 0))
+        # Two type elements is not a type we recognize, as before
+        self.assertEqual(credparsing.get_cred_type(DELEGATED)[0], CredentialFactory.UNKNOWN_CREDENTIAL_TYPE)
+
+    def test_unsigned(self):
+        summary = CredentialSummary(UNSIGNED)
+        self.assertTrue(summary.error is None)
+        self.assertFalse(summary.signed)
+        # The first credential is used when none is signed
+        self.assertEqual(summary.field('owner_urn'), USER)
+        self.assertEqual(summary.field('target_urn'), SLICE)
+
+        self.assertFalse(credparsing.is_cred_xml(UNSIGNED))
+        self.assertFalse(credparsing.is_valid_v3(self.logger, UNSIGNED))
+        self.assertEqual(credparsing.get_cred_type(UNSIGNED), (Credential.SFA_CREDENTIAL_TYPE, "2"))
+        # Not XML credentials, so no URN
+        self.assertEqual(credparsing.get_cred_target_urn(self.logger, UNSIGNED), "")
+
+    def test_abac(self):
+        self.assertEqual(credparsing.get_cred_type(ABAC), (ABACCredential.ABAC_CREDENTIAL_TYPE, "1"))
+
+    def test_malformed(self):
+        summary = CredentialSummary(MALFORMED)
+        self.assertFalse(summary.error is None)
+        self.assertRaises(Exception, summary.field, 'target_urn')
+        self.assertRaises(Exception, summary.field, 'owner_urn')
+
+        self.assertFalse(credparsing.is_cred_xml(MALFORMED))
+        self.assertFalse(credparsing.is_valid_v3(self.logger, MALFORMED))
+        self.assertEqual(credparsing.get_cred_type(MALFORMED)[0], CredentialFactory.UNKNOWN_CREDENTIAL_TYPE)
+
+        no_cred = '<?xml version="1.0"?><signed-credential></signed-credential>'
+        summary = CredentialSummary(no_cred)
+        self.assertTrue(summary.error is None)
+        self.assertTrue(summary.credential is None)
+        self.assertRaises(Exception, summary.field, 'target_urn')
+
+        no_field = PLAIN.replace('<target_gid>TARGETGID</target_gid>', '')
+        self.assertRaises(Exception, CredentialSummary(no_field).field, 'target_gid')
+        self.assertEqual(CredentialSummary(no_field).field('target_urn'), SLICE)
+
+    def test_summaries_remembered(self):
+        self.assertTrue(summarize_cred(PLAIN) is summarize_cred(PLAIN))
+        self.assertTrue(summarize_cred(unicode(PLAIN)) is summarize_cred(PLAIN))
+        # Whitespace padding is stripped on the left only, so is_cred_xml
+        # shares the summary of the padded credential
+        padded = '\n  ' + PLAIN + '\n'
+        self.assertTrue(credparsing.is_cred_xml(padded))
+        self.assertTrue(summarize_cred(padded.lstrip()) is summarize_cred(PLAIN + '\n'))
+        self.assertFalse(summarize_cred(None).error is None)
+        for i in range(credparsing.MAX_SUMMARIES + 1):
+            summarize_cred(PLAIN.replace('<serial>8', '<serial>%d' % i))
+        self.assertTrue(len(credparsing._summaries) <= credparsing.MAX_SUMMARIES)
+
+if __name__ == '__main__':
+    unittest.main()
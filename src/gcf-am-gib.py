@@ -67,6 +67,10 @@ def parse_args(argv):
                        help="enable debugging output")
     parser.add_option("-V", "--api-version", type=int,
                       help="AM API Version", default=2)
+    parser.add_option("--pool-size", type=int, metavar="N",
+                      help="Handle up to N calls at once on a pool of threads (default: one call at a time)")
+    parser.add_option("--queue-size", type=int, metavar="N",
+                      help="With --pool-size, answer BUSY when N calls are already waiting (default 4 per thread)")
     return parser.parse_args()
 
 def getAbsPath(path):
@@ -108,6 +112,15 @@ def main(argv=None):
 
     if opts.rootcadir is None:
         sys.exit('Missing path to trusted root certificate directory (-r argument)')
+
+    pool_size = 0
+    if opts.pool_size:
+        pool_size = int(opts.pool_size)
+    queue_size = None
+    if opts.queue_size is not None and str(opts.queue_size).strip() != "":
+        queue_size = int(opts.queue_size)
+    if pool_size < 0 or (queue_size is not None and queue_size < 1):
+        sys.exit('Pool size must not be negative, and queue size must be at least 1')
     
     certfile = getAbsPath(opts.certfile)
     keyfile = getAbsPath(opts.keyfile)
@@ -134,7 +147,9 @@ def main(argv=None):
                                      certfile=certfile,
                                      trust_roots_dir=getAbsPath(opts.rootcadir),
                                      ca_certs=comboCertsFile,
-                                     base_name=config['global']['base_name'])
+                                     base_name=config['global']['base_name'],
+                                     pool_size=pool_size,
+                                     queue_size=queue_size)
 
     logging.getLogger('gcf-am').info('GENI AM Listening on port %s...' % (opts.port))
     ams.serve_forever()
@@ -70,6 +70,12 @@ def parse_args(argv):
                        help="enable debugging output")
     parser.add_option("-V", "--api-version", type=int,
                       help="AM API Version", default=2)
+    parser.add_option("--pool-size", type=int, metavar="N",
+                      help="Handle up to N calls at once on a pool of threads (default: one call at a time)")
+    parser.add_option("--queue-size", type=int, metavar="N",
+                      help="With --pool-size, answer BUSY when N calls are already waiting (default 4 per thread)")
+    parser.add_option("--expiry-granularity", type=float, metavar="SECONDS",
+                      help="AM API v3: expire slivers in the background, sweeping at most every SECONDS. 0 expires slivers at the start of each call instead (default: 1 with --pool-size, otherwise 0)")
     parser.add_option("-D", "--delegate", metavar="DELEGATE",
                       help="Classname of aggregate delegate to instantiate (if none, reference implementation is used)")
     return parser.parse_args()
@@ -113,6 +119,20 @@ def main(argv=None):
 
     if opts.rootcadir is None:
         sys.exit('Missing path to trusted root certificate directory (-r argument)')
+
+    pool_size = 0
+    if opts.pool_size:
+        pool_size = int(opts.pool_size)
+    queue_size = None
+    if opts.queue_size is not None and str(opts.queue_size).strip() != "":
+        queue_size = int(opts.queue_size)
+    if pool_size < 0 or (queue_size is not None and queue_size < 1):
+        sys.exit('Pool size must not be negative, and queue size must be at least 1')
+    expiry_granularity = None
+    if opts.expiry_granularity is not None and str(opts.expiry_granularity).strip() != "":
+        expiry_granularity = float(opts.expiry_granularity)
+    if expiry_granularity is not None and expiry_granularity < 0:
+        sys.exit('Expiry granularity must not be negative')
     
     certfile = getAbsPath(opts.certfile)
     keyfile = getAbsPath(opts.keyfile)
@@ -168,6 +188,9 @@ def main(argv=None):
             logging.getLogger('gcf-am').error(msg)
             sys.exit(msg)
 
+    # Reload the trusted roots on SIGHUP
+    geni.CredentialVerifier.reloadRootsOnSighup()
+
     # here rootcadir is supposed to be a single file with multiple
     # certs possibly concatenated together
     comboCertsFile = geni.CredentialVerifier.getCAsFileFromDir(getAbsPath(opts.rootcadir))
@@ -190,7 +213,9 @@ def main(argv=None):
                                                      base_name=config['global']['base_name'], 
                                                      authorizer=authorizer,
                                                      resource_manager=resource_manager,
-                                                     delegate=delegate)
+                                                     delegate=delegate,
+                                                     pool_size=pool_size,
+                                                     queue_size=queue_size)
     elif opts.api_version == 3:
         ams = gcf.geni.am.am3.AggregateManagerServer((opts.host, int(opts.port)),
                                                      keyfile=keyfile,
@@ -200,7 +225,10 @@ def main(argv=None):
                                                      base_name=config['global']['base_name'],
                                                      authorizer=authorizer,
                                                      resource_manager=resource_manager,
-                                                     delegate=delegate)
+                                                     delegate=delegate,
+                                                     pool_size=pool_size,
+                                                     queue_size=queue_size,
+                                                     expiry_granularity=expiry_granularity)
     else:
         msg = "Unknown API version: %d. Valid choices are \"1\", \"2\", or \"3\""
         sys.exit(msg % (opts.api_version))
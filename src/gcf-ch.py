@@ -85,6 +85,9 @@ class CommandHandler(object):
         if not os.path.getsize(keyfile) > 0:
             sys.exit("Clearinghouse keyfile %s is empty" % keyfile)
 
+        # Reload the trusted roots on SIGHUP
+        geni.CredentialVerifier.reloadRootsOnSighup()
+
         # rootcafile is turned into a concatenated file for Python SSL use inside ch.py
         ch.runserver(addr, keyfile, certfile, 
                      getAbsPath(opts.rootcadir), config['global']['base_name'],
@@ -34,8 +34,11 @@ import ssl
 import base64
 import textwrap
 import os
+import logging
 import threading
+import Queue
 import SocketServer
+import xmlrpclib
 
 from .SecureXMLRPCServer import SecureXMLRPCServer
 from .SecureXMLRPCServer import SecureXMLRPCRequestHandler
@@ -102,3 +105,115 @@ class SecureThreadedXMLRPCServer(SocketServer.ThreadingMixIn, SecureXMLRPCServer
     def get_pem_cert(self) :
         return SecureThreadedXMLRPCRequestHandler.get_pem_cert()
 
+
+
+class SecurePooledXMLRPCServer(SecureThreadedXMLRPCServer):
+    """An extension to SecureXMLRPCServer that handles RPCs on a fixed
+    pool of worker threads, instead of a new thread per RPC.
+
+    Accepted requests wait in a queue of at most queue_size for a free
+    worker. When the queue is full the request is answered with
+    busy_result (or an XMLRPC Fault if that is None) by a separate
+    thread, without calling the registered instance. When that thread
+    falls behind too, further requests are closed unanswered."""
+
+    # Seconds to spend reading a request we will only answer BUSY
+    BUSY_TIMEOUT = 2
+    # Requests that may wait for a BUSY reply before being dropped
+    BUSY_QUEUE_SIZE = 16
+
+    def __init__(self, addr, requestHandler=SecureThreadedXMLRPCRequestHandler,
+                 logRequests=False, allow_none=False, encoding=None,
+                 bind_and_activate=True, keyfile=None, certfile=None,
+                 ca_certs=None, pool_size=8, queue_size=None,
+                 busy_result=None):
+        SecureThreadedXMLRPCServer.__init__(self, addr, requestHandler=requestHandler, \
+                                                logRequests=logRequests, allow_none=allow_none, \
+                                                encoding=encoding, \
+                                                bind_and_activate=bind_and_activate, \
+                                                keyfile=keyfile, certfile=certfile, ca_certs=ca_certs)
+        if pool_size < 1:
+            raise Exception("pool_size must be at least 1, not %r" % pool_size)
+        if queue_size is None:
+            queue_size = 4 * pool_size
+        self.pool_size = pool_size
+        self.queue_size = queue_size
+        self.busy_result = busy_result
+        self.busy_count = 0
+        # Queue(0) would be unbounded
+        self._requests = Queue.Queue(max(queue_size, 1))
+        self._replying_busy = threading.local()
+        self._busy_requests = Queue.Queue(self.BUSY_QUEUE_SIZE)
+        self._workers = []
+        for i in range(pool_size):
+            t = threading.Thread(target=self._work, name="xmlrpc-worker-%d" % i)
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+        # Answer BUSY off the accepting thread, so slow clients can't
+        # stall accepting requests the workers could take
+        t = threading.Thread(target=self._work_busy, name="xmlrpc-busy")
+        t.daemon = True
+        t.start()
+        self._busy_worker = t
+
+    def _close(self, request):
+        if hasattr(self, 'shutdown_request'):
+            self.shutdown_request(request)
+        else:
+            # python 2.6
+            self.close_request(request)
+
+    def _work(self):
+        while True:
+            request, client_address = self._requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+            self._close(request)
+
+    def _work_busy(self):
+        while True:
+            request, client_address = self._busy_requests.get()
+            self._reply_busy(request, client_address)
+
+    def process_request(self, request, client_address):
+        """Hand the request to a worker, or answer BUSY if too many are waiting"""
+        try:
+            self._requests.put_nowait((request, client_address))
+            return
+        except Queue.Full:
+            pass
+        self.busy_count += 1
+        try:
+            self._busy_requests.put_nowait((request, client_address))
+        except Queue.Full:
+            logging.getLogger('gcf.xmlrpc').warn("Dropped request from %s (%d refused so far): too busy to reply" % \
+                                                     (client_address, self.busy_count))
+            self._close(request)
+
+    def _reply_busy(self, request, client_address):
+        # Read the request on the busy thread and answer it from
+        # _dispatch without calling the real method.
+        self._replying_busy.on = True
+        try:
+            request.settimeout(self.BUSY_TIMEOUT)
+            self.finish_request(request, client_address)
+        except:
+            self.handle_error(request, client_address)
+        self._replying_busy.on = False
+        self._close(request)
+
+    def _dispatch(self, method, params):
+        if getattr(self._replying_busy, 'on', False):
+            msg = "Busy: %d requests already waiting for %d workers. Try again later." % \
+                (self._requests.qsize(), self.pool_size)
+            logging.getLogger('gcf.xmlrpc').warn("Refused %s (%d refused so far): %s" % (method, self.busy_count, msg))
+            if self.busy_result is None:
+                # 14 is BUSY in the GENI AM API
+                raise xmlrpclib.Fault(14, msg)
+            result = dict(self.busy_result)
+            result['output'] = msg
+            return result
+        return SecureThreadedXMLRPCServer._dispatch(self, method, params)
@@ -23,6 +23,8 @@
 
 from __future__ import absolute_import
 
+import threading
+
 from .resource import Resource
 
 class Aggregate(object):
@@ -30,9 +32,16 @@ class Aggregate(object):
     def __init__(self):
         self.resources = []
         self.containers = {} # of resources, not slivers
+        # Guards resources and containers for multithreaded servers
+        self.lock = threading.RLock()
+        # Incremented whenever resources or containers change, so
+        # callers can tell when something derived from them is stale
+        self.version = 0
 
     def add_resources(self, resources):
-        self.resources.extend(resources)
+        with self.lock:
+            self.resources.extend(resources)
+            self.version += 1
 
     def catalog(self, container=None):
         if container:
@@ -44,41 +53,46 @@ class Aggregate(object):
             return self.resources
 
     def allocate(self, container, resources):
-        if container not in self.containers:
-            self.containers[container] = []
-        for r in resources:
-            self.containers[container].append(r)
+        with self.lock:
+            if container not in self.containers:
+                self.containers[container] = []
+            for r in resources:
+                self.containers[container].append(r)
+            self.version += 1
 
     def deallocate(self, container, resources):
-        if container and not self.containers.has_key(container):
-            # Be flexible: if a container is specified but unknown
-            # ignore the call
-            return
-        if container and resources:
-            # deallocate the given resources from the container
-            for r in resources:
-                self.containers[container].remove(r)
-        elif container:
-            # deallocate all the resources in the container
-            container_resources = list(self.containers[container])
-            for r in container_resources:
-                self.containers[container].remove(r)
-        elif resources:
-            # deallocate the resources from their container
-            for r in resources:
-                for c in self.containers.values():
-                    if r in c:
-                        c.remove(r)
-        # Finally, check if container is empty. If so, delete it.
-        # Note cache the keys because we will be modifying the dict
-        # inside the loop
-        allkeys = self.containers.keys()
-        for k in allkeys:
-            if not self.containers[k]:
-                del self.containers[k]
+        with self.lock:
+            if container and not self.containers.has_key(container):
+                # Be flexible: if a container is specified but unknown
+                # ignore the call
+                return
+            # Match resources by id (see Resource.__eq__), removing
+            # them all in one pass over each container
+            if container and resources:
+                # deallocate the given resources from the container
+                touched = [container]
+            elif container:
+                # deallocate all the resources in the container
+                touched = [container]
+                resources = self.containers[container]
+            elif resources:
+                # deallocate the resources from their container
+                touched = self.containers.keys()
+            else:
+                touched = []
+            ids = set([r.id for r in resources or []])
+            self.version += 1
+            for k in touched:
+                self.containers[k] = [r for r in self.containers[k]
+                                      if r.id not in ids]
+                # Finally, check if container is empty. If so, delete it.
+                if not self.containers[k]:
+                    del self.containers[k]
 
     def stop(self, container):
         # Mark the resources as 'SHUTDOWN'
-        if container in self.containers:
-            for r in self.containers[container]:
-                r.status = Resource.STATUS_SHUTDOWN
+        with self.lock:
+            if container in self.containers:
+                for r in self.containers[container]:
+                    r.status = Resource.STATUS_SHUTDOWN
+                self.version += 1
@@ -41,6 +41,7 @@ import dateutil.parser
 import logging
 import os
 import string
+import threading
 import uuid
 import xml.dom.minidom as minidom
 import xmlrpclib
@@ -53,6 +54,7 @@ from ... import geni
 from ..util.urn_util import publicid_to_urn, URN
 from ..util.tz_util import tzd
 from ..SecureXMLRPCServer import SecureXMLRPCServer
+from ..SecureThreadedXMLRPCServer import SecurePooledXMLRPCServer
 from ..auth.base_authorizer import *
 from .am_method_context import AMMethodContext
 from ...gcf_version import GCF_VERSION
@@ -128,6 +130,9 @@ class ReferenceAggregateManager(object):
         self._api_version = 2
         self._am_type = "gcf"
         self._slices = dict()
+        # Guards _slices when calls are handled in parallel
+        # (see gcf-am.py --pool-size)
+        self._lock = threading.RLock()
         self._agg = Aggregate()
         self._agg.add_resources([FakeVM(self._agg) for _ in range(3)])
         self._cred_verifier = geni.CredentialVerifier(root_cert)
@@ -304,70 +309,73 @@ class ReferenceAggregateManager(object):
 
         # If we get here, the credentials give the caller
         # all needed privileges to act on the given target.
-        if slice_urn in self._slices:
-            self.logger.error('Slice %s already exists.', slice_urn)
-            return self.errorResult(17, 'Slice %s already exists' % (slice_urn))
+        # Checking, choosing resources and recording the new slice must not
+        # interleave with another call
+        with self._lock:
+            if slice_urn in self._slices:
+                self.logger.error('Slice %s already exists.', slice_urn)
+                return self.errorResult(17, 'Slice %s already exists' % (slice_urn))
 
-        rspec_dom = None
-        try:
-            rspec_dom = minidom.parseString(rspec)
-        except Exception, exc:
-            self.logger.error("Cant create sliver %s. Exception parsing rspec: %s" % (slice_urn, exc))
-            return self.errorResult(1, 'Bad Args: RSpec is unparseable')
-
-        # Look at the version of the input request RSpec
-        # Make sure it is supported
-        # Then make sure that you return an RSpec in the same format
-        # EG if both V1 and V2 are supported, and the user gives V2 request,
-        # then you must return a V2 request and not V1
-
-        allresources = self._agg.catalog()
-        allrdict = dict()
-        for r in allresources:
-            if r.available:
-                allrdict[r.id] = r
-
-        # Note: This only handles unbound nodes. Any attempt by the client
-        # to specify a node is ignored.
-        resources = dict()
-        unbound = list()
-        for elem in rspec_dom.documentElement.getElementsByTagName('node'):
-            unbound.append(elem)
-        for elem in unbound:
-            client_id = elem.getAttribute('client_id')
-            keys = allrdict.keys()
-            if keys:
-                rid = keys[0]
-                resources[client_id] = allrdict[rid]
-                del allrdict[rid]
-            else:
-                return self.errorResult(6, 'Too Big: insufficient resources to fulfill request')
-
-        # determine max expiration time from credentials
-        # do not create a sliver that will outlive the slice!
-        expiration = datetime.datetime.utcnow() + self.max_lease
-        for cred in creds:
-            credexp = self._naiveUTC(cred.expiration)
-            if credexp < expiration:
-                expiration = credexp
-
-        newslice = Slice(slice_urn, expiration)
-        self._agg.allocate(slice_urn, resources.values())
-        self._agg.allocate(user_urn, resources.values())
-        for cid, r in resources.items():
-            newslice.resources[cid] = r.id
-            r.status = Resource.STATUS_READY
-            r.available = False
-        self._slices[slice_urn] = newslice
-
-        self.logger.info("Created new slice %s" % slice_urn)
-        result = self.manifest_rspec(slice_urn)
-        self.logger.debug('Result = %s', result)
-        return dict(code=dict(geni_code=0,
-                              am_type="gcf2",
-                              am_code=0),
-                    value=result,
-                    output="")
+            rspec_dom = None
+            try:
+                rspec_dom = minidom.parseString(rspec)
+            except Exception, exc:
+                self.logger.error("Cant create sliver %s. Exception parsing rspec: %s" % (slice_urn, exc))
+                return self.errorResult(1, 'Bad Args: RSpec is unparseable')
+
+            # Look at the version of the input request RSpec
+            # Make sure it is supported
+            # Then make sure that you return an RSpec in the same format
+            # EG if both V1 and V2 are supported, and the user gives V2 request,
+            # then you must return a V2 request and not V1
+
+            allresources = self._agg.catalog()
+            allrdict = dict()
+            for r in allresources:
+                if r.available:
+                    allrdict[r.id] = r
+
+            # Note: This only handles unbound nodes. Any attempt by the client
+            # to specify a node is ignored.
+            resources = dict()
+            unbound = list()
+            for elem in rspec_dom.documentElement.getElementsByTagName('node'):
+                unbound.append(elem)
+            for elem in unbound:
+                client_id = elem.getAttribute('client_id')
+                keys = allrdict.keys()
+                if keys:
+                    rid = keys[0]
+                    resources[client_id] = allrdict[rid]
+                    del allrdict[rid]
+                else:
+                    return self.errorResult(6, 'Too Big: insufficient resources to fulfill request')
+
+            # determine max expiration time from credentials
+            # do not create a sliver that will outlive the slice!
+            expiration = datetime.datetime.utcnow() + self.max_lease
+            for cred in creds:
+                credexp = self._naiveUTC(cred.expiration)
+                if credexp < expiration:
+                    expiration = credexp
+
+            newslice = Slice(slice_urn, expiration)
+            self._agg.allocate(slice_urn, resources.values())
+            self._agg.allocate(user_urn, resources.values())
+            for cid, r in resources.items():
+                newslice.resources[cid] = r.id
+                r.status = Resource.STATUS_READY
+                r.available = False
+            self._slices[slice_urn] = newslice
+
+            self.logger.info("Created new slice %s" % slice_urn)
+            result = self.manifest_rspec(slice_urn)
+            self.logger.debug('Result = %s', result)
+            return dict(code=dict(geni_code=0,
+                                  am_type="gcf2",
+                                  am_code=0),
+                        value=result,
+                        output="")
 
     # The list of credentials are options - some single cred
     # must give the caller required permissions.
@@ -402,24 +410,25 @@ class ReferenceAggregateManager(object):
 
         # If we get here, the credentials give the caller
         # all needed privileges to act on the given target.
-        if slice_urn in self._slices:
-            sliver = self._slices[slice_urn]
-            resources = self._agg.catalog(slice_urn)
-            if sliver.status(resources) == Resource.STATUS_SHUTDOWN:
-                self.logger.info("Sliver %s not deleted because it is shutdown",
-                                 slice_urn)
-                return self.errorResult(11, "Unavailable: Slice %s is unavailable." % (slice_urn))
-
-            for r in resources:
-                r.reset()
-
-            self._agg.deallocate(slice_urn, None)
-            self._agg.deallocate(user_urn, None)
-            del self._slices[slice_urn]
-            self.logger.info("Sliver %r deleted" % slice_urn)
-            return self.successResult(True)
-        else:
-            return self._no_such_slice(slice_urn)
+        with self._lock:
+            if slice_urn in self._slices:
+                sliver = self._slices[slice_urn]
+                resources = self._agg.catalog(slice_urn)
+                if sliver.status(resources) == Resource.STATUS_SHUTDOWN:
+                    self.logger.info("Sliver %s not deleted because it is shutdown",
+                                     slice_urn)
+                    return self.errorResult(11, "Unavailable: Slice %s is unavailable." % (slice_urn))
+
+                for r in resources:
+                    r.reset()
+
+                self._agg.deallocate(slice_urn, None)
+                self._agg.deallocate(user_urn, None)
+                del self._slices[slice_urn]
+                self.logger.info("Sliver %r deleted" % slice_urn)
+                return self.successResult(True)
+            else:
+                return self._no_such_slice(slice_urn)
 
 
 
@@ -446,54 +455,55 @@ class ReferenceAggregateManager(object):
         except Exception, e:
             raise xmlrpclib.Fault('Insufficient privileges', str(e))
 
-        if slice_urn in self._slices:
-            theSlice = self._slices[slice_urn]
-            # Now calculate the status of the sliver
-            res_status = list()
-            resources = list()
-            expiration = theSlice.expiration
-            # Add UTC TZ, to have an RFC3339 compliant datetime, per the AM API
-            exp_with_tz = expiration.replace(tzinfo=dateutil.tz.tzutc())
-            exp_string = exp_with_tz.isoformat()
-
-            sliceurn = URN(urn=slice_urn)
-            sliceauth = sliceurn.getAuthority()
-            slicename = sliceurn.getName()
-            slivername = sliceauth + slicename # FIXME: really
-            # this should have a timestamp of when reserved to be unique over time
-
-            # Translate any slivername illegal punctation
-            other = '-.:/'
-            table = string.maketrans(other, '-' * len(other))
-            slivername = slivername.translate(table)
-
-            for cid, sliver_uuid in theSlice.resources.items():
-                resource = None
-                sliver_urn = None
-                for res in self._agg.resources:
-                    if res.id == sliver_uuid:
-                        self.logger.debug('Resource = %s', str(res))
-                        resources.append(res)
-                        sliver_urn = res.sliver_urn(self._urn_authority, slivername) 
-                        # Gather the status of all the resources
-                        # in the sliver. This could be actually
-                        # communicating with the resources, or simply
-                        # reporting the state of initialized, started, stopped, ...
-                        res_status.append(dict(geni_urn=sliver_urn,
-                                               geni_status=res.status,
-                                               geni_error=''))
-            self.logger.info("Calculated and returning slice %s status", slice_urn)
-            result = dict(geni_urn=slice_urn,
-                          geni_status=theSlice.status(resources),
-                          geni_resources=res_status,
-                          geni_expires=exp_string)
-            return dict(code=dict(geni_code=0,
-                                  am_type="gcf2",
-                                  am_code=0),
-                        value=result,
-                        output="")
-        else:
-            return self._no_such_slice(slice_urn)
+        with self._lock:
+            if slice_urn in self._slices:
+                theSlice = self._slices[slice_urn]
+                # Now calculate the status of the sliver
+                res_status = list()
+                resources = list()
+                expiration = theSlice.expiration
+                # Add UTC TZ, to have an RFC3339 compliant datetime, per the AM API
+                exp_with_tz = expiration.replace(tzinfo=dateutil.tz.tzutc())
+                exp_string = exp_with_tz.isoformat()
+
+                sliceurn = URN(urn=slice_urn)
+                sliceauth = sliceurn.getAuthority()
+                slicename = sliceurn.getName()
+                slivername = sliceauth + slicename # FIXME: really
+                # this should have a timestamp of when reserved to be unique over time
+
+                # Translate any slivername illegal punctation
+                other = '-.:/'
+                table = string.maketrans(other, '-' * len(other))
+                slivername = slivername.translate(table)
+
+                for cid, sliver_uuid in theSlice.resources.items():
+                    resource = None
+                    sliver_urn = None
+                    for res in self._agg.resources:
+                        if res.id == sliver_uuid:
+                            self.logger.debug('Resource = %s', str(res))
+                            resources.append(res)
+                            sliver_urn = res.sliver_urn(self._urn_authority, slivername) 
+                            # Gather the status of all the resources
+                            # in the sliver. This could be actually
+                            # communicating with the resources, or simply
+                            # reporting the state of initialized, started, stopped, ...
+                            res_status.append(dict(geni_urn=sliver_urn,
+                                                   geni_status=res.status,
+                                                   geni_error=''))
+                self.logger.info("Calculated and returning slice %s status", slice_urn)
+                result = dict(geni_urn=slice_urn,
+                              geni_status=theSlice.status(resources),
+                              geni_resources=res_status,
+                              geni_expires=exp_string)
+                return dict(code=dict(geni_code=0,
+                                      am_type="gcf2",
+                                      am_code=0),
+                            value=result,
+                            output="")
+            else:
+                return self._no_such_slice(slice_urn)
 
     def RenewSliver(self, slice_urn, credentials, expiration_time, options):
         '''Renew the local sliver that is part of the named Slice
@@ -513,40 +523,41 @@ class ReferenceAggregateManager(object):
             raise xmlrpclib.Fault('Insufficient privileges', str(e))
 
         # All the credentials we just got are valid
-        if slice_urn in self._slices:
-            # If any credential will still be valid at the newly
-            # requested time, then we can do this.
-            resources = self._agg.catalog(slice_urn)
-            sliver = self._slices.get(slice_urn)
-            if sliver.status(resources) == Resource.STATUS_SHUTDOWN:
-                self.logger.info("Sliver %s not renewed because it is shutdown",
-                                 slice_urn)
-                return self.errorResult(11, "Unavailable: Slice %s is unavailable." % (slice_urn))
-            requested = dateutil.parser.parse(str(expiration_time), tzinfos=tzd)
-            # Per the AM API, the input time should be TZ-aware
-            # But since the slice cred may not (per ISO8601), convert
-            # it to naiveUTC for comparison
-            requested = self._naiveUTC(requested)
-
-            # Find the minimum allowable expiration based on credential expiration and policy
-            min_expiration = self.min_expire(creds, self.max_lease)
-
-            # if requested > min_expiration, 
-            # If alap, set to min of requested and min_expiration
-            # Otherwise error
-            if requested > min_expiration:
-                if 'geni_extend_alap' in options and options['geni_extend_alap']:
-                    self.logger.info("Got geni_extend_alap: revising slice %s renew request from %s to %s", slice_urn, requested, min_expiration)
-                    requested = min_expiration
-                else:
-                    self.logger.info("Cannot renew %r: %s past maxlease %s", slice_urn, expiration_time, self.max_lease)
-                    return self.errorResult(19, "Out of range: Expiration %s is out of range (AM policy limits renewals to %s)." % (expiration_time, self.max_lease))
+        with self._lock:
+            if slice_urn in self._slices:
+                # If any credential will still be valid at the newly
+                # requested time, then we can do this.
+                resources = self._agg.catalog(slice_urn)
+                sliver = self._slices.get(slice_urn)
+                if sliver.status(resources) == Resource.STATUS_SHUTDOWN:
+                    self.logger.info("Sliver %s not renewed because it is shutdown",
+                                     slice_urn)
+                    return self.errorResult(11, "Unavailable: Slice %s is unavailable." % (slice_urn))
+                requested = dateutil.parser.parse(str(expiration_time), tzinfos=tzd)
+                # Per the AM API, the input time should be TZ-aware
+                # But since the slice cred may not (per ISO8601), convert
+                # it to naiveUTC for comparison
+                requested = self._naiveUTC(requested)
+
+                # Find the minimum allowable expiration based on credential expiration and policy
+                min_expiration = self.min_expire(creds, self.max_lease)
+
+                # if requested > min_expiration, 
+                # If alap, set to min of requested and min_expiration
+                # Otherwise error
+                if requested > min_expiration:
+                    if 'geni_extend_alap' in options and options['geni_extend_alap']:
+                        self.logger.info("Got geni_extend_alap: revising slice %s renew request from %s to %s", slice_urn, requested, min_expiration)
+                        requested = min_expiration
+                    else:
+                        self.logger.info("Cannot renew %r: %s past maxlease %s", slice_urn, expiration_time, self.max_lease)
+                        return self.errorResult(19, "Out of range: Expiration %s is out of range (AM policy limits renewals to %s)." % (expiration_time, self.max_lease))
                     
-            sliver.expiration = requested
-            return self.successResult(True, requested)
+                sliver.expiration = requested
+                return self.successResult(True, requested)
 
-        else:
-            return self._no_such_slice(slice_urn)
+            else:
+                return self._no_such_slice(slice_urn)
 
     def Shutdown(self, slice_urn, credentials, options):
         '''For Management Authority / operator use: shut down a badly
@@ -562,15 +573,16 @@ class ReferenceAggregateManager(object):
         except Exception, e:
             raise xmlrpclib.Fault('Insufficient privileges', str(e))
 
-        if slice_urn in self._slices:
-            resources = self._agg.catalog(slice_urn)
-            for resource in resources:
-                resource.status = Resource.STATUS_SHUTDOWN
-            self.logger.info("Sliver %r shut down" % slice_urn)
-            return self.successResult(True)
-        else:
-            self.logger.info("Shutdown: No such slice: %s.", slice_urn)
-            return self._no_such_slice(slice_urn)
+        with self._lock:
+            if slice_urn in self._slices:
+                resources = self._agg.catalog(slice_urn)
+                for resource in resources:
+                    resource.status = Resource.STATUS_SHUTDOWN
+                self.logger.info("Sliver %r shut down" % slice_urn)
+                return self.successResult(True)
+            else:
+                self.logger.info("Shutdown: No such slice: %s.", slice_urn)
+                return self._no_such_slice(slice_urn)
 
     # Return a slice and list slivers
     def decode_urns(self, urns):
@@ -854,7 +866,7 @@ class AggregateManagerServer(object):
                  trust_roots_dir=None,
                  ca_certs=None, base_name=None,
                  authorizer=None, resource_manager=None,
-                 delegate=None):
+                 delegate=None, pool_size=0, queue_size=None):
         # ca_certs arg here must be a file of concatenated certs
         if ca_certs is None:
             raise Exception('Missing CA Certs')
@@ -867,8 +879,19 @@ class AggregateManagerServer(object):
             delegate = ReferenceAggregateManager(trust_roots_dir, base_name, 
                                                  server_url)
         # FIXME: set logRequests=true if --debug
-        self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
-                                          certfile=certfile, ca_certs=ca_certs)
+        if pool_size:
+            # Handle up to pool_size calls at once, answering BUSY
+            # when more than queue_size are waiting
+            busy = dict(code=dict(geni_code=14, am_type="gcf2"),
+                        value="", output="")
+            self._server = SecurePooledXMLRPCServer(addr, keyfile=keyfile,
+                                                    certfile=certfile, ca_certs=ca_certs,
+                                                    pool_size=pool_size,
+                                                    queue_size=queue_size,
+                                                    busy_result=busy)
+        else:
+            self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
+                                              certfile=certfile, ca_certs=ca_certs)
         aggregate_manager = AggregateManager(trust_roots_dir, delegate, 
                                              authorizer, resource_manager)
         self._server.register_instance(aggregate_manager)
@@ -39,8 +39,11 @@ import base64
 import collections
 import datetime
 import dateutil.parser
+import heapq
 import logging
 import os
+import threading
+import time
 import traceback
 import uuid
 import xml.dom.minidom as minidom
@@ -54,6 +57,7 @@ from ..util.tz_util import tzd
 from ..util.urn_util import publicid_to_urn
 from ..util import urn_util as urn
 from ..SecureXMLRPCServer import SecureXMLRPCServer
+from ..SecureThreadedXMLRPCServer import SecurePooledXMLRPCServer
 
 from ...sfa.trust.credential import Credential
 from ...sfa.trust.abac_credential import ABACCredential
@@ -61,6 +65,7 @@ from ...gcf_version import GCF_VERSION
 
 from ...omnilib.util import credparsing as credutils
 
+from ..auth.allocation_ledger import AllocationLedger
 from ..auth.base_authorizer import *
 from .am_method_context import AMMethodContext
 from .api_error_exception import ApiErrorException
@@ -108,6 +113,14 @@ OPSTATE_GENI_READY = 'geni_ready'
 OPSTATE_GENI_READY_BUSY = 'geni_ready_busy'
 OPSTATE_GENI_FAILED = 'geni_failed'
 
+# Default seconds between sweeps of the expiry reaper thread
+EXPIRY_GRANULARITY_SECONDS = 1
+
+
+def _seconds(delta):
+    """Return a timedelta as float seconds (timedelta.total_seconds is new in 2.7)"""
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
 
 def isGeniCred(cred):
     """Filter (for use with filter()) to yield all 'geni_sfa' credentials
@@ -130,6 +143,7 @@ class AM_API(object):
     UNAVAILABLE = 11
     SEARCH_FAILED = 12
     UNSUPPORTED = 13
+    BUSY = 14
     ALREADY_EXISTS = 17
     # --- Non-standard errors below here. ---
     OUT_OF_RANGE = 19
@@ -257,6 +271,13 @@ class Slice(object):
         sliver.delete()
         self._slivers.remove(sliver)
 
+    def delete_slivers(self, slivers):
+        """Delete several slivers in one pass over the slice."""
+        for sliver in slivers:
+            sliver.delete()
+        doomed = set(slivers)
+        self._slivers = [s for s in self._slivers if s not in doomed]
+
     def slivers(self):
         return self._slivers
 
@@ -284,6 +305,38 @@ class ReferenceAggregateManager(object):
         self._api_version = 3
         self._am_type = "gcf"
         self._slices = dict()
+        # Guards _slices and the slivers in them when calls are
+        # handled in parallel (see gcf-am.py --pool-size)
+        self._lock = threading.RLock()
+        # Indexes over the slivers in _slices, kept up to date by
+        # _add_sliver, _set_expiration, _set_end_time and _remove_slivers:
+        # sliver URN -> Sliver
+        self._slivers = dict()
+        # sliver URN -> URN of the user that allocated it
+        self._owners = dict()
+        # sliver URN -> expiration, and a heap of (expiration, sliver URN)
+        # holding those and possibly stale earlier entries
+        self._expires_at = dict()
+        self._expirations = list()
+        # Current allocations by user, slice, project and authority,
+        # for resource quotas (see auth.abac_resource_manager)
+        self.allocation_ledger = AllocationLedger()
+        # Set by start_reaper. The reaper waits on _expiry_changed for
+        # the next sliver to come due.
+        self._reaper = None
+        self._reaper_granularity = EXPIRY_GRANULARITY_SECONDS
+        self._expiry_changed = threading.Condition(self._lock)
+        # Expiry metrics: lag is how long after its expiration a sliver
+        # was actually reaped
+        self._expired_count = 0
+        self._expiry_sweeps = 0
+        self._expiry_lag_total = 0.0
+        self._expiry_lag_max = 0.0
+        self._expiry_lag_last = 0.0
+        # Advertisement RSpecs by (available only, compressed), built
+        # from the Aggregate at version _advert_version
+        self._adverts = dict()
+        self._advert_version = None
         self._agg = Aggregate()
         self._agg.add_resources([FakeVM(self._agg) for _ in range(20)])
         self._my_urn = publicid_to_urn("%s %s %s" % (self._urn_authority, 'authority', 'am'))
@@ -297,7 +350,7 @@ class ReferenceAggregateManager(object):
         include API version information, RSpec format and version
         information, etc. Return a dict.'''
         self.logger.info("Called GetVersion")
-        self.expire_slivers()
+        self._expire_inline()
         reqver = [dict(type="GENI",
                        version="3",
                        schema="http://www.geni.net/resources/rspec/3/request.xsd",
@@ -334,7 +387,7 @@ class ReferenceAggregateManager(object):
         then only report available resources. If geni_compressed
         option is specified, then compress the result.'''
         self.logger.info('ListResources(%r)' % (options))
-        self.expire_slivers()
+        self._expire_inline()
 
         # Note this list of privileges is really the name of an operation
         # from the privilege_table in sfa/trust/rights.py
@@ -398,21 +451,9 @@ class ReferenceAggregateManager(object):
 #                # return an empty rspec
 #                return self._no_such_slice(slice_urn)
 #        else:
-        all_resources = self._agg.catalog(None)
         available = 'geni_available' in options and options['geni_available']
-        resource_xml = ""
-        for r in all_resources:
-            if available and not r.available:
-                continue
-            resource_xml = resource_xml + self.advert_resource(r)
-        result = self.advert_header() + resource_xml + self.advert_footer()
-        # Optionally compress the result
-        if 'geni_compressed' in options and options['geni_compressed']:
-            try:
-                result = base64.b64encode(zlib.compress(result))
-            except Exception, exc:
-                self.logger.error("Error compressing and encoding resource list: %s", traceback.format_exc())
-                raise Exception("Server error compressing resource list", exc)
+        compressed = 'geni_compressed' in options and options['geni_compressed']
+        result = self.advertisement(bool(available), bool(compressed))
         return self.successResult(result)
 
     # The list of credentials are options - some single cred
@@ -424,7 +465,7 @@ class ReferenceAggregateManager(object):
         Return an RSpec of the actually allocated resources.
         """
         self.logger.info('Allocate(%r)' % (slice_urn))
-        self.expire_slivers()
+        self._expire_inline()
         # Note this list of privileges is really the name of an operation
         # from the privilege_table in sfa/trust/rights.py
         # Credentials will specify a list of privileges, each of which
@@ -455,111 +496,115 @@ class ReferenceAggregateManager(object):
         # EG if both V1 and V2 are supported, and the user gives V2 request,
         # then you must return a V2 manifest and not V1
 
-        available = self.resources(available=True)
-
-        # Note: This only handles unbound nodes. Any attempt by the client
-        # to specify a node is ignored.
-        unbound = list()
-        for elem in rspec_dom.documentElement.getElementsByTagName('node'):
-            unbound.append(elem)
-        if len(unbound) > len(available):
-            # There aren't enough resources
-            self.logger.error('Too big: requesting %d resources but I only have %d',
-                              len(unbound), len(available))
-            return self.errorResult(AM_API.TOO_BIG,
-                                    'Too Big: insufficient resources to fulfill request')
-
-        resources = list()
-        for elem in unbound:
-            client_id = elem.getAttribute('client_id')
-            resource = available.pop(0)
-            resource.external_id = client_id
-            resource.available = False
-            resources.append(resource)
-
-        # determine max expiration time from credentials
-        # do not create a sliver that will outlive the slice!
-        expiration = self.min_expire(creds, self.max_alloc,
-                                     ('geni_end_time' in options
-                                      and options['geni_end_time']))
-
-        # determine end time as min of the slice 
-        # and the requested time (if any)
-        end_time = self.min_expire(creds, 
-                                   requested=('geni_end_time' in options 
-                                              and options['geni_end_time']))
-
-        # determine the start time as bounded by slice expiration and 'now'
-        now = datetime.datetime.utcnow()
-        start_time = now
-        if 'geni_start_time' in options:
-            # Need to parse this into datetime
-            start_time_raw = options['geni_start_time']
-            start_time = self._naiveUTC(dateutil.parser.parse(start_time_raw))
-        start_time = max(now, start_time)
-        if (start_time > self.min_expire(creds)):
-            return self.errorResult(AM_API.BAD_ARGS, 
-                                    "Can't request start time on sliver after slice expiration")
-
-        # determine max expiration time from credentials
-        # do not create a sliver that will outlive the slice!
-        expiration = self.min_expire(creds, self.max_alloc,
-                                     ('geni_end_time' in options
-                                      and options['geni_end_time']))
-
-        # If we're allocating something for future, give a window
-        # from start time in which to reserve
-        if start_time > now:
-            expiration = min(start_time + self.max_alloc, 
-                             self.min_expire(creds))
-
-        # if slice exists, check accept only if no  existing sliver overlaps
-        # with requested start/end time. If slice doesn't exist, create it
-        if slice_urn in self._slices:
-            newslice = self._slices[slice_urn]
-            # Check if any current slivers overlap with requested start/end
-            one_slice_overlaps = False
+        # Choosing resources and recording the new slivers must not interleave
+        # with another call
+        with self._lock:
+            available = self.resources(available=True)
+
+            # Note: This only handles unbound nodes. Any attempt by the client
+            # to specify a node is ignored.
+            unbound = list()
+            for elem in rspec_dom.documentElement.getElementsByTagName('node'):
+                unbound.append(elem)
+            if len(unbound) > len(available):
+                # There aren't enough resources
+                self.logger.error('Too big: requesting %d resources but I only have %d',
+                                  len(unbound), len(available))
+                return self.errorResult(AM_API.TOO_BIG,
+                                        'Too Big: insufficient resources to fulfill request')
+
+            resources = list()
+            for elem in unbound:
+                client_id = elem.getAttribute('client_id')
+                resource = available.pop(0)
+                resource.external_id = client_id
+                resource.available = False
+                resources.append(resource)
+            self._invalidate_advert()
+
+            # determine max expiration time from credentials
+            # do not create a sliver that will outlive the slice!
+            expiration = self.min_expire(creds, self.max_alloc,
+                                         ('geni_end_time' in options
+                                          and options['geni_end_time']))
+
+            # determine end time as min of the slice 
+            # and the requested time (if any)
+            end_time = self.min_expire(creds, 
+                                       requested=('geni_end_time' in options 
+                                                  and options['geni_end_time']))
+
+            # determine the start time as bounded by slice expiration and 'now'
+            now = datetime.datetime.utcnow()
+            start_time = now
+            if 'geni_start_time' in options:
+                # Need to parse this into datetime
+                start_time_raw = options['geni_start_time']
+                start_time = self._naiveUTC(dateutil.parser.parse(start_time_raw))
+            start_time = max(now, start_time)
+            if (start_time > self.min_expire(creds)):
+                return self.errorResult(AM_API.BAD_ARGS, 
+                                        "Can't request start time on sliver after slice expiration")
+
+            # determine max expiration time from credentials
+            # do not create a sliver that will outlive the slice!
+            expiration = self.min_expire(creds, self.max_alloc,
+                                         ('geni_end_time' in options
+                                          and options['geni_end_time']))
+
+            # If we're allocating something for future, give a window
+            # from start time in which to reserve
+            if start_time > now:
+                expiration = min(start_time + self.max_alloc, 
+                                 self.min_expire(creds))
+
+            # if slice exists, check accept only if no  existing sliver overlaps
+            # with requested start/end time. If slice doesn't exist, create it
+            if slice_urn in self._slices:
+                newslice = self._slices[slice_urn]
+                # Check if any current slivers overlap with requested start/end
+                one_slice_overlaps = False
+                for sliver in newslice.slivers():
+                    if sliver.startTime() < end_time and \
+                            sliver.endTime() > start_time:
+                        one_slice_overlaps = True
+                        break
+
+                if one_slice_overlaps:
+                    template = "Slice %s already has slivers at requested time"
+                    self.logger.error(template % (slice_urn))
+                    return self.errorResult(AM_API.ALREADY_EXISTS,
+                                            template % (slice_urn))
+            else:
+                newslice = Slice(slice_urn)
+
+            for resource in resources:
+                sliver = newslice.add_resource(resource)
+                sliver.setStartTime(start_time)
+                sliver.setEndTime(end_time)
+                sliver.setAllocationState(STATE_GENI_ALLOCATED)
+                self._add_sliver(sliver, user_urn, expiration)
+            self._agg.allocate(slice_urn, resources)
+            self._agg.allocate(user_urn, resources)
+            self._slices[slice_urn] = newslice
+
+            # Log the allocation
+            self.logger.info("Allocated new slice %s" % slice_urn)
             for sliver in newslice.slivers():
-                if sliver.startTime() < end_time and \
-                        sliver.endTime() > start_time:
-                    one_slice_overlaps = True
-                    break
-
-            if one_slice_overlaps:
-                template = "Slice %s already has slivers at requested time"
-                self.logger.error(template % (slice_urn))
-                return self.errorResult(AM_API.ALREADY_EXISTS,
-                                        template % (slice_urn))
-        else:
-            newslice = Slice(slice_urn)
+                self.logger.info("Allocated resource %s to slice %s as sliver %s",
+                                 sliver.resource().id, slice_urn, sliver.urn())
 
-        for resource in resources:
-            sliver = newslice.add_resource(resource)
-            sliver.setExpiration(expiration)
-            sliver.setStartTime(start_time)
-            sliver.setEndTime(end_time)
-            sliver.setAllocationState(STATE_GENI_ALLOCATED)
-        self._agg.allocate(slice_urn, newslice.resources())
-        self._agg.allocate(user_urn, newslice.resources())
-        self._slices[slice_urn] = newslice
-
-        # Log the allocation
-        self.logger.info("Allocated new slice %s" % slice_urn)
-        for sliver in newslice.slivers():
-            self.logger.info("Allocated resource %s to slice %s as sliver %s",
-                             sliver.resource().id, slice_urn, sliver.urn())
-
-        manifest = self.manifest_rspec(slice_urn)
-        result = dict(geni_rspec=manifest,
-                      geni_slivers=[s.status() for s in newslice.slivers()])
-        return self.successResult(result)
+            manifest = self.manifest_rspec(slice_urn)
+            result = dict(geni_rspec=manifest,
+                          geni_slivers=[s.status() for s in newslice.slivers()])
+            return self.successResult(result)
 
     def Provision(self, urns, credentials, options):
         """Allocate slivers to the given slice according to the given RSpec.
         Return an RSpec of the actually allocated resources.
         """
         self.logger.info('Provision(%r)' % (urns))
-        self.expire_slivers()
+        self._expire_inline()
 
         the_slice, slivers = self.decode_urns(urns)
         # Note this list of privileges is really the name of an operation
@@ -601,71 +646,63 @@ class ReferenceAggregateManager(object):
                                     'Bad Version: requested RSpec version %s is not a valid option.' % (rspec_version))
         self.logger.info("Provision requested RSpec %s (%s)", rspec_type, rspec_version)
 
-        # Only provision slivers that are in the scheduled time frame
-        now = datetime.datetime.utcnow()
-        provisionable_slivers = \
-            [sliver for sliver in slivers \
-                 if now >= sliver.startTime() and now <= sliver.endTime()]
-        slivers = provisionable_slivers
-
-        if len(slivers) == 0:
-            return self.errorResult(AM_API.UNAVAILABLE,
-                                    "No slivers available to provision at this time")
-
-        max_expiration = self.min_expire(creds, self.max_lease, 
-                                     ('geni_end_time' in options
-                                      and options['geni_end_time']))
-        for sliver in slivers:
-            # Extend the lease and set to PROVISIONED
-            expiration = min(sliver.endTime(), max_expiration)
-            sliver.setEndTime(expiration)
-            sliver.setExpiration(expiration)
-            sliver.setAllocationState(STATE_GENI_PROVISIONED)
-            sliver.setOperationalState(OPSTATE_GENI_NOT_READY)
-        result = dict(geni_rspec=self.manifest_rspec(the_slice.urn),
-                      geni_slivers=[s.status() for s in slivers])
-        return self.successResult(result)
+        with self._lock:
+            self._check_slivers(slivers)
+            # Only provision slivers that are in the scheduled time frame
+            now = datetime.datetime.utcnow()
+            provisionable_slivers = \
+                [sliver for sliver in slivers \
+                     if now >= sliver.startTime() and now <= sliver.endTime()]
+            slivers = provisionable_slivers
+
+            if len(slivers) == 0:
+                return self.errorResult(AM_API.UNAVAILABLE,
+                                        "No slivers available to provision at this time")
+
+            max_expiration = self.min_expire(creds, self.max_lease, 
+                                         ('geni_end_time' in options
+                                          and options['geni_end_time']))
+            for sliver in slivers:
+                # Extend the lease and set to PROVISIONED
+                expiration = min(sliver.endTime(), max_expiration)
+                self._set_end_time(sliver, expiration)
+                self._set_expiration(sliver, expiration)
+                sliver.setAllocationState(STATE_GENI_PROVISIONED)
+                sliver.setOperationalState(OPSTATE_GENI_NOT_READY)
+            result = dict(geni_rspec=self.manifest_rspec(the_slice.urn),
+                          geni_slivers=[s.status() for s in slivers])
+            return self.successResult(result)
 
     def Delete(self, urns, credentials, options):
         """Stop and completely delete the named slivers and/or slice.
         """
         self.logger.info('Delete(%r)' % (urns))
-        self.expire_slivers()
+        self._expire_inline()
 
         the_slice, slivers = self.decode_urns(urns)
         privileges = (DELETESLIVERPRIV,)
 
         self.getVerifiedCredentials(the_slice.urn, credentials, options, privileges)
 
-        # Grab the user_urn
-        user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
-
         # If we get here, the credentials give the caller
         # all needed privileges to act on the given target.
-        if the_slice.isShutdown():
-            self.logger.info("Slice %s not deleted because it is shutdown",
-                             the_slice.urn)
-            return self.errorResult(AM_API.UNAVAILABLE,
-                                    ("Unavailable: Slice %s is unavailable."
-                                     % (the_slice.urn)))
-        resources = [sliver.resource() for sliver in slivers]
-        self._agg.deallocate(the_slice.urn, resources)
-        self._agg.deallocate(user_urn, resources)
-        for sliver in slivers:
-            slyce = sliver.slice()
-            slyce.delete_sliver(sliver)
-            # If slice is now empty, delete it.
-            if not slyce.slivers():
-                self.logger.debug("Deleting empty slice %r", slyce.urn)
-                del self._slices[slyce.urn]
-        return self.successResult([s.status() for s in slivers])
+        with self._lock:
+            if the_slice.isShutdown():
+                self.logger.info("Slice %s not deleted because it is shutdown",
+                                 the_slice.urn)
+                return self.errorResult(AM_API.UNAVAILABLE,
+                                        ("Unavailable: Slice %s is unavailable."
+                                         % (the_slice.urn)))
+            self._check_slivers(slivers)
+            self._remove_slivers(slivers)
+            return self.successResult([s.status() for s in slivers])
 
     def PerformOperationalAction(self, urns, credentials, action, options):
         """Peform the specified action on the set of objects specified by
         urns.
         """
         self.logger.info('PerformOperationalAction(%r)' % (urns))
-        self.expire_slivers()
+        self._expire_inline()
 
         the_slice, slivers = self.decode_urns(urns)
         # Note this list of privileges is really the name of an operation
@@ -699,41 +736,43 @@ class ReferenceAggregateManager(object):
         # any resources are in the wrong state, stop and return an error.
         # But if the client specified best effort, trundle on and
         # do the best you can do.
-        errors = collections.defaultdict(str)
-        for sliver in slivers:
-            # ensure that the slivers are provisioned
-            if (sliver.allocationState() not in astates
-                or sliver.operationalState() not in ostates):
-                msg = "%d: Sliver %s is not in the right state for action %s."
-                msg = msg % (AM_API.UNSUPPORTED, sliver.urn(), action)
-                errors[sliver.urn()] = msg
-        best_effort = False
-        if 'geni_best_effort' in options:
-            best_effort = bool(options['geni_best_effort'])
-        if not best_effort and errors:
-            raise ApiErrorException(AM_API.UNSUPPORTED,
-                                    "\n".join(errors.values()))
-
-        # Perform the state changes:
-        for sliver in slivers:
-            if (action == 'geni_start'):
-                if (sliver.allocationState() in astates
-                    and sliver.operationalState() in ostates):
-                    sliver.setOperationalState(OPSTATE_GENI_READY)
-            elif (action == 'geni_restart'):
-                if (sliver.allocationState() in astates
-                    and sliver.operationalState() in ostates):
-                    sliver.setOperationalState(OPSTATE_GENI_READY)
-            elif (action == 'geni_stop'):
-                if (sliver.allocationState() in astates
-                    and sliver.operationalState() in ostates):
-                    sliver.setOperationalState(OPSTATE_GENI_NOT_READY)
-            else:
-                # This should have been caught above
-                msg = "Unsupported: action %s is not supported" % (action)
-                raise ApiErrorException(AM_API.UNSUPPORTED, msg)
-        return self.successResult([s.status(errors[s.urn()])
-                                   for s in slivers])
+        with self._lock:
+            self._check_slivers(slivers)
+            errors = collections.defaultdict(str)
+            for sliver in slivers:
+                # ensure that the slivers are provisioned
+                if (sliver.allocationState() not in astates
+                    or sliver.operationalState() not in ostates):
+                    msg = "%d: Sliver %s is not in the right state for action %s."
+                    msg = msg % (AM_API.UNSUPPORTED, sliver.urn(), action)
+                    errors[sliver.urn()] = msg
+            best_effort = False
+            if 'geni_best_effort' in options:
+                best_effort = bool(options['geni_best_effort'])
+            if not best_effort and errors:
+                raise ApiErrorException(AM_API.UNSUPPORTED,
+                                        "\n".join(errors.values()))
+
+            # Perform the state changes:
+            for sliver in slivers:
+                if (action == 'geni_start'):
+                    if (sliver.allocationState() in astates
+                        and sliver.operationalState() in ostates):
+                        sliver.setOperationalState(OPSTATE_GENI_READY)
+                elif (action == 'geni_restart'):
+                    if (sliver.allocationState() in astates
+                        and sliver.operationalState() in ostates):
+                        sliver.setOperationalState(OPSTATE_GENI_READY)
+                elif (action == 'geni_stop'):
+                    if (sliver.allocationState() in astates
+                        and sliver.operationalState() in ostates):
+                        sliver.setOperationalState(OPSTATE_GENI_NOT_READY)
+                else:
+                    # This should have been caught above
+                    msg = "Unsupported: action %s is not supported" % (action)
+                    raise ApiErrorException(AM_API.UNSUPPORTED, msg)
+            return self.successResult([s.status(errors[s.urn()])
+                                       for s in slivers])
 
 
     def Status(self, urns, credentials, options):
@@ -743,34 +782,37 @@ class ReferenceAggregateManager(object):
         statuses.'''
         # Loop over the resources in a sliver gathering status.
         self.logger.info('Status(%r)' % (urns))
-        self.expire_slivers()
+        self._expire_inline()
         the_slice, slivers = self.decode_urns(urns)
         privileges = (SLIVERSTATUSPRIV,)
         self.getVerifiedCredentials(the_slice.urn, credentials, options, privileges)
 
-        geni_slivers = list()
-        for sliver in slivers:
-            expiration = self.rfc3339format(sliver.expiration())
-            start_time = self.rfc3339format(sliver.startTime())
-            end_time = self.rfc3339format(sliver.endTime())
-            allocation_state = sliver.allocationState()
-            operational_state = sliver.operationalState()
-            geni_slivers.append(dict(geni_sliver_urn=sliver.urn(),
-                                     geni_expires=expiration,
-                                     geni_start_time=start_time,
-                                     geni_end_time=end_time,
-                                     geni_allocation_status=allocation_state,
-                                     geni_operational_status=operational_state,
-                                     geni_error=''))
-        result = dict(geni_urn=the_slice.urn,
-                      geni_slivers=[s.status() for s in slivers])
+        # Other calls (or the reaper) may delete these slivers meanwhile
+        with self._lock:
+            self._check_slivers(slivers)
+            geni_slivers = list()
+            for sliver in slivers:
+                expiration = self.rfc3339format(sliver.expiration())
+                start_time = self.rfc3339format(sliver.startTime())
+                end_time = self.rfc3339format(sliver.endTime())
+                allocation_state = sliver.allocationState()
+                operational_state = sliver.operationalState()
+                geni_slivers.append(dict(geni_sliver_urn=sliver.urn(),
+                                         geni_expires=expiration,
+                                         geni_start_time=start_time,
+                                         geni_end_time=end_time,
+                                         geni_allocation_status=allocation_state,
+                                         geni_operational_status=operational_state,
+                                         geni_error=''))
+            result = dict(geni_urn=the_slice.urn,
+                          geni_slivers=[s.status() for s in slivers])
         return self.successResult(result)
 
     def Describe(self, urns, credentials, options):
         """Generate a manifest RSpec for the given resources.
         """
         self.logger.info('Describe(%r)' % (urns))
-        self.expire_slivers()
+        self._expire_inline()
         # APIv3 spec says that a slice with nothing local should
         # give an empty manifest, not an error
         try:
@@ -816,9 +858,13 @@ class ReferenceAggregateManager(object):
                                     'Bad Version: requested RSpec version %s is not a valid option.' % (rspec_version))
         self.logger.info("Describe requested RSpec %s (%s)", rspec_type, rspec_version)
 
-        manifest_body = ""
-        for sliver in slivers:
-            manifest_body += self.manifest_sliver(sliver)
+        # Other calls (or the reaper) may delete these slivers meanwhile
+        with self._lock:
+            self._check_slivers(slivers)
+            manifest_body = ""
+            for sliver in slivers:
+                manifest_body += self.manifest_sliver(sliver)
+            geni_slivers = [s.status() for s in slivers]
         manifest = self.manifest_header() + manifest_body + self.manifest_footer()
         self.logger.debug("Result is now \"%s\"", manifest)
         # Optionally compress the manifest
@@ -830,7 +876,7 @@ class ReferenceAggregateManager(object):
                 raise Exception("Server error compressing resource list", exc)
         value = dict(geni_rspec=manifest,
                      geni_urn=the_slice.urn,
-                     geni_slivers=[s.status() for s in slivers])
+                     geni_slivers=geni_slivers)
         return self.successResult(value)
 
     def Renew(self, urns, credentials, expiration_time, options):
@@ -840,7 +886,7 @@ class ReferenceAggregateManager(object):
         Return False on any error, True on success.'''
 
         self.logger.info('Renew(%r, %r)' % (urns, expiration_time))
-        self.expire_slivers()
+        self._expire_inline()
         the_slice, slivers = self.decode_urns(urns)
 
         privileges = (RENEWSLIVERPRIV,)
@@ -864,35 +910,37 @@ class ReferenceAggregateManager(object):
                 self.logger.info("Got geni_extend_alap: revising slice %s renew request from %s to %s", urns, requested, expiration)
                 requested = expiration
 
-        now = datetime.datetime.utcnow()
-        if requested > expiration:
-            # Fail the call, the requested expiration exceeds the slice expir.
-            msg = (("Out of range: Expiration %s is out of range"
-                   + " (past last credential expiration of %s).")
-                   % (expiration_time, expiration))
-            self.logger.error(msg)
-            return self.errorResult(AM_API.OUT_OF_RANGE, msg)
-        elif requested < now:
-            msg = (("Out of range: Expiration %s is out of range"
-                   + " (prior to now %s).")
-                   % (expiration_time, now.isoformat()))
-            self.logger.error(msg)
-            return self.errorResult(AM_API.OUT_OF_RANGE, msg)
-        else:
-            # Renew all the named slivers
-            for sliver in slivers:
-                sliver.setExpiration(requested)
-                end_time = max(sliver.endTime(), requested)
-                sliver.setEndTime(end_time)
+        with self._lock:
+            self._check_slivers(slivers)
+            now = datetime.datetime.utcnow()
+            if requested > expiration:
+                # Fail the call, the requested expiration exceeds the slice expir.
+                msg = (("Out of range: Expiration %s is out of range"
+                       + " (past last credential expiration of %s).")
+                       % (expiration_time, expiration))
+                self.logger.error(msg)
+                return self.errorResult(AM_API.OUT_OF_RANGE, msg)
+            elif requested < now:
+                msg = (("Out of range: Expiration %s is out of range"
+                       + " (prior to now %s).")
+                       % (expiration_time, now.isoformat()))
+                self.logger.error(msg)
+                return self.errorResult(AM_API.OUT_OF_RANGE, msg)
+            else:
+                # Renew all the named slivers
+                for sliver in slivers:
+                    self._set_expiration(sliver, requested)
+                    end_time = max(sliver.endTime(), requested)
+                    self._set_end_time(sliver, end_time)
 
-        geni_slivers = [s.status() for s in slivers]
-        return self.successResult(geni_slivers)
+            geni_slivers = [s.status() for s in slivers]
+            return self.successResult(geni_slivers)
 
     def Shutdown(self, slice_urn, credentials, options):
         '''For Management Authority / operator use: shut down a badly
         behaving sliver, without deleting it to allow for forensics.'''
         self.logger.info('Shutdown(%r)' % (slice_urn))
-        self.expire_slivers()
+        self._expire_inline()
         privileges = (SHUTDOWNSLIVERPRIV,)
         self.getVerifiedCredentials(slice_urn, credentials, options, privileges)
 
@@ -900,12 +948,13 @@ class ReferenceAggregateManager(object):
         if the_urn.getType() != 'slice':
             self.logger.error('URN %s is not a slice URN.', slice_urn)
             return self.errorResult(AM_API.BAD_ARGS, "Bad Args: Not a slice URN")
-        the_slice, _ = self.decode_urns([slice_urn])
-        if the_slice.isShutdown():
-            self.logger.error('Slice %s is already shut down.', slice_urn)
-            return self.errorResult(AM_API.FORBIDDEN, "Already shut down.")
-        the_slice.shutdown()
-        return self.successResult(True)
+        with self._lock:
+            the_slice, _ = self.decode_urns([slice_urn])
+            if the_slice.isShutdown():
+                self.logger.error('Slice %s is already shut down.', slice_urn)
+                return self.errorResult(AM_API.FORBIDDEN, "Already shut down.")
+            the_slice.shutdown()
+            return self.successResult(True)
 
     def successResult(self, value):
         code_dict = dict(geni_code=0,
@@ -987,6 +1036,46 @@ class ReferenceAggregateManager(object):
                        resource_exclusive,
                        resource_available)
 
+    def advertisement(self, available=False, compressed=False):
+        """Return the advertisement RSpec, only of available resources
+        if available is True, and zlib compressed and base64 encoded if
+        compressed is True.
+
+        Each variant is built once and reused until the resources change:
+        see _invalidate_advert.
+        """
+        with self._lock:
+            if self._advert_version != self._agg.version:
+                self._adverts.clear()
+                self._advert_version = self._agg.version
+            key = (available, compressed)
+            if key in self._adverts:
+                return self._adverts[key]
+            if compressed:
+                plain = self.advertisement(available)
+                try:
+                    result = base64.b64encode(zlib.compress(plain))
+                except Exception, exc:
+                    self.logger.error("Error compressing and encoding resource list: %s", traceback.format_exc())
+                    raise Exception("Server error compressing resource list", exc)
+            else:
+                parts = [self.advert_header()]
+                for r in self._agg.catalog(None):
+                    if available and not r.available:
+                        continue
+                    parts.append(self.advert_resource(r))
+                parts.append(self.advert_footer())
+                result = ''.join(parts)
+            self._adverts[key] = result
+            return result
+
+    def _invalidate_advert(self):
+        """Forget the cached advertisements. Changes through the Aggregate
+        do this automatically; call it after changing resources directly
+        (say their availability)."""
+        with self._lock:
+            self._adverts.clear()
+
     # See https://www.protogeni.net/trac/protogeni/wiki/RspecAdOpState
     def advert_header(self):
         schema_locs = ["http://www.geni.net/resources/rspec/3",
@@ -1074,30 +1163,169 @@ class ReferenceAggregateManager(object):
         time_with_tz = dt.replace(tzinfo=dateutil.tz.tzutc())
         return time_with_tz.isoformat()
 
-    def expire_slivers(self):
-        """Look for expired slivers and clean them up. Ultimately this
-        should be run by a daemon, but until then, it is called at the
-        beginning of all methods.
-        """
-        expired = list()
-        now = datetime.datetime.utcnow()
-        for slyce in self._slices.values():
-            for sliver in slyce.slivers():
-                self.logger.debug('Checking sliver %s (expiration = %r) at %r',
-                                  sliver.urn(), sliver.expiration(), now)
-                if sliver.expiration() < now:
-                    self.logger.debug('Expring sliver %s (expiration = %r) at %r',
-                                      sliver.urn(), sliver.expiration(), now)
-                    expired.append(sliver)
-        self.logger.info('Expiring %d slivers', len(expired))
-        for sliver in expired:
-            slyce = sliver.slice()
-            slyce.delete_sliver(sliver)
+    def _add_sliver(self, sliver, user_urn, expiration):
+        """Index a new sliver, allocated by the given user, that
+        expires at the given naive UTC time."""
+        self._slivers[sliver.urn()] = sliver
+        self._owners[sliver.urn()] = user_urn
+        self._set_expiration(sliver, expiration)
+        # Each sliver is one fake node
+        self.allocation_ledger.add(sliver.urn(), sliver.slice().urn, user_urn,
+                                   sliver.startTime(), sliver.endTime(),
+                                   {'NODE' : 1})
+
+    def _set_end_time(self, sliver, end_time):
+        """Set the end time of an indexed sliver, updating the allocation ledger."""
+        sliver.setEndTime(end_time)
+        self.allocation_ledger.update(sliver.urn(), end_time=end_time)
+
+    def _set_expiration(self, sliver, expiration):
+        """Set the expiration of an indexed sliver. Use this rather than
+        Sliver.setExpiration so that expire_slivers sees the change.
+        Slivers deleted or expired meanwhile are left alone, so they
+        are not queued for expiry again."""
+        with self._lock:
+            if self._slivers.get(sliver.urn()) is not sliver:
+                return
+            sliver.setExpiration(expiration)
+            self._expires_at[sliver.urn()] = expiration
+            heapq.heappush(self._expirations, (expiration, sliver.urn()))
+            if self._expirations[0][1] == sliver.urn():
+                # Now the next sliver due: wake the reaper to reschedule
+                self._expiry_changed.notify()
+            # Renewals leave stale entries behind. Drop them once they
+            # outnumber the real ones.
+            if len(self._expirations) > 2 * len(self._expires_at) + 100:
+                self._expirations = [(exp, sliver_urn) for sliver_urn, exp
+                                     in self._expires_at.items()]
+                heapq.heapify(self._expirations)
+
+    def _check_slivers(self, slivers):
+        """Raise SEARCH_FAILED if any of the given slivers, found by
+        decode_urns before the lock was taken, has since been deleted
+        or expired by another call. Call with self._lock held."""
+        for sliver in slivers:
+            if self._slivers.get(sliver.urn()) is not sliver:
+                raise ApiErrorException(AM_API.SEARCH_FAILED,
+                                        'Unknown sliver "%s"' % (sliver.urn()))
+
+    def _remove_slivers(self, slivers):
+        """Delete the given slivers, returning their resources to the
+        aggregate, and delete any slice left empty."""
+        by_slice = dict()
+        for sliver in slivers:
+            by_slice.setdefault(sliver.slice(), []).append(sliver)
+        for slyce, doomed in by_slice.items():
+            by_owner = dict()
+            for sliver in doomed:
+                owner = self._owners.pop(sliver.urn(), None)
+                by_owner.setdefault(owner, []).append(sliver.resource())
+                self._slivers.pop(sliver.urn(), None)
+                self._expires_at.pop(sliver.urn(), None)
+                self.allocation_ledger.remove(sliver.urn())
+            for owner, resources in by_owner.items():
+                self._agg.deallocate(slyce.urn, resources)
+                if owner is not None:
+                    self._agg.deallocate(owner, resources)
+            slyce.delete_slivers(doomed)
             # If slice is now empty, delete it.
             if not slyce.slivers():
                 self.logger.debug("Deleting empty slice %r", slyce.urn)
                 del self._slices[slyce.urn]
 
+    def start_reaper(self, granularity=EXPIRY_GRANULARITY_SECONDS):
+        """Expire slivers on a background thread instead of at the
+        beginning of each call. The thread wakes when the next sliver
+        is due, but at most once every granularity seconds, so slivers
+        are reaped up to granularity seconds late."""
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper_granularity = granularity
+            self._reaper = threading.Thread(target=self._reap,
+                                            name="sliver-reaper")
+            # Do not keep the server from exiting
+            self._reaper.daemon = True
+            self._reaper.start()
+        self.logger.info("Expiring slivers in the background every %s seconds at most",
+                         granularity)
+
+    def _reap(self):
+        while True:
+            with self._lock:
+                try:
+                    self.expire_slivers()
+                except Exception:
+                    self.logger.exception("Failed to expire slivers")
+            # Sweep at most once every granularity seconds, so slivers
+            # due close together are reaped together
+            time.sleep(self._reaper_granularity)
+            with self._lock:
+                # Wait for the next sliver to come due. Calls that set
+                # an earlier expiration wake us to look again.
+                while True:
+                    wait = None
+                    if self._expirations:
+                        wait = _seconds(self._expirations[0][0] -
+                                        datetime.datetime.utcnow())
+                        if wait <= 0:
+                            break
+                    self._expiry_changed.wait(wait)
+
+    def _expire_inline(self):
+        """Expire slivers at the beginning of a call, unless the
+        reaper thread is doing it."""
+        if self._reaper is None:
+            self.expire_slivers()
+
+    def expiry_stats(self):
+        """Return a string describing slivers expired so far, and how late."""
+        with self._lock:
+            mean = 0.0
+            if self._expired_count:
+                mean = self._expiry_lag_total / self._expired_count
+            return ("%d slivers expired in %d sweeps, lag mean %.3f s, max %.3f s, last %.3f s"
+                    % (self._expired_count, self._expiry_sweeps, mean,
+                       self._expiry_lag_max, self._expiry_lag_last))
+
+    def expire_slivers(self):
+        """Look for expired slivers and clean them up. This is run by
+        the reaper thread if start_reaper was called, and otherwise at
+        the beginning of all methods.
+
+        Only the slivers due to expire are looked at, in expiration order.
+        """
+        with self._lock:
+            expired = list()
+            now = datetime.datetime.utcnow()
+            while self._expirations and self._expirations[0][0] < now:
+                expiration, sliver_urn = heapq.heappop(self._expirations)
+                if self._expires_at.get(sliver_urn) != expiration:
+                    # Deleted or renewed since this entry was queued
+                    continue
+                sliver = self._slivers.get(sliver_urn)
+                if sliver is None:
+                    # Removed without going through _remove_slivers
+                    self._expires_at.pop(sliver_urn, None)
+                    continue
+                if sliver.expiration() >= now:
+                    # Extended with Sliver.setExpiration: check again then
+                    self._set_expiration(sliver, sliver.expiration())
+                    continue
+                self.logger.debug('Expring sliver %s (expiration = %r) at %r',
+                                  sliver_urn, sliver.expiration(), now)
+                expired.append(sliver)
+                lag = _seconds(now - expiration)
+                self._expiry_lag_total += lag
+                self._expiry_lag_max = max(self._expiry_lag_max, lag)
+                self._expiry_lag_last = lag
+            if expired:
+                self.logger.info('Expiring %d slivers', len(expired))
+                self._remove_slivers(expired)
+                self._expired_count += len(expired)
+                self._expiry_sweeps += 1
+                self.logger.debug('Expiry: %s', self.expiry_stats())
+
     def decode_urns(self, urns, **kwargs):
         """Several methods need to map URNs to slivers and/or deduce
         a slice based on the slivers specified.
@@ -1110,44 +1338,37 @@ class ReferenceAggregateManager(object):
 
         Returns a slice and a list of slivers.
         """
-        slivers = list()
-        for urn_str in urns:
-            myurn = urn.URN(urn=urn_str)
-            urn_type = myurn.getType()
-            if urn_type == 'slice':
-                if self._slices.has_key(urn_str):
-                    the_slice = self._slices[urn_str]
-                    slivers.extend(the_slice.slivers())
-                else:
-                    raise ApiErrorException(AM_API.SEARCH_FAILED,
-                                            'Unknown slice "%s"' % (urn_str))
-            elif urn_type == 'sliver':
-                # Gross linear search. Maybe keep a map of known sliver urns?
-                needle = None
-                for a_slice in self._slices.values():
-                    for sliver in a_slice.slivers():
-                        if sliver.urn() == urn_str:
-                            needle = sliver
-                            break
+        with self._lock:
+            slivers = list()
+            for urn_str in urns:
+                myurn = urn.URN(urn=urn_str)
+                urn_type = myurn.getType()
+                if urn_type == 'slice':
+                    if self._slices.has_key(urn_str):
+                        the_slice = self._slices[urn_str]
+                        slivers.extend(the_slice.slivers())
+                    else:
+                        raise ApiErrorException(AM_API.SEARCH_FAILED,
+                                                'Unknown slice "%s"' % (urn_str))
+                elif urn_type == 'sliver':
+                    needle = self._slivers.get(urn_str)
                     if needle:
-                        break
-                if needle:
-                    slivers.append(needle)
+                        slivers.append(needle)
+                    else:
+                        raise ApiErrorException(AM_API.SEARCH_FAILED,
+                                                'Unknown sliver "%s"' % (urn_str))
                 else:
-                    raise ApiErrorException(AM_API.SEARCH_FAILED,
-                                            'Unknown sliver "%s"' % (urn_str))
+                    raise Exception("Bad URN type '%s'" % urn_type)
+            # Now verify that everything is part of the same slice
+            all_slices = set([o.slice() for o in slivers])
+            if len(all_slices) == 1:
+                the_slice = all_slices.pop()
+                if the_slice.isShutdown():
+                    msg = 'Refused: slice %s is shut down.' % (the_slice.urn)
+                    raise ApiErrorException(AM_API.REFUSED, msg)
+                return the_slice, slivers
             else:
-                raise Exception("Bad URN type '%s'" % urn_type)
-        # Now verify that everything is part of the same slice
-        all_slices = set([o.slice() for o in slivers])
-        if len(all_slices) == 1:
-            the_slice = all_slices.pop()
-            if the_slice.isShutdown():
-                msg = 'Refused: slice %s is shut down.' % (the_slice.urn)
-                raise ApiErrorException(AM_API.REFUSED, msg)
-            return the_slice, slivers
-        else:
-            raise Exception('Objects specify multiple slices')
+                raise Exception('Objects specify multiple slices')
 
     def normalize_credential(self, cred, ctype=Credential.SFA_CREDENTIAL_TYPE, cversion='3'):
         """This is a temporary measure to play nice with omni
@@ -1386,7 +1607,8 @@ class AggregateManagerServer(object):
                  trust_roots_dir=None,
                  ca_certs=None, base_name=None,
                  authorizer=None, resource_manager=None,
-                 delegate=None):
+                 delegate=None, pool_size=0, queue_size=None,
+                 expiry_granularity=None):
         # ca_certs arg here must be a file of concatenated certs
         if ca_certs is None:
             raise Exception('Missing CA Certs')
@@ -1398,12 +1620,31 @@ class AggregateManagerServer(object):
         if delegate is None:
             delegate = ReferenceAggregateManager(trust_roots_dir, base_name,
                                                  server_url)
+        if expiry_granularity is None and pool_size:
+            expiry_granularity = EXPIRY_GRANULARITY_SECONDS
+        if expiry_granularity and hasattr(delegate, 'start_reaper'):
+            # Expire slivers in the background, not at the start of calls.
+            # Off unless asked for or serving a pool: a lone call
+            # handler gains little from it.
+            delegate.start_reaper(expiry_granularity)
 
         # FIXED: set logRequests=true if --debug
         logRequest=logging.getLogger().getEffectiveLevel()==logging.DEBUG
-        self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
-                                          certfile=certfile, ca_certs=ca_certs, 
-                                          logRequests=logRequest)
+        if pool_size:
+            # Handle up to pool_size calls at once, answering BUSY
+            # when more than queue_size are waiting
+            busy = dict(code=dict(geni_code=AM_API.BUSY, am_type="gcf"),
+                        value="", output="")
+            self._server = SecurePooledXMLRPCServer(addr, keyfile=keyfile,
+                                                    certfile=certfile, ca_certs=ca_certs,
+                                                    logRequests=logRequest,
+                                                    pool_size=pool_size,
+                                                    queue_size=queue_size,
+                                                    busy_result=busy)
+        else:
+            self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
+                                              certfile=certfile, ca_certs=ca_certs, 
+                                              logRequests=logRequest)
         aggregate_manager = AggregateManager(trust_roots_dir, delegate, 
                                              authorizer, resource_manager)
         self._server.register_instance(aggregate_manager)
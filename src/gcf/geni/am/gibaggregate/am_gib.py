@@ -34,6 +34,7 @@ import datetime
 import dateutil.parser
 import logging
 import os
+import threading
 import uuid
 import xml.dom.minidom as minidom
 import xmlrpclib
@@ -44,6 +45,7 @@ from .... import geni
 from ...util.tz_util import tzd
 from ...util.urn_util import publicid_to_urn
 from ...SecureXMLRPCServer import SecureXMLRPCServer
+from ...SecureThreadedXMLRPCServer import SecurePooledXMLRPCServer
 from ..resource import Resource
 from ..aggregate import Aggregate
 from ..fakevm import FakeVM
@@ -111,6 +113,8 @@ class ReferenceAggregateManager(object):
         self._url = url
         self._api_version = 2
         self._slices = dict()
+        # Guards _slices and gib_manager when calls are handled in parallel
+        self._lock = threading.RLock()
         self._agg = Aggregate()
         self._agg.add_resources([FakeVM(self._agg) for _ in range(3)])
         self._cred_verifier = geni.CredentialVerifier(root_cert)
@@ -180,7 +184,7 @@ class ReferenceAggregateManager(object):
         # from the https connection by the SecureXMLRPCServer
         # to identify the caller.
         try:
-            self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                     credentials,
                                                     slice_urn,
                                                     privileges,
@@ -216,16 +220,19 @@ class ReferenceAggregateManager(object):
             return self.errorResult(4, 'Bad Version: requested RSpec version %s is not a valid option.' % (rspec_type))
         self.logger.info("ListResources requested RSpec %s (%s)", rspec_type, rspec_version)
 
-        if 'geni_slice_urn' in options:
-            slice_urn = options['geni_slice_urn']
-            if slice_urn in self._slices:
-                ### result = self.manifest_rspec(slice_urn)
-                result = gib_manager.get_manifest()
+        # gib_manager keeps its state in module globals and files,
+        # so only one call may use it at a time
+        with self._lock:
+            if 'geni_slice_urn' in options:
+                slice_urn = options['geni_slice_urn']
+                if slice_urn in self._slices:
+                    ### result = self.manifest_rspec(slice_urn)
+                    result = gib_manager.get_manifest()
+                else:
+                    # return an empty rspec
+                    return self._no_such_slice(slice_urn)
             else:
-                # return an empty rspec
-                return self._no_such_slice(slice_urn)
-        else:
-            result = gib_manager.get_advert()
+                result = gib_manager.get_advert()
 
             ### all_resources = self._agg.catalog(None)
             ### available = 'geni_available' in options and options['geni_available']
@@ -275,7 +282,7 @@ class ReferenceAggregateManager(object):
         # from the https connection by the SecureXMLRPCServer
         # to identify the caller.
         try:
-            creds = self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            creds = self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                             credentials,
                                                             slice_urn,
                                                             privileges,
@@ -285,75 +292,76 @@ class ReferenceAggregateManager(object):
 
         # If we get here, the credentials give the caller
         # all needed privileges to act on the given target.
-        if slice_urn in self._slices:
-            self.logger.error('Slice %s already exists.', slice_urn)
-            return self.errorResult(17, 'Slice %s already exists' % (slice_urn))
-
-        errString = gib_manager.createSliver(slice_urn, rspec, users)
-        if  errString != None :
-            # Something went wrong: we got back an error string.
-            return self.errorResult(500, errString)
-
-        ### rspec_dom = None
-        ### try:
-        ###     rspec_dom = minidom.parseString(rspec)
-        ### except Exception, exc:
-        ###     self.logger.error("Cant create sliver %s. Exception parsing rspec: %s" % (slice_urn, exc))
-        ###     return self.errorResult(1, 'Bad Args: RSpec is unparseable')
-
-        # Look at the version of the input request RSpec
-        # Make sure it is supported
-        # Then make sure that you return an RSpec in the same format
-        # EG if both V1 and V2 are supported, and the user gives V2 request,
-        # then you must return a V2 request and not V1
-
-        ### allresources = self._agg.catalog()
-        ### allrdict = dict()
-        ### for r in allresources:
-        ###     if r.available:
-        ###         allrdict[r.id] = r
-
-        ### # Note: This only handles unbound nodes. Any attempt by the client
-        ### # to specify a node is ignored.
-        ### resources = dict()
-        ### unbound = list()
-        ### for elem in rspec_dom.documentElement.getElementsByTagName('node'):
-        ###     unbound.append(elem)
-        ### for elem in unbound:
-        ###     client_id = elem.getAttribute('client_id')
-        ###     keys = allrdict.keys()
-        ###     if keys:
-        ###         rid = keys[0]
-        ###         resources[client_id] = allrdict[rid]
-        ###         del allrdict[rid]
-        ###     else:
-        ###         return self.errorResult(6, 'Too Big: insufficient resources to fulfill request')
-
-        # determine max expiration time from credentials
-        # do not create a sliver that will outlive the slice!
-        expiration = datetime.datetime.utcnow() + self.max_lease
-        for cred in creds:
-            credexp = self._naiveUTC(cred.expiration)
-            if credexp < expiration:
-                expiration = credexp
-
-        newslice = Slice(slice_urn, expiration)
-        ### self._agg.allocate(slice_urn, resources.values())
-        ### for cid, r in resources.items():
-        ###     newslice.resources[cid] = r.id
-        ###     r.status = Resource.STATUS_READY
-        self._slices[slice_urn] = newslice
-
-        self.logger.info("Created new slice %s" % slice_urn)
-        ### result = self.manifest_rspec(slice_urn)
-        result = gib_manager.get_manifest()
-
-        self.logger.debug('Result = %s', result)
-        return dict(code=dict(geni_code=0,
-                              am_type="gcf2",
-                              am_code=0),
-                    value=result,
-                    output="")
+        with self._lock:
+            if slice_urn in self._slices:
+                self.logger.error('Slice %s already exists.', slice_urn)
+                return self.errorResult(17, 'Slice %s already exists' % (slice_urn))
+
+            errString = gib_manager.createSliver(slice_urn, rspec, users)
+            if  errString != None :
+                # Something went wrong: we got back an error string.
+                return self.errorResult(500, errString)
+
+            ### rspec_dom = None
+            ### try:
+            ###     rspec_dom = minidom.parseString(rspec)
+            ### except Exception, exc:
+            ###     self.logger.error("Cant create sliver %s. Exception parsing rspec: %s" % (slice_urn, exc))
+            ###     return self.errorResult(1, 'Bad Args: RSpec is unparseable')
+
+            # Look at the version of the input request RSpec
+            # Make sure it is supported
+            # Then make sure that you return an RSpec in the same format
+            # EG if both V1 and V2 are supported, and the user gives V2 request,
+            # then you must return a V2 request and not V1
+
+            ### allresources = self._agg.catalog()
+            ### allrdict = dict()
+            ### for r in allresources:
+            ###     if r.available:
+            ###         allrdict[r.id] = r
+
+            ### # Note: This only handles unbound nodes. Any attempt by the client
+            ### # to specify a node is ignored.
+            ### resources = dict()
+            ### unbound = list()
+            ### for elem in rspec_dom.documentElement.getElementsByTagName('node'):
+            ###     unbound.append(elem)
+            ### for elem in unbound:
+            ###     client_id = elem.getAttribute('client_id')
+            ###     keys = allrdict.keys()
+            ###     if keys:
+            ###         rid = keys[0]
+            ###         resources[client_id] = allrdict[rid]
+            ###         del allrdict[rid]
+            ###     else:
+            ###         return self.errorResult(6, 'Too Big: insufficient resources to fulfill request')
+
+            # determine max expiration time from credentials
+            # do not create a sliver that will outlive the slice!
+            expiration = datetime.datetime.utcnow() + self.max_lease
+            for cred in creds:
+                credexp = self._naiveUTC(cred.expiration)
+                if credexp < expiration:
+                    expiration = credexp
+
+            newslice = Slice(slice_urn, expiration)
+            ### self._agg.allocate(slice_urn, resources.values())
+            ### for cid, r in resources.items():
+            ###     newslice.resources[cid] = r.id
+            ###     r.status = Resource.STATUS_READY
+            self._slices[slice_urn] = newslice
+
+            self.logger.info("Created new slice %s" % slice_urn)
+            ### result = self.manifest_rspec(slice_urn)
+            result = gib_manager.get_manifest()
+
+            self.logger.debug('Result = %s', result)
+            return dict(code=dict(geni_code=0,
+                                  am_type="gcf2",
+                                  am_code=0),
+                        value=result,
+                        output="")
 
     # The list of credentials are options - some single cred
     # must give the caller required permissions.
@@ -374,7 +382,7 @@ class ReferenceAggregateManager(object):
         # from the https connection by the SecureXMLRPCServer
         # to identify the caller.
         try:
-            self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                     credentials,
                                                     slice_urn,
                                                     privileges,
@@ -384,24 +392,25 @@ class ReferenceAggregateManager(object):
 
         # If we get here, the credentials give the caller
         # all needed privileges to act on the given target.
-        if slice_urn in self._slices:
-            ### sliver = self._slices[slice_urn]
-            ### resources = self._agg.catalog(slice_urn)
-            ### if sliver.status(resources) == Resource.STATUS_SHUTDOWN:
-            ###     self.logger.info("Sliver %s not deleted because it is shutdown",
-            ###                      slice_urn)
-            ###     return self.errorResult(11, "Unavailable: Slice %s is unavailable." % (slice_urn))
-            ### self._agg.deallocate(slice_urn, None)
-            ### for r in resources:
-            ###     r.status = Resource.STATUS_UNKNOWN
-
-            gib_manager.deleteSliver()
-
-            del self._slices[slice_urn]
-            self.logger.info("Sliver %r deleted" % slice_urn)
-            return self.successResult(True)
-        else:
-            return self._no_such_slice(slice_urn)
+        with self._lock:
+            if slice_urn in self._slices:
+                ### sliver = self._slices[slice_urn]
+                ### resources = self._agg.catalog(slice_urn)
+                ### if sliver.status(resources) == Resource.STATUS_SHUTDOWN:
+                ###     self.logger.info("Sliver %s not deleted because it is shutdown",
+                ###                      slice_urn)
+                ###     return self.errorResult(11, "Unavailable: Slice %s is unavailable." % (slice_urn))
+                ### self._agg.deallocate(slice_urn, None)
+                ### for r in resources:
+                ###     r.status = Resource.STATUS_UNKNOWN
+
+                gib_manager.deleteSliver()
+
+                del self._slices[slice_urn]
+                self.logger.info("Sliver %r deleted" % slice_urn)
+                return self.successResult(True)
+            else:
+                return self._no_such_slice(slice_urn)
 
 
     def SliverStatus(self, slice_urn, credentials, options):
@@ -419,7 +428,7 @@ class ReferenceAggregateManager(object):
         # listslices, listnodes, policy
         privileges = (SLIVERSTATUSPRIV,)
         try:
-            self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                     credentials,
                                                     slice_urn,
                                                     privileges,
@@ -427,33 +436,34 @@ class ReferenceAggregateManager(object):
         except Exception, e:
             raise xmlrpclib.Fault('Insufficient privileges', str(e))
 
-        if slice_urn in self._slices:
-            theSlice = self._slices[slice_urn]
-            # Now calculate the status of the sliver
-
-            ### res_status = list()
-            ### resources = self._agg.catalog(slice_urn)
-            ### for res in resources:
-            ###     self.logger.debug('Resource = %s', str(res))
-            ###     # Gather the status of all the resources
-            ###     # in the sliver. This could be actually
-            ###     # communicating with the resources, or simply
-            ###     # reporting the state of initialized, started, stopped, ...
-            ###     res_status.append(dict(geni_urn=self.resource_urn(res),
-            ###                            geni_status=res.status,
-            ###                            geni_error=''))
-
-            result = gib_manager.sliverStatus(slice_urn)
-
-            self.logger.info("Calculated and returning slice %s status", slice_urn)
-            ### result = dict(geni_urn=slice_urn,
-            ###               geni_status=theSlice.status(resources),
-            ###               geni_resources=res_status)
-            return dict(code=dict(geni_code=0),
-                        value=result,
-                        output="")
-        else:
-            return self._no_such_slice(slice_urn)
+        with self._lock:
+            if slice_urn in self._slices:
+                theSlice = self._slices[slice_urn]
+                # Now calculate the status of the sliver
+
+                ### res_status = list()
+                ### resources = self._agg.catalog(slice_urn)
+                ### for res in resources:
+                ###     self.logger.debug('Resource = %s', str(res))
+                ###     # Gather the status of all the resources
+                ###     # in the sliver. This could be actually
+                ###     # communicating with the resources, or simply
+                ###     # reporting the state of initialized, started, stopped, ...
+                ###     res_status.append(dict(geni_urn=self.resource_urn(res),
+                ###                            geni_status=res.status,
+                ###                            geni_error=''))
+
+                result = gib_manager.sliverStatus(slice_urn)
+
+                self.logger.info("Calculated and returning slice %s status", slice_urn)
+                ### result = dict(geni_urn=slice_urn,
+                ###               geni_status=theSlice.status(resources),
+                ###               geni_resources=res_status)
+                return dict(code=dict(geni_code=0),
+                            value=result,
+                            output="")
+            else:
+                return self._no_such_slice(slice_urn)
 
     def RenewSliver(self, slice_urn, credentials, expiration_time, options):
         '''Renew the local sliver that is part of the named Slice
@@ -464,7 +474,7 @@ class ReferenceAggregateManager(object):
         self.logger.info('RenewSliver(%r, %r)' % (slice_urn, expiration_time))
         privileges = (RENEWSLIVERPRIV,)
         try:
-            creds = self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            creds = self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                             credentials,
                                                             slice_urn,
                                                             privileges,
@@ -473,42 +483,43 @@ class ReferenceAggregateManager(object):
             raise xmlrpclib.Fault('Insufficient privileges', str(e))
 
         # All the credentials we just got are valid
-        if slice_urn in self._slices:
-            # If any credential will still be valid at the newly
-            # requested time, then we can do this.
-            resources = self._agg.catalog(slice_urn)
-            sliver = self._slices.get(slice_urn)
-            if sliver.status(resources) == Resource.STATUS_SHUTDOWN:
-                self.logger.info("Sliver %s not renewed because it is shutdown",
-                                 slice_urn)
-                return self.errorResult(11, "Unavailable: Slice %s is unavailable." % (slice_urn))
-            requested = dateutil.parser.parse(str(expiration_time), tzinfos=tzd)
-            # Per the AM API, the input time should be TZ-aware
-            # But since the slice cred may not (per ISO8601), convert
-            # it to naiveUTC for comparison
-            requested = self._naiveUTC(requested)
-            maxexp = datetime.datetime.min
-            for cred in creds:
-                credexp = self._naiveUTC(cred.expiration)
-                if credexp > maxexp:
+        with self._lock:
+            if slice_urn in self._slices:
+                # If any credential will still be valid at the newly
+                # requested time, then we can do this.
+                resources = self._agg.catalog(slice_urn)
+                sliver = self._slices.get(slice_urn)
+                if sliver.status(resources) == Resource.STATUS_SHUTDOWN:
+                    self.logger.info("Sliver %s not renewed because it is shutdown",
+                                     slice_urn)
+                    return self.errorResult(11, "Unavailable: Slice %s is unavailable." % (slice_urn))
+                requested = dateutil.parser.parse(str(expiration_time), tzinfos=tzd)
+                # Per the AM API, the input time should be TZ-aware
+                # But since the slice cred may not (per ISO8601), convert
+                # it to naiveUTC for comparison
+                requested = self._naiveUTC(requested)
+                maxexp = datetime.datetime.min
+                for cred in creds:
+                    credexp = self._naiveUTC(cred.expiration)
+                    if credexp > maxexp:
+                        maxexp = credexp
                     maxexp = credexp
-                maxexp = credexp
-                if credexp >= requested:
-                    sliver.expiration = requested
-                    self.logger.info("Sliver %r now expires on %r", slice_urn, expiration_time)
-                    return self.successResult(True)
-                else:
-                    self.logger.debug("Valid cred %r expires at %r before %r", cred, credexp, requested)
+                    if credexp >= requested:
+                        sliver.expiration = requested
+                        self.logger.info("Sliver %r now expires on %r", slice_urn, expiration_time)
+                        return self.successResult(True)
+                    else:
+                        self.logger.debug("Valid cred %r expires at %r before %r", cred, credexp, requested)
+
+                # Fell through then no credential expires at or after
+                # newly requested expiration time
+                self.logger.info("Can't renew sliver %r until %r because none of %d credential(s) valid until then (latest expires at %r)", slice_urn, expiration_time, len(creds), maxexp)
+                # FIXME: raise an exception so the client knows what
+                # really went wrong?
+                return self.errorResult(19, "Out of range: Expiration %s is out of range (past last credential expiration of %s)." % (expiration_time, maxexp))
 
-            # Fell through then no credential expires at or after
-            # newly requested expiration time
-            self.logger.info("Can't renew sliver %r until %r because none of %d credential(s) valid until then (latest expires at %r)", slice_urn, expiration_time, len(creds), maxexp)
-            # FIXME: raise an exception so the client knows what
-            # really went wrong?
-            return self.errorResult(19, "Out of range: Expiration %s is out of range (past last credential expiration of %s)." % (expiration_time, maxexp))
-
-        else:
-            return self._no_such_slice(slice_urn)
+            else:
+                return self._no_such_slice(slice_urn)
 
     def Shutdown(self, slice_urn, credentials, options):
         '''For Management Authority / operator use: shut down a badly
@@ -516,7 +527,7 @@ class ReferenceAggregateManager(object):
         self.logger.info('Shutdown(%r)' % (slice_urn))
         privileges = (SHUTDOWNSLIVERPRIV,)
         try:
-            self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                     credentials,
                                                     slice_urn,
                                                     privileges,
@@ -524,15 +535,16 @@ class ReferenceAggregateManager(object):
         except Exception, e:
             raise xmlrpclib.Fault('Insufficient privileges', str(e))
 
-        if slice_urn in self._slices:
-            resources = self._agg.catalog(slice_urn)
-            for resource in resources:
-                resource.status = Resource.STATUS_SHUTDOWN
-            self.logger.info("Sliver %r shut down" % slice_urn)
-            return self.successResult(True)
-        else:
-            self.logger.info("Shutdown: No such slice: %s.", slice_urn)
-            return self._no_such_slice(slice_urn)
+        with self._lock:
+            if slice_urn in self._slices:
+                resources = self._agg.catalog(slice_urn)
+                for resource in resources:
+                    resource.status = Resource.STATUS_SHUTDOWN
+                self.logger.info("Sliver %r shut down" % slice_urn)
+                return self.successResult(True)
+            else:
+                self.logger.info("Shutdown: No such slice: %s.", slice_urn)
+                return self._no_such_slice(slice_urn)
 
     def successResult(self, value):
         code_dict = dict(geni_code=0,
@@ -722,7 +734,7 @@ class AggregateManagerServer(object):
 
     def __init__(self, addr, keyfile=None, certfile=None,
                  trust_roots_dir=None,
-                 ca_certs=None, base_name=None):
+                 ca_certs=None, base_name=None, pool_size=0, queue_size=None):
         # ca_certs arg here must be a file of concatenated certs
         if ca_certs is None:
             raise Exception('Missing CA Certs')
@@ -734,8 +746,19 @@ class AggregateManagerServer(object):
         delegate = ReferenceAggregateManager(trust_roots_dir, base_name, 
                                              server_url)
         # FIXME: set logRequests=true if --debug
-        self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
-                                          certfile=certfile, ca_certs=ca_certs)
+        if pool_size:
+            # Handle up to pool_size calls at once, answering BUSY
+            # when more than queue_size are waiting
+            busy = dict(code=dict(geni_code=14, am_type="gcf2"),
+                        value="", output="")
+            self._server = SecurePooledXMLRPCServer(addr, keyfile=keyfile,
+                                                    certfile=certfile, ca_certs=ca_certs,
+                                                    pool_size=pool_size,
+                                                    queue_size=queue_size,
+                                                    busy_result=busy)
+        else:
+            self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
+                                              certfile=certfile, ca_certs=ca_certs)
         self._server.register_instance(AggregateManager(delegate))
         # Set the server on the delegate so it can access the
         # client certificate.
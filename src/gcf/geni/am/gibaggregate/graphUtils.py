@@ -38,30 +38,79 @@ class GraphNode(object) :
         pass
 
 
+def shortestPathTree(startNode, avoid=()) :
+    """ Breadth first search of the graph from the specified GraphNode.
+        Return a dictionary mapping each node reachable from startNode
+        (without going through any node in avoid) to the node before
+        it on a shortest path from startNode (None for startNode).
+
+        Neighbors are visited in the order getNeighbors returns them, so
+        of several shortest paths, the one through the earliest neighbors
+        is the one kept.
+    """
+    previous = {startNode : None}
+    frontier = [startNode]
+    while frontier :
+        nextFrontier = []
+        for node in frontier :
+            for neighbor in node.getNeighbors() :
+                if neighbor is not None and neighbor not in previous and \
+                        neighbor not in avoid :
+                    previous[neighbor] = node
+                    nextFrontier.append(neighbor)
+        frontier = nextFrontier
+    return previous
+
+
+def pathFromTree(previous, endNode) :
+    """ Return the path (list of nodes) to endNode in the given tree
+        from shortestPathTree, or None if endNode is not in the tree.
+    """
+    if endNode not in previous :
+        return None
+    path = []
+    node = endNode
+    while node is not None :
+        path.append(node)
+        node = previous[node]
+    path.reverse()
+    return path
+
+
 def findShortestPath(startNode, endNode, pathSoFar =[]) :
     """ Find the shortest path between the specified GraphNode objects 
-        that form the nodes of a graph.
+        that form the nodes of a graph.  The path may not go through
+        nodes in pathSoFar, and starts with pathSoFar.
     """
-    # Add this node to the path explored so far
-    pathSoFar = pathSoFar + [startNode]
+    path = pathFromTree(shortestPathTree(startNode, set(pathSoFar)), endNode)
+    if path is None :
+        return None
+    return pathSoFar + path
 
-    if startNode == endNode :
-        # Found path to the endNode!
-        return pathSoFar
 
-    # Path from here to the endNode.  We currently don't have such a path
-    pathFromHere =  None
+class PathFinder(object) :
+    """ Shortest paths in a graph whose nodes do not change: the breadth
+        first search from each start node is done once, and shared by
+        all the paths from that node.  Use one PathFinder per request.
+    """
+    def __init__(self) :
+        self.trees = {}  # Map of start node to its shortestPathTree
 
-    # See if we can get to the endNode through one of our neighbors
-    neighbors = startNode.getNeighbors() 
-    for i in range(len(neighbors)) :
-        if neighbors[i] not in pathSoFar :
-            pathThruNeighbor = findShortestPath(neighbors[i], endNode, \
-                                                    pathSoFar)
-            if pathThruNeighbor != None :
-                if (pathFromHere == None) or (len(pathThruNeighbor) < \
-                                                  len(pathFromHere)) :
-                    # Found a new or shorter path to the endNode 
-                    pathFromHere = pathThruNeighbor
+    def findShortestPath(self, startNode, endNode) :
+        """ Find the shortest path between the specified GraphNode objects,
+            as findShortestPath does.
+        """
+        if startNode not in self.trees :
+            self.trees[startNode] = shortestPathTree(startNode)
+        return pathFromTree(self.trees[startNode], endNode)
 
-    return pathFromHere
+    def allPairs(self, startNodes, endNodes) :
+        """ Return a dictionary mapping each (start node, end node) pair
+            to the shortest path between them, or None if there is none.
+        """
+        paths = {}
+        for startNode in startNodes :
+            for endNode in endNodes :
+                paths[(startNode, endNode)] = \
+                    self.findShortestPath(startNode, endNode)
+        return paths
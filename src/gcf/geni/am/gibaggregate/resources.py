@@ -390,6 +390,8 @@ def _generateBashScript(users) :
 
     # Now we are ready to set up the IP routing tables on each container
     scriptFile.write('\n## Set up IP routing tables on each host \n');
+    # One search per host finds the paths from that host to every link
+    pathFinder = graphUtils.PathFinder()
     for i in range(len(hostNames)) :
         hostObject = experimentHosts[hostNames[i]]
     
@@ -451,7 +453,7 @@ def _generateBashScript(users) :
             linkObject = notDirectlyConnectedLinks[j]
 
             # Find the shortest path from this host to this subnet (linkObject)
-            path = graphUtils.findShortestPath(hostObject, linkObject)
+            path = pathFinder.findShortestPath(hostObject, linkObject)
             if path != None :
                 # We found a path from this host to the subnet (link)
                 #    Path is a NIC -> Link -> NIC -> Host (gateway) -> ...
@@ -32,6 +32,7 @@ from ...sfa.trust.credential import Credential
 from ...sfa.trust.certificate import Certificate
 from ...sfa.trust.abac_credential import ABACCredential
 from ..util.speaksfor_util import get_cert_keyid
+from .abac_policy import CompiledPolicy, ProofGraph, VARIABLE_RE, split_assertion
 from .util import *
 
 # AM authorizer class that uses policies to generate ABAC proofs 
@@ -85,6 +86,7 @@ class ABAC_Authorizer(Base_Authorizer):
         rule_set = ABAC_Authorizer_Rule_Set(label, self._root_cert)
         for filename in filenames:
             rule_set.parse(filename)
+        rule_set.compile()
         return rule_set
 
     # Find the correct set of rules for the given caller based on authority
@@ -128,10 +130,8 @@ class ABAC_Authorizer(Base_Authorizer):
         credential_assertions = \
             self._generate_credential_assertions(caller, creds, bindings, rules)
 
-        fixed_policies = rules.getPolicies()
-
-        assertions = \
-            assertions + credential_assertions + fixed_policies
+        # The fixed policies are already in the compiled rules
+        assertions = assertions + credential_assertions
 
 #        self._logger.info("ASSERTIONS = %s" % assertions)
 
@@ -157,38 +157,7 @@ class ABAC_Authorizer(Base_Authorizer):
     # If true and if the associated assertion is completely bound,
     # generate the assertion
     def _generate_assertions(self, bindings, rules):
-        assertions = []
-        conditional_assertions = rules.getConditionalAssertions()
-
-        # Handle old format of policies that are list of condition/assertion
-        # rather than list of precondition/exclusive and then a list
-        # of condition/assertion clauses
-        if len(conditional_assertions) > 0 and \
-                'precondition' not in conditional_assertions[0]:
-            conditional_assertions = [{'precondition' : 'True',
-                                      'clauses' : conditional_assertions}]
-
-        for clause_set in conditional_assertions:
-            precondition = clause_set['precondition']
-            bound_precondition = self._bind_expression(precondition, bindings)
-            if self._has_unbound_variables(bound_precondition): continue
-            if not eval(bound_precondition): continue
-            exclusive = 'exclusive' in clause_set and clause_set['exclusive']
-            clauses = clause_set['clauses']
-            for ca in clauses:
-                condition = ca['condition']
-                assertion = ca['assertion']
-                bound_condition = self._bind_expression(condition, bindings)
-                if self._has_unbound_variables(bound_condition): continue
-                self._logger.info("EVAL : %s" % bound_condition)
-                if not eval(bound_condition): continue
-                bound_assertion = self._bind_expression(assertion, bindings)
-                if self._has_unbound_variables(bound_assertion): continue
-                assertions.append(bound_assertion)
-            # If this is an exclusive clause set whose precondition matched
-            # Don't look at any other clause sets
-            if exclusive: break 
-        return assertions
+        return rules.getCompiledPolicy().generate_assertions(bindings)
 
     # If provided a set of ABAC assertions, import them into our set
     # of assertions
@@ -218,123 +187,32 @@ class ABAC_Authorizer(Base_Authorizer):
         return assertions
 
     # Determine if all positive queries are proven and no negative
-    # query is proven
+    # query is proven, given the assertions beyond the fixed policies
     def _evaluate_queries(self, bindings, assertions, rules):
-
-        messages = []
-
-        all_positive_proved = True
-        for q in rules.getPositiveQueries():
-            evaluated, proven, msg = \
-                self._evaluate_query(bindings, assertions, q, rules)
-            if not evaluated: continue
-            if not proven:
-                all_positive_proved = False
-                messages.append(msg)
-
-        all_negative_disproved = True
-        for q in rules.getNegativeQueries():
-            evaluated, proven, msg = \
-                self._evaluate_query(bindings, assertions, q, rules)
-            if not evaluated: continue
-            if proven:
-                all_negative_disproved = False
-                messages.append(msg)
-
-        result = (all_positive_proved and all_negative_disproved)
-        return result, ", ".join(messages)
-
-    # Evaluate a single query
-    # If there is a condition, it must be true to considered
-    # Return evaluated, evaluation, failure_message
-    def _evaluate_query(self, bindings, assertions, query, rules):
-        # If there is a condition on this query, only evaluate if 
-        # condition is satisfied
-        if query in rules.getQueryConditionMap():
-            condition = rules.getQueryConditionMap()[query]
-            bound_condition = self._bind_expression(condition, bindings)
-            if self._has_unbound_variables(bound_condition):
-                raise Exception("Illegal query condition: unbound variable %s"\
-                                    % bound_condition)
-            if not eval(bound_condition): 
-                return False, False, ""
-
-        # If no condition or condition  succeeded, evaluate bound query
-        bound_q = self._bind_expression(query, bindings)
-        if self._has_unbound_variables(bound_q): 
-            raise Exception("Illegal query: unbound variable %s" % bound_q)
-
-        evaluation = self._prove_query(bound_q, assertions)
-        msg = rules.getQueryMessageMap()[query]
-        return True, evaluation, msg
-
+        return rules.getCompiledPolicy().evaluate_queries(bindings, assertions)
 
     # Replace bindings ($VAR) with bound value
+    # Unbound variables are left in place
     def _bind_expression(self, expr, bindings):
-        for binding, value in bindings.items():
-            if expr.find(binding) > -1:
-                expr = expr.replace(binding, value)
-        return expr
+        return VARIABLE_RE.sub(lambda m: bindings.get(m.group(0), m.group(0)),
+                               expr)
 
     # Are there any unbound variables in expression?
     def _has_unbound_variables(self, expr):
         return expr.find("$") > -1
 
-
     # Prove (or fail to prove) an ABAC query based on a set of assertions
-    # We use a simple recursive chaining to see if we can find a path
-    # from the query LHS to the query RHS
+    # by finding a path from the query LHS to the query RHS
     def _prove_query(self, query, assertions):
-
-        query_parts = query.split('<-')
-        query_lhs = query_parts[0].strip()
-        query_rhs = query_parts[1].strip()
-
-        parsed_assertions = {}
+        graph = ProofGraph()
         for assertion in assertions:
-            assertion_parts = assertion.split('<-')
-            assert_lhs = assertion_parts[0].strip()
-            assert_rhs = assertion_parts[1].strip()
-            if assert_lhs not in parsed_assertions:
-                parsed_assertions[assert_lhs] = []
-            assertion_info = {'rhs' : assert_rhs, 'assertion' : assertion}
-            parsed_assertions[assert_lhs].append(assertion_info)
-
-        result, chain = \
-            self._prove_query_internal(query_lhs, query_rhs, parsed_assertions)
-
-        self._logger.info("QUERY (%s) : %s" % (result, query))
-        if result:
+            graph.add(assertion)
+        query_lhs, query_rhs = split_assertion(query)
+        chain = graph.prove(query_lhs, query_rhs)
+        self._logger.info("QUERY (%s) : %s" % (chain is not None, query))
+        if chain is not None:
             self._logger.info("PROOF_CHAIN : %s" % chain)
-        return result
-
-    # Internal method supporting _prove_query as a recursive call
-    # Return the proof chain if success
-    def _prove_query_internal(self, lhs, target, parsed_assertions):
-        if lhs not in parsed_assertions: return False, None
-
-        found_direct_link = False
-        for pa in parsed_assertions[lhs]:
-            rhs = pa['rhs']
-            assertion = pa['assertion']
-            if rhs == target:
-                found_direct_link = True
-                break
-        if found_direct_link:
-            return True, [assertion]
-
-
-        found_indrect_link = False
-        for pa in parsed_assertions[lhs]:
-            new_lhs = pa['rhs']
-            assertion = pa['assertion']
-            result, chain = \
-                self._prove_query_internal(new_lhs, target, parsed_assertions)
-            if result:
-                new_chain = list(chain)
-                new_chain.insert(0, assertion)
-                return True, new_chain
-        return False, None
+        return chain is not None
 
     # Compute keyid from a cert
     @staticmethod
@@ -373,11 +251,13 @@ class ABAC_Authorizer_Rule_Set:
         self._query_message_map = {}
         self._query_condition_map = {}
         self._keyid_name_map = {}
+        self._compiled_policy = None
 
     # Parse rule content from a file and add to existing rule content (if any)
     # That is, we may parse multiple files in sequence, thus adding to lists
     # and adding/replacing elements in dictionaries
     def parse(self, filename):
+        self._compiled_policy = None
         data = open(filename).read()
         raw_rules = json.loads(data)
 
@@ -421,6 +301,14 @@ class ABAC_Authorizer_Rule_Set:
                 if id_keyid:
                     self._keyid_name_map[id_keyid] = id_name
 
+    # Compile the conditional assertions, policies and queries parsed so far
+    def compile(self):
+        self._compiled_policy = \
+            CompiledPolicy(self._conditional_assertions, self._policies,
+                           self._positive_queries, self._negative_queries,
+                           self._query_message_map,
+                           self._query_condition_map, self._constants)
+
     # Dump contents to stdout
     def dump(self):
         print "RULE SET : %s" % self._label
@@ -469,3 +357,6 @@ class ABAC_Authorizer_Rule_Set:
     def getQueryMessageMap(self): return self._query_message_map
     def getQueryConditionMap(self): return self._query_condition_map
     def getKeyIdNameMap(self) : return self._keyid_name_map
+    def getCompiledPolicy(self):
+        if self._compiled_policy is None: self.compile()
+        return self._compiled_policy
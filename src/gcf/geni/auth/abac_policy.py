@@ -0,0 +1,343 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Compiled form of the ABAC_Authorizer policies.
+#
+# Policy files hold python expressions and ABAC assertions with
+# $VARIABLES, whose values are bound on each call (by the binders).
+# The values are python expression text: '$HOUR < 6' binds to
+# '23 < 6'. Here each expression is parsed once when the policy is
+# loaded:
+#  - the $VARIABLES are found (longest name first, so $CALLER does not
+#    match the start of $CALLER_AUTHORITY),
+#  - conditions are compiled to python code in which each variable is
+#    a name, so a call evaluates the code against the bound values
+#    rather than building and evaluating a new string,
+#  - assertions are split into their left and right sides.
+# Proofs search a graph of the assertions, remembering what each role
+# reaches, and cannot loop on cyclic assertions.
+
+from __future__ import absolute_import
+
+import logging
+import re
+import tokenize
+from StringIO import StringIO
+
+VARIABLE_RE = re.compile(r'\$[A-Za-z0-9_]+')
+_PLACEHOLDER = '__abac_'
+
+# Bound values already evaluated: value text -> python value
+_values = dict()
+_MAX_VALUES = 10000
+
+def _value(text):
+    if text not in _values:
+        if len(_values) >= _MAX_VALUES:
+            _values.clear()
+        _values[text] = eval(text)
+    return _values[text]
+
+class PolicyExpression(object):
+    '''An expression with $VARIABLES to be bound on each call'''
+
+    def __init__(self, source, constants=None):
+        if constants:
+            # Constants never change: bind them now
+            source = VARIABLE_RE.sub(lambda m: constants.get(m.group(0), m.group(0)),
+                                     source)
+        self.source = source
+        # Alternately literal text and variable names
+        self._parts = VARIABLE_RE.split(source)
+        self._names = VARIABLE_RE.findall(source)
+        self.variables = frozenset(self._names)
+
+    def bind(self, bindings):
+        '''Return the expression with the variables replaced by their
+        values, or None if any variable is unbound.'''
+        if not self._names:
+            return self.source
+        result = [self._parts[0]]
+        for i, name in enumerate(self._names):
+            if name not in bindings:
+                return None
+            result.append(bindings[name])
+            result.append(self._parts[i + 1])
+        result = ''.join(result)
+        if '$' in result:
+            # A value brought in a variable
+            return None
+        return result
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.source)
+
+class PolicyCondition(PolicyExpression):
+    '''A python boolean expression with $VARIABLES, compiled once'''
+
+    def __init__(self, source, constants=None):
+        PolicyExpression.__init__(self, source, constants)
+        self._code = None
+        # placeholder -> variable whose value is evaluated as python
+        self._values = dict()
+        # placeholder -> (string, variables) for string literals with
+        # variables in them, which are replaced by the value text
+        self._strings = dict()
+        try:
+            self._compile()
+        except Exception, e:
+            logging.getLogger('gcf.abac_auth').debug("Evaluating %r as text: %s" % (self.source, e))
+            self._code = None
+
+    def _compile(self):
+        placeholders = dict()
+        def placeholder(match):
+            name = match.group(0)
+            ph = _PLACEHOLDER + name[1:]
+            placeholders[ph] = name
+            return ph
+        src = VARIABLE_RE.sub(placeholder, self.source)
+        tokens = []
+        for tok in tokenize.generate_tokens(StringIO(src).readline):
+            toktype, text = tok[0], tok[1]
+            if toktype == tokenize.NAME and text in placeholders:
+                self._values[text] = placeholders[text]
+            elif toktype == tokenize.STRING and _PLACEHOLDER in text:
+                ph = "%sstr%d" % (_PLACEHOLDER, len(self._strings))
+                names = [(p, v) for p, v in placeholders.items() if p in text]
+                # Longest first, as for VARIABLE_RE
+                names.sort(key=lambda pv: -len(pv[0]))
+                self._strings[ph] = (eval(text), names)
+                toktype, text = tokenize.NAME, ph
+            tokens.append((toktype, text))
+        self._code = compile(tokenize.untokenize(tokens).strip(), '<policy>', 'eval')
+
+    def evaluate(self, bindings):
+        '''Return the truth of the condition, or None if any variable is unbound'''
+        for name in self._names:
+            if name not in bindings or '$' in bindings[name]:
+                return None
+        if self._code is None:
+            return self._evaluate_text(bindings)
+        namespace = dict()
+        try:
+            for ph, name in self._values.items():
+                namespace[ph] = _value(bindings[name])
+        except Exception:
+            # The value is not an expression by itself (an URN say),
+            # so this only made sense as text
+            return self._evaluate_text(bindings)
+        for ph, (string, names) in self._strings.items():
+            for p, name in names:
+                string = string.replace(p, bindings[name])
+            namespace[ph] = string
+        return bool(eval(self._code, {}, namespace))
+
+    def _evaluate_text(self, bindings):
+        bound = self.bind(bindings)
+        if bound is None:
+            return None
+        return bool(eval(bound))
+
+class PolicyAssertion(object):
+    '''An ABAC assertion lhs<-rhs, whose sides may have $VARIABLES'''
+
+    def __init__(self, source, constants=None):
+        if '<-' not in source:
+            raise Exception("Malformed ABAC assertion: %s" % source)
+        lhs, rhs = source.split('<-', 1)
+        self.source = source
+        self.lhs = PolicyExpression(lhs.strip(), constants)
+        self.rhs = PolicyExpression(rhs.strip(), constants)
+
+    def bind(self, bindings):
+        '''Return the bound assertion text, or None if any variable is unbound'''
+        lhs = self.lhs.bind(bindings)
+        if lhs is None:
+            return None
+        rhs = self.rhs.bind(bindings)
+        if rhs is None:
+            return None
+        return "%s<-%s" % (lhs, rhs)
+
+    def __repr__(self):
+        return "PolicyAssertion(%r)" % self.source
+
+def split_assertion(assertion):
+    '''Return the (lhs, rhs) of an assertion string, stripped'''
+    parts = assertion.split('<-')
+    return parts[0].strip(), parts[1].strip()
+
+class ProofGraph(object):
+    '''A graph of ABAC assertions: an edge from each assertion's left side
+    to its right side. A query lhs<-rhs is proven by a path from lhs to rhs.
+
+    The roles reachable from each left side are found once, breadth first,
+    and remembered, so the queries of one call share the search.'''
+
+    def __init__(self, base=None):
+        # node -> [(rhs, assertion)]; base is shared and never modified
+        self._base = base or dict()
+        self._edges = dict()
+        # lhs -> {node reached: (previous node, assertion)}
+        self._reached = dict()
+
+    def add(self, assertion):
+        lhs, rhs = split_assertion(assertion)
+        self._edges.setdefault(lhs, []).append((rhs, assertion))
+        self._reached.clear()
+
+    def _neighbors(self, node):
+        return self._base.get(node, []) + self._edges.get(node, [])
+
+    def prove(self, lhs, target):
+        '''Return the list of assertions leading from lhs to target, or None'''
+        if lhs not in self._reached:
+            reached = dict()
+            queue = [lhs]
+            i = 0
+            while i < len(queue):
+                node = queue[i]
+                i += 1
+                for rhs, assertion in self._neighbors(node):
+                    if rhs not in reached:
+                        reached[rhs] = (node, assertion)
+                        queue.append(rhs)
+            self._reached[lhs] = reached
+        reached = self._reached[lhs]
+        if target not in reached:
+            return None
+        chain = []
+        node = target
+        while True:
+            previous, assertion = reached[node]
+            chain.insert(0, assertion)
+            if previous == lhs:
+                return chain
+            node = previous
+
+def make_edges(assertions):
+    '''Return the edges dict of a ProofGraph base for these assertions'''
+    edges = dict()
+    for assertion in assertions:
+        lhs, rhs = split_assertion(assertion)
+        edges.setdefault(lhs, []).append((rhs, assertion))
+    return edges
+
+class CompiledPolicy(object):
+    '''The conditional assertions, policies and queries of a rule set,
+    compiled for evaluation on each call.'''
+
+    def __init__(self, conditional_assertions, policies,
+                 positive_queries, negative_queries,
+                 query_message_map, query_condition_map, constants=None):
+        self._logger = logging.getLogger('gcf.abac_auth')
+        constants = constants or dict()
+
+        # Handle old format of policies that are list of condition/assertion
+        # rather than list of precondition/exclusive and then a list
+        # of condition/assertion clauses
+        if len(conditional_assertions) > 0 and \
+                'precondition' not in conditional_assertions[0]:
+            conditional_assertions = [{'precondition' : 'True',
+                                      'clauses' : conditional_assertions}]
+
+        # [(precondition, exclusive, [(condition, assertion)])]
+        self._clause_sets = []
+        for clause_set in conditional_assertions:
+            exclusive = 'exclusive' in clause_set and clause_set['exclusive']
+            clauses = [(PolicyCondition(ca['condition'], constants),
+                        PolicyAssertion(ca['assertion'], constants))
+                       for ca in clause_set['clauses']]
+            self._clause_sets.append((PolicyCondition(clause_set['precondition'], constants),
+                                      exclusive, clauses))
+
+        # Fixed policies are used as is, unbound
+        self.policies = list(policies)
+        self._policy_edges = make_edges(self.policies)
+
+        # [(statement, is_positive, condition or None, query, message)]
+        self._queries = []
+        for queries, positive in ((positive_queries, True),
+                                  (negative_queries, False)):
+            for q in queries:
+                condition = None
+                if q in query_condition_map:
+                    condition = PolicyCondition(query_condition_map[q], constants)
+                self._queries.append((q, positive, condition,
+                                      PolicyAssertion(q, constants),
+                                      query_message_map[q]))
+
+    # For each conditional assertion, evaluate the condition
+    # If true and if the associated assertion is completely bound,
+    # generate the assertion
+    def generate_assertions(self, bindings):
+        assertions = []
+        debug = self._logger.isEnabledFor(logging.DEBUG)
+        for precondition, exclusive, clauses in self._clause_sets:
+            if not precondition.evaluate(bindings): continue
+            for condition, assertion in clauses:
+                if debug:
+                    self._logger.debug("EVAL : %s" % condition.bind(bindings))
+                if not condition.evaluate(bindings): continue
+                bound_assertion = assertion.bind(bindings)
+                if bound_assertion is None: continue
+                assertions.append(bound_assertion)
+            # If this is an exclusive clause set whose precondition matched
+            # Don't look at any other clause sets
+            if exclusive: break
+        return assertions
+
+    def proof_graph(self, assertions):
+        '''Return a ProofGraph of the fixed policies plus these assertions'''
+        graph = ProofGraph(self._policy_edges)
+        for assertion in assertions:
+            graph.add(assertion)
+        return graph
+
+    # Determine if all positive queries are proven and no negative
+    # query is proven. Return success and the failure messages.
+    def evaluate_queries(self, bindings, assertions):
+        graph = self.proof_graph(assertions)
+        messages = []
+        for statement, positive, condition, query, message in self._queries:
+            # If there is a condition on this query, only evaluate if
+            # condition is satisfied
+            if condition is not None:
+                satisfied = condition.evaluate(bindings)
+                if satisfied is None:
+                    raise Exception("Illegal query condition: unbound variable %s" \
+                                        % condition.source)
+                if not satisfied:
+                    continue
+            bound_q = query.bind(bindings)
+            if bound_q is None:
+                raise Exception("Illegal query: unbound variable %s" % statement)
+            lhs, rhs = split_assertion(bound_q)
+            chain = graph.prove(lhs, rhs)
+            self._logger.info("QUERY (%s) : %s" % (chain is not None, bound_q))
+            if chain is not None:
+                self._logger.info("PROOF_CHAIN : %s" % chain)
+            if (chain is not None) != positive:
+                messages.append(message)
+        return len(messages) == 0, ", ".join(messages)
@@ -30,6 +30,7 @@ import xml.dom.minidom
 
 from ...sfa.trust import gid
 from ...sfa.trust import credential
+from ..util import urn_util
 from ..util.tz_util import tzd
 from .base_authorizer import AM_Methods, V2_Methods
 
@@ -129,12 +130,20 @@ class GCFAM_Resource_Manager(Base_Resource_Manager):
 
 
     # Get all current slivers and return them in proper format
+    # If the aggregate keeps an allocation ledger, only the slivers sharing
+    # a user, authority, slice or project with this call are needed, and
+    # each is attributed to the user that allocated it.
     def get_current_allocations(self, aggregate_manager,
                                 arguments, method_name, options, creds):
 
         sliver_info = []
-        slices = aggregate_manager._delegate._slices
         user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
+        ledger = getattr(aggregate_manager._delegate, 'allocation_ledger', None)
+        if ledger is not None:
+            return ledger.sliver_infos(user_urn,
+                                       self.get_slice_urn(ledger, arguments))
+
+        slices = aggregate_manager._delegate._slices
 
         for slice_urn, slice_obj in slices.items():
             self.add_sliver_info_for_slice(slice_obj, sliver_info, 
@@ -143,6 +152,21 @@ class GCFAM_Resource_Manager(Base_Resource_Manager):
 
         return sliver_info
 
+    # Return the URN of the slice this call is about, or None.
+    # V2 methods name the slice. V3 methods take a list of slice or
+    # sliver URNs, all of one slice (as decode_urns insists), so take
+    # the slice from the first URN the ledger knows.
+    def get_slice_urn(self, ledger, arguments):
+        if arguments.get('slice_urn'):
+            return arguments['slice_urn']
+        for urn_str in arguments.get('urns') or []:
+            if urn_util.is_valid_urn_bytype(urn_str, 'slice'):
+                return urn_str
+            slice_urn = ledger.slice_urn(urn_str)
+            if slice_urn is not None:
+                return slice_urn
+        return None
+
     # Add entry for each sliver of slice
     # Account for difference between GCF AM V2 and V3 representations
     def add_sliver_info_for_slice(self, slice_obj, sliver_info, method_name,
@@ -0,0 +1,127 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+import threading
+
+from .util import convert_slice_urn_to_project_urn, convert_user_urn_to_authority_urn
+
+# A ledger of the current allocations at an aggregate, indexed by the
+# contexts that resource quotas are computed over (see resource_binder):
+# the user, slice, project and authority of each sliver.
+#
+# The aggregate records slivers as they are allocated, renewed and
+# deleted or expired, so a resource manager can hand the authorizer the
+# slivers relevant to a call without looking at every slice.
+
+class AllocationLedger(object):
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # sliver URN -> sliver info dict, in the format of
+        # Base_Resource_Manager.get_requested_allocation_state
+        self._slivers = {}
+        # (domain, URN) -> set of sliver URNs
+        self._contexts = {}
+
+    def _sliver_contexts(self, slice_urn, user_urn):
+        contexts = []
+        if slice_urn:
+            contexts.append(('SLICE', slice_urn))
+            if slice_urn.count('+') > 1:
+                project_urn = convert_slice_urn_to_project_urn(slice_urn)
+                if project_urn:
+                    contexts.append(('PROJECT', project_urn))
+        if user_urn:
+            contexts.append(('USER', user_urn))
+            if user_urn.count('+') > 1:
+                contexts.append(('AUTHORITY',
+                                 convert_user_urn_to_authority_urn(user_urn)))
+        return contexts
+
+    # Record a sliver (replacing any previous record of it)
+    # start_time and end_time are naive UTC datetimes
+    # measurements is {measurement name : value}, e.g. {'NODE' : 1}
+    def add(self, sliver_urn, slice_urn, user_urn, start_time, end_time,
+            measurements):
+        with self.lock:
+            self.remove(sliver_urn)
+            self._slivers[sliver_urn] = {'sliver_urn' : sliver_urn,
+                                         'slice_urn' : slice_urn,
+                                         'user_urn' : user_urn,
+                                         'start_time' : str(start_time),
+                                         'end_time' : str(end_time),
+                                         'measurements' : dict(measurements)}
+            for context in self._sliver_contexts(slice_urn, user_urn):
+                self._contexts.setdefault(context, set()).add(sliver_urn)
+
+    # Change the times of a recorded sliver
+    def update(self, sliver_urn, start_time=None, end_time=None):
+        with self.lock:
+            info = self._slivers.get(sliver_urn)
+            if info is None:
+                return
+            if start_time is not None:
+                info['start_time'] = str(start_time)
+            if end_time is not None:
+                info['end_time'] = str(end_time)
+
+    # Forget a sliver that was deleted or expired
+    def remove(self, sliver_urn):
+        with self.lock:
+            info = self._slivers.pop(sliver_urn, None)
+            if info is None:
+                return
+            for context in self._sliver_contexts(info['slice_urn'],
+                                                 info['user_urn']):
+                urns = self._contexts.get(context)
+                if urns is not None:
+                    urns.discard(sliver_urn)
+                    if not urns:
+                        del self._contexts[context]
+
+    # Return the URN of the slice of a recorded sliver, or None
+    def slice_urn(self, sliver_urn):
+        with self.lock:
+            info = self._slivers.get(sliver_urn)
+            if info is None:
+                return None
+            return info['slice_urn']
+
+    # Return copies of the sliver infos for all slivers sharing a context
+    # (user, authority, slice or project) with the given user and slice
+    def sliver_infos(self, user_urn=None, slice_urn=None):
+        with self.lock:
+            urns = set()
+            for context in self._sliver_contexts(slice_urn, user_urn):
+                urns.update(self._contexts.get(context, ()))
+            result = []
+            for sliver_urn in urns:
+                info = dict(self._slivers[sliver_urn])
+                info['measurements'] = dict(info['measurements'])
+                result.append(info)
+            return result
+
+    def __len__(self):
+        return len(self._slivers)
@@ -79,15 +79,23 @@ class Resource_Binder(Base_Binder):
         user_urn = sliver_info['user_urn']
         project_urn = None
         authority_urn = None
-        start_time = dateutil.parser.parse(sliver_info['start_time'])
-        end_time = dateutil.parser.parse(sliver_info['end_time'])
-        measurements = sliver_info['measurements']
 
         if slice_urn:
             project_urn = convert_slice_urn_to_project_urn(slice_urn)
         if user_urn:
             authority_urn = convert_user_urn_to_authority_urn(user_urn)
 
+        # Only parse the times of slivers in the call context
+        if not ((slice_urn and slice_urn == self._slice_urn) or
+                (user_urn and user_urn == self._user_urn) or
+                (project_urn and project_urn == self._project_urn) or
+                (authority_urn and authority_urn == self._authority_urn)):
+            return
+
+        start_time = dateutil.parser.parse(sliver_info['start_time'])
+        end_time = dateutil.parser.parse(sliver_info['end_time'])
+        measurements = sliver_info['measurements']
+
         if slice_urn:
             self._update_sliver(slice_urn, self._slice_urn, 'SLICE', 
                                 start_time, end_time, measurements, 
@@ -234,49 +242,32 @@ class HOURS_ResourceMeasurementState(Base_ResourceMeasurementState):
 class MAX_ResourceMeasurementState(Base_ResourceMeasurementState):
     def __init__(self, urn_type, meas_type):
         Base_ResourceMeasurementState.__init__(self, urn_type, meas_type)
-        # Maintain list of times
-        self._times = set()
-
-        # Maintain list of [value, start, end] tuples
-        self._entries = []
+        # Maintain list of (time, change in total) events
+        self._events = []
 
     def update(self, start_time, end_time, value, sliver_info):
-        # Register times
-        self._times.add(start_time)
-        self._times.add(end_time)
-
         # Registry entry for later 'MAX' calculation
-        self._entries.append((start_time, end_time, value))
-
+        self._events.append((start_time, value))
+        self._events.append((end_time, -value))
 
     def getBindings(self):
 
-        # Get a sorted list of all the start/end times
-        time_boundaries = [tm for tm in self._times]
-        time_boundaries.sort()
-
-        # Collect totals for each window [i:i+1] in bin [i]
-        totals = [0 for i in range(len(time_boundaries)-1)]
-
-        # For each entry, add the value to the right bins if
-        # entry overlaps the time window of that bin
-        # In so doing, compute max_total
+        # Sweep through the start/end times in order, keeping the
+        # running total and its maximum
         #
         # Note: we treat start_time as first included time
-        # end_times as NON-included time
+        # end_times as NON-included time, so at equal times the
+        # ends (negative changes) sort first
         max_total = 0
-        for entry in self._entries:
-            entry_start = entry[0]
-            entry_end = entry[1]
-            value = entry[2]
-            for i in range(len(totals)):
-                boundary_start = time_boundaries[i]
-                boundary_end = time_boundaries[i+1]
-                no_overlap =  entry_start >= boundary_end or \
-                    entry_end <= boundary_start;
-                if not no_overlap:
-                    totals[i] = totals[i] + value
-                    max_total = max(totals[i], max_total)
+        total = 0
+        self._events.sort()
+        for i in range(len(self._events)):
+            tm, change = self._events[i]
+            total = total + change
+            # Only count the total once all changes at this time are in
+            if i + 1 < len(self._events) and self._events[i+1][0] == tm:
+                continue
+            max_total = max(total, max_total)
 
         max_key = "$%s_%s_%s" % (self._urn_type, self._meas_type, 'MAX')
         return {max_key : str(max_total) }
@@ -32,6 +32,8 @@ import xmlrpclib
 import sys
 import datetime
 import dateutil
+import hashlib
+import threading
 
 from ...sfa.trust import credential as cred
 from ...sfa.trust import gid
@@ -40,6 +42,7 @@ from ...sfa.util.xrn import hrn_authfor_hrn
 from ...sfa.trust.credential_factory import CredentialFactory
 from ...sfa.trust.abac_credential import ABACCredential
 from ...sfa.trust.certificate import Certificate
+from ...sfa.trust.trust_store import TrustRootStore, reload_on_sighup
 
 from .speaksfor_util import determine_speaks_for
 
@@ -56,6 +59,78 @@ def naiveUTC(dt):
         dt = dt.replace(tzinfo=None)
     return dt
 
+class VerifiedCredentialCache(object):
+    """A bounded, thread safe, least recently used cache of credentials
+    that have already passed signature and chain verification.
+
+    Entries are keyed by a digest of the credential XML and the trusted
+    root certificates it was verified against, and hold the verified
+    Credential object until the earlier of the credential's own
+    expiration and maxAge seconds from when it was verified."""
+
+    def __init__(self, maxEntries=500, maxAge=600):
+        self.maxEntries = maxEntries
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        # key -> [credential, expires, last used tick]
+        self.entries = dict()
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the verified credential with this key, or None"""
+        now = datetime.datetime.utcnow()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.tick += 1
+            entry[2] = self.tick
+            return entry[0]
+
+    def holds(self, key, credential):
+        """Is this very credential object still cached under this key?"""
+        now = datetime.datetime.utcnow()
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] is credential and entry[1] > now
+
+    def put(self, key, credential, expiration):
+        """Remember that credential verified. expiration is a naive UTC datetime"""
+        if self.maxEntries < 1:
+            return
+        now = datetime.datetime.utcnow()
+        expires = min(expiration, now + datetime.timedelta(seconds=self.maxAge))
+        if expires <= now:
+            return
+        with self.lock:
+            if not self.entries.has_key(key) and len(self.entries) >= self.maxEntries:
+                self._evict(now)
+            self.tick += 1
+            self.entries[key] = [credential, expires, self.tick]
+
+    def _evict(self, now):
+        # Called with the lock held. Drop expired entries, else the least recently used
+        expired = [k for k, e in self.entries.iteritems() if e[1] <= now]
+        for k in expired:
+            del self.entries[k]
+        if len(self.entries) >= self.maxEntries:
+            lru = min(self.entries.iterkeys(), key=lambda k: self.entries[k][2])
+            del self.entries[lru]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return "%d entries, %d hits, %d misses" % (len(self.entries), self.hits, self.misses)
+
 class CredentialVerifier(object):
     """Utilities to verify signed credentials from a given set of 
     root certificates. Will compare target and source URNs, and privileges.
@@ -65,25 +140,39 @@ class CredentialVerifier(object):
 
     # root_cert_fileordir is a trusted root cert file or directory of
     # trusted roots for verifying credentials
-    def __init__(self, root_cert_fileordir):
+    # cache_size is the number of verified credentials to remember (0 to disable)
+    def __init__(self, root_cert_fileordir, cache_size=500):
         self.logger = logging.getLogger('cred-verifier')
+        self.cache = VerifiedCredentialCache(cache_size)
         if root_cert_fileordir is None:
             raise Exception("Missing Root certs argument")
-        elif os.path.isdir(root_cert_fileordir):
-            files = os.listdir(root_cert_fileordir)
-            self.root_cert_files = []
-            for file in files:
-                # FIXME: exclude files that aren't cert files?
-                if file == CredentialVerifier.CATEDCERTSFNAME:
-                    continue
-                self.root_cert_files.append(os.path.expanduser(os.path.join(root_cert_fileordir, file)))
+        # Load the roots once, reloading if they change (or on SIGHUP,
+        # see reloadRootsOnSighup)
+        self.trust_roots = TrustRootStore(root_cert_fileordir)
+        if os.path.isdir(root_cert_fileordir):
             self.logger.info('Will accept credentials signed by any of %d root certs found in %s: %r' % (len(self.root_cert_files), root_cert_fileordir, self.root_cert_files))
-        elif os.path.isfile(root_cert_fileordir):
-            self.logger.info('Will accept credentials signed by the single root cert %s' % root_cert_fileordir)
-            self.root_cert_files = [root_cert_fileordir]
         else:
-            raise Exception("Couldn't find Root certs in %s" % root_cert_fileordir)
+            self.logger.info('Will accept credentials signed by the single root cert %s' % root_cert_fileordir)
+
+    @property
+    def root_cert_files(self):
+        return self.trust_roots.files
 
+    def _roots_digest(self):
+        '''Identify the current trusted roots, which changes if any of them is edited or removed'''
+        self.trust_roots.reload_if_changed()
+        return "%s|%d|" % (self.trust_roots.root_cert_fileordir, self.trust_roots.version)
+
+    def _cache_key(self, cred_string, roots_digest):
+        if isinstance(cred_string, unicode):
+            cred_string = cred_string.encode('utf-8')
+        return hashlib.sha256(roots_digest + cred_string).hexdigest()
+
+    @classmethod
+    def reloadRootsOnSighup(cls):
+        '''Reload the trusted roots of every verifier on SIGHUP.
+        Call once, from the main thread of a server.'''
+        reload_on_sighup()
 
     @classmethod
     def getCAsFileFromDir(cls, caCerts):
@@ -134,9 +223,8 @@ class CredentialVerifier(object):
 
     # Get the GID of the caller, substituting the real user if this is a 'speaks-for' invocation
     def get_caller_gid(self, gid_string, cred_strings, options=None):
-        root_certs = \
-            [Certificate(filename=root_cert_file) \
-                 for root_cert_file in self.root_cert_files]
+        self.trust_roots.reload_if_changed()
+        root_certs = self.trust_roots
 
         caller_gid = gid.GID(string=gid_string)
 
@@ -162,8 +250,12 @@ class CredentialVerifier(object):
         '''Create Credential and GID objects from the given strings,
         and then verify the GID has the right privileges according 
         to the given credentials on the given target.'''
+        roots_digest = self._roots_digest()
         def make_cred(cred_string):
-            credO = None
+            # Reuse an already verified credential if we have seen this one
+            credO = self.cache.get(self._cache_key(cred_string, roots_digest))
+            if credO is not None:
+                return credO
             try:
                 credO = CredentialFactory.createCred(credString=cred_string)
             except Exception, e:
@@ -177,8 +269,10 @@ class CredentialVerifier(object):
         cred_strings = [cred_string for cred_string in cred_strings \
                             if CredentialFactory.getType(cred_string) == cred.Credential.SFA_CREDENTIAL_TYPE]
 
+        creds = map(make_cred, cred_strings)
+        self.logger.debug("Verified credential cache: %s. Trust roots: %s", self.cache.stats(), self.trust_roots.stats())
         return self.verify(caller_gid,
-                           map(make_cred, cred_strings),
+                           creds,
                            target_urn,
                            privileges)
         
@@ -250,6 +344,7 @@ class CredentialVerifier(object):
         # The semantics of the list of credentials is under specified.
 
         self.logger.debug('Verifying privileges')
+        roots_digest = self._roots_digest()
         result = list()
         failure = ""
         tried_creds = ""
@@ -291,14 +386,20 @@ class CredentialVerifier(object):
                 failure = "Cred for %s over %s doesn't provide sufficient privileges" % (cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn())
                 continue
 
+            key = self._cache_key(cred.save_to_string(), roots_digest)
+            if self.cache.holds(key, cred):
+                # Verified by an earlier call against the same roots
+                result.append(cred)
+                continue
             try:
-                if not cred.verify(self.root_cert_files):
+                if not cred.verify(self.trust_roots):
                     failure = "Couldn't validate credential for caller %s with target %s with any of %d known root certs" % (cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn(), len(self.root_cert_files))
                     continue
             except Exception, exc:
                 failure = "Couldn't validate credential for caller %s with target %s with any of %d known root certs: %s: %s" % (cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn(), len(self.root_cert_files), exc.__class__.__name__, exc)
                 self.logger.info(failure)
                 continue
+            self.cache.put(key, cred, naiveUTC(cred.get_expiration()))
             # If got here it verified
             result.append(cred)
 
@@ -29,15 +29,24 @@ RSpec validation and printing utilities.
 from __future__ import absolute_import
 
 import xml.etree.ElementTree as etree 
+import binascii
 import subprocess
 import tempfile
 import xml.parsers.expat
 import xml.dom.minidom as md
+import zlib
 
 from .rspec_schema import *
 
 RSPECLINT = "rspeclint" 
 
+# RSpecs longer than this many bytes are checked a piece at a time
+# (each piece lowercased) rather than in one go from a lowercased copy
+STREAM_THRESHOLD = 1000000
+
+# Size of the pieces to parse or decompress at a time
+STREAM_CHUNK = 65536
+
 def is_wellformed_xml( string, logger=None ):
     # Try to parse the XML code.
     # If it fails to parse, then it is not well-formed
@@ -322,6 +331,12 @@ def is_rspec_string( rspec, rspec_namespace=None, rspec_schema=None,
     if isinstance(rspec, unicode):
         rspec = rspec.encode('utf-8')
 
+    # Big RSpecs: parse a piece at a time instead of copying the whole thing.
+    # Lowercase each piece, so tags match case insensitively as below.
+    if len(rspec) > STREAM_THRESHOLD and not (rspec_namespace and rspec_schema):
+        return write_rspec_stream((chunk.lower() for chunk in iter_chunks(rspec)),
+                                  None, False, logger)
+
     # do all comparisons as lowercase
     rspec = rspec.lower()
 
@@ -369,6 +384,154 @@ def getPrettyRSpec(rspec, prettify=True):
         prettyrspec = prettyrspec.encode('utf-8')
     return prettyrspec
 
+def iter_chunks(string, size=STREAM_CHUNK):
+    '''Yield the given string a piece at a time'''
+    for start in xrange(0, len(string), size):
+        yield string[start:start+size]
+
+def iter_decompressed(data, size=STREAM_CHUNK):
+    '''Yield the contents of a base64 encoded zlib compressed string a piece
+    at a time, decoding and decompressing only one piece at a time.
+    Raises an Exception if the data is not base64 encoded zlib data.'''
+    decompressor = zlib.decompressobj()
+    left = ''
+    for chunk in iter_chunks(data, size):
+        # base64 decodes in groups of 4 characters, ignoring whitespace
+        chunk = left + ''.join(chunk.split())
+        usable = len(chunk) - len(chunk) % 4
+        left = chunk[usable:]
+        if usable > 0:
+            out = decompressor.decompress(binascii.a2b_base64(chunk[:usable]))
+            if out:
+                yield out
+    if left:
+        # Raises an Error for the bad padding
+        out = decompressor.decompress(binascii.a2b_base64(left))
+        if out:
+            yield out
+    out = decompressor.flush()
+    if out:
+        yield out
+
+def _escape_text(text):
+    # As minidom escapes both text and attribute values
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+class _RSpecStreamWriter(object):
+    '''expat handlers that note whether the document has an rspec element,
+    and if given a file-like object, write the document to it re-indented.
+    Elements with only text are written on one line, whitespace only
+    text is dropped, and attributes are sorted by name, like minidom
+    toprettyxml.'''
+
+    def __init__(self, parser, out=None, indent='  '):
+        self.out = out
+        self.indent = indent
+        self.isRSpec = False
+        self.depth = 0
+        # Start tag not written until we see whether the element is empty
+        self.pending = None
+        self.text = []
+        parser.StartElementHandler = self.start
+        if out is not None:
+            parser.EndElementHandler = self.end
+            parser.CharacterDataHandler = self.text.append
+            parser.CommentHandler = self.comment
+            parser.ProcessingInstructionHandler = self.pi
+            # Like minidom toprettyxml
+            out.write('<?xml version="1.0" ?>\n')
+
+    def _line(self, depth, string):
+        self.out.write(self.indent * depth + string + '\n')
+
+    def _flush(self):
+        '''Write any waiting start tag and text'''
+        if self.pending is not None:
+            self._line(self.depth - 1, self.pending + '>')
+            self.pending = None
+        text = ''.join(self.text).strip()
+        del self.text[:]
+        if text:
+            self._line(self.depth, _escape_text(text))
+
+    def start(self, name, attrs):
+        lname = name.lower()
+        if lname.startswith('rspec') or lname.startswith('resv_rspec'):
+            self.isRSpec = True
+        if self.out is None:
+            return
+        self._flush()
+        tag = ['<', name]
+        for attr, value in sorted(zip(attrs[0::2], attrs[1::2])):
+            tag.append(' %s="%s"' % (attr, _escape_text(value)))
+        self.pending = ''.join(tag)
+        self.depth += 1
+
+    def end(self, name):
+        if self.pending is not None:
+            text = ''.join(self.text).strip()
+            del self.text[:]
+            self.depth -= 1
+            if text:
+                self._line(self.depth, "%s>%s</%s>" % (self.pending, _escape_text(text), name))
+            else:
+                self._line(self.depth, self.pending + '/>')
+            self.pending = None
+        else:
+            self._flush()
+            self.depth -= 1
+            self._line(self.depth, '</%s>' % name)
+
+    def comment(self, data):
+        self._flush()
+        self._line(self.depth, '<!--%s-->' % data)
+
+    def pi(self, target, data):
+        self._flush()
+        self._line(self.depth, '<?%s %s?>' % (target, data))
+
+def write_rspec_stream(chunks, out=None, prettify=None, logger=None):
+    '''Check an RSpec given as an iterable of string pieces with an incremental
+    parser, writing it to the file-like object out (if any) as it goes,
+    so neither a DOM nor another copy of the whole RSpec is built.
+    If prettify is None, pretty print unless the first piece already has
+    more than 10 newlines. Otherwise the pieces are written unchanged.
+    Returns True if the pieces make a well formed XML document with an
+    rspec element (like is_rspec_string without a schema).
+    Exceptions raised by the iterable (say from decompressing) are not caught.'''
+    parser = xml.parsers.expat.ParserCreate()
+    parser.returns_unicode = False
+    parser.ordered_attributes = True
+    writer = None
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            if writer is None:
+                if prettify is None:
+                    prettify = chunk.count('\n') <= 10
+                if prettify:
+                    writer = _RSpecStreamWriter(parser, out)
+                else:
+                    writer = _RSpecStreamWriter(parser)
+            if out is not None and not prettify:
+                out.write(chunk)
+            parser.Parse(chunk, 0)
+        if writer is None:
+            if logger is not None:
+                logger.debug("rspec is empty")
+            return False
+        parser.Parse('', 1)
+    except xml.parsers.expat.ExpatError, e:
+        if logger is not None:
+            logger.debug("Not wellformed XML: %s", e)
+        return False
+    if not writer.isRSpec:
+        if logger is not None:
+            logger.debug("RSpec string invalid: no rspec element")
+        return False
+    return True
+
 if __name__ == "__main__":
     request_str = """<?xml version='1.0'?>
 <!--Comment-->
@@ -39,12 +39,14 @@ try:
     from ...sfa.trust.credential import Credential, signature_template, HAVELXML
     from ...sfa.trust.credential_factory import CredentialFactory
     from ...sfa.trust.gid import GID
+    from ...sfa.trust.signature_verifier import get_verifier, SignatureNotVerified
 except:
     from gcf.sfa.trust.abac_credential import ABACCredential, ABACElement
     from gcf.sfa.trust.certificate import Certificate
     from gcf.sfa.trust.credential import Credential, signature_template, HAVELXML
     from gcf.sfa.trust.credential_factory import CredentialFactory
     from gcf.sfa.trust.gid import GID
+    from gcf.sfa.trust.signature_verifier import get_verifier, SignatureNotVerified
 
 # Routine to validate that a speaks-for credential 
 # says what it claims to say:
@@ -168,27 +170,16 @@ def verify_speaks_for(cred, tool_gid, speaking_for_urn, \
     role = head.get_role()
 
     # Credential must pass xmlsec1 verify
-    cred_file = write_to_tempfile(cred.save_to_string())
-    cert_args = []
+    # Like xmlsec1 with no --node-id, this checks the first Signature
+    trusted_files = []
     if trusted_roots:
-        for x in trusted_roots:
-            cert_args += ['--trusted-pem', x.filename]
-    # FIXME: Why do we not need to specify the --node-id option as credential.py does?
-    xmlsec1_args = [cred.xmlsec_path, '--verify'] + cert_args + [ cred_file]
-    output = run_subprocess(xmlsec1_args, stdout=None, stderr=subprocess.PIPE)
-    os.unlink(cred_file)
-    if output != 0:
-        # FIXME
-        # xmlsec errors have a msg= which is the interesting bit.
-        # But does this go to stderr or stdout? Do we have it here?
-        mstart = verified.find("msg=")
-        msg = ""
-        if mstart > -1 and len(verified) > 4:
-            mstart = mstart + 4
-            mend = verified.find('\\', mstart)
-            msg = verified[mstart:mend]
+        trusted_files = [x.filename for x in trusted_roots]
+    try:
+        get_verifier(cred.xmlsec_path).verify(cred.save_to_string(), None, trusted_files)
+    except SignatureNotVerified, snv:
+        msg = snv.msg
         if msg == "":
-            msg = output
+            msg = snv.detail
         return False, None, "ABAC credential failed to xmlsec1 verify: %s" % msg
 
     # Must say U.speaks_for(U)<-T
@@ -31,6 +31,7 @@ Handle calls to AM API functions
 """
 
 from copy import copy
+import cStringIO
 import datetime
 import dateutil.parser
 import json
@@ -39,10 +40,13 @@ import os
 import pprint
 import re
 import string
+import threading
 import zlib
 
 from .util import OmniError, NoSliceCredError, RefusedError, naiveUTC, AMAPIError
+from .util.adcache import AdCache
 from .util.dossl import _do_ssl
+from .util.fanout import FanOut
 from .util.abac import get_abac_creds, save_abac_creds, save_proof, is_ABAC_framework
 from .util import credparsing as credutils
 from .util.handler_utils import _listaggregates, validate_url, _get_slice_cred, _derefAggNick, \
@@ -75,6 +79,11 @@ class AMCallHandler(object):
         self.opts = opts # command line options as parsed
         self.GetVersionCache = None # The cache of GetVersion info in memory
         self.clients = None # XMLRPC clients for talking to AMs
+        self.clientCache = None # AM URL -> XMLRPC client to re-use, shared by the calls of an omni Session
+        self.prefetched = {} # client URL -> op -> (result, exc_info) from a parallel fan out
+        self.cacheLock = threading.RLock() # Guard the GetVersion cache when calling AMs in parallel
+        self.adCache = None # Advertisement RSpecs saved on disk, once needed
+        self.adCacheUser = None # URN of the user the advertisement cache is used for
         if self.opts.abac:
             aconf = self.config['selected_framework']
             if 'abac' in aconf and 'abac_log' in aconf:
@@ -157,9 +166,15 @@ class AMCallHandler(object):
         retmsg = "" # Message to put at start of result summary
         i = -1 # Index of client in clients list
         badcIs = [] # Indices of bad clients to remove from list later
+        self._prefetch_getversion(clients)
         for client in clients:
             i = i + 1
-            (thisVer, message) = self._get_this_api_version(client)
+            prefetched = self._take_prefetched(client, 'GetVersion')
+            if prefetched is not None and prefetched[1] is None:
+                # Use the result from the parallel GetVersion, including any error
+                (thisVer, message) = prefetched[0]
+            else:
+                (thisVer, message) = self._get_this_api_version(client)
             if thisVer is None:
                 # Not a valid client
                 numClients = numClients - 1
@@ -539,25 +554,28 @@ class AMCallHandler(object):
         else:
             res['url'] = "unspecified_AM_URL"
         res['error'] = error
-        if self.GetVersionCache is None:
-            # Read the file as serialized JSON
-            self._load_getversion_cache()
-        if error:
-            # On error, leave existing data alone - just record the last error
-            if self.GetVersionCache.has_key(client.url):
-                self.GetVersionCache[client.url]['lasterror'] = error
-            self.logger.debug("Added GetVersion error output to cache for %s: %s", client.url, error)
-        else:
-            self.GetVersionCache[client.url] = res
-            self.logger.debug("Added GetVersion success output to cache for %s", client.url)
+        # With --parallel, several threads may add to the cache at once
+        with self.cacheLock:
+            if self.GetVersionCache is None:
+                # Read the file as serialized JSON
+                self._load_getversion_cache()
+            if error:
+                # On error, leave existing data alone - just record the last error
+                if self.GetVersionCache.has_key(client.url):
+                    self.GetVersionCache[client.url]['lasterror'] = error
+                self.logger.debug("Added GetVersion error output to cache for %s: %s", client.url, error)
+            else:
+                self.GetVersionCache[client.url] = res
+                self.logger.debug("Added GetVersion success output to cache for %s", client.url)
 
-        # Write the file as serialized JSON
-        self._save_getversion_cache()
+            # Write the file as serialized JSON
+            self._save_getversion_cache()
 
     def _get_cached_getversion(self, client):
         '''Get GetVersion from cache or this AM, if any.'''
-        if self.GetVersionCache is None:
-            self._load_getversion_cache()
+        with self.cacheLock:
+            if self.GetVersionCache is None:
+                self._load_getversion_cache()
         if self.GetVersionCache is None:
             return None
         self.logger.debug("Checking cache for %s", client.url)
@@ -627,8 +645,9 @@ class AMCallHandler(object):
         message = None
 
         # We cache results by URL
-        if not hasattr(self, 'gvValueCache'):
-            self.gvValueCache = dict()
+        with self.cacheLock:
+            if not hasattr(self, 'gvValueCache'):
+                self.gvValueCache = dict()
         if self.gvValueCache.has_key(client.url):
             return self.gvValueCache[client.url]
 
@@ -735,9 +754,61 @@ class AMCallHandler(object):
         # Return is string: geni_single, geni_disjoint, or geni_many
         return (res, message)
 
+    def _prefetch(self, clientList, op, func):
+        '''If running with --parallel N (N > 1), call func(client) on all the given clients
+        concurrently, at most N at a time, and stash the results by client URL and op.
+        The usual loop over the clients then picks up each result with _take_prefetched,
+        so results, output and messages are produced in client order as if the calls
+        had been made one at a time.
+        Logs the wall clock time compared with the summed time of the individual calls.'''
+        for url in self.prefetched.keys():
+            self.prefetched[url].pop(op, None)
+        numWorkers = min(self.opts.parallel, len(clientList))
+        if numWorkers < 2:
+            return
+        self.logger.debug("Doing %s at %d aggregates, %d at a time", op, len(clientList), numWorkers)
+        fan = FanOut(numWorkers, self.logger)
+        results = fan.run(func, clientList)
+        for (client, result) in zip(clientList, results):
+            self.prefetched.setdefault(client.url, {})[op] = result
+        self.logger.info(fan.summary("%s at %d aggregates" % (op, len(clientList))))
+
+    def _take_prefetched(self, client, op):
+        '''Pop the (result, exc_info) from a parallel _prefetch of op at this client, if any. Else None.'''
+        if client is None or not self.prefetched.has_key(client.url):
+            return None
+        return self.prefetched[client.url].pop(op, None)
+
+    def _prefetch_getversion(self, clientList):
+        '''With --parallel, fill the GetVersion caches for all clients concurrently,
+        so later per client checks of the AM API version do not each wait on an AM.'''
+        self._prefetch(clientList, 'GetVersion', self._get_this_api_version)
+
+    def _prefetch_api_calls(self, clientList, msg, op, args):
+        '''With --parallel, make the given AM API call at all clients concurrently, for
+        _api_call to hand back in the usual loop over clients.
+        msg is the start of the message describing the call, to which the client URL is added.
+        args is the list of call arguments, or a function that takes the client and returns them.'''
+        def doCall(client):
+            if callable(args):
+                callArgs = args(client)
+            else:
+                callArgs = args
+            return self._api_call(client, msg + str(client.url), op, callArgs)
+        self._prefetch(clientList, op, doCall)
+
     def _api_call(self, client, msg, op, args):
         '''Make the AM API Call, after first checking that the AM we are talking
-        to is of the right API version.'''
+        to is of the right API version.
+        If this call was already made in a parallel _prefetch_api_calls, return
+        (or raise) what that call did.'''
+        prefetched = self._take_prefetched(client, op)
+        if prefetched is not None:
+            (result, excInfo) = prefetched
+            if excInfo is not None:
+                raise excInfo[0], excInfo[1], excInfo[2]
+            return result
+
         (ver, newc, validMsg) = self._checkValidClient(client)
         if newc is None:
             # if the error reason is just that the client is not
@@ -1054,6 +1125,60 @@ class AMCallHandler(object):
                 pass
         return rspec
 
+    def _ad_cache(self):
+        '''Return the AdCache of advertisement RSpecs, or None if not using cache files'''
+        if self.opts.noCacheFiles:
+            return None
+        if self.adCache is None:
+            self.adCache = AdCache(self.opts.adCacheName, self.logger)
+        return self.adCache
+
+    def _ad_cache_key(self, client, options):
+        '''The key for the advertisement from this client with these ListResources options in the AdCache'''
+        if self.adCacheUser is None:
+            self.adCacheUser = getattr(self.framework, 'user_urn', None) or \
+                _get_user_urn(self.logger, self.framework.config)
+        rspec_version = options.get('geni_rspec_version', options.get('rspec_version'))
+        return (client.url, self.opts.api_version, rspec_version,
+                options.get('geni_available', False), self.adCacheUser)
+
+    def _have_cached_ad(self, client, options):
+        '''With --use-cached-ad, is there an advertisement from this client cached within --max-ad-age?'''
+        if not self.opts.useCachedAd or self._ad_cache() is None:
+            return False
+        age = self.adCache.age(self._ad_cache_key(client, options))
+        return age is not None and age <= self.opts.maxAdAge * 60
+
+    def _get_cached_ad(self, client, options):
+        '''With --use-cached-ad, return the (rspec, code, output) of the advertisement from
+        this client if cached within --max-ad-age. Else None.'''
+        if not self.opts.useCachedAd or self._ad_cache() is None:
+            return None
+        return self.adCache.get(self._ad_cache_key(client, options), self.opts.maxAdAge * 60)
+
+    def _streamRSpec(self, options, rspec):
+        '''Decompress if necessary, check and pretty print a large RSpec a piece at a time,
+        without the full intermediate copies and DOM of _maybeDecompressRSpec and getPrettyRSpec.
+        Return the result, or None if the RSpec could not be streamed (use the usual path for errors).'''
+        # Look only at the start: stripping the whole string would copy it
+        looksXML = rspec[:1000].lstrip().startswith('<')
+        if looksXML:
+            chunks = rspec_util.iter_chunks(rspec)
+        elif options.get('geni_compressed', False) or not self.opts.devmode:
+            chunks = rspec_util.iter_decompressed(rspec)
+        else:
+            return None
+        out = cStringIO.StringIO()
+        try:
+            if not rspec_util.write_rspec_stream(chunks, out, logger=self.logger):
+                return None
+        except Exception, e:
+            self.logger.debug("Failed to stream RSpec: %s", e)
+            return None
+        result = out.getvalue()
+        self.logger.debug("Streamed %d byte RSpec (%d bytes returned by AM)", len(result), len(rspec))
+        return result
+
     def _listresources(self, args):
         """Support method for doing AM API ListResources. Queries resources on various aggregates.
         
@@ -1154,11 +1279,26 @@ class AMCallHandler(object):
             creds = _maybe_add_abac_creds(self.framework, cred)
             creds = self._maybe_add_creds_from_files(creds)
 
+        # With --parallel, check the AM API version and call ListResources at all AMs at once.
+        # The loop below uses those results, in order.
+        def doListResources(client):
+            (ver, newc, validMsg) = self._checkValidClient(client)
+            if newc is None or ver != self.opts.api_version:
+                return None
+            (clientOptions, ignore) = self._selectRSpecVersion(slicename, newc, "", copy(options))
+            clientOptions = self._build_options("ListResources", slicename, clientOptions)
+            if slicename is None and self._have_cached_ad(newc, clientOptions):
+                # The loop below uses the cached advertisement
+                return None
+            return _do_ssl(self.framework, None, ("List Resources at %s" % (newc.url)), newc.ListResources, creds, clientOptions)
+        self._prefetch(clientList, 'ListResources', doListResources)
+
         # Connect to each available GENI AM to list their resources
         for client in clientList:
             if creds is None or len(creds) == 0:
                 self.logger.debug("Have null or empty credential list in call to ListResources!")
             rspec = None
+            prefetched = self._take_prefetched(client, 'ListResources')
 
             (ver, newc, validMsg) = self._checkValidClient(client)
             if newc is None:
@@ -1268,8 +1408,22 @@ class AMCallHandler(object):
             # Done constructing options to ListResources
 #-----
 
-            self.logger.debug("Doing listresources with %d creds, options %r", len(creds), options)
-            (resp, message) = _do_ssl(self.framework, None, ("List Resources at %s" % (client.url)), client.ListResources, creds, options)
+            cachedAd = None
+            if slicename is None:
+                cachedAd = self._get_cached_ad(client, options)
+            if cachedAd is not None:
+                (rspec, code, output) = cachedAd
+                if self.opts.api_version > 1:
+                    resp = dict(code=code, value=rspec, output=output)
+                else:
+                    resp = rspec
+                message = ""
+            elif prefetched is not None and prefetched[1] is None and prefetched[0] is not None:
+                self.logger.debug("Using result of parallel listresources at %s", client.url)
+                (resp, message) = prefetched[0]
+            else:
+                self.logger.debug("Doing listresources with %d creds, options %r", len(creds), options)
+                (resp, message) = _do_ssl(self.framework, None, ("List Resources at %s" % (client.url)), client.ListResources, creds, options)
 
             # Decompress the RSpec before sticking it in retItem
             if resp and (self.opts.api_version == 1 or (self.opts.api_version > 1 and isinstance(resp, dict) and resp.has_key('value') and isinstance(resp['value'], str))):
@@ -1277,32 +1431,50 @@ class AMCallHandler(object):
                     origRSpec = resp['value']
                 else:
                     origRSpec = resp
-                rspec = self._maybeDecompressRSpec(options, origRSpec)
-                if rspec and rspec != origRSpec:
-                    self.logger.debug("Decompressed RSpec")
-                if rspec and rspec_util.is_rspec_string( rspec, None, None, logger=self.logger ):
+                rspec = None
+                validRSpec = False
+                if cachedAd is not None:
+                    rspec = origRSpec
+                elif self.opts.streamRSpecs or len(origRSpec) > self.opts.streamRSpecThreshold:
+                    # Avoid holding several copies of a big RSpec at once
+                    rspec = self._streamRSpec(options, origRSpec)
+                if rspec is not None:
+                    # Already decompressed, checked and pretty printed
                     successCnt += 1
-                    doPretty = (slicename is not None) # True on Manifests
-                    if doPretty and rspec.count('\n') > 10:
-                        # Are there newlines in the manifest already? Then set it false. Good enough.
-                        doPretty = False
-                    elif not doPretty and rspec.count('\n') <= 10:
-                        # Are there no newlines in the Ad? Then set it true to make the ad prettier,
-                        # but usually don't bother. FOAM ads are messy otherwise.
-                        doPretty = True
-                    rspec = rspec_util.getPrettyRSpec(rspec, doPretty)
+                    validRSpec = True
                 else:
-                    self.logger.warn("Didn't get a valid RSpec!")
-                    if mymessage != "":
-                        if mymessage.endswith('.'):
-                            mymessage += ' '
-                        else:
-                            mymessage += ". "
-                    mymessage += "No resources from AM %s: %s" % (client.str, message)
+                    rspec = self._maybeDecompressRSpec(options, origRSpec)
+                    if rspec and rspec != origRSpec:
+                        self.logger.debug("Decompressed RSpec")
+                    if rspec and rspec_util.is_rspec_string( rspec, None, None, logger=self.logger ):
+                        successCnt += 1
+                        doPretty = (slicename is not None) # True on Manifests
+                        if doPretty and rspec.count('\n') > 10:
+                            # Are there newlines in the manifest already? Then set it false. Good enough.
+                            doPretty = False
+                        elif not doPretty and rspec.count('\n') <= 10:
+                            # Are there no newlines in the Ad? Then set it true to make the ad prettier,
+                            # but usually don't bother. FOAM ads are messy otherwise.
+                            doPretty = True
+                        rspec = rspec_util.getPrettyRSpec(rspec, doPretty)
+                        validRSpec = True
+                    else:
+                        self.logger.warn("Didn't get a valid RSpec!")
+                        if mymessage != "":
+                            if mymessage.endswith('.'):
+                                mymessage += ' '
+                            else:
+                                mymessage += ". "
+                        mymessage += "No resources from AM %s: %s" % (client.str, message)
                 if self.opts.api_version > 1:
                     resp['value']=rspec
                 else:
                     resp = rspec
+                if validRSpec and slicename is None and cachedAd is None and self._ad_cache() is not None:
+                    if self.opts.api_version > 1:
+                        self.adCache.put(self._ad_cache_key(client, options), rspec, resp.get('code'), resp.get('output'))
+                    else:
+                        self.adCache.put(self._ad_cache_key(client, options), rspec)
             else:
                 self.logger.warn("No resource listing returned!")
                 self.logger.debug("Return struct missing proper rspec in value element!")
@@ -1317,6 +1489,9 @@ class AMCallHandler(object):
             rspecs[(client.urn, client.url)] = resp
         # End of loop over clients
 
+        if self.adCache is not None:
+            self.logger.debug(self.adCache.stats())
+
         if self.numOrigClients > 0:
             if slicename:
                 self.logger.info( "Listed reserved resources on %d out of %d possible aggregates." % (successCnt, self.numOrigClients))
@@ -1374,6 +1549,7 @@ class AMCallHandler(object):
         --devmode: Continue on error if possible
         --no-compress: Request the returned RSpec not be compressed (default is to compress)
         --available: Return Ad of only available resources
+        --use-cached-ad: Use an Ad saved in the advertisement cache within --max-ad-age minutes, instead of calling the AM
 
         -l to specify a logging config file
         --logoutput <filename> to specify a logging output filename
@@ -1606,6 +1782,10 @@ class AMCallHandler(object):
             descripMsg = "%d slivers in slice %s" % (len(slivers), urn)
         op = 'Describe'
         msg = "Describe %s at " % (descripMsg)
+        def describeArgs(client):
+            (clientOptions, ignore) = self._selectRSpecVersion(name, client, "", copy(options))
+            return [urnsarg, creds, clientOptions]
+        self._prefetch_api_calls(clientList, msg, op, describeArgs)
         for client in clientList:
             args = [urnsarg, creds]
             try:
@@ -2281,6 +2461,11 @@ class AMCallHandler(object):
             else:
                 self.logger.warn(msg + " Consider running with --best-effort in future.")
 
+        def provisionArgs(client):
+            (clientOptions, ignore) = self._selectRSpecVersion(slicename, client, "", copy(options))
+            return [urnsarg, creds, clientOptions]
+        self._prefetch_api_calls(clientList, "Provision %s at " % descripMsg, op, provisionArgs)
+
         # Loop over clients doing operation
         for client in clientList:
             args = [urnsarg, creds]
@@ -2587,6 +2772,8 @@ class AMCallHandler(object):
             else:
                 self.logger.warn(msg + " Consider running with --best-effort in future.")
 
+        self._prefetch_api_calls(clientList, "PerformOperationalAction %s at " % descripMsg, op, args)
+
         # Do poa action on each client
         for client in clientList:
             self.logger.info("%s %s at %s", op, descripMsg, client.str)
@@ -2771,6 +2958,7 @@ class AMCallHandler(object):
         (clientList, message) = self._getclients()
         numClients = len(clientList)
         msg = "Renew Sliver %s on " % (urn)
+        self._prefetch_api_calls(clientList, msg, op, args)
         for client in clientList:
             try:
                 ((res, message), client) = self._api_call(client,
@@ -2916,9 +3104,8 @@ class AMCallHandler(object):
                                                     self.logger.debug("Malformed sliver URN '%s'. Assuming this is OK anyhow at this FOAM based am: %s. See http://groups.geni.net/geni/ticket/1294", surn, agg_urn)
                                     # End of loop over status return elems
 
-                            for sliver_urn in sliver_urns:
-                                self.framework.update_sliver_info(agg_urn, urn, sliver_urn,
-                                                                  newExp)
+                            self.framework.update_sliver_infos(agg_urn, urn,
+                                                               [(sliver_urn, newExp) for sliver_urn in sliver_urns])
                         else:
                             self.logger.info("Not updating recorded sliver expirations - no valid AM URN known")
                     except NotImplementedError, nie:
@@ -3073,6 +3260,7 @@ class AMCallHandler(object):
         numClients = len(clientList)
         retItem = dict()
         msg = "Renew %s at " % (descripMsg)
+        self._prefetch_api_calls(clientList, msg, op, args)
         for client in clientList:
             try:
                 ((res, message), client) = self._api_call(client, msg + client.url, op,
@@ -3148,6 +3336,7 @@ class AMCallHandler(object):
                     try:
                         agg_urn = self._getURNForClient(client)
                         slivers = self._getSliverResultList(res)
+                        toUpdate = []
                         for sliver in slivers:
                             if isinstance(sliver, dict) and \
                                     sliver.has_key('geni_sliver_urn') and \
@@ -3165,8 +3354,8 @@ class AMCallHandler(object):
                                     self.logger.debug("Not recording sliver that had renew error: %s", sliver)
                                     continue
 
-                                self.framework.update_sliver_info \
-                                    (agg_urn, urn, sliver['geni_sliver_urn'], sliver['geni_expires'])
+                                toUpdate.append((sliver['geni_sliver_urn'], sliver['geni_expires']))
+                        self.framework.update_sliver_infos(agg_urn, urn, toUpdate)
                     except NotImplementedError, nie:
                         self.logger.debug('Framework %s doesnt support recording slivers in SA database', self.config['selected_framework']['type'])
                     except Exception, e:
@@ -3279,6 +3468,8 @@ class AMCallHandler(object):
 
         msg = "%s of %s at " % (op, urn)
 
+        self._prefetch_api_calls(clientList, msg, op, args)
+
         # Call SliverStatus on each client
         for client in clientList:
             try:
@@ -3405,6 +3596,8 @@ class AMCallHandler(object):
                                     self.logger.debug("Reconciling %d CH sliver infos against %d AM reported slivers", len(ch_slivers.keys()), len(poss_slivers))
                                     # For each CH sliver, if not in poss_slivers, then remove it
                                     # Else if expirations differ, update it
+                                    toDelete = []
+                                    toUpdate = []
                                     for sliver in ch_slivers.keys():
                                         chexpo = None
                                         if ch_slivers[sliver].has_key('SLIVER_INFO_EXPIRATION'):
@@ -3413,17 +3606,18 @@ class AMCallHandler(object):
                                         if sliver not in poss_slivers:
                                             self.logger.debug("CH lists sliver '%s' that is not in AM list; delete", sliver)
                                             # CH reported a sliver not reported by the AM. Delete it
-                                            self.framework.delete_sliver_info(sliver)
+                                            toDelete.append(sliver)
                                         else:
                                             if chexpo is None or (expI is not None and abs(chexpo - expI) > datetime.timedelta.resolution):
                                                 self.logger.debug("CH sliver %s expiration %s != AM exp %s; update at CH", sliver, str(chexpo), str(expI))
                                                 # update the recorded expiration time to be accurate
-                                                self.framework.update_sliver_info(agg_urn, urn, sliver,
-                                                                                  expI)
+                                                toUpdate.append((sliver, expI))
                                             else:
                                                 # CH has what we have
 #                                                self.logger.debug("CH agrees about expiration of %s: %s", sliver, expI)
                                                 pass
+                                    self.framework.delete_sliver_infos(toDelete)
+                                    self.framework.update_sliver_infos(agg_urn, urn, toUpdate)
 
                                     # Then for each AM sliver, if not in ch_slivers, add it
                                     sliver_statusstruct = []
@@ -3497,8 +3691,7 @@ class AMCallHandler(object):
                             # I'd like to be able to tell the SA to delete all slivers registered for
                             # this slice/AM, but the API says sliver_urn is required
                             sliver_urns = self.framework.list_sliverinfo_urns(urn, agg_urn)
-                            for sliver_urn in sliver_urns:
-                                self.framework.delete_sliver_info(sliver_urn)
+                            self.framework.delete_sliver_infos(sliver_urns)
                         else:
                             self.logger.debug("Not ensuring with CH that AM %s slice %s has no slivers - no valid AM URN known")
                     except NotImplementedError, nie:
@@ -3629,6 +3822,7 @@ class AMCallHandler(object):
         # Do Status at all clients
         op = 'Status'
         msg = "Status of %s at " % (descripMsg)
+        self._prefetch_api_calls(clientList, msg, op, args)
         for client in clientList:
             try:
                 ((status, message), client) = self._api_call(client,
@@ -3676,8 +3870,7 @@ class AMCallHandler(object):
                         try:
                             if len(slivers) > 0:
                                 self.logger.debug("Status failed - assuming all %d sliver URNs asked about are invalid and not at this AM - delete from CH", len(slivers))
-                                for sliver in slivers:
-                                    self.framework.delete_sliver_info(sliver)
+                                self.framework.delete_sliver_infos(slivers)
                             else:
                                 self.logger.debug("Status failed: assuming this slice has 0 slivers at this AM. Ensure CH lists none.")
                                 # Get the Agg URN for this client
@@ -3686,8 +3879,7 @@ class AMCallHandler(object):
                                     # I'd like to be able to tell the SA to delete all slivers registered for
                                     # this slice/AM, but the API says sliver_urn is required
                                     sliver_urns = self.framework.list_sliverinfo_urns(urn, agg_urn)
-                                    for sliver_urn in sliver_urns:
-                                        self.framework.delete_sliver_info(sliver_urn)
+                                    self.framework.delete_sliver_infos(sliver_urns)
                                 else:
                                     self.logger.debug("Not ensuring with CH that AM %s slice %s has no slivers - no valid AM URN known")
                         except NotImplementedError, nie:
@@ -3846,6 +4038,11 @@ class AMCallHandler(object):
                         statuses = self._getSliverAllocStates(status) # Dict by URN of sliver alloc state
                         resultSlivers = statuses.keys()
 
+                        # Sliver records to change at the CH, made together at the end
+                        toCreate = [] # (expiration, sliver status struct)
+                        toDelete = [] # sliver URN
+                        toUpdate = [] # (sliver URN, expiration)
+
                         if slivers_by_am is None or not slivers_by_am.has_key(agg_urn):
                             # CH has no slivers. So all
                             # slivers the AM reported must be sent
@@ -3865,10 +4062,7 @@ class AMCallHandler(object):
                                         self.logger.debug("status_structs missing %s: %s", sliver, status_structs)
                                     else:
                                     # self.logger.debug("Will create sliver. slice: %s, AMURL: %s, expiration: %s, status_struct: %s, AMURN: %s", urn, client.url, expO, status_structs[sliver], agg_urn)
-                                        self.framework.create_sliver_info(None, urn, 
-                                                                          client.url,
-                                                                          expO,
-                                                                          [status_structs[sliver]], agg_urn)
+                                        toCreate.append((expO, status_structs[sliver]))
                                 # else this sliver should not (yet) be recorded at the CH
                         else:
                             # Need to reconcile the CH list and the AM list
@@ -3882,7 +4076,7 @@ class AMCallHandler(object):
                                 self.logger.debug("Ensure %d missing slivers not reported by CH", len(missingSlivers))
                             for missing in missingSlivers:
                                 if missing in ch_slivers.keys():
-                                    self.framework.delete_sliver_info(missing)
+                                    toDelete.append(missing)
                                 # Else AM didn't list it and neither did CH
 
                             # sliverFails: If the failed sliver says it is provisioned, it should be at the CH
@@ -3891,14 +4085,11 @@ class AMCallHandler(object):
                                 if statuses[fail] == 'geni_provisioned' and fail not in ch_slivers.keys():
                                     expO = self._datetimeFromString(expirations[fail])[1]
                                     self.logger.debug("Recording failed but provisioned sliver %s at CH (error: %s)", fail, sliverFails[fail])
-                                    self.framework.create_sliver_info(None, urn, 
-                                                                      client.url,
-                                                                      expO,
-                                                                      [status_structs[fail]], agg_urn)
+                                    toCreate.append((expO, status_structs[fail]))
                                 elif statuses[fail] != 'geni_provisioned' and fail in ch_slivers.keys():
                                     # The AM says the sliver is gone or not yet provisioned: Delete
                                     self.logger.debug("Deleting CH record of failed and not provisioned sliver %s (error: %s, expiration: %s)", fail, sliverFails[fail], expirations[fail])
-                                    self.framework.delete_sliver_info(fail)
+                                    toDelete.append(fail)
                                 else:
                                     # Do nothing with this failed sliver - just note it
                                     if fail in ch_slivers.keys():
@@ -3914,10 +4105,10 @@ class AMCallHandler(object):
                                 if ch_sliver not in resultSlivers:
                                     if len(slivers) == 0 or ch_sliver in slivers:
                                         self.logger.debug("Deleting CH record of sliver not at AM: %s", ch_sliver)
-                                        self.framework.delete_sliver_info(ch_sliver)
+                                        toDelete.append(ch_sliver)
                                 elif statuses[ch_sliver] != 'geni_provisioned':
                                     self.logger.debug("Deleting CH record of not provisioned sliver %s (expiration: %s)", ch_sliver, expirations[ch_sliver])
-                                    self.framework.delete_sliver_info(ch_sliver)
+                                    toDelete.append(ch_sliver)
 
                             # All other slivers in result (not in sliverFails):
                             for sliver in resultSlivers:
@@ -3925,10 +4116,7 @@ class AMCallHandler(object):
                                     if sliver not in ch_slivers.keys():
                                         expO = self._datetimeFromString(expirations[sliver])[1]
                                         self.logger.debug("Recording AM reported sliver %s at CH", sliver)
-                                        self.framework.create_sliver_info(None, urn, 
-                                                                          client.url,
-                                                                          expO,
-                                                                          [status_structs[sliver]], agg_urn)
+                                        toCreate.append((expO, status_structs[sliver]))
                                     else:
                                         # Now dealing with slivers listed by AM and CH, and provisioned at AM, and not failed
                                         chexpo = None
@@ -3940,12 +4128,12 @@ class AMCallHandler(object):
                                         if chexpo is None or (expO is not None and abs(chexpo - expO) > datetime.timedelta.resolution):
                                             self.logger.debug("CH sliver %s expiration %s != AM exp %s; update at CH", sliver, str(chexpo), str(expO))
                                             # update the recorded expiration time to be accurate
-                                            self.framework.update_sliver_info(agg_urn, urn, sliver,
-                                                                              expT)
+                                            toUpdate.append((sliver, expT))
                                         # else CH/AM agree on the time. Nothing to do
                                 # Else the sliver is not yet provisioned or failed. Should already have been handled
                             # End of loop over slivers in result
                         # End of block where CH lists slivers in the slice for this AM
+                        self._change_sliver_infos(urn, client, agg_urn, toCreate, toDelete, toUpdate)
                     except NotImplementedError, nie:
                         self.logger.debug('Framework %s doesnt support recording slivers in SA database', self.config['selected_framework']['type'])
                     except Exception, e:
@@ -4017,6 +4205,7 @@ class AMCallHandler(object):
         (clientList, message) = self._getclients()
         numClients = len(clientList)
         msg = "%s %s at " % (op, urn)
+        self._prefetch_api_calls(clientList, msg, op, args)
 
         # Connect to each available GENI AM
         ## The AM API does not cleanly state how to deal with
@@ -4071,8 +4260,7 @@ class AMCallHandler(object):
                             # I'd like to be able to tell the SA to delete all slivers registered for
                             # this slice/AM, but the API says sliver_urn is required
                             sliver_urns = self.framework.list_sliverinfo_urns(urn, agg_urn)
-                            for sliver_urn in sliver_urns:
-                                self.framework.delete_sliver_info(sliver_urn)
+                            self.framework.delete_sliver_infos(sliver_urns)
                         else:
                             self.logger.debug("Not reporting to CH that slivers were deleted - no valid AM URN known")
                     except NotImplementedError, nie:
@@ -4106,8 +4294,7 @@ class AMCallHandler(object):
                             # I'd like to be able to tell the SA to delete all slivers registered for
                             # this slice/AM, but the API says sliver_urn is required
                             sliver_urns = self.framework.list_sliverinfo_urns(urn, agg_urn)
-                            for sliver_urn in sliver_urns:
-                                self.framework.delete_sliver_info(sliver_urn)
+                            self.framework.delete_sliver_infos(sliver_urns)
                         else:
                             self.logger.debug("Not ensuring with CH that AM %s slice %s has no slivers - no valid AM URN known")
                     except NotImplementedError, nie:
@@ -4249,6 +4436,7 @@ class AMCallHandler(object):
         op = 'Delete'
         msg = "Delete of %s at " % (descripMsg)
         retItem = {}
+        self._prefetch_api_calls(clientList, msg, op, args)
         for client in clientList:
             try:
                 ((result, message), client) = self._api_call(client,
@@ -4287,6 +4475,7 @@ class AMCallHandler(object):
                     # record results in SA database
                     try:
                         sliversDict = self._getSliverResultList(realres)
+                        toDelete = []
                         for sliver in sliversDict:
                             if isinstance(sliver, dict) and \
                                     sliver.has_key('geni_sliver_urn'):
@@ -4306,10 +4495,10 @@ class AMCallHandler(object):
                                     self.logger.debug("Skipping noting delete of failed sliver %s", sliver)
                                     continue
                                 self.logger.debug("Recording sliver %s deleted", sliver)
-                                self.framework.delete_sliver_info \
-                                    (sliver['geni_sliver_urn'])
+                                toDelete.append(sliver['geni_sliver_urn'])
                             else:
                                 self.logger.debug("Skipping noting delete of malformed sliver %s", sliver)
+                        self.framework.delete_sliver_infos(toDelete)
                     except NotImplementedError, nie:
                         self.logger.debug('Framework %s doesnt support recording slivers in SA database', self.config['selected_framework']['type'])
                     except Exception, e:
@@ -4374,8 +4563,7 @@ class AMCallHandler(object):
                         try:
                             if len(slivers) > 0:
                                 self.logger.debug("Delete failed - assuming all %d sliver URNs asked about are invalid and not at this AM - delete from CH", len(slivers))
-                                for sliver in slivers:
-                                    self.framework.delete_sliver_info(sliver)
+                                self.framework.delete_sliver_infos(slivers)
                             else:
                                 self.logger.debug("Delete failed: assuming this slice has 0 slivers at this AM. Ensure CH lists none.")
                                 # Get the Agg URN for this client
@@ -4384,8 +4572,7 @@ class AMCallHandler(object):
                                     # I'd like to be able to tell the SA to delete all slivers registered for
                                     # this slice/AM, but the API says sliver_urn is required
                                     sliver_urns = self.framework.list_sliverinfo_urns(urn, agg_urn)
-                                    for sliver_urn in sliver_urns:
-                                        self.framework.delete_sliver_info(sliver_urn)
+                                    self.framework.delete_sliver_infos(sliver_urns)
                                 else:
                                     self.logger.debug("Not ensuring with CH that AM %s slice %s has no slivers - no valid AM URN known")
                         except NotImplementedError, nie:
@@ -4461,6 +4648,7 @@ class AMCallHandler(object):
         (clientList, message) = self._getclients()
         numClients = len(clientList)
         msg = "Shutdown %s on " % (urn)
+        self._prefetch_api_calls(clientList, msg, op, args)
         for client in clientList:
             try:
                 ((res, message), client) = self._api_call(client, msg + client.url, op, args)
@@ -4897,6 +5085,7 @@ class AMCallHandler(object):
         op = 'Cancel'
         msg = "Cancel of %s at " % (descripMsg)
         retItem = {}
+        self._prefetch_api_calls(clientList, msg, op, args)
         for client in clientList:
             try:
                 ((result, message), client) = self._api_call(client,
@@ -6077,6 +6266,25 @@ class AMCallHandler(object):
         return name, urn, slice_cred, retVal, slice_exp
     # End of _args_to_slicecred
 
+    def _change_sliver_infos(self, urn, client, agg_urn, toCreate, toDelete, toUpdate):
+        '''Make the changes to the CH records of slivers in this slice at this AM found
+        by reconciling them with the AM: record the slivers in toCreate (a list of
+        (expiration, sliver status struct)), delete the records of the sliver URNs in
+        toDelete, and update the (sliver URN, expiration) pairs in toUpdate.
+        New slivers are recorded with one create_sliver_info per distinct expiration.'''
+        expirations = []
+        structsByExp = {}
+        for (exp, struct) in toCreate:
+            if not structsByExp.has_key(exp):
+                expirations.append(exp)
+                structsByExp[exp] = []
+            structsByExp[exp].append(struct)
+        for exp in expirations:
+            self.framework.create_sliver_info(None, urn, client.url, exp,
+                                              structsByExp[exp], agg_urn)
+        self.framework.delete_sliver_infos(toDelete)
+        self.framework.update_sliver_infos(agg_urn, urn, toUpdate)
+
     def _raise_omni_error( self, msg, err=OmniError, triple=None ):
         msg2 = msg
         if triple is not None:
@@ -6117,7 +6325,13 @@ class AMCallHandler(object):
         if message == "From CH":
             self.logger.info("Acting on all aggregates from the clearinghouse - this may take time")
         for (urn, url) in aggs.items():
-            client = make_client(url, self.framework, self.opts)
+            client = None
+            if self.clientCache is not None:
+                client = self.clientCache.get(url)
+            if client is None:
+                client = make_client(url, self.framework, self.opts)
+                if self.clientCache is not None:
+                    self.clientCache[url] = client
             client.urn = urn
             client.nick = _lookupAggNick(self, url)
             clstr = client.url
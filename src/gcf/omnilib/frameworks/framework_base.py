@@ -346,6 +346,18 @@ class Framework_Base():
     def delete_sliver_info(self, sliver_urn):
         raise NotImplementedError('delete_sliver_info')
 
+    # update the recorded expiration times of several slivers at one AM:
+    # slivers is a list of (sliver_urn, expiration) pairs.
+    # Return the list of update_sliver_info results
+    def update_sliver_infos(self, aggregate_urn, slice_urn, slivers):
+        return [self.update_sliver_info(aggregate_urn, slice_urn, sliver_urn, expiration) \
+                    for (sliver_urn, expiration) in slivers]
+
+    # delete several slivers from the CH database of slivers in a slice
+    # Return the list of delete_sliver_info results
+    def delete_sliver_infos(self, sliver_urns):
+        return [self.delete_sliver_info(sliver_urn) for sliver_urn in sliver_urns]
+
     # Find all slivers the SA lists for the given slice
     # Return a struct by AM URN containing a struct: sliver_urn = sliver info struct
     # Compare with list_sliverinfo_urns which only returns the sliver URNs
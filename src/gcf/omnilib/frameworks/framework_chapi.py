@@ -31,7 +31,9 @@ from .framework_base import Framework_Base
 from ..util import OmniError
 from ..util.dates import naiveUTC
 from ..util.dossl import _do_ssl
+from ..util.fanout import FanOut
 from ..util import credparsing as credutils
+from ..util.credcache import CredentialCache
 #from ..util.handler_utils import _lookupAggURNFromURLInNicknames
 from ..util.handler_utils import _load_cred
 
@@ -49,10 +51,24 @@ import dateutil
 import logging
 import os
 from pprint import pprint
+import re
 import string
 import sys
+import time
 import uuid
 
+# Most calls to the SA to record slivers to make at once
+SLIVER_INFO_WORKERS = 8
+
+# Most members whose emails or SSH keys to look up in one call to the MA
+MEMBER_LOOKUP_BATCH = 50
+
+# Seconds to remember member emails and SSH keys looked up at the MA
+MEMBER_INFO_TTL = 5 * 60
+
+# The sliver URNs in a manifest RSpec
+SLIVER_ID_RE = re.compile(r'sliver_id=[^"]*"([^"]*)"')
+
 class Framework(Framework_Base):
     def __init__(self, config, opts):
         Framework_Base.__init__(self,config)
@@ -96,6 +112,14 @@ class Framework(Framework_Base):
 
         self._sa = None
         self._sa_url = None
+
+        # Aggregate URL -> URN looked up at the CH
+        self._aggURNsByURL = {}
+
+        # Member URN -> dict of time looked up, and EMAIL and KEYS once known
+        self._memberInfo = {}
+        # Set False if the MA fails to look up several members at once
+        self._bulkMemberLookups = True
         if config.has_key('sa') and config['sa'].strip() != "":
             self._sa_url = config['sa']
             self.logger.info("Slice Authority is %s (from config)", self._sa_url)
@@ -142,6 +166,12 @@ class Framework(Framework_Base):
             sys.exit('CHAPI Framework failed to parse cert read from %s: %s' % (self.cert, e))
 
         self.cred_nonOs = None
+
+        # User and slice credentials are saved for use by later omni invocations
+        self.credCache = None
+        if not opts.noCredCache and not opts.noCacheFiles:
+            self.credCache = CredentialCache(opts.credCacheName, self.logger)
+
         # ***
         # Do the whole speaksfor test here
         # ***
@@ -332,6 +362,13 @@ class Framework(Framework_Base):
         if struct==True and self.user_cred_struct is not None:
             return self.user_cred_struct, msg
 
+        if self.user_cred == None and self.credCache is not None:
+            cached = self.credCache.get(self.ch_url, self.user_urn)
+            if cached is not None:
+                self.user_cred_struct = cached
+                self.user_cred = cached['geni_value']
+                self.logger.debug(self.credCache.stats())
+
         if self.user_cred == None:
             creds, options = self._add_credentials_and_speaksfor(creds, options)
             self.logger.debug("Getting user credential from %s MA %s",
@@ -356,6 +393,10 @@ class Framework(Framework_Base):
                                     self.logger.debug("Got non string geni_version on user cred. %s is type %s", 
                                                       self.user_cred_struct['geni_version'], type(self.user_cred_struct['geni_version']))
                                     self.user_cred_struct['geni_version'] = str(self.user_cred_struct['geni_version'])
+                            if self.credCache is not None:
+                                self.credCache.put(self.ch_url, self.user_urn, None, self.user_cred_struct,
+                                                   credutils.get_cred_exp(self.logger, self.user_cred))
+                                self.logger.debug(self.credCache.stats())
                     if self.user_cred is None:
                         self.logger.error("No SFA-type user credential returned!")
                         self.logger.debug("Got: %s", res['value'])
@@ -388,6 +429,14 @@ class Framework(Framework_Base):
                     'SLICE_EXPIRED': False,
                     }}
 
+        if self.credCache is not None:
+            cached = self.credCache.get(self.ch_url, self.user_urn, slice_urn)
+            if cached is not None:
+                self.logger.debug(self.credCache.stats())
+                if struct==False:
+                    return cached['geni_value']
+                return cached
+
         # PG implementation needs a user cred
         if self.needcred:
             uc, msg = self.get_user_cred(True)
@@ -410,14 +459,18 @@ class Framework(Framework_Base):
                 d = res['value']
                 if d is not None:
                     credstruct = self._select_sfa_cred(d, True)
+                    if credstruct and credstruct.has_key('geni_version'):
+                        if not isinstance(credstruct['geni_version'], str):
+                            self.logger.debug("Got non string geni_version on cred. %s is type %s", credstruct['geni_version'], type(credstruct['geni_version']))
+                            credstruct['geni_version'] = str(credstruct['geni_version'])
+                    if credstruct and self.credCache is not None:
+                        self.credCache.put(self.ch_url, self.user_urn, slice_urn, credstruct,
+                                           credutils.get_cred_exp(self.logger, credstruct['geni_value']))
+                        self.logger.debug(self.credCache.stats())
                     if struct==False and credstruct:
                         cred = credstruct['geni_value']
                     else:
                         cred = credstruct
-                        if cred.has_key('geni_version'):
-                            if not isinstance(cred['geni_version'], str):
-                                self.logger.debug("Got non string geni_version on cred. %s is type %s", cred['geni_version'], type(cred['geni_version']))
-                                cred['geni_version'] = str(cred['geni_version'])
                     if cred is None:
                         self.logger.debug("Malformed list of creds: Got: %s", d)
                         raise OmniError("No slice credential returned for slice %s" % slice_urn)
@@ -607,6 +660,9 @@ class Framework(Framework_Base):
                 d = res['value']
                 if d is not None and d.has_key('SLICE_URN'):
                     slice_urn = d['SLICE_URN']
+                    # Any cached credential is for an old slice of the same name
+                    if self.credCache is not None:
+                        self.credCache.forget(self.ch_url, self.user_urn, slice_urn)
                 else:
                     self.logger.error("Malformed response from create slice: %s", d)
             else:
@@ -1192,6 +1248,10 @@ class Framework(Framework_Base):
             self.logger.error(message)
 
         if b:
+            # The cached slice credential expires when the slice used to
+            if self.credCache is not None:
+                self.credCache.forget(self.ch_url, self.user_urn, urn)
+
             # Fetch new expiration and make sure it is what was requested
             slice_expiration = self.get_slice_expiration(urn)
 
@@ -1294,7 +1354,7 @@ class Framework(Framework_Base):
 
         logr = self._log_results((res, mess), 'Lookup member email')
         if logr == True:
-            if not res['value'] and isinstance(res['value'], dict) and len(res['value'].values()) > 0 and res['value'].values()[0].has_key('MEMBER_EMAIL'):
+            if not (res['value'] and isinstance(res['value'], dict) and len(res['value'].values()) > 0 and res['value'].values()[0].has_key('MEMBER_EMAIL')):
                 self.logger.debug("Got malformed return looking up member email: %s", res)
                 return None
             else:
@@ -1342,6 +1402,132 @@ class Framework(Framework_Base):
         else:
             return None
 
+    # Look up the emails of the given members in one call to the MA.
+    # Return a dictionary by member URN (with no entry for members
+    # the MA does not know), or None if the lookup failed
+    def _lookup_member_emails(self, urns):
+        creds = []
+        # PG implementation seems to want a user cred
+        if self.needcred:
+            uc, msg = self.get_user_cred(True)
+            if uc is not None:
+                creds.append(uc)
+        options = {'match': {'MEMBER_URN': urns}, 'filter': ['MEMBER_URN', 'MEMBER_EMAIL']}
+        creds, options = self._add_credentials_and_speaksfor(creds, options)
+        if not self.speakV2:
+            res, mess = _do_ssl(self, None, "Looking up %d member emails" % len(urns),
+                                self.ma().lookup_identifying_member_info, creds, options)
+        else:
+            res, mess = _do_ssl(self, None, "Looking up %d member emails" % len(urns),
+                                self.ma().lookup, "MEMBER", creds, options)
+
+        logr = self._log_results((res, mess), 'Lookup %d member emails' % len(urns))
+        if logr != True:
+            return None
+        if not isinstance(res['value'], dict):
+            self.logger.debug("Got malformed return looking up member emails: %s", res)
+            return None
+        emails = {}
+        for (key, val) in res['value'].items():
+            if isinstance(val, dict) and val.has_key('MEMBER_EMAIL'):
+                emails[val.get('MEMBER_URN', key)] = val['MEMBER_EMAIL']
+        return emails
+
+    # Look up the SSH public keys of the given members in one call to the MA.
+    # Return a dictionary by member URN of lists of keys (with no entry for members
+    # with no keys), or None if the lookup failed
+    def _lookup_member_keys(self, urns):
+        creds = []
+        # PG implementation seems to want a user cred
+        if self.needcred:
+            uc, msg = self.get_user_cred(True)
+            if uc is not None:
+                creds.append(uc)
+        options = {'match': {'KEY_MEMBER': urns}, 'filter': ['KEY_MEMBER', 'KEY_PUBLIC']}
+        creds, options = self._add_credentials_and_speaksfor(creds, options)
+        if not self.speakV2:
+            res, mess = _do_ssl(self, None, "Looking up %d members' SSH keys" % len(urns),
+                                self.ma().lookup_keys, creds, options)
+        else:
+            res, mess = _do_ssl(self, None, "Looking up %d members' SSH keys" % len(urns),
+                                self.ma().lookup, "KEY", creds, options)
+
+        logr = self._log_results((res, mess), "Lookup %d members' SSH keys" % len(urns))
+        if logr != True:
+            return None
+        if not isinstance(res['value'], dict):
+            self.logger.debug("Got malformed return looking up member SSH keys: %s", res)
+            return None
+        keys = {}
+        for (key, val) in res['value'].items():
+            if isinstance(val, list):
+                # In V1, we get a dictionary of KEY_MEMBER => list of KEY_PUBLIC, ...
+                keys.setdefault(key, []).extend([v['KEY_PUBLIC'] for v in val])
+            elif isinstance(val, dict) and val.has_key('KEY_MEMBER'):
+                # In V2, we get a dictionary of KEY_ID => KEY_MEMBER, KEY_PUBLIC, ...
+                keys.setdefault(val['KEY_MEMBER'], []).append(val['KEY_PUBLIC'])
+        return keys
+
+    # Get the emails (and if withKeys, the SSH public keys) of the given members.
+    # Return a dictionary by member URN of dictionaries with EMAIL and KEYS
+    # (None if not known), as _get_member_email and _get_member_keys would.
+    # Members are looked up MEMBER_LOOKUP_BATCH at a time, and remembered
+    # for MEMBER_INFO_TTL seconds so that later calls do not look them up again.
+    # If the MA fails a batch lookup, members are looked up one at a time
+    # from then on.
+    def _get_members_info(self, urns, withKeys=True):
+        now = time.time()
+        needEmail = []
+        needKeys = []
+        for urn in urns:
+            if urn is None or urn.strip() == "" or not is_valid_urn_bytype(urn, 'user', None):
+                continue
+            entry = self._memberInfo.get(urn)
+            if entry is None or now - entry['time'] > MEMBER_INFO_TTL:
+                entry = {'time': now}
+                self._memberInfo[urn] = entry
+            if not entry.has_key('EMAIL') and urn not in needEmail:
+                needEmail.append(urn)
+            if withKeys and not entry.has_key('KEYS') and urn not in needKeys:
+                needKeys.append(urn)
+
+        for i in range(0, len(needEmail), MEMBER_LOOKUP_BATCH):
+            batch = needEmail[i:i + MEMBER_LOOKUP_BATCH]
+            emails = None
+            if self._bulkMemberLookups:
+                emails = self._lookup_member_emails(batch)
+                self._bulkMemberLookups = emails is not None
+            for urn in batch:
+                if emails is not None:
+                    email = emails.get(urn)
+                else:
+                    email = self._get_member_email(urn)
+                # Do not remember failures
+                if email is not None or emails is not None:
+                    self._memberInfo[urn]['EMAIL'] = email
+        for i in range(0, len(needKeys), MEMBER_LOOKUP_BATCH):
+            batch = needKeys[i:i + MEMBER_LOOKUP_BATCH]
+            keys = None
+            if self._bulkMemberLookups:
+                keys = self._lookup_member_keys(batch)
+                self._bulkMemberLookups = keys is not None
+            for urn in batch:
+                if keys is not None:
+                    mkeys = keys.get(urn)
+                else:
+                    mkeys = self._get_member_keys(urn)
+                if mkeys is not None or keys is not None:
+                    self._memberInfo[urn]['KEYS'] = mkeys
+        if needEmail or needKeys:
+            self.logger.debug("Looked up %d member emails and %d members' SSH keys (%d of %d members remembered)",
+                              len(needEmail), len(needKeys), len(urns) - len(set(needEmail + needKeys)), len(urns))
+
+        info = {}
+        for urn in urns:
+            entry = self._memberInfo.get(urn, {})
+            info[urn] = {'EMAIL': entry.get('EMAIL'), 'KEYS': entry.get('KEYS')}
+        return info
+
     # get the members (urn, email) and their ssh keys and role in the slice
     def get_members_of_slice(self, urn):
         # FIXME: This seems to list members even of an expired slice,
@@ -1393,12 +1579,13 @@ class Framework(Framework_Base):
         logr = self._log_results((res, mess), 'Get members for %s slice %s%s' % (self.fwtype, slice_urn, expmess))
         if logr == True:
             if res['value']:
+                info = self._get_members_info([member_vals['SLICE_MEMBER'] for member_vals in res['value']])
                 for member_vals in res['value']:
                     member_urn = member_vals['SLICE_MEMBER']
                     member_role = member_vals['SLICE_ROLE']
                     member = {'URN': member_urn}
-                    member['EMAIL'] = self._get_member_email(member_urn)
-                    member['KEYS'] = self._get_member_keys(member_urn)
+                    member['EMAIL'] = info[member_urn]['EMAIL']
+                    member['KEYS'] = info[member_urn]['KEYS']
                     member['ROLE'] = member_role
                     members.append(member)
         else:
@@ -1445,13 +1632,15 @@ class Framework(Framework_Base):
         logr = self._log_results((res, mess), 'Get members for %s project %s' % (self.fwtype, project_urn))
         if logr == True:
             if res['value']:
+                info = self._get_members_info([member_vals['PROJECT_MEMBER'] for member_vals in res['value']],
+                                              withKeys=False)
                 for member_vals in res['value']:
                     # Entries: PROJECT_MEMBER, PROJECT_ROLE, optional: PROJECT_MEMBER_UID
                     # self.logger.debug("Got member value: %s", member_vals)
                     member_urn = member_vals['PROJECT_MEMBER']
                     member_role = member_vals['PROJECT_ROLE']
                     member = {'PROJECT_MEMBER': member_urn}
-                    member['EMAIL'] = self._get_member_email(member_urn)
+                    member['EMAIL'] = info[member_urn]['EMAIL']
                     member['PROJECT_ROLE'] = member_role
                     if member_vals.has_key('PROJECT_MEMBER_UID'):
                         member['PROJECT_MEMBER_UID'] = member_vals['PROJECT_MEMBER_UID']
@@ -1598,19 +1787,68 @@ class Framework(Framework_Base):
         auth = sliver_urn[0 : idx1]
         return auth + '+authority+am'
 
-    # Helper for actually recording a new sliver with the given expiration
-    def _record_one_new_sliver(self, sliver_urn, slice_urn, agg_urn,
-                               creator_urn, expiration):
+    # Get the credentials to pass when recording slivers: the slice
+    # credential if the CH needs one, or the user credential if there is
+    # no slice. Also load any --cred credentials and make the SA client,
+    # so that calls made in parallel threads need not.
+    def _sliver_info_creds(self, slice_urn=None):
         creds = []
         if self.needcred:
             # FIXME: At PG should this be user or slice cred?
             # They don't seem to be requiring either one?
-#            uc, msg = self.get_user_cred(True)
-#            if uc is not None:
-#                creds.append(uc)
-            sc = self.get_slice_cred_struct(slice_urn)
-            if sc is not None:
-                creds.append(sc)
+            if slice_urn:
+                sc = self.get_slice_cred_struct(slice_urn)
+                if sc is not None:
+                    creds.append(sc)
+            else:
+                uc, msg = self.get_user_cred(True)
+                if uc is not None:
+                    creds.append(uc)
+        self._add_credentials_and_speaksfor([], None)
+        self.sa()
+        return creds
+
+    # Call func on each item, up to SLIVER_INFO_WORKERS at a time.
+    # Return the results in item order, raising the first exception
+    # (if any) as a loop over the items would.
+    def _sliver_info_calls(self, func, items, what):
+        items = list(items)
+        if len(items) == 0:
+            return []
+        # Make the first call alone, so any problem with the key or the
+        # SA shows up once, then the rest in parallel
+        results = [func(items[0])]
+        if len(items) > 1:
+            fan = FanOut(SLIVER_INFO_WORKERS, self.logger)
+            for (result, exc_info) in fan.run(func, items[1:]):
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                results.append(result)
+            self.logger.debug(fan.summary("%s (after the first)" % what))
+        return results
+
+    # Record the given new slivers at the SA.
+    # records is a list of (sliver_urn, agg_urn, expiration)
+    # Return the list of _record_one_new_sliver results
+    def _record_new_slivers(self, records, slice_urn, creator_urn):
+        if len(records) == 0:
+            return []
+        creds = self._sliver_info_creds(slice_urn)
+        def record(item):
+            (sliver_urn, agg_urn, expiration) = item
+            return self._record_one_new_sliver(sliver_urn, slice_urn, agg_urn,
+                                               creator_urn, expiration, creds)
+        return self._sliver_info_calls(record, records,
+                                       "Recording %d new slivers at %s" % (len(records), self.fwtype))
+
+    # Helper for actually recording a new sliver with the given expiration
+    # creds are from _sliver_info_creds, which is called if they are not given
+    def _record_one_new_sliver(self, sliver_urn, slice_urn, agg_urn,
+                               creator_urn, expiration, creds=None):
+        if creds is None:
+            creds = self._sliver_info_creds(slice_urn)
+        # _add_credentials_and_speaksfor adds to the list
+        creds = list(creds)
 
         if not is_valid_urn(agg_urn):
             self.logger.debug("Not a valid AM URN: %s", agg_urn)
@@ -1703,35 +1941,22 @@ class Framework(Framework_Base):
         if not is_valid_urn(slice_urn):
             self.logger.warn("Invalid slice URN '%s' for recording new slivers", slice_urn)
             return
-        creds = []
         msg = ""
+        # (sliver_urn, agg_urn, expiration) of each sliver to record
+        records = []
 
         if manifest and manifest.strip() != "" and (slivers is None or len(slivers) == 0):
             # APIv1/2: find slivers in manifest
             self.logger.debug("Finding new slivers to record in manifest")
-            # Loop through manifest finding all slivers to record
-            foundSlivers = False
-            while True:
-                idx1 = manifest.find('sliver_id=') # Start of 'sliver_id='
-                if idx1 < 0: break # No more slivers
-                idx2 = manifest.find('"', idx1) + 1 # Start of URN
-                if idx2 == 0:
-                    # didn't find start of sliver id?
-                    self.logger.debug("Malformed sliver_id in rspec? %s", manifest[:30])
-                    manifest = manifest[9:]
-                    continue
-                idx3 = manifest.find('"', idx2) # End of URN
-                if idx3 == 0:
-                    # didn't find end of sliver id?
-                    self.logger.debug("Malformed sliver_id in rspec? %s", manifest[idx2-15:idx2+80])
-                    manifest = manifest[idx2:]
-                    continue
-                sliver_urn = manifest[idx2 : idx3]
-                manifest = manifest[idx3+1:]
-                foundSlivers = True
-                msg = msg + str(self._record_one_new_sliver(sliver_urn,
-                                                        slice_urn, agg_urn, creator_urn, expiration))
-            # End of while loop over slivers in manifest
+            # One pass through the manifest finding all slivers to record
+            sliver_urns = []
+            for match in SLIVER_ID_RE.finditer(manifest):
+                sliver_urn = match.group(1)
+                if sliver_urn not in sliver_urns:
+                    sliver_urns.append(sliver_urn)
+            foundSlivers = len(sliver_urns) > 0
+            for sliver_urn in sliver_urns:
+                records.append((sliver_urn, agg_urn, expiration))
 
             # Ticket #574
             # If we have an am_urn and have a manifest and this is a FOAM manifest/AM, then we have no sliver_urns yet probably.
@@ -1749,8 +1974,7 @@ class Framework(Framework_Base):
                 sliver_urn = URN(authority=auth, type="sliver", name=str(sliver_uuid)).urn_string()
                 self.logger.debug("Recording sliver_info had manifest with no sliver_ids (FOAM?). Created a single sliver urn to record: %s", sliver_urn)
                 # Record one new sliver with that
-                msg = msg + str(self._record_one_new_sliver(sliver_urn,
-                                                        slice_urn, agg_urn, creator_urn, expiration))
+                records.append((sliver_urn, agg_urn, expiration))
 
         elif slivers and len(slivers) > 0:
             # APIv3 style sliver to record
@@ -1766,20 +1990,25 @@ class Framework(Framework_Base):
                 exp = expiration
                 if sliver.has_key('geni_expires'):
                     exp = sliver['geni_expires']
-                msg = msg + str(self._record_one_new_sliver(sliver_urn,
-                                                        slice_urn, agg_urn, creator_urn, exp))
+                records.append((sliver_urn, agg_urn, exp))
             # End of loop over slivers
         else:
             self.logger.debug("Got no manifest AND no slivers to record")
         # End of if/else block for API Version
+
+        for res in self._record_new_slivers(records, slice_urn, creator_urn):
+            msg = msg + str(res)
         return msg
 
     # use the database to convert an aggregate url to the corresponding urn
+    # Answers are remembered, so each URL is looked up at most once.
     # FIXME: other CHs do similar things - implement this elsewhere
     def lookup_agg_urn_by_url(self, agg_url):
         if agg_url is None or agg_url.strip() == "":
             self.logger.warn("Empty Aggregate URL to look up")
             return None
+        if self._aggURNsByURL.has_key(agg_url):
+            return self._aggURNsByURL[agg_url]
 
         # FIXME: This relies on an exact match. See handler_utils for
         # tricks we do locally that perhaps we should do here.
@@ -1797,9 +2026,11 @@ class Framework(Framework_Base):
         if logr == True:
             self.logger.debug("Got CH AM listing '%s' for URL '%s'", res['value'], agg_url)
             if len(res['value']) == 0:
-                return None
+                agg_urn = None
             else:
-                return res['value'][0]['SERVICE_URN']
+                agg_urn = res['value'][0]['SERVICE_URN']
+            self._aggURNsByURL[agg_url] = agg_urn
+            return agg_urn
         else:
             return None
 
@@ -1860,7 +2091,8 @@ class Framework(Framework_Base):
     # update the expiration time on a sliver
     # If we get an argument error indicating the sliver was not yet recorded, try
     # to record it
-    def update_sliver_info(self, agg_urn, slice_urn, sliver_urn, expiration):
+    # creds are from _sliver_info_creds, which is called if they are not given
+    def update_sliver_info(self, agg_urn, slice_urn, sliver_urn, expiration, creds=None):
         if expiration is None:
             self.logger.warn("Empty new expiration to record for sliver '%s'", sliver_urn)
             return None
@@ -1884,15 +2116,10 @@ class Framework(Framework_Base):
 
         slice_urn = self.slice_name_to_urn(slice_urn)
 
-        creds = []
-        if self.needcred:
-            # FIXME: At PG should this be user or slice cred?
-#            uc, msg = self.get_user_cred(True)
-#            if uc is not None:
-#                creds.append(uc)
-            sc = self.get_slice_cred_struct(slice_urn)
-            if sc is not None:
-                creds.append(sc)
+        if creds is None:
+            creds = self._sliver_info_creds(slice_urn)
+        # _add_credentials_and_speaksfor adds to the list
+        creds = list(creds)
 
         # Note that if no TZ is specified, UTC is assumed
         fields = {'SLIVER_INFO_EXPIRATION': str(expiration)}
@@ -1912,13 +2139,27 @@ class Framework(Framework_Base):
 
             msg = str(msg)
             nm = self._record_one_new_sliver(sliver_urn,
-                                               slice_urn, agg_urn, self.user_urn, expiration)
+                                               slice_urn, agg_urn, self.user_urn, expiration, creds)
             if nm != True:
                 msg += str(msg)
             else:
                 msg = "Recorded sliver '%s' with new expiration" % sliver_urn
         return msg
 
+    # update the expiration times of several slivers at one AM, several at a time:
+    # slivers is a list of (sliver_urn, expiration) pairs.
+    # Return the list of update_sliver_info results
+    def update_sliver_infos(self, agg_urn, slice_urn, slivers):
+        if len(slivers) == 0:
+            return []
+        slice_urn = self.slice_name_to_urn(slice_urn)
+        creds = self._sliver_info_creds(slice_urn)
+        def update(item):
+            (sliver_urn, expiration) = item
+            return self.update_sliver_info(agg_urn, slice_urn, sliver_urn, expiration, creds)
+        return self._sliver_info_calls(update, slivers,
+                                       "Updating %d sliver expirations at %s" % (len(slivers), self.fwtype))
+
 # Note: Valid 'match' fields for lookup_sliver_info are the same as is
 # passed in create_sliver_info. However, you can only look up by
 # sliver/slice if you are a member of the relevant slice, and only by
@@ -1931,17 +2172,14 @@ class Framework(Framework_Base):
 # SLIVER_INFO_CREATION
 
     # delete the sliver from the chapi database
-    def delete_sliver_info(self, sliver_urn):
-        creds = []
-        if self.needcred:
+    # creds are from _sliver_info_creds, which is called if they are not given
+    def delete_sliver_info(self, sliver_urn, creds=None):
+        if creds is None:
             # FIXME: At PG should this be user or slice cred?
             # If slice, then must refactor to get slice urn
-            uc, msg = self.get_user_cred(True)
-            if uc is not None:
-                creds.append(uc)
-#            sc = self.get_slice_cred_struct(slice_urn)
-#            if sc is not None:
-#                creds.append(sc)
+            creds = self._sliver_info_creds()
+        # _add_credentials_and_speaksfor adds to the list
+        creds = list(creds)
         options = {}
         if sliver_urn is None or sliver_urn.strip() == "":
             self.logger.debug("Empty sliver_urn to record deletion but continuing")
@@ -1960,6 +2198,17 @@ class Framework(Framework_Base):
                           self.sa().delete, "SLIVER_INFO", sliver_urn, creds, options)
         return self._log_results(res, "Record sliver '%s' deleted" % sliver_urn)
 
+    # delete several slivers from the chapi database, several at a time
+    # Return the list of delete_sliver_info results
+    def delete_sliver_infos(self, sliver_urns):
+        if len(sliver_urns) == 0:
+            return []
+        creds = self._sliver_info_creds()
+        def delete(sliver_urn):
+            return self.delete_sliver_info(sliver_urn, creds)
+        return self._sliver_info_calls(delete, sliver_urns,
+                                       "Recording %d slivers deleted at %s" % (len(sliver_urns), self.fwtype))
+
     # Find all slivers the SA lists for the given slice
     # Return a struct by AM URN containing a struct: sliver_urn = sliver info struct
     # Compare with list_sliverinfo_urns which only returns the sliver URNs
@@ -0,0 +1,124 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+Report the time Omni spends importing modules, like python3 -X importtime.
+
+Usage: python -m gcf.omnilib.importtime [omni options and command]
+EG:    python -m gcf.omnilib.importtime --help
+       python -m gcf.omnilib.importtime -a ig-utah getversion
+
+Runs omni with the given arguments, timing each module import (including
+imports done while running the command), then prints to stderr one line
+per imported module, indented by nesting depth, with the time spent in
+that module itself and including the modules it imported, in microseconds.
+'''
+
+from __future__ import absolute_import
+
+import __builtin__
+import sys
+import time
+
+class ImportTimer(object):
+    '''Time the imports done between start() and stop().
+    records is a list of (depth, module name, self seconds, cumulative seconds),
+    in the order the imports finished.'''
+
+    def __init__(self):
+        self.records = []
+        self._stack = []
+        self._import = None
+
+    def start(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timedImport
+
+    def stop(self):
+        if self._import is not None:
+            __builtin__.__import__ = self._import
+            self._import = None
+
+    def _name(self, name, globals, fromlist, level):
+        # Name of the imported module, resolving relative imports
+        if level > 0 and globals:
+            package = globals.get('__package__') or globals.get('__name__', '')
+            if '__path__' not in globals and not globals.get('__package__'):
+                package = package.rpartition('.')[0]
+            if level > 1:
+                package = package.rsplit('.', level - 1)[0]
+            name = package + (name and '.' + name or '')
+        if fromlist and not name.endswith('.' + str(fromlist[0])):
+            newlist = [f for f in fromlist if (name + '.' + str(f)) in sys.modules]
+            if newlist:
+                name = "%s.{%s}" % (name, ",".join(newlist))
+        return name
+
+    def _timedImport(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        numModules = len(sys.modules)
+        # Python 2 first tries a module name relative to the importing package,
+        # adding None entries to sys.modules, which are not imports
+        loaded = level <= 0 and sys.modules.get(name) is not None
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if len(sys.modules) > numModules and not loaded:
+                self.records.append((len(self._stack), self._name(name, globals, fromlist, level),
+                                     elapsed - children, elapsed))
+
+    def totals(self):
+        '''Return the (number of imports, seconds) of the top level imports'''
+        top = [r for r in self.records if r[0] == 0]
+        return len(self.records), sum([r[3] for r in top])
+
+    def report(self, out=sys.stderr):
+        out.write("import time: self [us] | cumulative | imported package\n")
+        for (depth, name, selfTime, cumulative) in self.records:
+            out.write("import time: %9d | %10d | %s%s\n" % (selfTime * 1000000, cumulative * 1000000, "  " * depth, name))
+        (count, seconds) = self.totals()
+        out.write("%d imports took %.3f seconds\n" % (count, seconds))
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    timer = ImportTimer()
+    start = time.time()
+    timer.start()
+    try:
+        from .. import oscript
+        oscript.main(argv)
+    except SystemExit:
+        pass
+    finally:
+        timer.stop()
+        elapsed = time.time() - start
+        timer.report()
+        sys.stderr.write("omni %s took %.3f seconds\n" % (" ".join(argv), elapsed))
+
+if __name__ == "__main__":
+    main()
@@ -31,6 +31,7 @@ from __future__ import absolute_import
 import json
 import logging
 import sys
+from xml.dom import minidom
 from xml.dom.minidom import getDOMImplementation, Node, Text, Comment, CDATASection
 
 from . import objects
@@ -54,6 +55,82 @@ PATH_ID = 'id'
 
 # FIXME: As in RSpecParser, check use of getAttribute vs getAttributeNS and localName vs nodeName
 
+class _PathIndex(object):
+    '''Index the path elements of a stitching element by path ID, and the hop
+    elements of each path by hop ID, so combining hops is not a search per hop.
+    Like findPathByID, the first matching element in document order wins.'''
+
+    def __init__(self, stitching):
+        self.paths = {} # path ID -> path element
+        self.hops = {} # id(path element) -> hop ID -> hop element
+        if stitching is None:
+            return
+        for child in stitching.childNodes:
+            if child.nodeType == Node.ELEMENT_NODE and \
+                    child.localName == defs.PATH_TAG:
+                self.paths.setdefault(child.getAttribute(PATH_ID), child)
+
+    def path(self, path_id):
+        return self.paths.get(path_id)
+
+    def addPath(self, path):
+        self.paths.setdefault(path.getAttribute(PATH_ID), path)
+
+    def pathHops(self, path):
+        '''Return the dictionary of hops in the given path element by hop ID'''
+        hops = self.hops.get(id(path))
+        if hops is None:
+            hops = {}
+            for child in path.childNodes:
+                if child.nodeType == Node.ELEMENT_NODE and \
+                        child.localName == HOP:
+                    hops.setdefault(child.getAttribute(HOP_ID), child)
+            self.hops[id(path)] = hops
+        return hops
+
+class _ChildPositions(object):
+    '''Append and replace children of a DOM element, remembering the position
+    of each child. minidom's replaceChild searches the list of children for the
+    one to replace, which makes replacing each node or link of a big RSpec quadratic.'''
+
+    def __init__(self, parent):
+        self.parent = parent
+        self._index()
+
+    def _index(self):
+        self.positions = dict((id(child), i) for (i, child) in enumerate(self.parent.childNodes))
+
+    def appendChild(self, node):
+        self.parent.appendChild(node)
+        self.positions[id(node)] = len(self.parent.childNodes) - 1
+        return node
+
+    def replaceChild(self, newChild, oldChild):
+        children = self.parent.childNodes
+        i = self.positions.get(id(oldChild))
+        if i is None or i >= len(children) or children[i] is not oldChild or \
+                newChild.parentNode is not None or newChild.nodeType != Node.ELEMENT_NODE:
+            # Let minidom handle (or complain about) anything unusual
+            ret = self.parent.replaceChild(newChild, oldChild)
+            self._index()
+            return ret
+        # As in minidom's replaceChild
+        children[i] = newChild
+        newChild.parentNode = self.parent
+        oldChild.parentNode = None
+        minidom._clear_id_cache(self.parent)
+        newChild.nextSibling = oldChild.nextSibling
+        newChild.previousSibling = oldChild.previousSibling
+        oldChild.nextSibling = None
+        oldChild.previousSibling = None
+        if newChild.previousSibling:
+            newChild.previousSibling.nextSibling = newChild
+        if newChild.nextSibling:
+            newChild.nextSibling.previousSibling = newChild
+        del self.positions[id(oldChild)]
+        self.positions[id(newChild)] = i
+        return oldChild
+
 class ManifestRSpecCombiner:
 
     # Constructor
@@ -81,7 +158,7 @@ class ManifestRSpecCombiner:
         # Add to the base any top level elements not already there
         doc_root = dom_template.documentElement
         children = doc_root.childNodes
-        template_kids = []
+        template_kids = set()
         # Find all the client_ids for nodes in the template too
         rspec_node = None
         if doc_root.nodeType == Node.ELEMENT_NODE and \
@@ -108,7 +185,7 @@ class ManifestRSpecCombiner:
                 cstr = ""
             if cstr == "":
                 continue
-            template_kids.append(cstr)
+            template_kids.add(cstr)
 #            self.logger.debug("Template had element: '%s'...", cstr[:min(len(cstr), 60)])
 
         for am in ams_list:
@@ -275,8 +352,9 @@ class ManifestRSpecCombiner:
 
         # Set up a dictionary mapping node by component_manager_id
         template_nodes_by_cmid={}
-        template_node_cids=[]
+        template_node_cids=set()
         doc_root = dom_template.documentElement
+        doc_kids = _ChildPositions(doc_root)
         children = doc_root.childNodes
         # Find all the client_ids for nodes in the template too
         for child in children:
@@ -287,9 +365,7 @@ class ManifestRSpecCombiner:
                     template_nodes_by_cmid[cmid] = []
                 template_nodes_by_cmid[cmid].append(child)
                 cid = child.getAttribute(CLIENT_ID)
-                key = cid + cmid
-                if not key in template_node_cids:
-                    template_node_cids.append(key)
+                template_node_cids.add(cid + cmid)
 
 #        print "DICT = " + str(template_nodes_by_cmid)
         
@@ -313,6 +389,13 @@ class ManifestRSpecCombiner:
                 self.logger.debug("combineNodes Skipping manifest from template AM %s", am)
                 continue
 
+            # Index this AMs nodes by client_id, in document order
+            am_nodes_by_cid = {}
+            for child in am_doc_root.childNodes:
+                if child.nodeType == Node.ELEMENT_NODE and \
+                        child.localName == defs.NODE_TAG:
+                    am_nodes_by_cid.setdefault(child.getAttribute(CLIENT_ID), []).append(child)
+
             # For each node in this AMs manifest for which this AM
             # is the component manager, if that client_id
             # was not in the template, then append this node
@@ -327,7 +410,7 @@ class ManifestRSpecCombiner:
                         if cmid in am.urn_syns:
                             # self.logger.debug(".... adding it")
                             self.logger.debug("Adding missing node client_id: %s; comp_mgr: %s; from AM: %s", cid, cmid, am)
-                            doc_root.appendChild(child.cloneNode(True))
+                            doc_kids.appendChild(child.cloneNode(True))
                         # For reservation from ExoSM the AM manifest lists a cmid for a specific rack, so different than request or any urn_syn on the ExoSM
                         # Ticket #780
                         elif ':' in cmid[len('urn:publicid:IDN+'):cmid.find('+authority')]:
@@ -349,39 +432,35 @@ class ManifestRSpecCombiner:
                             key2 = cid + cmidTrim
                             if key2 not in template_node_cids and (cmid in am.urn_syns or cmidTrim in am.urn_syns):
                                 self.logger.debug("Adding missing node from a sub-AM client_id: %s; comp_mgr: %s; from AM: %s", cid, cmid, am)
-                                doc_root.appendChild(child.cloneNode(True))
+                                doc_kids.appendChild(child.cloneNode(True))
             # Now do the node replacing as necessary
             for urn in am.urn_syns:
                 if template_nodes_by_cmid.has_key(urn):
                     for template_node in template_nodes_by_cmid[urn]:
                         template_client_id = template_node.getAttribute(CLIENT_ID)
-                        for child in am_doc_root.childNodes:
-                            if child.nodeType == Node.ELEMENT_NODE and \
-                                    child.localName == defs.NODE_TAG:
-                                child_cmid = child.getAttribute(COMPONENT_MGR_ID)
-                                child_client_id = child.getAttribute(CLIENT_ID)
-                                if child_client_id == template_client_id:
-                                    if child_cmid == urn:
-                                        self.logger.debug(("Replacing template for node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
-                                        doc_root.replaceChild(child.cloneNode(True), template_node)
-                                    elif ':' in child_cmid[len('urn:publicid:IDN+'):child_cmid.find('+authority')] and child_cmid not in am.urn_syns:
-                                        self.logger.debug("Node %s cmid %s shows it is from a sub-AM. See if the parent would be a match (so must replace the node) at %s", child_client_id, child_cmid, am)
-                                        # If the CM on this node had a sub-site, then try comparing the non-root cmid with that in the template.
-                                        # if no other AM claims that CM and there is no node with the trimmed (less specific) cmid in the template
-
-                                        # if there is an am with cmid as a urn_syn but not this am: continue
-                                        thatAM = objects.Aggregate.findDontMake(child_cmid)
-                                        if thatAM is not None and thatAM != am:
-                                            self.logger.debug("Node cmid belongs to someone else: %s, %s", child_cmid, thatAM)
-                                            continue
-
-                                        # Produce the cmid urn...exogeni.net+authority+am from urn...exogeni.net:site+authority+am
-                                        cmidTrim = child_cmid[:child_cmid.find('+authority')]
-                                        cmidTrim = cmidTrim[:cmidTrim.find(':', len('urn:publicid:IDN+'))]
-                                        cmidTrim += child_cmid[child_cmid.find('+authority'):]
-                                        if cmidTrim == urn:
-                                            self.logger.debug(("Replacing template for super AM (like EG-SM) node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
-                                            doc_root.replaceChild(child.cloneNode(True), template_node)
+                        for child in am_nodes_by_cid.get(template_client_id, []):
+                            child_cmid = child.getAttribute(COMPONENT_MGR_ID)
+                            if child_cmid == urn:
+                                self.logger.debug(("Replacing template for node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
+                                doc_kids.replaceChild(child.cloneNode(True), template_node)
+                            elif ':' in child_cmid[len('urn:publicid:IDN+'):child_cmid.find('+authority')] and child_cmid not in am.urn_syns:
+                                self.logger.debug("Node %s cmid %s shows it is from a sub-AM. See if the parent would be a match (so must replace the node) at %s", template_client_id, child_cmid, am)
+                                # If the CM on this node had a sub-site, then try comparing the non-root cmid with that in the template.
+                                # if no other AM claims that CM and there is no node with the trimmed (less specific) cmid in the template
+
+                                # if there is an am with cmid as a urn_syn but not this am: continue
+                                thatAM = objects.Aggregate.findDontMake(child_cmid)
+                                if thatAM is not None and thatAM != am:
+                                    self.logger.debug("Node cmid belongs to someone else: %s, %s", child_cmid, thatAM)
+                                    continue
+
+                                # Produce the cmid urn...exogeni.net+authority+am from urn...exogeni.net:site+authority+am
+                                cmidTrim = child_cmid[:child_cmid.find('+authority')]
+                                cmidTrim = cmidTrim[:cmidTrim.find(':', len('urn:publicid:IDN+'))]
+                                cmidTrim += child_cmid[child_cmid.find('+authority'):]
+                                if cmidTrim == urn:
+                                    self.logger.debug(("Replacing template for super AM (like EG-SM) node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
+                                    doc_kids.replaceChild(child.cloneNode(True), template_node)
 
     def combineLinks(self, ams_list, dom_template):
         '''Replace each link in dom_template with matching link from (an) AM with same URN.
@@ -391,10 +470,11 @@ class ManifestRSpecCombiner:
 
         # For each link in template by component_manager_id
         doc_root = dom_template.documentElement
+        doc_kids = _ChildPositions(doc_root)
         docAM = None
         children = doc_root.childNodes
         # Collect the link client_ids in the template
-        template_link_cids=[]
+        template_link_cids=set()
         for child in children:
             if child.nodeType == Node.ELEMENT_NODE and \
                     child.localName == defs.LINK_TAG:
@@ -402,7 +482,7 @@ class ManifestRSpecCombiner:
                 # Get first 'component_manager' child element
 #                print "LINK = " + str(link) + " " + cmid
                 client_id = str(link.getAttribute(CLIENT_ID))
-                template_link_cids.append(client_id)
+                template_link_cids.add(client_id)
 
         # loop over AMs. If an AM has a link client_id not in template_link_ids
         # and the link has that AM as a component_manager, then append this link to the template
@@ -445,10 +525,36 @@ class ManifestRSpecCombiner:
                         break
                 if myLink:
 #                    self.logger.debug("Adding link %s (%s)", cid, link2.toxml(encoding="utf-8"))
-                    doc_root.appendChild(link2.cloneNode(True))
-                    template_link_cids.append(cid)
+                    doc_kids.appendChild(link2.cloneNode(True))
+                    template_link_cids.add(cid)
         # Done adding links from AMs not in template
 
+        # Index the links with a vlantag in each AM manifest by client_id (the first such link
+        # in each manifest wins), so each template link only visits the AMs that have it
+        am_links_by_cid = {} # client_id -> list of (agg, manifest DOM, link element), in ams_list order
+        for agg in ams_list:
+            if self.useReqs and not agg.manifestDom:
+                if not agg.requestDom:
+                    agg.requestDom = agg.getEditedRSpecDom(dom_template)
+                man = agg.requestDom
+            else:
+                man = agg.manifestDom
+            if man is None:
+                self.logger.debug("%s had no manifest DOM", agg)
+                continue
+            if man.documentElement == doc_root:
+                self.logger.debug("combineLinks Skipping manifest from %s - same as template", agg)
+                continue
+            seen = set()
+            for link2 in man.documentElement.childNodes:
+                if link2.nodeType == Node.ELEMENT_NODE and \
+                        link2.localName == defs.LINK_TAG and \
+                        link2.hasAttribute(VLANTAG):
+                    cid = str(link2.getAttribute(CLIENT_ID))
+                    if cid not in seen:
+                        seen.add(cid)
+                        am_links_by_cid.setdefault(cid, []).append((agg, man, link2))
+
         # Now go through the links in the template, swapping in info from the appropriate manifest RSpecs
         children = doc_root.childNodes
         for child in children:
@@ -503,7 +609,7 @@ class ManifestRSpecCombiner:
                      # FIXME: Take this block out?
                     continue
 
-                for agg in ams_list:
+                for (agg, man, link2) in am_links_by_cid.get(client_id, []):
                     # If this is a manifest link and all irefs have
                     # manifest info, then this link is done. Move on.
                     # FIXME: This means we do not add the link sliver_id
@@ -525,319 +631,280 @@ class ManifestRSpecCombiner:
 #                    else:
 #                        self.logger.debug("Looking at AM %s for link %s", agg.urn, client_id)
 
-                    if self.useReqs and not agg.manifestDom:
-                        if not agg.requestDom:
-                            agg.requestDom = agg.getEditedRSpecDom(dom_template)
-                        man = agg.requestDom
-                    else:
-                        man = agg.manifestDom
-                    if man is None:
-                        self.logger.debug("%s had no manifest DOM", agg)
-                        continue
-                    if man.documentElement == doc_root:
-                        self.logger.debug("combineLinks Skipping manifest from %s - same as template", agg)
-                        continue
                     self.logger.debug("combineLinks Considering manifest from %s", agg)
-                    for link2 in man.documentElement.childNodes:
-                        if link2.nodeType != Node.ELEMENT_NODE or \
-                                link2.localName != defs.LINK_TAG:
-                            continue
-                        # If this is a manifest link and all irefs have
-                        # manifest info, then this link is done. Move on.
-                        # FIXME: This means we do not add the link sliver_id
-                        # & VLAN tag from other AMs on this link.
-                        if len(intfs) == 0 and not needSwap:
-                            self.logger.debug("All ifcs on link %s had vlan or comp_id", client_id)
-                            # FIXME: Take this block out?
-                            break
-                        # Get the link with a sliverid and the right client_id
-                        if str(link2.getAttribute(CLIENT_ID)) == client_id and \
-                                link2.hasAttribute(VLANTAG):
-                            self.logger.debug("Found AM %s link '%s' that has vlantag '%s'", agg.urn, client_id, link2.getAttribute('vlantag'))
-                            if needSwap:
-                                self.logger.debug("Will swap link in template with this element")
-                                link2Clone = link2.cloneNode(True)
-
-                                # Need to pull out the irefs with a sliver id or component_id from link
-                                # Before completing this swap
-                                for intf in link.childNodes:
-                                    if intf.nodeType == Node.ELEMENT_NODE and \
-                                            intf.localName == INTFC_REF and \
-                                            (intf.hasAttribute(SLIVER_ID) or intf.hasAttribute(COMP_ID)):
-                                        for intf2 in link2Clone.childNodes:
-                                            if intf2.nodeType == Node.ELEMENT_NODE and \
-                                                    intf2.localName == INTFC_REF and \
-                                                    str(intf2.getAttribute(CLIENT_ID)) == str(intf.getAttribute(CLIENT_ID)) and \
-                                                    (not intf2.hasAttribute(SLIVER_ID) and not intf2.hasAttribute(COMP_ID)):
-#                                                self.logger.debug("from old template saving iref %s", intf2.getAttribute(CLIENT_ID))
-                                                link2Clone.replaceChild(intf.cloneNode(True), intf2)
-                                                break
-
-                                # Bug 803. For each intfc in link, if it is not in link2Clone, add it to link2Clone
-                                # Similarly, for each cm in link, if it is not in link2Clone, add it
-                                for l1intid in intfs.keys():
-                                    self.logger.debug("Checking if new AM link has ifc %s from template", l1intid)
-                                    found = False
-                                    for intf in link2Clone.childNodes:
-                                        if intf.nodeType != Node.ELEMENT_NODE or intf.localName != INTFC_REF:
-                                            continue
-                                        if str(intf.getAttribute(CLIENT_ID)) == l1intid:
-                                            found = True
-                                            break
-                                    if not found:
-                                        link2Clone.appendChild(intfs.get(l1intid).cloneNode(True))
-                                        self.logger.debug("Adding missing iref %s from template manifest to rspec for this AM we are swapping in", l1intid)
-                                # Done adding missing intfs
-
-                                # Now add missing cms
-                                for cm in cms:
-                                    self.logger.debug("Checking if new AM link has cm %s from template", cm)
-                                    found = False
-                                    for cmL in link2Clone.childNodes:
-                                        if cmL.nodeType != Node.ELEMENT_NODE or cmL.localName != COMP_MGR:
-                                            continue
-                                        if str(cmL.getAttribute(COMP_MGR_NAME)) == cm:
-                                            found = True
-                                            break
-                                    if not found:
-                                        newCM = man.createElement(COMP_MGR)
-                                        newCM.setAttribute(COMP_MGR_NAME, cm)
-                                        link2Clone.appendChild(newCM)
-                                        self.logger.debug("Adding missing comp_mgr %s from template manifest to rspec for this AM we are swapping in", cm)
-                                # Done adding missing cms
-
-                                # Handle property tags
-                                #Link.PROPERTY_TAG
-                                #attributes: LinkProperty.SOURCE_TAG, DEST_TAG, CAPACITY_TAG
-                                for prop in link.childNodes:
-                                    if prop.nodeType != Node.ELEMENT_NODE or prop.localName != objects.Link.PROPERTY_TAG:
-                                        continue
-                                    pSrc = prop.getAttribute(objects.LinkProperty.SOURCE_TAG)
-                                    pDst = None
-                                    if prop.hasAttribute(objects.LinkProperty.DEST_TAG):
-                                        pDst = prop.getAttribute(objects.LinkProperty.DEST_TAG)
-                                    self.logger.debug("Checking on property src=%s, dst=%s", pSrc, pDst)
-                                    found = False
-                                    for prop2 in link2Clone.childNodes:
-                                        if prop2.nodeType != Node.ELEMENT_NODE or prop2.localName != objects.Link.PROPERTY_TAG:
-                                            continue
-                                        p2Src = prop2.getAttribute(objects.LinkProperty.SOURCE_TAG)
-                                        p2Dst = None
-                                        if prop2.hasAttribute(objects.LinkProperty.DEST_TAG):
-                                            p2Dst = prop2.getAttribute(objects.LinkProperty.DEST_TAG)
-                                        self.logger.debug("Checking on property on link2Clone src=%s, dst=%s", p2Src, p2Dst)
-                                        if p2Src == pSrc and (pDst is None or pDst == p2Dst):
-                                            found = True
-                                            break
-                                    if not found:
-                                        self.logger.debug(" ... link2Clone was missing property - adding it")
-                                        link2Clone.appendChild(prop.cloneNode(True))
-
-                                # What about things that aren't either the CM or the ifc_ref?
-                                for child in link.childNodes:
-                                    if child.nodeType == Node.ELEMENT_NODE and (child.localName == COMP_MGR or child.localName == INTFC_REF or child.localName == objects.Link.PROPERTY_TAG):
-                                        continue
-                                    if isinstance(child, Text) or isinstance(child, Comment) or isinstance(child, CDATASection):
-                                        if str(child.data).strip() == "":
-                                            continue
-                                        self.logger.debug("Looking at template element under link: %s", child.data)
-                                    else:
-                                        self.logger.debug("Looking at template element under link type %s name %s value %s, attCnt %d, childCnt %d", child.nodeType, child.localName, child.nodeValue, (child.hasAttributes() and child.attributes.length) or 0, len(child.childNodes))
-                                        if child.localName is None and str(child.nodeValue).strip() == "" and not child.hasAttributes() and len(child.childNodes) == 0:
-                                            self.logger.debug("Child appears empty. Skip it: %s", child.toxml(encoding="utf-8"))
-                                            continue
-                                    found = False
-                                    for child2 in link2Clone.childNodes:
-                                        if child2.nodeType == Node.ELEMENT_NODE and (child2.localName == COMP_MGR or child2.localName == INTFC_REF or child.localName == objects.Link.PROPERTY_TAG):
-                                            continue
-                                        if isinstance(child2, Text) or isinstance(child2, Comment) or isinstance(child2, CDATASection):
-                                            if str(child2.data).strip() == "":
-                                                continue
-                                            self.logger.debug("Looking at link2Clone element under link: %s", child2.data)
-                                            if (isinstance(child, Text) or isinstance(child, Comment) or isinstance(child, CDATASection)) and child.data == child2.data:
-                                                found = True
-                                                break
-                                        else:
-                                            self.logger.debug("Looking at element under link2Clone type %s name %s value %s, attCnt %d, childCnt %d", child2.nodeType, child2.localName, child2.nodeValue, (child2.hasAttributes() and child2.attributes.length) or 0, len(child2.childNodes))
-                                            if child.nodeType == child2.nodeType and child.localName == child2.localName and child.nodeValue == child2.nodeValue and ((child.hasAttributes() and child2.hasAttributes() and child.attributes.length == child2.attributes.length) or (not child.hasAttributes() and not child2.hasAttributes())) and len(child.childNodes) == len(child2.childNodes):
-                                                found = True
-                                                self.logger.debug("Those are same - no need to copy")
-                                                break
-                                    if not found:
-                                        self.logger.debug("Copying that elem from template to new link: %s", child.toxml(encoding="utf-8"))
-                                        link2Clone.appendChild(child.cloneNode(True))
-                                # Done copying 'other' elements
-
-                                # Need to recreate intfs dict
-                                # Get interface_ref elements that need to be swapped
-                                intfs = {}
-                                for intf in link2Clone.childNodes:
-                                    if intf.nodeType != Node.ELEMENT_NODE or intf.localName != INTFC_REF:
-                                        continue
-                                    if not intf.hasAttribute(SLIVER_ID) and not intf.hasAttribute(COMP_ID):
-                                        intfs[str(intf.getAttribute(CLIENT_ID))] = intf
-#                                        self.logger.debug("intfc_ref %s has no sliver_id or component_id", intf.getAttribute(CLIENT_ID))
-#                                    else:
-#                                        sid = None
-#                                        cid = None
-#                                        if intf.hasAttribute(COMP_ID):
-#                                            cid = intf.getAttribute(COMP_ID)
-#                                        if intf.hasAttribute(SLIVER_ID):
-#                                            sid = intf.getAttribute(SLIVER_ID)
-#                                        self.logger.debug("intfc_ref %s has sliver_id %s, component_id %s", intf.getAttribute(CLIENT_ID), sid, cid)
-#                                self.logger.debug("Interfaces we need to swap: %s", intfs)
-
-                                # Add a comment on link2Clone with link's sliver_id and vlan_tag
-                                # But only if I deduced which AM the template is for above...
-                                if docAM:
-                                    lsid = None
-                                    if link.hasAttribute(SLIVER_ID):
-                                        lsid = link.getAttribute(SLIVER_ID)
-                                    lvt = link.getAttribute(VLANTAG)
-                                    # Skip the comment if it would be empty
-                                    if lsid is not None or str(lvt).strip() != "":
-                                        comment_text = "AM %s: sliver_id=%s vlantag=%s" % (docAM.urn, lsid, lvt)
-                                        self.logger.debug("Created comment to put in link2Clone to add to template: %s", comment_text)
-                                        comment_element = dom_template.createComment(comment_text)
-                                        link2Clone.insertBefore(comment_element, link2Clone.firstChild)
-
-                                doc_root.replaceChild(link2Clone, link)
-                                needSwap = False
-
-                                link = link2Clone
-                                self.logger.debug("Done swapping link %s from %s into template", client_id, agg)
-                                break # out of loop over link2's in this inner AM looking for the right link
-                            # End of block to do swap of link
-
-                            # So the template link didn't need to be swapped. But it still might need the proper irefs or comments or whatnot
-
-                            # Look at this version of the link's interface_refs. If any have
-                            # a sliver_id or component_id, then this is the version with manifest info
-                            # put it on the link
-                            for intf in link2.childNodes:
-                                if intf.nodeType == Node.ELEMENT_NODE and \
-                                        intf.localName == INTFC_REF and \
-                                        (intf.hasAttribute(SLIVER_ID) or intf.hasAttribute(COMP_ID)):
-                                    cid = str(intf.getAttribute(CLIENT_ID))
-                                    if intfs.has_key(cid):
-                                        sid = None
-                                        compid = None
-                                        if intf.hasAttribute(COMP_ID):
-                                            compid = intf.getAttribute(COMP_ID)
-                                        if intf.hasAttribute(SLIVER_ID):
-                                            sid = intf.getAttribute(SLIVER_ID)
-#                                        self.logger.debug("replacing iref cid %s, sid %s, comp_id %s: %s for old %s", cid, sid, compid, intf, intfs[cid])
-                                        link.replaceChild(intf.cloneNode(True), intfs[cid])
-#                                        self.logger.debug("Copied iref %s from AM %s", cid, agg.urn)
-                                        del intfs[cid]
-                                    else:
-                                        self.logger.debug("Template for link %s missing iref %s listed by %s - add it", client_id, cid, agg)
-                                        link.appendChild(intf.cloneNode(True))
-                                # End of loop over this Aggs link's children, looking for i_refs
-
-                            # Add a comment on link with link2's sliver_id and vlan_tag
-                            # Note we don't get here always - see
-                            # FIXMEs above
-                            lsid = None
-                            if link2.hasAttribute(SLIVER_ID):
-                                lsid = link2.getAttribute(SLIVER_ID)
-                            lvt = link2.getAttribute(VLANTAG)
-                            # Skip the comment if it would be empty
-                            if lsid is not None or str(lvt).strip() != "":
-                                comment_text = "AM %s: sliver_id=%s vlantag=%s" % (agg.urn, lsid, lvt)
-                                self.logger.debug("Created comment to add to template: %s", comment_text)
-                                comment_element = dom_template.createComment(comment_text)
-                                link.insertBefore(comment_element, link.firstChild)
+                    self.logger.debug("Found AM %s link '%s' that has vlantag '%s'", agg.urn, client_id, link2.getAttribute('vlantag'))
+                    if needSwap:
+                        self.logger.debug("Will swap link in template with this element")
+                        link2Clone = link2.cloneNode(True)
+
+                        # Need to pull out the irefs with a sliver id or component_id from link
+                        # Before completing this swap
+                        for intf in link.childNodes:
+                            if intf.nodeType == Node.ELEMENT_NODE and \
+                                    intf.localName == INTFC_REF and \
+                                    (intf.hasAttribute(SLIVER_ID) or intf.hasAttribute(COMP_ID)):
+                                for intf2 in link2Clone.childNodes:
+                                    if intf2.nodeType == Node.ELEMENT_NODE and \
+                                            intf2.localName == INTFC_REF and \
+                                            str(intf2.getAttribute(CLIENT_ID)) == str(intf.getAttribute(CLIENT_ID)) and \
+                                            (not intf2.hasAttribute(SLIVER_ID) and not intf2.hasAttribute(COMP_ID)):
+#                                        self.logger.debug("from old template saving iref %s", intf2.getAttribute(CLIENT_ID))
+                                        link2Clone.replaceChild(intf.cloneNode(True), intf2)
+                                        break
 
-                            # Now add missing cms
-                            for cm in link2.childNodes:
-                                if cm.nodeType != Node.ELEMENT_NODE or cm.localName != COMP_MGR:
+                        # Bug 803. For each intfc in link, if it is not in link2Clone, add it to link2Clone
+                        # Similarly, for each cm in link, if it is not in link2Clone, add it
+                        for l1intid in intfs.keys():
+                            self.logger.debug("Checking if new AM link has ifc %s from template", l1intid)
+                            found = False
+                            for intf in link2Clone.childNodes:
+                                if intf.nodeType != Node.ELEMENT_NODE or intf.localName != INTFC_REF:
                                     continue
-                                found = False
-                                thisCM = str(cm.getAttribute(COMP_MGR_NAME))
-                                self.logger.debug("Checking if new AM link's CM %s is on template", thisCM)
-                                for cmT in cms: # these are cms from the template
-                                    if thisCM == cmT:
-                                        found = True
-                                        break
-                                if not found:
-                                    link.appendChild(cm.cloneNode(True))
-                                    self.logger.debug("Adding missing comp_mgr %s from %s manifest to template", thisCM, agg)
-                            # Done adding missing cms
-
-                            # Handle property tags
-                            #Link.PROPERTY_TAG
-                            #attributes: LinkProperty.SOURCE_TAG, DEST_TAG, CAPACITY_TAG
-                            for prop in link2.childNodes:
-                                if prop.nodeType != Node.ELEMENT_NODE or prop.localName != objects.Link.PROPERTY_TAG:
+                                if str(intf.getAttribute(CLIENT_ID)) == l1intid:
+                                    found = True
+                                    break
+                            if not found:
+                                link2Clone.appendChild(intfs.get(l1intid).cloneNode(True))
+                                self.logger.debug("Adding missing iref %s from template manifest to rspec for this AM we are swapping in", l1intid)
+                        # Done adding missing intfs
+
+                        # Now add missing cms
+                        for cm in cms:
+                            self.logger.debug("Checking if new AM link has cm %s from template", cm)
+                            found = False
+                            for cmL in link2Clone.childNodes:
+                                if cmL.nodeType != Node.ELEMENT_NODE or cmL.localName != COMP_MGR:
                                     continue
-                                pSrc = prop.getAttribute(objects.LinkProperty.SOURCE_TAG)
-                                pDst = None
-                                if prop.hasAttribute(objects.LinkProperty.DEST_TAG):
-                                    pDst = prop.getAttribute(objects.LinkProperty.DEST_TAG)
-                                self.logger.debug("Checking if template has property found in AMs link src=%s, dst=%s", pSrc, pDst)
-                                found = False
-                                for prop2 in link.childNodes:
-                                    if prop2.nodeType != Node.ELEMENT_NODE or prop2.localName != objects.Link.PROPERTY_TAG:
-                                        continue
-                                    p2Src = prop2.getAttribute(objects.LinkProperty.SOURCE_TAG)
-                                    p2Dst = None
-                                    if prop2.hasAttribute(objects.LinkProperty.DEST_TAG):
-                                        p2Dst = prop2.getAttribute(objects.LinkProperty.DEST_TAG)
-                                    self.logger.debug("Comparing to property on template link src=%s, dst=%s", p2Src, p2Dst)
-                                    if p2Src == pSrc and (pDst is None or pDst == p2Dst):
-                                        found = True
-                                        break
-                                if not found:
-                                    self.logger.debug(" ... template link was missing property - adding it")
-                                    link.appendChild(prop.cloneNode(True))
-
-                            # What about things that aren't either the CM or the ifc_ref?
-                            for child2 in link2.childNodes:
-                                if child2.nodeType == Node.ELEMENT_NODE and (child2.localName == COMP_MGR or child2.localName == INTFC_REF or child2.localName == objects.Link.PROPERTY_TAG):
+                                if str(cmL.getAttribute(COMP_MGR_NAME)) == cm:
+                                    found = True
+                                    break
+                            if not found:
+                                newCM = man.createElement(COMP_MGR)
+                                newCM.setAttribute(COMP_MGR_NAME, cm)
+                                link2Clone.appendChild(newCM)
+                                self.logger.debug("Adding missing comp_mgr %s from template manifest to rspec for this AM we are swapping in", cm)
+                        # Done adding missing cms
+
+                        # Handle property tags
+                        #Link.PROPERTY_TAG
+                        #attributes: LinkProperty.SOURCE_TAG, DEST_TAG, CAPACITY_TAG
+                        for prop in link.childNodes:
+                            if prop.nodeType != Node.ELEMENT_NODE or prop.localName != objects.Link.PROPERTY_TAG:
+                                continue
+                            pSrc = prop.getAttribute(objects.LinkProperty.SOURCE_TAG)
+                            pDst = None
+                            if prop.hasAttribute(objects.LinkProperty.DEST_TAG):
+                                pDst = prop.getAttribute(objects.LinkProperty.DEST_TAG)
+                            self.logger.debug("Checking on property src=%s, dst=%s", pSrc, pDst)
+                            found = False
+                            for prop2 in link2Clone.childNodes:
+                                if prop2.nodeType != Node.ELEMENT_NODE or prop2.localName != objects.Link.PROPERTY_TAG:
+                                    continue
+                                p2Src = prop2.getAttribute(objects.LinkProperty.SOURCE_TAG)
+                                p2Dst = None
+                                if prop2.hasAttribute(objects.LinkProperty.DEST_TAG):
+                                    p2Dst = prop2.getAttribute(objects.LinkProperty.DEST_TAG)
+                                self.logger.debug("Checking on property on link2Clone src=%s, dst=%s", p2Src, p2Dst)
+                                if p2Src == pSrc and (pDst is None or pDst == p2Dst):
+                                    found = True
+                                    break
+                            if not found:
+                                self.logger.debug(" ... link2Clone was missing property - adding it")
+                                link2Clone.appendChild(prop.cloneNode(True))
+
+                        # What about things that aren't either the CM or the ifc_ref?
+                        for child in link.childNodes:
+                            if child.nodeType == Node.ELEMENT_NODE and (child.localName == COMP_MGR or child.localName == INTFC_REF or child.localName == objects.Link.PROPERTY_TAG):
+                                continue
+                            if isinstance(child, Text) or isinstance(child, Comment) or isinstance(child, CDATASection):
+                                if str(child.data).strip() == "":
+                                    continue
+                                self.logger.debug("Looking at template element under link: %s", child.data)
+                            else:
+                                self.logger.debug("Looking at template element under link type %s name %s value %s, attCnt %d, childCnt %d", child.nodeType, child.localName, child.nodeValue, (child.hasAttributes() and child.attributes.length) or 0, len(child.childNodes))
+                                if child.localName is None and str(child.nodeValue).strip() == "" and not child.hasAttributes() and len(child.childNodes) == 0:
+                                    self.logger.debug("Child appears empty. Skip it: %s", child.toxml(encoding="utf-8"))
+                                    continue
+                            found = False
+                            for child2 in link2Clone.childNodes:
+                                if child2.nodeType == Node.ELEMENT_NODE and (child2.localName == COMP_MGR or child2.localName == INTFC_REF or child.localName == objects.Link.PROPERTY_TAG):
                                     continue
                                 if isinstance(child2, Text) or isinstance(child2, Comment) or isinstance(child2, CDATASection):
                                     if str(child2.data).strip() == "":
                                         continue
-                                    self.logger.debug("Checking that template has this element found under other AMs link: %s", child2.data)
+                                    self.logger.debug("Looking at link2Clone element under link: %s", child2.data)
+                                    if (isinstance(child, Text) or isinstance(child, Comment) or isinstance(child, CDATASection)) and child.data == child2.data:
+                                        found = True
+                                        break
                                 else:
-                                    if child2.localName is None and str(child2.nodeValue).strip() == "" and not child2.hasAttributes() and len(child2.childNodes) == 0:
-                                        self.logger.debug("Child appears empty. Skip it: %s", child2.toxml(encoding="utf-8"))
-                                        continue
-                                    self.logger.debug("Checking that template has this AMs element found under link: type %s name %s value %s, attCnt %d, childCnt %d", child2.nodeType, child2.localName, child2.nodeValue, (child2.hasAttributes() and child2.attributes.length) or 0, len(child2.childNodes))
-                                found = False
-                                for child in link.childNodes:
-                                    if child.nodeType == Node.ELEMENT_NODE and (child.localName == COMP_MGR or child.localName == INTFC_REF or child.localName == objects.Link.PROPERTY_TAG):
-                                        continue
-                                    if isinstance(child, Text) or isinstance(child, Comment) or isinstance(child, CDATASection):
-                                        if str(child.data).strip() == "":
-                                            continue
-                                        self.logger.debug("Comparing with template element under link: %s", child.data)
-                                        if (isinstance(child2, Text) or isinstance(child2, Comment) or isinstance(child2, CDATASection)) and child.data == child2.data:
-                                            found = True
-                                            break
-                                    else:
-                                        self.logger.debug("Comparing with template element under link type %s name %s value %s, attCnt %d, childCnt %d", child.nodeType, child.localName, child.nodeValue, (child.hasAttributes() and child.attributes.length) or 0, len(child.childNodes))
-                                        if child.nodeType == child2.nodeType and child.localName == child2.localName and child.nodeValue == child2.nodeValue and ((child.hasAttributes() and child2.hasAttributes() and child.attributes.length == child2.attributes.length) or (not child.hasAttributes() and not child2.hasAttributes())) and len(child.childNodes) == len(child2.childNodes):
-                                            found = True
-                                            self.logger.debug("Those are same - no need to copy")
-                                            break
-                                if not found:
-                                    self.logger.debug("Copying that elem from this AM to template: %s", child2.toxml(encoding="utf-8"))
-                                    link.appendChild(child2.cloneNode(True))
-                            # Done copying 'other' elements
-
-                            break # out of loop over Aggs' elements
-#                        else:
-#                            acid = str(link2.getAttribute(CLIENT_ID))
-#                            self.logger.debug("In manifest for AM %s found link %s", agg.urn, acid)
-#                            if acid == client_id:
-#                                self.logger.debug("Found AM %s link %s that has no vlantag - so we skip", agg.urn, client_id)
+                                    self.logger.debug("Looking at element under link2Clone type %s name %s value %s, attCnt %d, childCnt %d", child2.nodeType, child2.localName, child2.nodeValue, (child2.hasAttributes() and child2.attributes.length) or 0, len(child2.childNodes))
+                                    if child.nodeType == child2.nodeType and child.localName == child2.localName and child.nodeValue == child2.nodeValue and ((child.hasAttributes() and child2.hasAttributes() and child.attributes.length == child2.attributes.length) or (not child.hasAttributes() and not child2.hasAttributes())) and len(child.childNodes) == len(child2.childNodes):
+                                        found = True
+                                        self.logger.debug("Those are same - no need to copy")
+                                        break
+                            if not found:
+                                self.logger.debug("Copying that elem from template to new link: %s", child.toxml(encoding="utf-8"))
+                                link2Clone.appendChild(child.cloneNode(True))
+                        # Done copying 'other' elements
+
+                        # Need to recreate intfs dict
+                        # Get interface_ref elements that need to be swapped
+                        intfs = {}
+                        for intf in link2Clone.childNodes:
+                            if intf.nodeType != Node.ELEMENT_NODE or intf.localName != INTFC_REF:
+                                continue
+                            if not intf.hasAttribute(SLIVER_ID) and not intf.hasAttribute(COMP_ID):
+                                intfs[str(intf.getAttribute(CLIENT_ID))] = intf
+#                                self.logger.debug("intfc_ref %s has no sliver_id or component_id", intf.getAttribute(CLIENT_ID))
 #                            else:
-#                                self.logger.debug("Found AM %s link %s (not the one I'm looking for)", agg.urn, acid)
-
+#                                sid = None
+#                                cid = None
+#                                if intf.hasAttribute(COMP_ID):
+#                                    cid = intf.getAttribute(COMP_ID)
+#                                if intf.hasAttribute(SLIVER_ID):
+#                                    sid = intf.getAttribute(SLIVER_ID)
+#                                self.logger.debug("intfc_ref %s has sliver_id %s, component_id %s", intf.getAttribute(CLIENT_ID), sid, cid)
+#                        self.logger.debug("Interfaces we need to swap: %s", intfs)
+
+                        # Add a comment on link2Clone with link's sliver_id and vlan_tag
+                        # But only if I deduced which AM the template is for above...
+                        if docAM:
+                            lsid = None
+                            if link.hasAttribute(SLIVER_ID):
+                                lsid = link.getAttribute(SLIVER_ID)
+                            lvt = link.getAttribute(VLANTAG)
+                            # Skip the comment if it would be empty
+                            if lsid is not None or str(lvt).strip() != "":
+                                comment_text = "AM %s: sliver_id=%s vlantag=%s" % (docAM.urn, lsid, lvt)
+                                self.logger.debug("Created comment to put in link2Clone to add to template: %s", comment_text)
+                                comment_element = dom_template.createComment(comment_text)
+                                link2Clone.insertBefore(comment_element, link2Clone.firstChild)
+
+                        doc_kids.replaceChild(link2Clone, link)
+                        needSwap = False
+
+                        link = link2Clone
+                        self.logger.debug("Done swapping link %s from %s into template", client_id, agg)
+                        continue # on to the next AM, with the link swapped in
+                    # End of block to do swap of link
+
+                    # So the template link didn't need to be swapped. But it still might need the proper irefs or comments or whatnot
+
+                    # Look at this version of the link's interface_refs. If any have
+                    # a sliver_id or component_id, then this is the version with manifest info
+                    # put it on the link
+                    for intf in link2.childNodes:
+                        if intf.nodeType == Node.ELEMENT_NODE and \
+                                intf.localName == INTFC_REF and \
+                                (intf.hasAttribute(SLIVER_ID) or intf.hasAttribute(COMP_ID)):
+                            cid = str(intf.getAttribute(CLIENT_ID))
+                            if intfs.has_key(cid):
+                                sid = None
+                                compid = None
+                                if intf.hasAttribute(COMP_ID):
+                                    compid = intf.getAttribute(COMP_ID)
+                                if intf.hasAttribute(SLIVER_ID):
+                                    sid = intf.getAttribute(SLIVER_ID)
+#                                self.logger.debug("replacing iref cid %s, sid %s, comp_id %s: %s for old %s", cid, sid, compid, intf, intfs[cid])
+                                link.replaceChild(intf.cloneNode(True), intfs[cid])
+#                                self.logger.debug("Copied iref %s from AM %s", cid, agg.urn)
+                                del intfs[cid]
+                            else:
+                                self.logger.debug("Template for link %s missing iref %s listed by %s - add it", client_id, cid, agg)
+                                link.appendChild(intf.cloneNode(True))
+                        # End of loop over this Aggs link's children, looking for i_refs
+
+                    # Add a comment on link with link2's sliver_id and vlan_tag
+                    # Note we don't get here always - see
+                    # FIXMEs above
+                    lsid = None
+                    if link2.hasAttribute(SLIVER_ID):
+                        lsid = link2.getAttribute(SLIVER_ID)
+                    lvt = link2.getAttribute(VLANTAG)
+                    # Skip the comment if it would be empty
+                    if lsid is not None or str(lvt).strip() != "":
+                        comment_text = "AM %s: sliver_id=%s vlantag=%s" % (agg.urn, lsid, lvt)
+                        self.logger.debug("Created comment to add to template: %s", comment_text)
+                        comment_element = dom_template.createComment(comment_text)
+                        link.insertBefore(comment_element, link.firstChild)
+
+                    # Now add missing cms
+                    for cm in link2.childNodes:
+                        if cm.nodeType != Node.ELEMENT_NODE or cm.localName != COMP_MGR:
+                            continue
+                        found = False
+                        thisCM = str(cm.getAttribute(COMP_MGR_NAME))
+                        self.logger.debug("Checking if new AM link's CM %s is on template", thisCM)
+                        for cmT in cms: # these are cms from the template
+                            if thisCM == cmT:
+                                found = True
+                                break
+                        if not found:
+                            link.appendChild(cm.cloneNode(True))
+                            self.logger.debug("Adding missing comp_mgr %s from %s manifest to template", thisCM, agg)
+                    # Done adding missing cms
+
+                    # Handle property tags
+                    #Link.PROPERTY_TAG
+                    #attributes: LinkProperty.SOURCE_TAG, DEST_TAG, CAPACITY_TAG
+                    for prop in link2.childNodes:
+                        if prop.nodeType != Node.ELEMENT_NODE or prop.localName != objects.Link.PROPERTY_TAG:
+                            continue
+                        pSrc = prop.getAttribute(objects.LinkProperty.SOURCE_TAG)
+                        pDst = None
+                        if prop.hasAttribute(objects.LinkProperty.DEST_TAG):
+                            pDst = prop.getAttribute(objects.LinkProperty.DEST_TAG)
+                        self.logger.debug("Checking if template has property found in AMs link src=%s, dst=%s", pSrc, pDst)
+                        found = False
+                        for prop2 in link.childNodes:
+                            if prop2.nodeType != Node.ELEMENT_NODE or prop2.localName != objects.Link.PROPERTY_TAG:
+                                continue
+                            p2Src = prop2.getAttribute(objects.LinkProperty.SOURCE_TAG)
+                            p2Dst = None
+                            if prop2.hasAttribute(objects.LinkProperty.DEST_TAG):
+                                p2Dst = prop2.getAttribute(objects.LinkProperty.DEST_TAG)
+                            self.logger.debug("Comparing to property on template link src=%s, dst=%s", p2Src, p2Dst)
+                            if p2Src == pSrc and (pDst is None or pDst == p2Dst):
+                                found = True
+                                break
+                        if not found:
+                            self.logger.debug(" ... template link was missing property - adding it")
+                            link.appendChild(prop.cloneNode(True))
 
-                    # End of loop over this Aggs elements looking for the particular link
+                    # What about things that aren't either the CM or the ifc_ref?
+                    for child2 in link2.childNodes:
+                        if child2.nodeType == Node.ELEMENT_NODE and (child2.localName == COMP_MGR or child2.localName == INTFC_REF or child2.localName == objects.Link.PROPERTY_TAG):
+                            continue
+                        if isinstance(child2, Text) or isinstance(child2, Comment) or isinstance(child2, CDATASection):
+                            if str(child2.data).strip() == "":
+                                continue
+                            self.logger.debug("Checking that template has this element found under other AMs link: %s", child2.data)
+                        else:
+                            if child2.localName is None and str(child2.nodeValue).strip() == "" and not child2.hasAttributes() and len(child2.childNodes) == 0:
+                                self.logger.debug("Child appears empty. Skip it: %s", child2.toxml(encoding="utf-8"))
+                                continue
+                            self.logger.debug("Checking that template has this AMs element found under link: type %s name %s value %s, attCnt %d, childCnt %d", child2.nodeType, child2.localName, child2.nodeValue, (child2.hasAttributes() and child2.attributes.length) or 0, len(child2.childNodes))
+                        found = False
+                        for child in link.childNodes:
+                            if child.nodeType == Node.ELEMENT_NODE and (child.localName == COMP_MGR or child.localName == INTFC_REF or child.localName == objects.Link.PROPERTY_TAG):
+                                continue
+                            if isinstance(child, Text) or isinstance(child, Comment) or isinstance(child, CDATASection):
+                                if str(child.data).strip() == "":
+                                    continue
+                                self.logger.debug("Comparing with template element under link: %s", child.data)
+                                if (isinstance(child2, Text) or isinstance(child2, Comment) or isinstance(child2, CDATASection)) and child.data == child2.data:
+                                    found = True
+                                    break
+                            else:
+                                self.logger.debug("Comparing with template element under link type %s name %s value %s, attCnt %d, childCnt %d", child.nodeType, child.localName, child.nodeValue, (child.hasAttributes() and child.attributes.length) or 0, len(child.childNodes))
+                                if child.nodeType == child2.nodeType and child.localName == child2.localName and child.nodeValue == child2.nodeValue and ((child.hasAttributes() and child2.hasAttributes() and child.attributes.length == child2.attributes.length) or (not child.hasAttributes() and not child2.hasAttributes())) and len(child.childNodes) == len(child2.childNodes):
+                                    found = True
+                                    self.logger.debug("Those are same - no need to copy")
+                                    break
+                        if not found:
+                            self.logger.debug("Copying that elem from this AM to template: %s", child2.toxml(encoding="utf-8"))
+                            link.appendChild(child2.cloneNode(True))
+                    # Done copying 'other' elements
                 # end of loop over aggs looking for manifest link entries
             # End of block handling link elements
         # end of loop over template manifest elements
@@ -890,6 +957,8 @@ class ManifestRSpecCombiner:
                 return
         # End of block to handle have no stitching template
 
+        template_index = _PathIndex(template_stitching)
+
         for am in ams_list:
             if am.dcn:
                 self.logger.debug("Pulling hops from a DCN AM: %s", am)
@@ -914,6 +983,7 @@ class ManifestRSpecCombiner:
                 continue
             if not amStitch and len(am.hops) > 0:
                 self.logger.error("%s has no stitching element but has %d hops?!", am, len(am.hops))
+            am_index = _PathIndex(amStitch)
 
             # FIXME: Should this be am._hops or is am.hops OK as is?
             # In my testing, everything in _hops is in .hops
@@ -929,18 +999,18 @@ class ManifestRSpecCombiner:
                     continue
                 if hop.aggregate != am:
                     self.logger.error("%s says AM is %s, but expected %s", hop, hop.aggregate, am)
-                template_path = self.findPathByID(template_stitching, path_id)
+                template_path = template_index.path(path_id)
                 if template_path is None:
                     self.logger.debug("Cannot find path %s in template manifest", path_id)
                     # Find it on the AM and append it to the template
-                    am_path = self.findPathByID(amStitch, path_id)
-                    template_stitching.appendChild(am_path.cloneNode(True))
+                    am_path = am_index.path(path_id)
+                    template_index.addPath(template_stitching.appendChild(am_path.cloneNode(True)))
                     self.logger.debug(" ... added it from this AM")
                     continue
                 #self.logger.debug("Found path %s in template manifest: %s", path_id, template_path.toxml(encoding="utf-8"))
                 #                print "AGG " + str(am) + " HID " + str(hop_id)
                 if not am.isEG:
-                    res = self.replaceHopOrAddElement(template_path, self.getStitchingElement(am_manifest_dom), hop_id, path_id)
+                    res = self.replaceHopOrAddElement(template_path, amStitch, hop_id, path_id, template_index, am_index)
 #                    for child in template_path.childNodes:
 #                        if child.nodeType == Node.ELEMENT_NODE and \
 #                                child.localName == HOP and \
@@ -949,7 +1019,7 @@ class ManifestRSpecCombiner:
                 else:
                     self.logger.debug("Had EG AM in combineHops: %s", am)
                     link_id = hop._hop_link.urn
-                    self.replaceHopLinkElement(template_path, amStitch, hop_id, path_id, link_id)
+                    self.replaceHopLinkElement(template_path, amStitch, hop_id, path_id, link_id, am_index)
 #            self.logger.debug("After swapping hops for %s, stitching extension is %s", am, stripBlankLines(template_stitching.toprettyxml(encoding="utf-8")))
 
     # Add details about allocations to each aggregate in a 
@@ -1046,31 +1116,26 @@ class ManifestRSpecCombiner:
 
     # Replace the hop element in the template DOM with the hop element 
     # from the aggregate DOM that has the given HOP ID
-    def replaceHopOrAddElement(self, template_path, am_stitching, hop_id, path_id):
-        template_hop = None
-
-        for child in template_path.childNodes:
-            if child.nodeType == Node.ELEMENT_NODE and \
-                    child.localName == HOP and \
-                    child.getAttribute(HOP_ID) == hop_id:
-                template_hop = child
-                break
+    # template_index and am_index are _PathIndex objects for the template and
+    # AM stitching elements, if the caller has them
+    def replaceHopOrAddElement(self, template_path, am_stitching, hop_id, path_id, template_index=None, am_index=None):
+        if template_index is None:
+            template_index = _PathIndex(None)
+        if am_index is None:
+            am_index = _PathIndex(am_stitching)
+        template_hops = template_index.pathHops(template_path)
+        template_hop = template_hops.get(hop_id)
         if template_hop is None:
             # This used to be an error and return, cause it means we can't replace
             # So now instead we will do an add
             self.logger.info("Cannot find hop %s in template manifest path %s - will add it", hop_id, path_id)
 
         # Find the path for the given path_id (there may be more than one)
-        am_path = self.findPathByID(am_stitching, path_id)
+        am_path = am_index.path(path_id)
 
         am_hop = None
         if am_path is not None:
-            for child in am_path.childNodes:
-                if child.nodeType == Node.ELEMENT_NODE and \
-                        child.localName == HOP and \
-                        child.getAttribute(HOP_ID) == hop_id:
-                    am_hop = child
-                    break
+            am_hop = am_index.pathHops(am_path).get(hop_id)
         else:
             self.logger.error("Cannot find path %s in AM's stitching extension when looking to use AM's version of hop %s", path_id, hop_id)
             # self.logger.debug("%s" % am_stitching)
@@ -1078,10 +1143,11 @@ class ManifestRSpecCombiner:
 
         if am_hop is not None and template_hop is not None:
 #            self.logger.debug("Replacing " + template_hop.toxml(encoding="utf-8") + " with " + am_hop.toxml(encoding="utf-8"))
-            template_path.replaceChild(am_hop.cloneNode(True), template_hop)
+            template_hops[hop_id] = am_hop.cloneNode(True)
+            template_path.replaceChild(template_hops[hop_id], template_hop)
         elif am_hop is not None:
             self.logger.debug("Instead of replacing hop, will add")
-            template_path.appendChild(am_hop.cloneNode(True))
+            template_hops[hop_id] = template_path.appendChild(am_hop.cloneNode(True))
         else:
             self.logger.error ("Can't replace hop %s from path %s in template: AM HOP %s TEMPLATE HOP %s" % (hop_id, path_id, am_hop, template_hop))
             return False
@@ -1091,7 +1157,7 @@ class ManifestRSpecCombiner:
     # Replace the hop link element in the template DOM with the hop link element 
     # from the aggregate DOM that has the given HOP LINK ID
     # For use with EG AMs
-    def replaceHopLinkElement(self, template_path, am_stitching, template_hop_id, path_id, link_id):
+    def replaceHopLinkElement(self, template_path, am_stitching, template_hop_id, path_id, link_id, am_index=None):
         template_link = None
         template_hop = None
 
@@ -1141,7 +1207,10 @@ class ManifestRSpecCombiner:
                 return
 
         # Find the path for the given path_id (there may be more than one)
-        am_path = self.findPathByID(am_stitching, path_id)
+        if am_index is not None:
+            am_path = am_index.path(path_id)
+        else:
+            am_path = self.findPathByID(am_stitching, path_id)
 
         am_link = None
         if am_path is not None:
@@ -47,40 +47,313 @@ class VLAN( int ):
     def maxvlan(cls):
         return cls.__maxvlan
 
-class VLANRange( set ):
-    '''A set of ints or VLANs representing a range of VLAN tags.'''
+def _bitsFor( minValue, maxValue ):
+    '''Return the bitmap with bits minValue through maxValue (inclusive) set'''
+    if maxValue < minValue:
+        return 0
+    return ((1 << (maxValue - minValue + 1)) - 1) << minValue
+
+def _bitFor( value ):
+    '''Return the bitmap with just the bit for this VLAN tag set'''
+    if not isinstance(value, (int, long)):
+        raise TypeError("Value must be of type 'int' instead is of type '%s'" % type(value))
+    if value < 0:
+        raise TypeError("Int must be >= 0 instead is %s" % value)
+    return 1 << value
+
+class VLANRange( object ):
+    '''A set of ints or VLANs representing a range of VLAN tags.
+
+    This behaves like a python set of ints (the full set API and operators),
+    but is stored as a bitmap (a python long with bit N set when tag N is in
+    the range), so that set algebra between ranges works a word at a time,
+    and 'any' is a single value instead of 4096 entries.'''
+
+    # Sets are not hashable, so neither are VLANRanges
+    __hash__ = None
+
+    # The bitmap len() last counted, and its count. Every change makes a
+    # new long, so the count is good while the bitmap is that same object.
+    _countedBits = 0
+    _count = 0
+
     def __init__( self, vlan=None ):
+        self._bits = 0
         if vlan is None:
-            super( VLANRange, self).__init__()
+            pass
         elif isinstance(vlan, VLAN) or isinstance(vlan, int):
-            super( VLANRange, self).__init__([vlan])
+            self._bits = _bitFor(vlan)
         elif isinstance(vlan, list) or isinstance(vlan, tuple):
-            retRange = VLANRange()
             for item in vlan:
-                newItem = VLAN(item)
-                retRange.add( newItem )
-            super( VLANRange, self).__init__(vlan)
-        elif isinstance(vlan, set):
-            super( VLANRange, self).__init__(vlan)
+                self._bits |= _bitFor(VLAN(item))
         elif isinstance(vlan, VLANRange):
-            super( VLANRange, self).__init__(vlan)
+            self._bits = vlan._bits
+        elif isinstance(vlan, (set, frozenset)):
+            self._bits = self._bitsOf(vlan)
         else:
             raise TypeError("Value must be one of 'int', 'VLAN', or 'VLANRange' instead is '%s'" % type(vlan))
 
-        
+    @classmethod
+    def _fromBits( cls, bits ):
+        newObj = cls()
+        newObj._bits = bits
+        return newObj
+
+    @classmethod
+    def _bitsOf( cls, other ):
+        '''Return the bitmap for the tags in the given VLANRange or iterable of ints'''
+        if isinstance(other, VLANRange):
+            return other._bits
+        bits = 0
+        for item in other:
+            bits |= _bitFor(item)
+        return bits
+
+    @classmethod
+    def _bitsIn( cls, other ):
+        '''Return (bitmap of the VLAN tags in other, whether other has any other items).
+        Items that cannot be VLAN tags cannot be in a VLANRange, so some operations can ignore them.'''
+        if isinstance(other, VLANRange):
+            return other._bits, False
+        bits = 0
+        others = False
+        for item in other:
+            try:
+                bits |= _bitFor(item)
+            except TypeError:
+                others = True
+        return bits, others
+
     @classmethod
     def _isValidVLAN( cls, other ):
         if isinstance(other, VLANRange) or isinstance(other, VLAN):
             return True
         else:
             return False
-    
-    # Inherit from parent object (set):
-    #   __contains__, __sub__, __and__, __eq__
-    # FIXME: set has no __add__. There is __and__ or add, but no __add__. What is intended here?
-#    def __add__( self, other ):
-#        newRange = VLANRange( other )
-#        super( VLANRange, self).__add__(newRange)                    
+
+    @classmethod
+    def _isSet( cls, other ):
+        return isinstance(other, (VLANRange, set, frozenset))
+
+    # Container methods
+
+    def __len__( self ):
+        bits = self._bits
+        if bits is not self._countedBits:
+            self._count = bin(bits).count('1')
+            self._countedBits = bits
+        return self._count
+
+    def __nonzero__( self ):
+        return self._bits != 0
+
+    def __contains__( self, item ):
+        if not isinstance(item, (int, long)) or item < 0:
+            return False
+        return bool((self._bits >> item) & 1)
+
+    def __iter__( self ):
+        # The bits from lowest to highest, as a string
+        bits = bin(self._bits)[:1:-1]
+        i = bits.find('1')
+        while i >= 0:
+            yield i
+            i = bits.find('1', i + 1)
+
+    def _runs( self ):
+        '''Return the list of (first, last) tags of each run of consecutive tags, in order'''
+        runs = []
+        bits = bin(self._bits)[:1:-1]
+        first = bits.find('1')
+        while first >= 0:
+            last = bits.find('0', first)
+            if last < 0:
+                last = len(bits)
+            runs.append((first, last - 1))
+            first = bits.find('1', last)
+        return runs
+
+    def __repr__( self ):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+    def __reduce__( self ):
+        return (self.__class__, (list(self),))
+
+    # Set methods that make a new VLANRange
+
+    def copy( self ):
+        return self._fromBits(self._bits)
+
+    def union( self, *others ):
+        bits = self._bits
+        for other in others:
+            bits |= self._bitsOf(other)
+        return self._fromBits(bits)
+
+    def intersection( self, *others ):
+        bits = self._bits
+        for other in others:
+            bits &= self._bitsIn(other)[0]
+        return self._fromBits(bits)
+
+    def difference( self, *others ):
+        bits = self._bits
+        for other in others:
+            bits &= ~self._bitsIn(other)[0]
+        return self._fromBits(bits)
+
+    def symmetric_difference( self, other ):
+        return self._fromBits(self._bits ^ self._bitsOf(other))
+
+    # Set comparisons
+
+    def issubset( self, other ):
+        return self._bits & ~self._bitsIn(other)[0] == 0
+
+    def issuperset( self, other ):
+        bits, others = self._bitsIn(other)
+        return not others and bits & ~self._bits == 0
+
+    def isdisjoint( self, other ):
+        return self._bits & self._bitsIn(other)[0] == 0
+
+    def __eq__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        bits, others = self._bitsIn(other)
+        return not others and bits == self._bits
+
+    def __ne__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return not self == other
+
+    def __le__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return self.issubset(other)
+
+    def __lt__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return self.issubset(other) and not self == other
+
+    def __ge__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return self.issuperset(other)
+
+    def __gt__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return self.issuperset(other) and not self == other
+
+    # Set operators: like set, both sides must be sets
+
+    def __or__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return self.union(other)
+
+    def __and__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return self.intersection(other)
+
+    def __sub__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return self.difference(other)
+
+    def __xor__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return self.symmetric_difference(other)
+
+    # A set on the left gives a set, as for a subclass of set
+    def __ror__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return other | set(self)
+
+    def __rand__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return other & set(self)
+
+    def __rsub__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return other - set(self)
+
+    def __rxor__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        return other ^ set(self)
+
+    # Methods that change this VLANRange
+
+    def add( self, item ):
+        self._bits |= _bitFor(item)
+
+    def discard( self, item ):
+        if item in self:
+            self._bits &= ~(1 << item)
+
+    def remove( self, item ):
+        if item not in self:
+            raise KeyError(item)
+        self._bits &= ~(1 << item)
+
+    def pop( self ):
+        '''Remove and return the lowest tag'''
+        if not self._bits:
+            raise KeyError('pop from an empty set')
+        lowest = self._bits & -self._bits
+        self._bits ^= lowest
+        return len(bin(lowest)) - 3
+
+    def clear( self ):
+        self._bits = 0
+
+    def update( self, *others ):
+        for other in others:
+            self._bits |= self._bitsOf(other)
+
+    def intersection_update( self, *others ):
+        for other in others:
+            self._bits &= self._bitsIn(other)[0]
+
+    def difference_update( self, *others ):
+        for other in others:
+            self._bits &= ~self._bitsIn(other)[0]
+
+    def symmetric_difference_update( self, other ):
+        self._bits ^= self._bitsOf(other)
+
+    def __ior__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        self.update(other)
+        return self
+
+    def __iand__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        self.intersection_update(other)
+        return self
+
+    def __isub__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        self.difference_update(other)
+        return self
+
+    def __ixor__( self, other ):
+        if not self._isSet(other):
+            return NotImplemented
+        self.symmetric_difference_update(other)
+        return self
 
     @classmethod
     def fromString( cls, stringIn ):
@@ -94,11 +367,13 @@ class VLANRange( set ):
         inputs = str(stringIn).strip()
         if inputs == "":
             return newObj
+        if inputs.lower() in ("any", "*"):
+            newObj._bits = cls._ANYBITS
+            return newObj
         items = inputs.split(",")
         for item in items:
             splitItem = item.split("-")
             parsedItems = [parse.strip().lower() for parse in splitItem]
-#            print parsedItems
             minValue = -1
             maxValue = -1
             if len(parsedItems) == 1:                
@@ -121,50 +396,26 @@ class VLANRange( set ):
                     raise ValueError("Both values must be integers instead received %s " % str(item))
             else:
                 raise ValueError("Range should contain at most 2 values instead received %s " % str(item))
-#            print minValue, maxValue
-            for newVLAN in xrange(minValue,maxValue+1):
-                newObj.add( newVLAN )
+            if minValue < 0 and maxValue >= minValue:
+                raise TypeError("Int must be >= 0 instead is %s" % minValue)
+            newObj._bits |= _bitsFor(minValue, maxValue)
         return newObj
 
     def __str__( self ):
-        out = ""
-        if len(self) == 0:
-            return out
-        hasNum = False
-        min = VLAN.maxvlan()+1
-        max = VLAN.minvlan()-1
-        for num in sorted(self):
-            if min <= VLAN.maxvlan() and (max+1) == num:
-                max = num
-                continue
-            elif min <= VLAN.maxvlan() and num > max+1:
-                if hasNum:
-                    out += ','
-                if max > min+1:
-                    out += str(min)+'-'+str(max)
-                    hasNum = True
-                else:
-                    out += str(min)
-                    hasNum = True
-                    if max > min:
-                        out += ',' + str(max)
-                min = num
-                max = num
-                continue
+        runs = self._runs()
+        if runs == [(VLAN.minvlan(), VLAN.maxvlan())]:
+            return 'any'
+        out = []
+        for (first, last) in runs:
+            if last > first+1:
+                out.append(str(first)+'-'+str(last))
+            elif last > first:
+                out.append(str(first)+','+str(last))
             else:
-                min = num
-                max = num
-        if hasNum:
-            out += ','
-        if min == VLAN.minvlan() and max == VLAN.maxvlan():
-            out = 'any'
-        elif max > min+1:
-            out += str(min)+'-'+str(max)
-        else:
-            out += str(min)
-            if max > min:
-                out += ',' + str(max)
-        return out
+                out.append(str(first))
+        return ','.join(out)
+
+VLANRange._ANYBITS = _bitsFor(VLAN.minvlan(), VLAN.maxvlan())
 
 
 if __name__ == "__main__":
@@ -20,16 +20,27 @@
 # OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
 # IN THE WORK.
 #----------------------------------------------------------------------
-'''Launch each aggregate when it is ready, and detect when all are done.'''
+'''Launch each aggregate when it is ready, and detect when all are done.
+
+By default aggregates are reserved one at a time. With the omni option
+--parallel N, up to N aggregates whose dependencies are complete are
+reserved at once, each as soon as it becomes ready, and an aggregate
+that must retry waits out its own pause while the others continue.'''
 
 from __future__ import absolute_import
 
 import datetime
 import logging
+import Queue
+import sys
+import threading
 import time
 
 from .utils import StitchingRetryAggregateNewVlanError, StitchingRetryAggregateNewVlanImmediatelyError, StitchingError, StitchingStoppedError
-from .objects import Aggregate
+from .objects import Aggregate, stateLocked
+
+def _seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.0
 
 class Launcher(object):
 
@@ -39,10 +50,13 @@ class Launcher(object):
         self.slicename = slicename
         self.timeoutTime = timeoutTime
         self.logger = logger or logging.getLogger('stitch.launcher')
+        self.maxParallel = getattr(options, 'parallel', 1) or 1
 
     def launch(self, rspec, scsCallCount):
         '''The main loop for stitching: keep looking for AMs that are not complete, then 
         make a reservation there.'''
+        if self.maxParallel > 1:
+            return self._launch_parallel(rspec, scsCallCount)
         lastAM = None
         while not self._complete():
             if datetime.datetime.utcnow() >= self.timeoutTime:
@@ -86,17 +100,7 @@ class Launcher(object):
                 except StitchingRetryAggregateNewVlanError, se:
                     self.logger.info("Will put %s back in the pool to allocate. Got: %s", agg, se)
 
-                    # Aggregate.BUSY_POLL_INTERVAL_SEC = 10 # dossl does 10
-                    # Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS = 30
-                    # Use the v3 AM sleep by default.
-                    # But if any v2 AMs have (or have had) reservations, then use that sleep
-                    secs = Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS
-                    for agg2 in self.aggs:
-                        if agg2.api_version == 2 and secs < Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS and agg2.triedRes:
-                            secs = Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS
-                    if not isinstance(se, StitchingRetryAggregateNewVlanImmediatelyError):
-                        if agg.dcn:
-                            secs = Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS
+                    secs = self._retry_pause(agg, se)
 
                     if datetime.datetime.utcnow() + datetime.timedelta(seconds=secs) >= self.timeoutTime:
                         # We'll time out. So quit now.
@@ -117,6 +121,162 @@ class Launcher(object):
         self.logger.info("All aggregates are complete.")
         return lastAM
 
+    def _retry_pause(self, agg, se):
+        '''Seconds to wait for aggregates to free resources before retrying agg after the given error'''
+        # Aggregate.BUSY_POLL_INTERVAL_SEC = 10 # dossl does 10
+        # Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS = 30
+        # Use the v3 AM sleep by default.
+        # But if any v2 AMs have (or have had) reservations, then use that sleep
+        secs = Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS
+        for agg2 in self.aggs:
+            if agg2.api_version == 2 and secs < Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS and agg2.triedRes:
+                secs = Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS
+        if not isinstance(se, StitchingRetryAggregateNewVlanImmediatelyError):
+            if agg.dcn:
+                secs = Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS
+        return secs
+
+    def _allocate(self, agg, rspec, scsCallCount, done):
+        '''Worker thread body: allocate at one aggregate, and report (agg, exc_info) on the done queue.'''
+        try:
+            agg.allocate(self.opts, self.slicename, rspec.dom, scsCallCount)
+            done.put((agg, None))
+        except:
+            done.put((agg, sys.exc_info()))
+
+    def _launch_parallel(self, rspec, scsCallCount):
+        '''Event driven version of the launch loop, used when --parallel is more than 1.
+        Any aggregate whose dependencies are complete is started right away (up to
+        maxParallel at a time) in its own thread. Each time a reservation finishes,
+        the ready aggregates are re-computed, so dependents start as soon as they can.
+        An aggregate that must retry with a new VLAN is put back in the pool with
+        its own retry time (as are any aggregates whose reservations were undone by
+        that failure), instead of pausing all reservations.
+        On any other error, the reservations still in progress are allowed to finish
+        (so that they can be deleted), and then the error is raised.'''
+        lastAM = None
+        done = Queue.Queue()
+        running = dict() # Aggregate -> Thread
+        retryAt = dict() # Aggregate -> datetime before which not to retry it
+        completed = set([agg for agg in self.aggs if agg.completed])
+        error = None # exc_info to raise once nothing is running
+
+        try:
+            while True:
+                # The reservation threads change the aggregates, so look at them only
+                # while holding the stitching state lock (which allocate lets go of
+                # while waiting on an AM)
+                with stateLocked():
+                    now = datetime.datetime.utcnow()
+                    if error is not None:
+                        if not running:
+                            raise error[0], error[1], error[2]
+                    elif self._complete() and not running:
+                        break
+                    elif now >= self.timeoutTime:
+                        msg = "Reservation attempt timed out after %d minutes." % self.opts.timeout
+                        if not running:
+                            raise StitchingError(msg)
+                        self.logger.info("%s Waiting for %d reservation(s) in progress to finish.", msg, len(running))
+                        error = (StitchingError, StitchingError(msg), None)
+                    else:
+                        ready_aggs = [agg for agg in self._ready_aggregates() if not running.has_key(agg)]
+                        waiting = [agg for agg in ready_aggs if retryAt.has_key(agg) and retryAt[agg] > now]
+                        ready_aggs = [agg for agg in ready_aggs if agg not in waiting]
+
+                        if self.opts.noTransitAMs and ready_aggs:
+                            allTransit = True
+                            for agg in ready_aggs:
+                                if agg.userRequested:
+                                    allTransit = False
+                                    break
+                            if allTransit:
+                                # Let running reservations finish first: they may make user requested AMs ready
+                                ready_aggs = []
+                                if not running and not waiting:
+                                    self.logger.debug("Only transit AMs are now ready to allocate - will stop")
+                                    incompleteAMs = 0
+                                    for agg in self.aggs:
+                                        if not agg.completed:
+                                            incompleteAMs += 1
+                                        if agg.userRequested and agg.manifestDom is None:
+                                            self.logger.debug("WARN: Some non transit AMs not done, like %s", agg)
+                                    raise StitchingStoppedError("Per commandline option, stopping reservation before doing transit AMs. %d AM(s) not reserved." % incompleteAMs)
+
+                        if not ready_aggs and not running and not waiting:
+                            self.logger.debug("Error! No ready aggregates and not all complete!")
+                            for agg in self.aggs:
+                                if not agg.completed:
+                                    self.logger.debug("%s is not complete but also not ready. inProcess=%s, depsComplete=%s", agg, agg.inProcess, agg.dependencies_complete)
+                            raise StitchingError("Internal stitcher error: No aggregates are ready to allocate but not all are complete?")
+
+                        toStart = ready_aggs[:max(0, self.maxParallel - len(running))]
+                        if toStart:
+                            self.logger.debug("\nThere are %d ready aggregates: %s. Starting %s (%d already in progress)",
+                                              len(ready_aggs), ready_aggs, toStart, len(running))
+                        for agg in toStart:
+                            retryAt.pop(agg, None)
+                            t = threading.Thread(target=self._allocate, args=(agg, rspec, scsCallCount, done),
+                                                 name="stitch-%s" % (agg.nick or agg.urn))
+                            # Do not let a hung AM keep stitcher from exiting
+                            t.daemon = True
+                            running[agg] = t
+                            lastAM = agg
+                            t.start()
+
+                    # Wait for a reservation to finish, or the next aggregate to be due for retry.
+                    # Wake up at least once a second so KeyboardInterrupt is delivered.
+                    wait = 1.0
+                    if not running and error is None:
+                        due = [retryAt[agg] for agg in retryAt if not agg.completed]
+                        if due:
+                            wait = max(0.0, min(wait, _seconds(min(due) - datetime.datetime.utcnow())))
+                try:
+                    agg, exc = done.get(True, wait)
+                except Queue.Empty:
+                    continue
+                running.pop(agg).join()
+                with stateLocked():
+                    lastAM = agg
+
+                    if exc is not None:
+                        se = exc[1]
+                        if error is not None:
+                            self.logger.debug("Reservation at %s also failed: %s", agg, se)
+                        elif isinstance(se, StitchingRetryAggregateNewVlanError):
+                            self.logger.info("Will put %s back in the pool to allocate. Got: %s", agg, se)
+                            secs = self._retry_pause(agg, se)
+                            now = datetime.datetime.utcnow()
+                            if now + datetime.timedelta(seconds=secs) >= self.timeoutTime:
+                                # We'll time out. So quit once the reservations in progress finish.
+                                self.logger.debug("After planned pause for %d seconds we will time out", secs)
+                                msg = "Reservation attempt timing out after %d minutes." % self.opts.timeout
+                                error = (StitchingError, StitchingError(msg), None)
+                            else:
+                                # Handling the failure may have undone reservations at other aggregates.
+                                # Those (and this one) must wait for their AMs to free resources.
+                                undone = [agg2 for agg2 in completed if not agg2.completed]
+                                self.logger.info("Pausing %s for %d seconds for Aggregates to free up resources...\n\n",
+                                                 [agg] + undone, secs)
+                                for agg2 in [agg] + undone:
+                                    retryAt[agg2] = now + datetime.timedelta(seconds=secs)
+                        else:
+                            error = exc
+                            if running:
+                                self.logger.info("Reservation at %s failed. Waiting for %d reservation(s) in progress to finish.", agg, len(running))
+                    completed = set([agg2 for agg2 in self.aggs if agg2.completed])
+        except KeyboardInterrupt:
+            if running:
+                # Let the reservations finish, so the caller can delete them. Another Ctrl-C stops waiting.
+                self.logger.warn("Waiting for %d reservation(s) in progress to finish: %s", len(running), running.keys())
+                for t in running.values():
+                    while t.isAlive():
+                        t.join(1)
+            raise
+
+        self.logger.info("All aggregates are complete.")
+        return lastAM
+
     # ready implies not in process and not completed
     def _ready_aggregates(self):
         return [a for a in self.aggs if a.ready]
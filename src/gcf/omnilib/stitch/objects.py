@@ -27,6 +27,7 @@ functions for doing allocationg and deletions at aggregates.'''
 
 from __future__ import absolute_import
 
+import contextlib
 import copy
 import datetime
 import dateutil
@@ -35,6 +36,7 @@ import logging
 import os
 import random
 import string
+import threading
 import time
 from xml.dom.minidom import parseString, Node as XMLNode
 
@@ -56,6 +58,42 @@ from ...geni.util import rspec_schema, rspec_util, urn_util
 # Seconds to pause between calls to a DCN AM (ie ION)
 DCN_AM_RETRY_INTERVAL_SECS = 10 * 60 # Xi and Chad say ION routers take a long time to reset
 
+# Lock on the stitching state shared by all aggregates (hops, VLAN ranges,
+# completed and inProcess flags), for when the launcher reserves at several
+# aggregates at once. Aggregate.allocate holds it throughout, except while
+# waiting on an AM (see stateUnlocked).
+_stateLock = threading.Lock()
+_stateHolder = threading.local()
+
+@contextlib.contextmanager
+def stateLocked():
+    '''Hold the stitching state lock, unless this thread already does.'''
+    if getattr(_stateHolder, 'held', False):
+        yield
+        return
+    _stateLock.acquire()
+    _stateHolder.held = True
+    try:
+        yield
+    finally:
+        _stateHolder.held = False
+        _stateLock.release()
+
+@contextlib.contextmanager
+def stateUnlocked():
+    '''Let other threads change the stitching state while this one
+    calls or waits on an AM, if this thread holds the lock.'''
+    if not getattr(_stateHolder, 'held', False):
+        yield
+        return
+    _stateHolder.held = False
+    _stateLock.release()
+    try:
+        yield
+    finally:
+        _stateLock.acquire()
+        _stateHolder.held = True
+
 # FIXME: As in defs, check use of getAttribute vs getAttributeNS and localName vs nodeName
 # FIXME: Merge RSpec element/attribute name constants into defs
 
@@ -179,6 +217,10 @@ class Aggregate(object):
     # Hold all instances. One instance per URN.
     aggs = dict()
 
+    # Omni Session used for all AM API calls, created by the first call
+    omniSession = None
+    omniSessionLock = threading.Lock()
+
     # FIXME: Move these constants up higher
     MAX_TRIES = 10 # Max times to try allocating here. Compare with allocateTries
     BUSY_MAX_TRIES = 5 # dossl does 3
@@ -525,8 +567,13 @@ class Aggregate(object):
 
     def allocate(self, opts, slicename, rspecDom, scsCallCount):
         '''Main workhorse function. Build the request rspec for this AM,
-        and make the reservation. On error, delete and signal failure.'''
+        and make the reservation. On error, delete and signal failure.
+        Safe to call from several threads at once: the shared stitching
+        state is only changed while holding the state lock.'''
+        with stateLocked():
+            self._allocate(opts, slicename, rspecDom, scsCallCount)
 
+    def _allocate(self, opts, slicename, rspecDom, scsCallCount):
         self.logger.debug("Starting allocate on %s...", self)
 
         if self.inProcess:
@@ -566,7 +613,8 @@ class Aggregate(object):
                 raise StitchingError(msg)
 
             self.logger.info("Pausing %d seconds to let aggregate free resources...", sleepSecs)
-            time.sleep(sleepSecs)
+            with stateUnlocked():
+                time.sleep(sleepSecs)
         # end of block to delete a previous reservation
 
         if alreadyDone:
@@ -914,7 +962,12 @@ class Aggregate(object):
         # Mark AM not busy
         self.inProcess = False
 
-        if not hadSuggestedNotRequest:
+        if not hadSuggestedNotRequest and not self.dependencies_complete:
+            # A reservation we depend on was redone (by another thread) while this
+            # one was in progress, so our VLANs may be stale. Leave this AM incomplete:
+            # when ready again, copyVLANsAndDetectRedo redoes this reservation if needed.
+            self.logger.info("... Allocation at %s done, but an AM it depends on is being redone. Will check it again.", self)
+        elif not hadSuggestedNotRequest:
             # mark self complete
             self.completed = True
             self.logger.info("... Allocation at %s complete.", self)
@@ -2591,7 +2644,8 @@ class Aggregate(object):
                 raise StitchingError(msg)
 
             self.logger.info("Pausing %d seconds to let circuit become ready...", self.SLIVERSTATUS_POLL_INTERVAL_SEC)
-            time.sleep(self.SLIVERSTATUS_POLL_INTERVAL_SEC)
+            with stateUnlocked():
+                time.sleep(self.SLIVERSTATUS_POLL_INTERVAL_SEC)
 
             # generate args for sliverstatus
             if self.api_version == 2:
@@ -4312,12 +4366,15 @@ class Aggregate(object):
                 if opts.fakeModeDir:
                     (text, result) = self.fakeAMAPICall(args, opts, opName, slicename, ctr)
                 else:
-                    (text, result) = self.doOmniCall(args, opts, suppressLogs)
+                    # Let other reservations proceed while this AM works
+                    with stateUnlocked():
+                        (text, result) = self.doOmniCall(args, opts, suppressLogs)
                 break # Not an error - breakout of loop
             except AMAPIError, ae:
                 if is_busy_reply(ae.returnstruct):
                     self.logger.debug("%s got BUSY doing %s", self, opName)
-                    time.sleep(self.BUSY_POLL_INTERVAL_SEC)
+                    with stateUnlocked():
+                        time.sleep(self.BUSY_POLL_INTERVAL_SEC)
                     busyCtr = busyCtr + 1
                     if busyCtr == self.BUSY_MAX_TRIES:
                         raise ae
@@ -4337,7 +4394,7 @@ class Aggregate(object):
 #            logging.disable(logging.INFO)
         res = None
         try:
-            res = omni.call(args, opts)
+            res = Aggregate.omniCall(args, opts)
         except:
             raise
 #        finally:
@@ -4345,6 +4402,15 @@ class Aggregate(object):
 #                logging.disable(logging.NOTSET)
         return res
 
+    @classmethod
+    def omniCall(cls, args, opts):
+        '''Make an omni call in the shared omni Session, so that omni is set up
+        once per stitcher run instead of once per call.'''
+        with cls.omniSessionLock:
+            if cls.omniSession is None:
+                cls.omniSession = omni.Session(opts)
+        return cls.omniSession.call(args, opts)
+
     # This needs to handle createsliver, allocate, sliverstatus, listresources at least
     # FIXME FIXME: Need more fake result files and to clean this all up! ****
     def fakeAMAPICall(self, args, opts, opName, slicename, ctr):
@@ -4368,7 +4434,8 @@ class Aggregate(object):
         if not resultPath or not os.path.exists(resultPath):
             if opName in ("allocate", "createsliver"):
                 # Fallback fake mode behavior
-                time.sleep(random.randrange(1, 6))
+                with stateUnlocked():
+                    time.sleep(random.randrange(1, 6))
                 for hop in self.hops:
                     hop._hop_link.vlan_suggested_manifest = hop._hop_link.vlan_suggested_request
                     hop._hop_link.vlan_range_manifest = hop._hop_link.vlan_range_request
@@ -148,6 +148,10 @@ class StitchingHandler(object):
         #   pull out summary resource expiration information and a summary of the run,
         #   and return (pretty string, combined manifest rspec)
         # On error, log something appropriate and exit
+
+        # Set up omni afresh for this run on the first AM API call
+        Aggregate.omniSession = None
+
         # Always be sure to clean up temporary files
 
         # Parse the commandline args
@@ -434,6 +438,9 @@ class StitchingHandler(object):
 
             self.dump_objects(self.parsedSCSRSpec, self.ams_to_process)
 
+            if Aggregate.omniSession is not None:
+                self.logger.debug(Aggregate.omniSession.summary())
+
         # Construct return message
         retMsg = self.buildRetMsg()
 
@@ -3152,7 +3159,7 @@ class StitchingHandler(object):
 
             try:
                 self.logger.debug("Getting extra AM info from Omni for AM %s", agg)
-                (text, version) = omni.call(omniargs, options_copy)
+                (text, version) = Aggregate.omniCall(omniargs, options_copy)
                 aggurl = agg.url
                 if isinstance (version, dict) and version.has_key(aggurl) and isinstance(version[aggurl], dict) \
                         and version[aggurl].has_key('value') and isinstance(version[aggurl]['value'], dict):
@@ -0,0 +1,191 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+A cache on disk of the advertisement RSpecs omni gets from ListResources.
+
+Advertisements change slowly but can be many megabytes, and each omni
+listresources (and each time the stitcher checks available VLAN tags)
+would otherwise fetch them from the aggregate again. The cache keeps
+the last advertisement from each aggregate for each AM API version,
+requested RSpec type and version, available only or not, and user,
+so that with
+--use-cached-ad omni can use it instead while it is recent enough.
+
+Each advertisement is a file in the cache directory: one line of JSON
+describing it (including a SHA1 of the RSpec) followed by the zlib
+compressed RSpec. The time it was fetched is the file modification
+time: when a newly fetched advertisement has the same SHA1 as the
+cached one, only that time is updated. New files are written to a
+temporary file and renamed into place, so concurrent omni processes
+never see a partial file; the last one to finish wins.
+'''
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+# Change this when the format of the cache files changes
+CACHE_VERSION = 1
+
+def _toStr(value):
+    # json gives back unicode, where the AM return had str
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, dict):
+        return dict([(_toStr(k), _toStr(v)) for (k, v) in value.items()])
+    if isinstance(value, list):
+        return [_toStr(v) for v in value]
+    return value
+
+class AdCache(object):
+    '''Advertisement RSpecs saved in the given directory.
+
+    hits counts the advertisements used from the cache, and saves
+    those written (or found unchanged) after getting them from an aggregate.'''
+
+    def __init__(self, dirname, logger):
+        self.dirname = os.path.normcase(os.path.expanduser(dirname))
+        self.logger = logger
+        self.hits = 0
+        self.saves = 0
+        self.lock = threading.Lock()
+
+    # A key is a tuple of the aggregate URL, AM API version, requested
+    # rspec version dict, geni_available and user URN
+
+    def _describe(self, key):
+        (url, api_version, rspec_version, available, user_urn) = key
+        return {'version': CACHE_VERSION, 'url': url, 'api_version': api_version,
+                'rspec_version': rspec_version, 'available': bool(available), 'user': user_urn}
+
+    def _path(self, desc):
+        name = json.dumps([desc['url'], desc['api_version'], desc['rspec_version'], desc['available'], desc['user']],
+                          sort_keys=True)
+        return os.path.join(self.dirname, hashlib.sha1(name).hexdigest() + ".ad")
+
+    def _readHeader(self, f, desc):
+        '''Read the JSON line that starts a cache file. Return it if it is for
+        the advertisement with the given description, else None.'''
+        try:
+            header = json.loads(f.readline())
+        except Exception, e:
+            self.logger.debug("Malformed advertisement cache file %s: %s", f.name, e)
+            return None
+        if not isinstance(header, dict):
+            return None
+        for (k, v) in desc.items():
+            if header.get(k) != v:
+                return None
+        return header
+
+    def age(self, key):
+        '''Seconds since the advertisement with the given key was cached, or None if there is none.'''
+        try:
+            return max(0, time.time() - os.path.getmtime(self._path(self._describe(key))))
+        except OSError:
+            return None
+
+    def get(self, key, maxAge):
+        '''Return a (rspec, code, output) triple for the cached advertisement with the
+        given key, if it was fetched within maxAge seconds. Else None.
+        code and output are as the aggregate returned them (None in AM API v1).'''
+        desc = self._describe(key)
+        path = self._path(desc)
+        age = self.age(key)
+        if age is None or age > maxAge:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                header = self._readHeader(f, desc)
+                if header is None:
+                    return None
+                rspec = zlib.decompress(f.read())
+        except Exception, e:
+            self.logger.debug("Failed to read cached advertisement %s: %s", path, e)
+            return None
+        if hashlib.sha1(rspec).hexdigest() != header.get('sha1'):
+            self.logger.debug("Ignoring corrupt cached advertisement %s", path)
+            return None
+        with self.lock:
+            self.hits += 1
+        self.logger.info("Using advertisement from %s cached %d minute(s) ago", desc['url'], age / 60)
+        return (rspec, _toStr(header.get('code')), _toStr(header.get('output')))
+
+    def put(self, key, rspec, code=None, output=None):
+        '''Save the advertisement with the given key just fetched from the aggregate,
+        with the code and output the aggregate returned.'''
+        import tempfile
+        if isinstance(rspec, unicode):
+            rspec = rspec.encode('utf-8')
+        desc = self._describe(key)
+        path = self._path(desc)
+        url = desc['url']
+        digest = hashlib.sha1(rspec).hexdigest()
+        with self.lock:
+            self.saves += 1
+        try:
+            with open(path, 'rb') as f:
+                header = self._readHeader(f, desc)
+            if header is not None and header.get('sha1') == digest:
+                # Just note that it is still current
+                os.utime(path, None)
+                self.logger.debug("Advertisement from %s is unchanged since it was cached", url)
+                return
+            self.logger.debug("Advertisement from %s has changed since it was cached", url)
+        except (IOError, OSError):
+            pass
+
+        tmpname = None
+        try:
+            if not os.path.exists(self.dirname):
+                os.makedirs(self.dirname)
+            desc['sha1'] = digest
+            desc['code'] = code
+            desc['output'] = output
+            handle, tmpname = tempfile.mkstemp(dir=self.dirname)
+            os.write(handle, json.dumps(desc) + "\n")
+            os.write(handle, zlib.compress(rspec))
+            os.close(handle)
+            # On Windows, rename doesn't delete any existing file
+            if os.name == 'nt' and os.path.exists(path):
+                os.unlink(path)
+            os.rename(tmpname, path)
+            tmpname = None
+            self.logger.debug("Cached advertisement from %s in %s", url, path)
+        except Exception, e:
+            self.logger.debug("Failed to cache advertisement from %s in %s: %s", url, path, e)
+        finally:
+            if tmpname:
+                try:
+                    os.unlink(tmpname)
+                except:
+                    pass
+
+    def stats(self):
+        return "%d advertisements from the advertisement cache, %d fetched from aggregates" % \
+            (self.hits, self.saves)
@@ -0,0 +1,205 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+Compiled copies of the agg_nick_cache, and lazily loaded aggregate nicknames.
+
+Parsing the agg_nick_cache with ConfigParser on every omni start is slow,
+and many commands never look at an aggregate nickname. So a compiled copy
+of the parsed cache is kept beside it (as <agg_nick_cache>.compiled):
+a small header, holding the omni_defaults and what the source file looked
+like, followed by the marshalled aggregate nicknames. Reading the header is
+quick; the nicknames are read the first time they are used (see
+LazyAggNicknames).
+
+The compiled copy is only used if the source file has the same size and
+modification time, or else the same SHA1 hash, as when it was compiled,
+and was compiled by this version of the format and of Python.
+'''
+
+from __future__ import absolute_import
+
+import hashlib
+import marshal
+import os
+import struct
+import sys
+import threading
+
+# Change this when the format of the compiled file changes
+COMPILED_VERSION = 1
+COMPILED_MAGIC = "GCFNICK\n"
+COMPILED_SUFFIX = ".compiled"
+
+def compiledName(filename):
+    '''Name of the compiled copy of the given agg_nick_cache file'''
+    return filename + COMPILED_SUFFIX
+
+def _fileHash(filename):
+    f = open(filename, 'rb')
+    try:
+        return hashlib.sha1(f.read()).hexdigest()
+    finally:
+        f.close()
+
+def _sourceInfo(filename):
+    st = os.stat(filename)
+    return (st.st_size, st.st_mtime)
+
+def _formatVersion():
+    # marshal data is only readable by the same Python version
+    return (COMPILED_VERSION, marshal.version, sys.version_info[:2])
+
+def writeCompiled(filename, nicknames, omni_defaults, logger):
+    '''Save a compiled copy of the given agg_nick_cache file, with the given parsed contents.
+    Return True on success. Failures (EG the directory is not writable) are only logged.'''
+    import tempfile
+    target = compiledName(filename)
+    tmpname = None
+    try:
+        (size, mtime) = _sourceInfo(filename)
+        header = marshal.dumps({'format': _formatVersion(),
+                                'size': size,
+                                'mtime': mtime,
+                                'sha1': _fileHash(filename),
+                                'omni_defaults': dict(omni_defaults)})
+        body = marshal.dumps(dict(nicknames))
+        handle, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)))
+        os.write(handle, COMPILED_MAGIC + struct.pack("!I", len(header)) + header + body)
+        os.close(handle)
+        # On Windows, rename doesn't delete any existing file
+        if os.path.exists(target):
+            os.unlink(target)
+        os.rename(tmpname, target)
+        tmpname = None
+        logger.debug("Saved compiled agg_nick_cache '%s'", target)
+        return True
+    except Exception, e:
+        logger.debug("Could not save compiled agg_nick_cache '%s': %s", target, e)
+        return False
+    finally:
+        if tmpname:
+            try:
+                os.unlink(tmpname)
+            except:
+                pass
+
+def readCompiledHeader(filename, logger):
+    '''Return the header of the compiled copy of the given agg_nick_cache file
+    (a dict including the 'omni_defaults'), or None if there is no compiled
+    copy that is good for the current contents of the file.'''
+    target = compiledName(filename)
+    if not os.path.exists(target):
+        return None
+    try:
+        f = open(target, 'rb')
+        try:
+            if f.read(len(COMPILED_MAGIC)) != COMPILED_MAGIC:
+                logger.debug("Ignoring compiled agg_nick_cache '%s': not a compiled file", target)
+                return None
+            (hlen,) = struct.unpack("!I", f.read(4))
+            header = marshal.loads(f.read(hlen))
+        finally:
+            f.close()
+        if header.get('format') != _formatVersion():
+            logger.debug("Ignoring compiled agg_nick_cache '%s': compiled by another version", target)
+            return None
+        if (header['size'], header['mtime']) != _sourceInfo(filename):
+            if header['size'] != _sourceInfo(filename)[0] or header['sha1'] != _fileHash(filename):
+                logger.debug("Ignoring compiled agg_nick_cache '%s': '%s' has changed", target, filename)
+                return None
+        header['offset'] = len(COMPILED_MAGIC) + 4 + hlen
+        return header
+    except Exception, e:
+        logger.debug("Ignoring compiled agg_nick_cache '%s': %s", target, e)
+        return None
+
+def readCompiledNicknames(filename, header):
+    '''Return the aggregate nicknames from the compiled copy of the given agg_nick_cache
+    file, whose header was returned by readCompiledHeader'''
+    f = open(compiledName(filename), 'rb')
+    try:
+        f.seek(header['offset'])
+        return marshal.loads(f.read())
+    finally:
+        f.close()
+
+class LazyAggNicknames(dict):
+    '''A dict of aggregate nicknames that is only filled in (by calling
+    the given loader, which returns a dict) the first time it is used.
+
+    Use whenLoaded to change the nicknames once they are loaded (EG to apply
+    nicknames from the omni_config over those from the agg_nick_cache),
+    without loading them now.'''
+
+    def __init__(self, loader):
+        dict.__init__(self)
+        self.loader = loader
+        self.loaded = False # Set only once loading is complete
+        self.loading = False
+        self.pending = []
+        self.lock = threading.RLock()
+
+    def whenLoaded(self, func):
+        '''Call func (with no arguments) once the nicknames are loaded: now if they
+        are already, or if this thread is loading them (from a pending function).'''
+        with self.lock:
+            # Only the thread holding the lock can see loading set
+            if not self.loaded and not self.loading:
+                self.pending.append(func)
+                return
+        func()
+
+    def load(self):
+        with self.lock:
+            # Pending functions may use this dict, so may get here again
+            if self.loaded or self.loading:
+                return
+            self.loading = True
+            try:
+                if self.loader is not None:
+                    dict.update(self, self.loader())
+                    self.loader = None
+                while self.pending:
+                    func = self.pending.pop(0)
+                    func()
+            finally:
+                self.loading = False
+            # Other threads read this without the lock: set it last
+            self.loaded = True
+
+def _loadFirst(name):
+    method = getattr(dict, name)
+    def wrapper(self, *args, **kwargs):
+        if not self.loaded:
+            self.load()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+for _name in ('__getitem__', '__setitem__', '__delitem__', '__contains__', '__iter__',
+              '__len__', '__repr__', '__eq__', '__ne__', 'clear', 'copy', 'get',
+              'has_key', 'items', 'iteritems', 'iterkeys', 'itervalues', 'keys',
+              'pop', 'popitem', 'setdefault', 'update', 'values'):
+    setattr(LazyAggNicknames, _name, _loadFirst(_name))
+del _name
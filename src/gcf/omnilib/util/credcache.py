@@ -0,0 +1,201 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+A cache on disk of the user and slice credentials omni gets from a clearinghouse.
+
+Each omni invocation (and each call the stitcher makes) would otherwise
+fetch the same user and slice credentials again. The cache keeps each
+credential with its expiration, keyed by clearinghouse, user URN and (for
+slice credentials) slice URN, and hands it back until shortly before it
+expires.
+
+The cache is a JSON file readable only by the user. It is replaced
+atomically on each change, while holding a lock (on <cache file>.lock)
+so that concurrent omni processes do not lose each other's entries.
+Where fcntl is not available (Windows), updates are not locked: the
+worst case is a lost entry, which is fetched again next time.
+'''
+
+from __future__ import absolute_import
+
+import calendar
+import datetime
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .dates import naiveUTC
+
+# Change this when the format of the cache file changes
+CACHE_VERSION = 1
+
+# Do not hand back credentials that expire within this many seconds
+EXPIRY_MARGIN = 10 * 60
+
+def _toStr(value):
+    # json gives back unicode, but callers expect credentials as str
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, dict):
+        return dict([(_toStr(k), _toStr(v)) for (k, v) in value.items()])
+    return value
+
+def _epoch(dt):
+    return calendar.timegm(naiveUTC(dt).utctimetuple())
+
+class CredentialCache(object):
+    '''User and slice credentials saved in the given file.
+
+    hits counts the credentials handed back from the cache, and fetches
+    the credentials saved after getting them from the clearinghouse.'''
+
+    def __init__(self, filename, logger, margin=EXPIRY_MARGIN):
+        self.filename = os.path.normcase(os.path.expanduser(filename))
+        self.logger = logger
+        self.margin = margin
+        self.hits = 0
+        self.fetches = 0
+        # Threads in this process (EG with --parallel) share the file lock
+        self.lock = threading.Lock()
+
+    def _key(self, framework, user_urn, slice_urn):
+        return "%s|%s|%s" % (framework, user_urn, slice_urn or "")
+
+    def _read(self):
+        '''Return the cached entries, or an empty dict if there are none (or the file is unreadable)'''
+        if not os.path.exists(self.filename):
+            return {}
+        try:
+            with open(self.filename, 'r') as f:
+                contents = json.load(f)
+            if not isinstance(contents, dict) or contents.get('version') != CACHE_VERSION:
+                self.logger.debug("Ignoring credential cache %s from another version", self.filename)
+                return {}
+            return contents['credentials']
+        except Exception, e:
+            self.logger.debug("Failed to read credential cache %s: %s", self.filename, e)
+            return {}
+
+    def _write(self, entries):
+        import tempfile
+        fdir = os.path.dirname(self.filename)
+        tmpname = None
+        try:
+            # mkstemp makes the file readable only by this user
+            handle, tmpname = tempfile.mkstemp(dir=fdir or None)
+            os.write(handle, json.dumps({'version': CACHE_VERSION, 'credentials': entries}))
+            os.close(handle)
+            # On Windows, rename doesn't delete any existing file
+            if os.name == 'nt' and os.path.exists(self.filename):
+                os.unlink(self.filename)
+            os.rename(tmpname, self.filename)
+            tmpname = None
+        except Exception, e:
+            self.logger.debug("Failed to write credential cache %s: %s", self.filename, e)
+        finally:
+            if tmpname:
+                try:
+                    os.unlink(tmpname)
+                except:
+                    pass
+
+    def _update(self, func):
+        '''Call func on the cached entries and save them, holding the cache lock'''
+        with self.lock:
+            lockfile = None
+            try:
+                fdir = os.path.dirname(self.filename)
+                if fdir and not os.path.exists(fdir):
+                    try:
+                        os.makedirs(fdir)
+                    except OSError, e:
+                        self.logger.debug("Failed to create directory for credential cache %s: %s", self.filename, e)
+                if fcntl is not None:
+                    try:
+                        lockfile = open(self.filename + ".lock", 'a')
+                        fcntl.lockf(lockfile, fcntl.LOCK_EX)
+                    except Exception, e:
+                        self.logger.debug("Failed to lock credential cache %s: %s", self.filename, e)
+                entries = self._read()
+                # Drop what has expired while here
+                now = _epoch(datetime.datetime.utcnow())
+                for key in entries.keys():
+                    if entries[key].get('expires', 0) <= now:
+                        del entries[key]
+                func(entries)
+                self._write(entries)
+            finally:
+                if lockfile is not None:
+                    # Closing the file releases the lock
+                    lockfile.close()
+
+    def get(self, framework, user_urn, slice_urn=None):
+        '''Return the cached user credential (or slice credential if slice_urn is given)
+        for the given framework and user, if it is good for a while yet. Else None.'''
+        entry = self._read().get(self._key(framework, user_urn, slice_urn))
+        if entry is None:
+            return None
+        if entry.get('expires', 0) - self.margin <= _epoch(datetime.datetime.utcnow()):
+            return None
+        with self.lock:
+            self.hits += 1
+        if slice_urn:
+            self.logger.debug("Using cached credential for slice %s from %s", slice_urn, self.filename)
+        else:
+            self.logger.debug("Using cached user credential for %s from %s", user_urn, self.filename)
+        return _toStr(entry['cred'])
+
+    def put(self, framework, user_urn, slice_urn, cred, expires):
+        '''Save the given credential (that expires at the given datetime) just fetched
+        from the clearinghouse for the given framework and user (and slice, if not None)'''
+        with self.lock:
+            self.fetches += 1
+        try:
+            expires = _epoch(expires)
+        except Exception, e:
+            self.logger.debug("Not caching credential with unusable expiration %s: %s", expires, e)
+            return
+        if expires - self.margin <= _epoch(datetime.datetime.utcnow()):
+            return
+        def add(entries):
+            entries[self._key(framework, user_urn, slice_urn)] = {'cred': cred, 'expires': expires}
+        self._update(add)
+
+    def forget(self, framework, user_urn, slice_urn=None):
+        '''Remove any cached credential for the given framework, user and slice
+        (EG because the slice expiration changed)'''
+        key = self._key(framework, user_urn, slice_urn)
+        if not self._read().has_key(key):
+            return
+        def remove(entries):
+            entries.pop(key, None)
+        self._update(remove)
+
+    def stats(self):
+        return "%d credentials from the credential cache, %d fetched from the clearinghouse" % \
+            (self.hits, self.fetches)
@@ -31,14 +31,146 @@ from __future__ import absolute_import
 import datetime
 import dateutil.parser
 import logging
+import threading
 import traceback
-import xml.dom.minidom as md
+import xml.parsers.expat
 
 from ...sfa.trust.credential import Credential
 from ...sfa.trust.abac_credential import ABACCredential
 from ...sfa.trust.credential_factory import CredentialFactory
 from ...geni.util.tz_util import tzd
 
+# Elements of the credential whose text a CredentialSummary keeps
+SUMMARY_FIELDS = ('owner_urn', 'target_gid', 'target_urn', 'expires')
+
+# Number of CredentialSummaries to remember
+MAX_SUMMARIES = 100
+
+class _CredFields(object):
+    '''The SUMMARY_FIELDS of one credential element, filled in as the parser goes'''
+    def __init__(self, depth):
+        self.depth = depth # of the credential element
+        self.open = True
+        self.values = dict()
+        self.capturing = None # field whose text is being collected
+
+class CredentialSummary(object):
+    '''What omni needs to know about a credential XML string, from one pass of
+    an incremental parser: whether it is well formed (else error is the
+    parse exception), whether it has a signed-credential element, the
+    type elements, and the text of the first owner_urn, target_gid,
+    target_urn and expires elements of the credential.
+    That is the first credential element in a signed-credential, or if
+    there is no signed-credential, the first credential element.
+    Get these with summarize_cred, which remembers them by credential.'''
+
+    def __init__(self, credString):
+        self.error = None
+        self.signed = False
+        self.typeCount = 0
+        self.typeText = None # Of the first type element
+        self.credential = None # Field name -> text ('' if none) of the credential, if any
+        self._depth = 0
+        self._inSigned = 0
+        self._signedCred = None
+        self._firstCred = None
+        self._inType = False
+        parser = xml.parsers.expat.ParserCreate()
+        parser.returns_unicode = False
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._text
+        try:
+            parser.Parse(credString, 1)
+        except Exception, exc:
+            self.error = exc
+            return
+        if self.signed:
+            cred = self._signedCred
+        else:
+            cred = self._firstCred
+        if cred is not None:
+            self.credential = cred.values
+
+    def _creds(self):
+        return [c for c in (self._signedCred, self._firstCred) if c is not None and c.open]
+
+    def _start(self, name, attrs):
+        self._depth += 1
+        self._inType = False
+        for cred in self._creds():
+            # Like minidom childNodes[0]: only text before any child element
+            cred.capturing = None
+            if name in SUMMARY_FIELDS and not cred.values.has_key(name):
+                cred.values[name] = ''
+                cred.capturing = name
+        if name == 'signed-credential':
+            self.signed = True
+            self._inSigned += 1
+        elif name == 'credential':
+            if self._firstCred is None:
+                self._firstCred = _CredFields(self._depth)
+            if self._inSigned and self._signedCred is None:
+                self._signedCred = _CredFields(self._depth)
+        elif name == 'type':
+            self.typeCount += 1
+            if self.typeCount == 1:
+                self.typeText = ''
+                self._inType = True
+
+    def _end(self, name):
+        self._inType = False
+        for cred in self._creds():
+            cred.capturing = None
+            if cred.depth == self._depth:
+                cred.open = False
+        if name == 'signed-credential':
+            self._inSigned -= 1
+        self._depth -= 1
+
+    def _text(self, data):
+        if self._inType:
+            self.typeText += data
+        for cred in self._creds():
+            if cred.capturing is not None:
+                cred.values[cred.capturing] += data
+
+    def field(self, name):
+        '''Return the text of the given SUMMARY_FIELDS element of the credential ('' if it is empty).
+        Raise an Exception if the credential was not parsable or has no such element.'''
+        if self.error is not None:
+            raise self.error
+        if self.credential is None:
+            raise Exception("No credential element")
+        if not self.credential.has_key(name):
+            raise Exception("No %s element in credential" % name)
+        return self.credential[name]
+
+_summaries = dict()
+_summaries_lock = threading.Lock()
+
+def summarize_cred(credString):
+    '''Return the CredentialSummary of the given credential XML string,
+    parsing it only if it has not been summarized recently.
+    Summaries are keyed by the credential string itself: Python keeps the
+    hash of a string, so looking up the same credential again is cheaper
+    than computing a digest of it.'''
+    if isinstance(credString, unicode):
+        credString = credString.encode('utf-8')
+    if not isinstance(credString, str):
+        summary = CredentialSummary('')
+        summary.error = Exception("Credential is not a string: %s" % str(credString))
+        return summary
+    with _summaries_lock:
+        summary = _summaries.get(credString)
+    if summary is None:
+        summary = CredentialSummary(credString)
+        with _summaries_lock:
+            if len(_summaries) >= MAX_SUMMARIES:
+                _summaries.clear()
+            _summaries[credString] = summary
+    return summary
+
 # FIXME: Doesn't distinguish v2 vs v3 yet
 def is_valid_v3(logger, credString):
     '''Is the given credential a valid geni_sfa style v3 credential?'''
@@ -80,21 +212,14 @@ def is_valid_v3(logger, credString):
         return False
 
     try:
-        # Note this is relatively memory intensive
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
+        summary = summarize_cred(credString)
         # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
+        if summary.error is None and not summary.signed:
             logger.warn("No signed-credential element found")
             return False
 
-        targetnode = cred.getElementsByTagName("target_urn")[0]
-        if len(targetnode.childNodes) > 0:
-            urn = str(targetnode.childNodes[0].nodeValue)
-        else:
+        urn = summary.field("target_urn")
+        if urn == "":
             logger.warn("No target_urn found")
             return False
     except Exception, exc:
@@ -110,11 +235,12 @@ def get_cred_type(cred):
     is_abac = False
     is_sfa = False
     try:
-        doc = md.parseString(cred)
-        type_elts = doc.getElementsByTagName('type')
-        if len(type_elts) == 1 and type_elts[0].childNodes[0].nodeValue.strip() == 'abac':
+        summary = summarize_cred(cred)
+        if summary.error is not None:
+            raise summary.error
+        if summary.typeCount == 1 and summary.typeText.strip() == 'abac':
             is_abac = True
-        elif len(type_elts) == 1 and type_elts[0].childNodes[0].nodeValue.strip() == 'privilege':
+        elif summary.typeCount == 1 and summary.typeText.strip() == 'privilege':
             is_sfa = True
     except Exception, e:
         level = logging.INFO
@@ -174,19 +300,8 @@ def get_cred_target_urn(logger, cred):
         return urn
 
     try:
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            cred = doc.getElementsByTagName("credential")[0]
-
-        targetnode = cred.getElementsByTagName("target_urn")[0]
-        if len(targetnode.childNodes) > 0:
-            urn = str(targetnode.childNodes[0].nodeValue)
-        else:
+        urn = summarize_cred(credString).field("target_urn")
+        if urn == "":
             if logger is None:
                 level = logging.INFO
                 logging.basicConfig(level=level)
@@ -227,19 +342,8 @@ def get_cred_owner_urn(logger, cred):
         return urn
 
     try:
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            cred = doc.getElementsByTagName("credential")[0]
-
-        ownernode = cred.getElementsByTagName("owner_urn")[0]
-        if len(ownernode.childNodes) > 0:
-            urn = str(ownernode.childNodes[0].nodeValue)
-        else:
+        urn = summarize_cred(credString).field("owner_urn")
+        if urn == "":
             if logger is None:
                 level = logging.INFO
                 logging.basicConfig(level=level)
@@ -284,17 +388,9 @@ def get_cred_exp(logger, cred):
         return credexp
 
     try:
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            cred = doc.getElementsByTagName("credential")[0]
-        expirnode = cred.getElementsByTagName("expires")[0]
-        if len(expirnode.childNodes) > 0:
-            credexp = dateutil.parser.parse(expirnode.childNodes[0].nodeValue, tzinfos=tzd)
+        expires = summarize_cred(credString).field("expires")
+        if expires != "":
+            credexp = dateutil.parser.parse(expires, tzinfos=tzd)
     except Exception, exc:
         if logger is None:
             level = logging.INFO
@@ -316,25 +412,19 @@ def is_cred_xml(cred):
     cred = str(cred)
     if cred.strip() == "":
         return False
-    cred = cred.strip()
-    if not cred.startswith("<?xml"):
+    if not cred.strip().startswith("<?xml"):
         return False
     if not "signed-credential" in cred:
         return False
 
     try:
-        doc = md.parseString(cred)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
+        # Trailing whitespace does not matter to the parser, and keeping it
+        # lets the other functions here use the same CredentialSummary
+        summary = summarize_cred(cred.lstrip())
         # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            credEle = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            return False
-
-        targetnode = credEle.getElementsByTagName("target_gid")[0]
-        if not targetnode:
+        if summary.error is None and not summary.signed:
             return False
+        summary.field("target_gid")
     except Exception, exc:
         return False
 
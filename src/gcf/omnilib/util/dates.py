@@ -22,7 +22,6 @@
 # OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
 # IN THE WORK.
 #----------------------------------------------------------------------
-import dateutil
 
 def naiveUTC(dt):
     """Converts dt to a naive datetime in UTC.
@@ -32,6 +31,7 @@ def naiveUTC(dt):
         strip off timezone (make it "naive" in Python parlance)
     """
     if dt.tzinfo:
+        import dateutil.tz
         tz_utc = dateutil.tz.tzutc()
         dt = dt.astimezone(tz_utc)
         dt = dt.replace(tzinfo=None)
@@ -0,0 +1,106 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+Bounded concurrency for doing the same operation at many aggregates.
+
+A FanOut runs a function over a list of items using a fixed number of
+worker threads, and hands back the results in the order of the items,
+no matter what order the calls finished in.
+'''
+
+from __future__ import absolute_import
+
+import logging
+import Queue
+import sys
+import threading
+import time
+
+class FanOut(object):
+    '''Run a function over a list of items, at most maxWorkers at a time.
+
+    run() returns a list with one (result, exc_info) pair per item, in item order.
+    exc_info is None on success, else the sys.exc_info() triple of the exception
+    raised by the function for that item, so the caller can re-raise it
+    at the point where it would have been raised in a serial loop.
+
+    After run(), elapsed holds the wall clock seconds for the whole run,
+    and durations the seconds spent on each item.'''
+
+    def __init__(self, maxWorkers, logger=None):
+        if maxWorkers < 1:
+            maxWorkers = 1
+        self.maxWorkers = maxWorkers
+        self.logger = logger or logging.getLogger("omni.fanout")
+        self.elapsed = 0.0
+        self.durations = []
+
+    def _work(self, func, items, tasks, results):
+        while True:
+            try:
+                i = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            start = time.time()
+            try:
+                results[i] = (func(items[i]), None)
+            except:
+                results[i] = (None, sys.exc_info())
+            self.durations[i] = time.time() - start
+
+    def run(self, func, items):
+        '''Call func on each item, returning the list of (result, exc_info) pairs in item order.'''
+        items = list(items)
+        results = [(None, None)] * len(items)
+        self.durations = [0.0] * len(items)
+        tasks = Queue.Queue()
+        for i in range(len(items)):
+            tasks.put(i)
+        start = time.time()
+        numWorkers = min(self.maxWorkers, len(items))
+        if numWorkers <= 1:
+            self._work(func, items, tasks, results)
+        else:
+            workers = []
+            for n in range(numWorkers):
+                t = threading.Thread(target=self._work, args=(func, items, tasks, results),
+                                     name="fanout-%d" % n)
+                # Do not let a hung AM keep omni from exiting on Ctrl-C
+                t.daemon = True
+                t.start()
+                workers.append(t)
+            for t in workers:
+                # Join with a timeout so KeyboardInterrupt is still delivered
+                while t.isAlive():
+                    t.join(1)
+        self.elapsed = time.time() - start
+        return results
+
+    def summary(self, what):
+        '''Return a string comparing wall clock time with the summed per item time'''
+        summed = sum(self.durations)
+        speedup = 1.0
+        if self.elapsed > 0:
+            speedup = summed / self.elapsed
+        return "%s took %.1f seconds with up to %d at a time (%.1f seconds summed over %d calls: %.1fx speedup)" % \
+            (what, self.elapsed, self.maxWorkers, summed, len(self.durations), speedup)
@@ -21,7 +21,6 @@
 # IN THE WORK.
 #----------------------------------------------------------------------
 
-import urllib2
 import os
 
 URL_PREFIXES = ("http://", "https://", "ftp://")
@@ -42,6 +41,8 @@ def readFromLocalFile( filename ):
     return readstr
 
 def readFromURL( url ):
+    # urllib2 is slow to import, and rarely needed
+    import urllib2
     readstr = None
     u = urllib2.urlopen(url) 
     readstr = u.read()
@@ -24,8 +24,8 @@
 
 from __future__ import absolute_import
 
+import bisect
 import datetime
-import dateutil
 import json
 import logging
 import os
@@ -33,14 +33,12 @@ import re
 import string
 
 from . import json_encoding
-from . import credparsing as credutils
-from .dossl import _do_ssl
 from .dates import naiveUTC
 from .files import *
-from ...geni.util import rspec_util
-from ...geni.util.tz_util import tzd
-from ...sfa.trust.gid import GID
-from ...sfa.trust.credential import Credential
+
+# The credential, SSL and RSpec modules (and the crypto and XML libraries
+# they use) are imported by the functions that use them, so that
+# importing this module (as omni does at startup) stays quick.
 
 def _derefAggNick(handler, aggregateNickname):
     """Check if the given aggregate string is a nickname defined
@@ -119,45 +117,149 @@ def _isBetterNick(retNick, nick, logger=None):
         return True
     return False
 
+class AggNickIndex(object):
+    '''Index of the aggregate nicknames (a dict of nickname: (URN, URL)) by
+    exact, stripped and extracted (see _extractURL) URN and URL, so that
+    finding the nicknames for an AM does not scan every nickname.
+    Lookups return the matching nicknames in the order the nicknames dict
+    iterates, so that picking the best nickname (see _isBetterNick)
+    gives the same answer as a scan of the dict would.
+    Get the index for a config with getAggNickIndex.'''
+
+    def __init__(self, nicknames):
+        self.nicknames = nicknames
+        self.size = len(nicknames)
+        self.nicks = [] # In dict order
+        self.urns = [] # By position in self.nicks
+        self.urls = []
+        self.byURN = {}
+        self.byURL = {}
+        self.byStrippedURL = {}
+        self.byExtractedURL = {}
+        for (pos, (nick, val)) in enumerate(nicknames.items()):
+            (urn, url) = val[0], val[1]
+            self.nicks.append(nick)
+            self.urns.append(urn)
+            self.urls.append(url)
+            self.byURN.setdefault(urn, []).append(pos)
+            self.byURL.setdefault(url, []).append(pos)
+            self.byStrippedURL.setdefault(url.strip(), []).append(pos)
+            self.byExtractedURL.setdefault(_extractURL(None, url), []).append(pos)
+        # Sorted extracted URLs, to find those starting with a given string
+        self.sortedExtractedURLs = sorted(self.byExtractedURL.keys())
+        # All URNs (and URLs) joined in one string, to find those containing a given string
+        self.urnText, self.urnStarts = self._join(self.urns)
+        self.urlText, self.urlStarts = self._join(self.urls)
+
+    def _join(self, strings):
+        starts = []
+        offset = 0
+        for string in strings:
+            starts.append(offset)
+            offset += len(string) + 1
+        return "\n".join(strings), starts
+
+    def _containing(self, text, starts, strings, value):
+        '''Positions of the strings that contain value'''
+        if value == "" or "\n" in value:
+            return [pos for pos in range(len(strings)) if value in strings[pos]]
+        found = []
+        i = text.find(value)
+        while i != -1:
+            pos = bisect.bisect_right(starts, i) - 1
+            found.append(pos)
+            # Skip the rest of this string
+            if pos + 1 < len(starts):
+                i = text.find(value, starts[pos + 1])
+            else:
+                i = -1
+        return found
+
+    def _prefixesOf(self, table, value):
+        '''Positions of the keys of table that value starts with'''
+        found = []
+        for i in range(len(value) + 1):
+            found.extend(table.get(value[:i], []))
+        return found
+
+    def _extractedStartingWith(self, value):
+        '''Positions of the entries whose extracted URL starts with value'''
+        found = []
+        i = bisect.bisect_left(self.sortedExtractedURLs, value)
+        while i < len(self.sortedExtractedURLs) and self.sortedExtractedURLs[i].startswith(value):
+            found.extend(self.byExtractedURL[self.sortedExtractedURLs[i]])
+            i += 1
+        return found
+
+    def _nicks(self, positions):
+        '''The nicknames at the given positions, in dict order'''
+        return [self.nicks[pos] for pos in sorted(set(positions))]
+
+    def withURNOrURL(self, value):
+        return self._nicks(self.byURN.get(value, []) + self.byURL.get(value, []))
+
+    def withURLPrefixOf(self, value):
+        return self._nicks(self._prefixesOf(self.byURL, value))
+
+    def withStrippedURL(self, value):
+        return self._nicks(self.byStrippedURL.get(value, []))
+
+    def withStrippedURLPrefixOf(self, value):
+        return self._nicks(self._prefixesOf(self.byStrippedURL, value))
+
+    def withExtractedURL(self, value):
+        return self._nicks(self.byExtractedURL.get(value, []))
+
+    def withExtractedURLStartingWith(self, value):
+        return self._nicks(self._extractedStartingWith(value))
+
+    def withURNContaining(self, value):
+        return self._nicks(self._containing(self.urnText, self.urnStarts, self.urns, value))
+
+    def withURLContaining(self, value):
+        return self._nicks(self._containing(self.urlText, self.urlStarts, self.urls, value))
+
+    def withURNContainingOrExtractedURLStartingWith(self, value):
+        return self._nicks(self._containing(self.urnText, self.urnStarts, self.urns, value) +
+                           self._extractedStartingWith(value))
+
+def getAggNickIndex(config):
+    '''Return the AggNickIndex of config['aggregate_nicknames'], building it
+    if needed (on the first lookup, or if the nicknames were replaced).'''
+    nicknames = config.get('aggregate_nicknames', {})
+    index = config.get('aggregate_nickname_index')
+    if index is None or index.nicknames is not nicknames or index.size != len(nicknames):
+        index = AggNickIndex(nicknames)
+        config['aggregate_nickname_index'] = index
+    return index
+
+def _bestNick(nicks, logger=None):
+    '''Return the best of the given nicknames (see _isBetterNick), or None'''
+    retNick = None
+    for nick in nicks:
+        if _isBetterNick(retNick, nick, logger):
+            retNick = nick
+    return retNick
+
 # Lookup aggregate nickname by aggregate_urn or aggregate_url
 def _lookupAggNick(handler, aggregate_urn_or_url):
-    retNick = None
-    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
-        # Case 1
-        if aggregate_urn_or_url == urn or aggregate_urn_or_url == url:
-#            handler.logger.debug("For urn/url %s found match: %s=%s,%s", aggregate_urn_or_url, nick, urn, url)
-            if _isBetterNick(retNick, nick, handler.logger):
-                retNick = nick
+    index = getAggNickIndex(handler.config)
+    # Case 1: exact URN or URL
+    retNick = _bestNick(index.withURNOrURL(aggregate_urn_or_url), handler.logger)
     if retNick is not None:
         return retNick
-    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
-        # Case 2
-        if aggregate_urn_or_url.startswith(url):
-#            handler.logger.debug("Queried %s startswith url for nick %s", aggregate_urn_or_url, nick)
-            if _isBetterNick(retNick, nick, handler.logger):
-                retNick = nick
+    # Case 2: queried value starts with the URL
+    retNick = _bestNick(index.withURLPrefixOf(aggregate_urn_or_url), handler.logger)
     if retNick is not None:
         return retNick
     aggregate_urn_or_url = _extractURL(handler.logger, aggregate_urn_or_url)
-    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
-        # Case 3
-        if _extractURL(handler.logger,url) == aggregate_urn_or_url:
-#            handler.logger.debug("Queried & trimmed %s is end of url %s for nick %s", aggregate_urn_or_url, url, nick)
-            if _isBetterNick(retNick, nick, handler.logger):
-                retNick = nick
+    # Case 3: trimmed value is the trimmed URL
+    retNick = _bestNick(index.withExtractedURL(aggregate_urn_or_url), handler.logger)
     if retNick is not None:
         return retNick
-    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
-        # Case 4
-        if aggregate_urn_or_url in urn:
-#            handler.logger.debug("Trimmed %s is in urn for %s=%s,%s", aggregate_urn_or_url, nick, urn, url)
-            if _isBetterNick(retNick, nick, handler.logger):
-                retNick = nick
-        elif _extractURL(handler.logger, url).startswith(aggregate_urn_or_url):
-            # Case 5
-#            handler.logger.debug("Trimmed %s is in url for %s=%s,%s", aggregate_urn_or_url, nick, urn, url)
-            if _isBetterNick(retNick, nick, handler.logger):
-                retNick = nick
+    # Case 4: trimmed value is in the URN, or
+    # Case 5: trimmed URL starts with the trimmed value
+    retNick = _bestNick(index.withURNContainingOrExtractedURLStartingWith(aggregate_urn_or_url), handler.logger)
 #    if retNick is None:
 #        handler.logger.debug("Found no match for %s", aggregate_urn_or_url)
 #    else:
@@ -166,72 +268,23 @@ def _lookupAggNick(handler, aggregate_urn_or_url):
 
 def _lookupAggURNFromURLInNicknames(logger, config, agg_url):
     urn = ""
-    retNick = None
     # Take exact match else take row where agg_url startswith url in cache else
     # take row where extractURL exact match extractURL in cache
     nagg_url = _extractURL(logger, agg_url)
     if agg_url:
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            if agg_url.strip() == amURL.strip() and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches URL %s, nick %s T1)", agg_url, urn, amURL, nick)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T1)", agg_url, urn, retNick)
-            return urn
-
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            if agg_url.strip().startswith(amURL.strip()) and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T2)", agg_url, urn, amURL)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T2)", agg_url, urn, retNick)
-            return urn
-
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            if nagg_url == amURL.strip() and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T3)", agg_url, urn, amURL)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T3)", agg_url, urn, retNick)
-            return urn
-
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            extr_nick_url = _extractURL(logger, amURL)
-            if nagg_url == extr_nick_url and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T4)", agg_url, urn, amURL)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T4)", agg_url, urn, retNick)
-            return urn
-
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            extr_nick_url = _extractURL(logger, amURL)
-            if extr_nick_url.startswith(nagg_url) and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T5)", agg_url, urn, amURL)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T5)", agg_url, urn, retNick)
-            return urn
-
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            if nagg_url in amURL and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T6)", agg_url, urn, amURL)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T6)", agg_url, urn, retNick)
-            return urn
+        index = getAggNickIndex(config)
+        for (tier, lookup, value) in (("T1", index.withStrippedURL, agg_url.strip()),
+                                      ("T2", index.withStrippedURLPrefixOf, agg_url.strip()),
+                                      ("T3", index.withStrippedURL, nagg_url),
+                                      ("T4", index.withExtractedURL, nagg_url),
+                                      ("T5", index.withExtractedURLStartingWith, nagg_url),
+                                      ("T6", index.withURLContaining, nagg_url)):
+            # Only nicknames with a URN count
+            retNick = _bestNick([nick for nick in lookup(value) if config['aggregate_nicknames'][nick][0].strip() != ''], logger)
+            if retNick is not None:
+                urn = config['aggregate_nicknames'][retNick][0].strip()
+                logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s %s)", agg_url, urn, retNick, tier)
+                return urn
     return urn
 
 def _lookupAggNickURLFromURNInNicknames(logger, config, agg_urn):
@@ -242,10 +295,10 @@ def _lookupAggNickURLFromURNInNicknames(logger, config, agg_urn):
         if agg_urn.endswith('+cm') or agg_urn.endswith('+am'):
             agg_urn = agg_urn[:-3]
             logger.debug("Trimmed URN for lookup to %s", agg_urn)
-        for amNick in config['aggregate_nicknames'].keys():
-            (amURN, amURL) = config['aggregate_nicknames'][amNick]
+        for amNick in getAggNickIndex(config).withURNContaining(agg_urn):
+            (amURN, amURL) = config['aggregate_nicknames'][amNick][:2]
             # Pick the shortest URL / nickname for this URN - stripping of any version diff for the URL
-            if agg_urn in amURN and amURL.strip() != '':
+            if amURL.strip() != '':
                 if (url == "" or nick == "") or \
                         (len(amURL) < len(url)) or \
                         (len(amNick) < len(nick)) or \
@@ -302,6 +355,7 @@ def _listaggregates(handler):
     If URLs were given on the commandline, AM URN is 'unspecified_AM_URN', with '+'s tacked on for 2nd+ such.
     If multiple URLs were given in the omni config, URN is really the URL
     """
+    from .dossl import _do_ssl
     # used by _getclients (above), createsliver, listaggregates
     ret = {}
     if handler.opts.useSliceAggregates and not handler.opts.noExtraCHCalls and hasattr(handler.opts,'sliceName') and handler.opts.sliceName is not None:
@@ -411,6 +465,7 @@ def _load_cred(handler, filename):
     Based on AM API version, returned cred will be a struct or raw XML.
     In dev mode, file contents are returned as is.
     '''
+    from . import credparsing as credutils
     if not filename:
         handler.logger.debug("No filename provided for credential")
         return None
@@ -449,6 +504,9 @@ def _get_slice_cred(handler, urn):
     Return the slice credential, and a string message of any error.
     Returned credential will be a struct in AM API v3+.
     """
+    from . import credparsing as credutils
+    from .dossl import _do_ssl
+    from ...sfa.trust.credential import Credential
 
     cred = _load_cred(handler, handler.opts.slicecredfile)
     if cred is not None:
@@ -515,6 +573,7 @@ def _get_slice_cred(handler, urn):
 def _print_slice_expiration(handler, urn, sliceCred=None):
     """Check when the slice expires. Print varying warning notices
     and the expiration date"""
+    from . import credparsing as credutils
     # FIXME: push this to config?
     shorthours = 3
     middays = 1
@@ -707,6 +766,7 @@ def _construct_output_filename(opts, slicename, clienturl, clienturn, methodname
 
 def _getRSpecOutput(logger, rspec, slicename, urn, url, message, slivers=None):
     '''Get the header, rspec content, and retVal for writing the given RSpec to a file'''
+    from ...geni.util import rspec_util
     # Create HEADER
     if slicename:
         if slivers and len(slivers) > 0:
@@ -878,6 +938,7 @@ def _maybe_save_slicecred(handler, name, slicecred):
     --slicecredfile if supplied
     else [<--p value>-]-<slicename>-cred.[xml or json, depending on credential format]
     """
+    from . import credparsing as credutils
     if name is None or name.strip() == "" or slicecred is None or (credutils.is_cred_xml(slicecred) and slicecred.strip() is None):
         return None
 
@@ -902,6 +963,7 @@ def _save_cred(handler, name, cred):
     Infer an appropriate file extension from the file type.
     If we are using APIv3+ and the credential is not a struct, wrap it before saving.
     '''
+    from . import credparsing as credutils
     ftype = ".xml"
     # FIXME: Do this?
     if credutils.is_cred_xml(cred) and handler.opts.api_version >= 3:
@@ -933,6 +995,7 @@ def _save_cred(handler, name, cred):
     return filename
 
 def _is_user_cert_expired(handler):
+    from ...sfa.trust.gid import GID
     # create a gid
     usergid = None
     try:
@@ -945,6 +1008,7 @@ def _is_user_cert_expired(handler):
     return False
 
 def _get_user_urn(logger, config):
+    from ...sfa.trust.gid import GID
     # create a gid
     usergid = None
     try:
@@ -1091,6 +1155,8 @@ def expires_from_rspec(result, logger=None):
     return None
 
 def _naiveUTCFromString(timeStr):
+    import dateutil.parser
+    from ...geni.util.tz_util import tzd
     if not timeStr:
         return None
     try:
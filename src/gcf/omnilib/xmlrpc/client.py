@@ -25,15 +25,158 @@ import httplib
 import os
 import socket
 import ssl
+import threading
+import time
 import urllib
+import weakref
 import xmlrpclib
 
-class SafeTransportWithCert(xmlrpclib.SafeTransport):
+class ConnectionPool(object):
+    '''Process-wide pool of open HTTP(S) connections, so that repeated XML-RPC calls
+    to the same server reuse a connection (and its TLS session) instead of
+    paying for a new TCP connection and TLS handshake on every call, even when
+    the calls are made through different ServerProxy objects.
+
+    Connections are keyed by everything that makes a connection usable for a
+    given client: host and port, client key and cert, SSL version, ciphers and timeout.
+    At most maxPerHost connections per key are checked out at once (callers wait
+    for one to be returned); connections idle more than idleTimeout seconds are closed.'''
+
+    def __init__(self, maxPerHost=8, idleTimeout=60):
+        self.maxPerHost = maxPerHost
+        self.idleTimeout = idleTimeout
+        self._idle = dict() # key -> list of (connection, time returned to the pool)
+        self._inUse = dict() # key -> number of connections checked out
+        self._cond = threading.Condition()
+        self.hits = 0 # acquires satisfied by an idle connection
+        self.misses = 0 # acquires where the caller had to make a new connection
+
+    def _evict_idle(self, now):
+        # Caller must hold the lock
+        for key in self._idle.keys():
+            keep = []
+            for (conn, released) in self._idle[key]:
+                if now - released > self.idleTimeout:
+                    _close_quietly(conn)
+                else:
+                    keep.append((conn, released))
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+
+    def acquire(self, key):
+        '''Check out a connection for the given key, waiting while maxPerHost are in use.
+        Return an idle open connection, or None if the caller must make a new one.
+        Either way, the caller must later call release() with the same key.'''
+        with self._cond:
+            while self.maxPerHost and self._inUse.get(key, 0) >= self.maxPerHost:
+                # Wait with a timeout so that Ctrl-C still works
+                self._cond.wait(1)
+            self._inUse[key] = self._inUse.get(key, 0) + 1
+            self._evict_idle(time.time())
+            idle = self._idle.get(key)
+            if idle:
+                (conn, released) = idle.pop()
+                self.hits += 1
+                return conn
+            self.misses += 1
+            return None
+
+    def release(self, key, conn):
+        '''Return a checked out connection. Keep it for reuse if it is still open.'''
+        with self._cond:
+            if self._inUse.get(key, 0) > 1:
+                self._inUse[key] -= 1
+            else:
+                self._inUse.pop(key, None)
+            if conn is not None and getattr(conn, 'sock', None) is not None and \
+                    len(self._idle.get(key, [])) < max(self.maxPerHost, 1):
+                self._idle.setdefault(key, []).append((conn, time.time()))
+            elif conn is not None:
+                _close_quietly(conn)
+            self._cond.notify_all()
+
+    def clear(self):
+        '''Close all idle connections.'''
+        with self._cond:
+            for key in self._idle.keys():
+                for (conn, released) in self._idle[key]:
+                    _close_quietly(conn)
+            self._idle = dict()
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+# The pool shared by all transports made by make_client and make_client_m2crypto
+connection_pool = ConnectionPool()
+
+class PooledTransportMixin:
+    '''Mixin for our xmlrpclib SafeTransports: borrow a connection from the pool
+    for each request, and return it to the pool when the request is done.
+    Python 2.6 xmlrpclib does not reuse connections, so there we do not pool.
+    Each thread makes its requests through its own copy of the transport,
+    so threads can share one ServerProxy without sharing a connection.'''
+
+    def _init_pool(self, pool):
+        import sys
+        if sys.version_info < (2,7,0):
+            pool = None
+        self._pool = pool
+        self._pooled = None # (key, connection) currently checked out
+        self._local = threading.local()
+
+    def _thread_transport(self):
+        '''Return the copy of this transport for the current thread.
+        The copy holds the thread's connection (_connection and _pooled).'''
+        transport = getattr(self._local, 'transport', None)
+        if transport is None:
+            import copy
+            transport = copy.copy(self)
+            transport._connection = (None, None)
+            transport._pooled = None
+            self._local.transport = transport
+        return transport
+
+    def _pooled_connection(self, key, makeConnection):
+        '''Return a connection for key from the pool, else from makeConnection()'''
+        # Any previous connection (say one closed on error before a retry) goes back first
+        self._release_connection()
+        conn = None
+        if self._pool is not None:
+            conn = self._pool.acquire(key)
+            self._pooled = (key, conn)
+        if conn is None:
+            conn = makeConnection()
+            if self._pool is not None:
+                self._pooled = (key, conn)
+        return conn
+
+    def _release_connection(self):
+        if self._pooled is None:
+            return
+        (key, conn) = self._pooled
+        self._pooled = None
+        if self._connection[1] is conn:
+            self._connection = (None, None)
+        self._pool.release(key, conn)
+
+    def request(self, host, handler, request_body, verbose=0):
+        transport = self._thread_transport()
+        try:
+            return xmlrpclib.SafeTransport.request(transport, host, handler, request_body, verbose)
+        finally:
+            transport._release_connection()
+
+class SafeTransportWithCert(PooledTransportMixin, xmlrpclib.SafeTransport):
     '''Sample client for talking XMLRPC over SSL supplying
     a client X509 identity certificate.'''
 
     def __init__(self, use_datetime=0, keyfile=None, certfile=None,
-                 timeout=None, ssl_version=ssl.PROTOCOL_TLSv1, ciphers=None):
+                 timeout=None, ssl_version=ssl.PROTOCOL_TLSv1, ciphers=None, pool=connection_pool):
         # Ticket #776: As of Python 2.7.9, server certs are verified by default.
         # But we don't have those. To preserve old functionality with new python,
         # pass an explicit context
@@ -53,6 +196,7 @@ class SafeTransportWithCert(xmlrpclib.SafeTransport):
         self.ssl_version = ssl_version
         self.ciphers = ciphers
         self._connection = (None, None)
+        self._init_pool(pool)
 
     def make_connection(self, host):
         host_tuple = (host, self.__x509)
@@ -60,12 +204,14 @@ class SafeTransportWithCert(xmlrpclib.SafeTransport):
             return self._connection[1]
         #conn = xmlrpclib.SafeTransport.make_connection(self, host_tuple)
         chost, self._extra_headers, x509 = self.get_host_info(host_tuple)
+        key = (chost, self.__x509.get('key_file'), self.__x509.get('cert_file'),
+               self.ssl_version, self.ciphers, self._timeout)
         # HTTPSConnection instead of HTTPS is python issue6267 of June 2009 - before the 2.7 maint branch
         import sys
         if sys.version_info < (2,7,0):
             self._connection = host_tuple, TLS1P26HTTPS(chost, None, **(x509 or {}))
         else:
-            self._connection = host_tuple, TLS1HTTPSConnection(chost, None, **(x509 or {}))
+            self._connection = host_tuple, self._pooled_connection(key, lambda: TLS1HTTPSConnection(chost, None, **(x509 or {})))
         conn = self._connection[1]
         if hasattr(conn, '_conn'):
             # Python 2.6
@@ -100,6 +246,8 @@ class TLS1HTTPSConnection(httplib.HTTPSConnection):
             sock = socket.create_connection((self.host, self.port), self.timeout, self.source_address)
         else:
             sock = socket.create_connection((self.host, self.port), self.timeout)
+        # Connections may sit in the connection pool between calls
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
 
         # Note these next fixes require python at least from Oct 2009 so 2.6.3
         if sys.version_info >= (2,6,3):
@@ -134,9 +282,9 @@ class TLS1P26HTTPS(httplib.HTTPS):
                  strict=None):
         httplib.HTTPS.__init__(self, host, port, key_file, cert_file, strict)
 
-class SafeTransportNoCert(xmlrpclib.SafeTransport):
+class SafeTransportNoCert(PooledTransportMixin, xmlrpclib.SafeTransport):
     # A standard SafeTransport that honors the requested SSL timeout
-    def __init__(self, use_datetime=0, timeout=None, ssl_version=ssl.PROTOCOL_TLSv1, ciphers=None):
+    def __init__(self, use_datetime=0, timeout=None, ssl_version=ssl.PROTOCOL_TLSv1, ciphers=None, pool=connection_pool):
         # Ticket #776: As of Python 2.7.9, server certs are verified by default.
         # But we don't have those. To preserve old functionality with new python,
         # pass an explicit context
@@ -151,6 +299,7 @@ class SafeTransportNoCert(xmlrpclib.SafeTransport):
         self._timeout = timeout
         self.ssl_version = ssl_version
         self.ciphers = ciphers
+        self._init_pool(pool)
 
     def make_connection(self, host):
         host_tuple = (host, self.__x509)
@@ -158,11 +307,12 @@ class SafeTransportNoCert(xmlrpclib.SafeTransport):
             return self._connection[1]
         #conn = xmlrpclib.SafeTransport.make_connection(self, host_tuple)
         chost, self._extra_headers, x509 = self.get_host_info(host_tuple)
+        key = (chost, None, None, self.ssl_version, self.ciphers, self._timeout)
         import sys
         if sys.version_info < (2,7,0):
             self._connection = host_tuple, TLS1P26HTTPS(chost, None, **(x509 or {}))
         else:
-            self._connection = host_tuple, TLS1HTTPSConnection(chost, None, **(x509 or {}))
+            self._connection = host_tuple, self._pooled_connection(key, lambda: TLS1HTTPSConnection(chost, None, **(x509 or {})))
         conn = self._connection[1]
         if hasattr(conn, '_conn'):
             # Python 2.6
@@ -185,9 +335,12 @@ class SafeTransportNoCert(xmlrpclib.SafeTransport):
 # or else "HIGH:MEDIUM:!ADH:!SSLv2:!MD5:!RC4:@STRENGTH", which is what we use (though python2.6 ignores it).
 # By specifying TLSv1 this works at servers that have disabled SSLv2 and SSLv3.
 def make_client(url, keyfile, certfile, verbose=False, timeout=None,
-                allow_none=False, ssl_version=ssl.PROTOCOL_TLSv1, ciphers="HIGH:MEDIUM:!ADH:!SSLv2:!MD5:!RC4:@STRENGTH"):
+                allow_none=False, ssl_version=ssl.PROTOCOL_TLSv1, ciphers="HIGH:MEDIUM:!ADH:!SSLv2:!MD5:!RC4:@STRENGTH",
+                pool=connection_pool):
     """Create a connection to an XML RPC server, using SSL with client certificate
     authentication if requested.
+    Connections are borrowed from the given ConnectionPool (by default the process wide pool)
+    so repeated calls to the same server reuse a connection; supply pool=None to not pool.
     Returns the XML RPC server proxy.
     """
     cert_transport = None
@@ -204,7 +357,8 @@ def make_client(url, keyfile, certfile, verbose=False, timeout=None,
 
         cert_transport = SafeTransportWithCert(keyfile=keyfile,
                                                certfile=certfile,
-                                               timeout=timeout, ssl_version=ssl_version, ciphers=ciphers)
+                                               timeout=timeout, ssl_version=ssl_version, ciphers=ciphers,
+                                               pool=pool)
     else:
         # Note that the standard transport you get for https connections
         # does not take the requested timeout. So here we extend
@@ -216,7 +370,7 @@ def make_client(url, keyfile, certfile, verbose=False, timeout=None,
             url2 = url
         type, uri = urllib.splittype(url2.lower())
         if type == "https":
-            cert_transport = SafeTransportNoCert(timeout=timeout, ssl_version=ssl_version, ciphers=ciphers)
+            cert_transport = SafeTransportNoCert(timeout=timeout, ssl_version=ssl_version, ciphers=ciphers, pool=pool)
 
     return xmlrpclib.ServerProxy(url, transport=cert_transport,
                                  verbose=verbose, allow_none=allow_none)
@@ -244,10 +398,10 @@ import socket
 import sys
 import M2Crypto.SSL
 
-class SafeTransportWithCertM2Crypto(xmlrpclib.SafeTransport):
+class SafeTransportWithCertM2Crypto(PooledTransportMixin, xmlrpclib.SafeTransport):
 
     def __init__(self, use_datetime=0, ssl_context=None,
-                 timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+                 timeout=socket._GLOBAL_DEFAULT_TIMEOUT, pool=connection_pool):
         xmlrpclib.SafeTransport.__init__(self, use_datetime)
         self._ssl_context = ssl_context
         self._timeout = timeout
@@ -255,6 +409,7 @@ class SafeTransportWithCertM2Crypto(xmlrpclib.SafeTransport):
         # Python 2.7 introduces a connection cache.
         if not hasattr(self, '_connection'):
             self._connection = (None, None)
+        self._init_pool(pool)
 
     def make_connection27(self, host):
         if self._connection and host == self._connection[0]:
@@ -265,8 +420,17 @@ class SafeTransportWithCertM2Crypto(xmlrpclib.SafeTransport):
             # it is handled by the SSL Context. This one liner
             # avoids an eclipse warning
             _ = x509
-            conn = ContextHTTPSConnectionM2Crypto(chost, context=self._ssl_context,
-                                          timeout=self._timeout)
+            # The SSL context holds the client key and cert. Key on a weak
+            # reference to it rather than its id, which a new context could
+            # reuse once this one is freed, and which the pool must not
+            # keep alive.
+            context_ref = None
+            if self._ssl_context is not None:
+                context_ref = weakref.ref(self._ssl_context)
+            key = (chost, context_ref, self._timeout)
+            conn = self._pooled_connection(key,
+                                           lambda: ContextHTTPSConnectionM2Crypto(chost, context=self._ssl_context,
+                                                                                  timeout=self._timeout))
             # Cache the result for Python 2.7
             self._connection = host, conn
             return self._connection[1]
@@ -307,13 +471,14 @@ class ContextHTTPSConnectionM2Crypto(httplib.HTTPSConnection):
 
 def make_client_m2crypto(url, ssl_context, verbose=False,
                 timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
-                allow_none=False):
+                allow_none=False, pool=connection_pool):
     """Create an SSL connection to an XML RPC server.
+    Connections are borrowed from the given ConnectionPool, as in make_client.
     Returns the XML RPC server proxy.
     """
     cert_transport = None
     if ssl_context:
         cert_transport = SafeTransportWithCertM2Crypto(ssl_context=ssl_context,
-                                                       timeout=timeout)
+                                                       timeout=timeout, pool=pool)
     return xmlrpclib.ServerProxy(url, transport=cert_transport,
                                  verbose=verbose, allow_none=allow_none)
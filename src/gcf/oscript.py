@@ -109,29 +109,18 @@ from __future__ import absolute_import
 import ConfigParser
 from copy import deepcopy
 import datetime
-import inspect
-import logging.config
+import logging
 import optparse
 import os
 import shutil
 import sys
-import urllib
+import threading
+import time
 
 from .omnilib.util import OmniError, AMAPIError
-from .omnilib.handler import CallHandler
 from .omnilib.util.handler_utils import validate_url, printNicknames
+from .omnilib.util import aggnickcache
 
-# Explicitly import framework files so py2exe is happy
-from .omnilib.frameworks import framework_apg
-from .omnilib.frameworks import framework_base
-from .omnilib.frameworks import framework_gcf
-from .omnilib.frameworks import framework_gch
-from .omnilib.frameworks import framework_gib
-from .omnilib.frameworks import framework_of
-from .omnilib.frameworks import framework_pg
-from .omnilib.frameworks import framework_pgch
-from .omnilib.frameworks import framework_sfa
-from .omnilib.frameworks import framework_chapi
 from .gcf_version import GCF_VERSION
 
 #DEFAULT_RSPEC_LOCATION = "http://www.gpolab.bbn.com/experiment-support"               
@@ -167,6 +156,7 @@ def load_agg_nick_config(opts, logger):
         return config
 
     # the directory of this file
+    import inspect
     curr_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
     parent_dir = curr_dir.rsplit(os.sep,2)[0]
 
@@ -210,6 +200,15 @@ def load_agg_nick_config(opts, logger):
 
             logger.info("Loading agg_nick_cache file '%s'", filename)
 
+            # Use the compiled copy of the file if it is up to date,
+            # reading the nicknames only if something uses them
+            header = aggnickcache.readCompiledHeader(filename, logger)
+            if header is not None:
+                config['aggregate_nicknames'] = aggnickcache.LazyAggNicknames(
+                    lambda: load_compiled_agg_nicknames(filename, header, opts, logger))
+                config['omni_defaults'] = header['omni_defaults']
+                return config
+
             confparser = ConfigParser.RawConfigParser()
             try:
                 confparser.read(filename)
@@ -223,8 +222,29 @@ def load_agg_nick_config(opts, logger):
 
     config = load_aggregate_nicknames( config, confparser, filename, logger, opts )
     config = load_omni_defaults( config, confparser, filename, logger, opts )
+    # Save a compiled copy of the user's cache, to read next time.
+    # (Not of the agg_nick_cache.base installed with omni, whose directory
+    # may not be writable.)
+    if filename == os.path.expanduser(opts.aggNickCacheName):
+        aggnickcache.writeCompiled(filename, config['aggregate_nicknames'], config['omni_defaults'], logger)
     return config
 
+def load_compiled_agg_nicknames(filename, header, opts, logger):
+    """Return the aggregate nicknames from the compiled copy of the given agg_nick_cache
+    file (whose header we already read). If that fails, parse the file itself."""
+    try:
+        return aggnickcache.readCompiledNicknames(filename, header)
+    except Exception, e:
+        logger.debug("Failed to read compiled agg_nick_cache for '%s': %s", filename, e)
+    logger.info("Loading agg_nick_cache file '%s'", filename)
+    confparser = ConfigParser.RawConfigParser()
+    try:
+        confparser.read(filename)
+    except ConfigParser.Error as exc:
+        logger.error("agg_nick_cache file %s could not be parsed: %s"% (filename, str(exc)))
+        return {}
+    return load_aggregate_nicknames( {}, confparser, filename, logger, opts )['aggregate_nicknames']
+
 def locate_config( opts, logger, config={}):
     """Locate the omni config file.
     Search path:
@@ -393,6 +413,15 @@ def load_aggregate_nicknames( config, confparser, filename, logger, opts ):
     # Find aggregate nicknames
     if not config.has_key('aggregate_nicknames'):
         config['aggregate_nicknames'] = {}
+    nicknames = config['aggregate_nicknames']
+    if isinstance(nicknames, aggnickcache.LazyAggNicknames) and \
+            not (nicknames.loaded or nicknames.loading):
+        # The agg_nick_cache nicknames have not been read yet.
+        # Add these over them if they are ever needed.
+        # (While loading, this is that pending call: apply them now.)
+        if confparser.has_section('aggregate_nicknames'):
+            nicknames.whenLoaded(lambda: load_aggregate_nicknames( config, confparser, filename, logger, opts ))
+        return config
     if confparser.has_section('aggregate_nicknames'):
         for (key,val) in confparser.items('aggregate_nicknames'):
             temp = val.split(',')
@@ -457,6 +486,11 @@ def load_omni_defaults( config, confparser, filename, logger, opts ):
             config['omni_defaults'][key] = val
     return config
 
+# The control framework types (the 'type' of a framework in the omni_config).
+# The Framework for each type is in omnilib/frameworks/framework_<type>.py,
+# which is only imported if that type is used.
+FRAMEWORK_TYPES = ('apg', 'chapi', 'gcf', 'gch', 'gib', 'of', 'pg', 'pgch', 'sfa')
+
 def load_framework(config, opts):
     """Select the Control Framework to use from the config, and instantiate the proper class."""
 
@@ -467,7 +501,12 @@ def load_framework(config, opts):
     # inside the standard omni/gcf distribution, or deeper inside a larger package
     prefix = ".".join(__name__.split(".")[:-1])
 
-    framework_mod = __import__('%s.omnilib.frameworks.framework_%s' % (prefix, cf_type), fromlist=['%s.omnilib.frameworks' % (prefix)])
+    try:
+        framework_mod = __import__('%s.omnilib.frameworks.framework_%s' % (prefix, cf_type), fromlist=['%s.omnilib.frameworks' % (prefix)])
+    except ImportError, e:
+        if cf_type not in FRAMEWORK_TYPES:
+            raise OmniError, "Unknown framework type '%s' in configuration file (known types: %s)" % (cf_type, ", ".join(FRAMEWORK_TYPES))
+        raise
     config['selected_framework']['logger'] = config['logger']
     framework = framework_mod.Framework(config['selected_framework'], opts)
     return framework    
@@ -478,6 +517,7 @@ def update_agg_nick_cache( opts, logger ):
     tmpcache = None
     try:
         import tempfile
+        import urllib
         handle, tmpcache = tempfile.mkstemp()
         os.close(handle)
         # make sure the directory containing --aggNickCacheName exists
@@ -765,6 +805,91 @@ if __name__ == "__main__":
     # process the user's call
     return API_call( framework, config, args, opts, verbose=verbose )
 
+class Session(object):
+    """Omni state to re-use when a script makes many omni calls, like stitcher.
+
+    omni.call parses the options, configures logging, reads the omni_config
+    and agg_nick_cache, loads the framework (which fetches credentials) and
+    reads the GetVersion cache, every time it is called. A Session does that
+    once, and then each Session.call only parses its arguments before calling
+    the handler. The framework (with any credentials it has fetched),
+    the in memory GetVersion cache and the XML-RPC clients for each aggregate
+    URL are shared by all calls in the Session.
+
+    Calls may be made from several threads at once.
+    Options that configure the framework (see FIXED_OPTIONS) are fixed when
+    the Session is made, and a call that asks for other values is refused.
+    initSeconds is how long setting up the Session took (what each omni.call
+    would have spent), and calls / callSeconds count the calls made.
+    """
+
+    # Options the framework reads when it is made, or later from the
+    # Session's options: a call can not change them
+    FIXED_OPTIONS = ('framework', 'project', 'speaksfor', 'cred', 'ssltimeout')
+
+    # Options load_config may set from the omni_config. Calls that leave
+    # them at their defaults get the values the omni_config gave the Session.
+    CONFIG_OPTIONS = ('framework', 'project', 'useSliceMembers', 'ignoreConfigUsers')
+
+    def __init__(self, options=None, dictLoggingConfig=None):
+        """options is an optparse.Values object to use as the defaults for each call,
+        like the options to omni.call"""
+        start = time.time()
+        self.framework, self.config, args, self.opts = initialize([], options, dictLoggingConfig)
+        self.initSeconds = time.time() - start
+        self.lock = threading.RLock()
+        self.getVersionCache = None # Shared GetVersion cache, loaded by the first call
+        self.clients = {} # AM URL -> XML-RPC client
+        self.calls = 0
+        self.callSeconds = 0.0
+
+    def call(self, argv, options=None, verbose=False):
+        """Like omni.call, but using the framework and config of this Session.
+        options defaults to the options the Session was created with."""
+        if options is not None and not options.__class__==optparse.Values:
+            raise OmniError("Invalid options argument to call: must be an optparse.Values object")
+        if argv is None or not type(argv) == list:
+            raise OmniError("Invalid argv argument to call: must be a list")
+        if options is None:
+            options = self.opts
+        start = time.time()
+        try:
+            opts, args = parse_args(argv, options)
+            self._apply_options(opts)
+            return API_call(self.framework, self.config, args, opts, verbose=verbose, session=self)
+        finally:
+            with self.lock:
+                self.calls += 1
+                self.callSeconds += time.time() - start
+
+    def _apply_options(self, opts):
+        """Give the parsed options of a call the omni_config settings that
+        load_config gave the Session, and raise an OmniError if the call
+        asks for a framework option different from the Session's"""
+        defaults = getParser().defaults
+        for name in self.CONFIG_OPTIONS:
+            if getattr(opts, name, None) == defaults.get(name):
+                setattr(opts, name, getattr(self.opts, name, None))
+        for name in self.FIXED_OPTIONS:
+            if getattr(opts, name, None) != getattr(self.opts, name, None):
+                raise OmniError("Cannot change option %s to '%s' in a call in this Session: the Session uses '%s'. Make a new Session instead." % \
+                                    (name, getattr(opts, name, None), getattr(self.opts, name, None)))
+
+    def _share(self, amhandler):
+        """Have the given AMCallHandler use the GetVersion cache and clients of this Session"""
+        with self.lock:
+            if self.getVersionCache is None:
+                amhandler._load_getversion_cache()
+                self.getVersionCache = amhandler.GetVersionCache
+            amhandler.GetVersionCache = self.getVersionCache
+            amhandler.cacheLock = self.lock
+            amhandler.clientCache = self.clients
+
+    def summary(self):
+        """Return a string comparing the time spent in calls with the set up time saved"""
+        return "Made %d omni calls in %.1f seconds. Set up omni once in %.2f seconds, instead of for each call (saving about %.1f seconds)" % \
+            (self.calls, self.callSeconds, self.initSeconds, max(0, self.calls - 1) * self.initSeconds)
+
 def getOptsUsed(parser, opts, logger=None):
     '''Get string to print out the options supplied'''
     #sys.argv when called as a library is
@@ -817,10 +942,11 @@ def getOptsUsed(parser, opts, logger=None):
         nondef = "\n  Options as run:" + nondef + "\n\n  "
     return nondef
 
-def API_call( framework, config, args, opts, verbose=False ):
+def API_call( framework, config, args, opts, verbose=False, session=None ):
     """Call the function from the given args list. 
     Apply the options from the given optparse.Values opts argument
     If verbose, print the command and the summary.
+    If a Session is given, share its GetVersion cache and XML-RPC clients.
     Return is a list of 2 items: a human readable string summarizing the result 
     (possibly an error message), and the result object (may be None on error). The result 
     object type varies by underlying command called.
@@ -835,7 +961,10 @@ def API_call( framework, config, args, opts, verbose=False ):
         result = printNicknames(config, opts)
     else:
         # Process the user's call
+        from .omnilib.handler import CallHandler
         handler = CallHandler(framework, config, opts)
+        if session is not None:
+            session._share(handler.amhandler)
     #    Returns string, item
         result = handler._handle(args)
     if result is None:
@@ -914,7 +1043,8 @@ def configure_logging(opts, dictConfig=None):
             # Try to configure logging from the given object
             # Note this raises an exception if it fails (a ValueError, TypeError, AttributeError or ImportError)
             # Also note this only works in python2.7+
-            logging.config.dictConfig(dictConfig)
+            from logging import config as logging_config
+            logging_config.dictConfig(dictConfig)
         elif opts.logconfig:
             deft['optlevel'] = optlevel
             applyLogConfig(opts.logconfig, defaults=deft)
@@ -971,7 +1101,8 @@ def applyLogConfig(logConfigFilename, defaults={'optlevel': 'INFO'}):
             # Only new loggers get the parameters in the config file.
             # If disable_existing is True(default), then existing loggers are disabled,
             # unless they (or ancestors, not 'root') are explicitly listed in the config file.
-            logging.config.fileConfig(fn, defaults=defaults, disable_existing_loggers=False)
+            from logging import config as logging_config
+            logging_config.fileConfig(fn, defaults=defaults, disable_existing_loggers=False)
             logging.info("Configured logging from file %s", fn)
             found = True
             break
@@ -1166,7 +1297,7 @@ def getParser():
                       default="~/.gcf/get_version_cache.json",
                       help="File where GetVersion info will be cached, default is %default")
     gvgroup.add_option("--noCacheFiles", default=False, action="store_true",
-                       help="Disable both GetVersion and Aggregate Nickname cache functionality completely; no files are downloaded, saved, or loaded.")
+                       help="Disable the GetVersion, Aggregate Nickname, Credential and Advertisement cache functionality completely; no files are downloaded, saved, or loaded.")
     parser.add_option_group( gvgroup )
 
     # AggNick
@@ -1190,6 +1321,31 @@ def getParser():
                       help="Website with latest agg_nick_cache, default is %default. To force Omni to read this cache, delete your local AggNickCache or use --NoAggNickCache.")
     parser.add_option_group( angroup )
 
+    # Credentials
+    credgroup = optparse.OptionGroup( parser, "Credential Cache",
+                          "Control Cache of user and slice credentials from the clearinghouse" )
+    credgroup.add_option("--NoCredCache", dest='noCredCache',
+                      default=False, action="store_true",
+                      help="Do not use or save cached user and slice credentials; always get them from the clearinghouse (default is %default)")
+    credgroup.add_option("--CredCacheName", dest='credCacheName',
+                      default="~/.gcf/cred_cache.json",
+                      help="File where user and slice credentials will be cached until shortly before they expire, default is %default")
+    parser.add_option_group( credgroup )
+
+    # Advertisement cache
+    adgroup = optparse.OptionGroup( parser, "Advertisement Cache",
+                          "Control Cache of advertisement RSpecs from ListResources" )
+    adgroup.add_option("--use-cached-ad", dest='useCachedAd',
+                      default=False, action="store_true",
+                      help="Use the cached advertisement RSpec from an aggregate if it is not older than --max-ad-age, instead of calling ListResources (default is %default)")
+    adgroup.add_option("--max-ad-age", dest='maxAdAge',
+                      default=60, action="store", type="int", metavar="MINUTES",
+                      help="Age in minutes of a cached advertisement RSpec before --use-cached-ad refreshes it (default is %default)")
+    adgroup.add_option("--AdCacheName", dest='adCacheName',
+                      default="~/.gcf/ad_cache",
+                      help="Directory where advertisement RSpecs from ListResources will be cached (compressed), default is %default")
+    parser.add_option_group( adgroup )
+
     # Development / Advanced
     devgroup = optparse.OptionGroup( parser, "For Developers / Advanced Users",
                           "Features only needed by developers or advanced users" )
@@ -1212,9 +1368,17 @@ def getParser():
                       help="In AM API v2, if an AM returns a non-0 (failure) result code, raise an AMAPIError. Default is %default. For use by scripts.")
     devgroup.add_option("--maxBusyRetries", default=4, action="store", type="int",
                       help="Max times to retry AM or CH calls on getting a 'busy' error. Default: %default")
+    devgroup.add_option("--parallel", default=1, action="store", type="int", metavar="N",
+                      help="Contact up to N aggregates at a time when operating on multiple aggregates. " + \
+                          "Results are still reported in the usual order. Default: %default (one at a time)")
     devgroup.add_option("--no-compress", dest='geni_compressed', 
                       default=True, action="store_false",
                       help="Do not compress returned values")
+    devgroup.add_option("--streamRSpecs", default=False, action="store_true",
+                      help="Decompress, check and pretty print ListResources RSpecs a piece at a time, " + \
+                          "without building a DOM, to save memory. Done for any RSpec bigger than --streamRSpecThreshold")
+    devgroup.add_option("--streamRSpecThreshold", default=1000000, action="store", type="int", metavar="BYTES",
+                      help="Stream ListResources RSpecs when the AM returns more than this many bytes. Default: %default")
     devgroup.add_option("--abac", default=False, action="store_true",
                       help="Use ABAC authorization")
     devgroup.add_option("--arbitrary-option", dest='arbitrary_option',
@@ -1299,6 +1463,16 @@ def parse_args(argv, options=None, parser=None):
     if options.noAggNickCache and options.useAggNickCache:
         parser.error("Cannot both force not using the AggNick cache and force TO use it.")
 
+    options.credCacheName = os.path.normcase(os.path.expanduser(options.credCacheName))
+
+    options.adCacheName = os.path.normcase(os.path.expanduser(options.adCacheName))
+
+    if options.maxAdAge < 0:
+        parser.error("--max-ad-age must not be negative")
+
+    if options.parallel < 1:
+        parser.error("--parallel must be at least 1")
+
     if options.outputfile:
         options.output = True
 
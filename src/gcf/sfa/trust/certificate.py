@@ -715,24 +715,35 @@ class Certificate:
         # Verify a chain of certificates. Each certificate must be signed by
         # the public key contained in it's parent. The chain is recursed
         # until a certificate is found that is signed by a trusted root.
+        # trusted_certs may be a list of Certificates, or a TrustRootStore
+        # which finds the signing root by name and remembers verified chains.
 
         # verify expiration time
         if self.cert.has_expired():
             logger.debug("verify_chain: NO, Certificate %s has expired" % self.get_printable_subject())
             raise CertExpired(self.get_printable_subject(), "client cert")
 
+        store = None
+        if hasattr(trusted_certs, 'get_verified_chain'):
+            store = trusted_certs
+            version = store.version
+            (found, result) = store.get_verified_chain(self)
+            if found:
+                return result
+
         # if this cert is signed by a trusted_cert, then we are set
-        for trusted_cert in trusted_certs:
-            if self.is_signed_by_cert(trusted_cert):
-                # verify expiration of trusted_cert ?
-                if not trusted_cert.cert.has_expired():
-                    logger.debug("verify_chain: YES. Cert %s signed by trusted cert %s"%(
-                            self.get_printable_subject(), trusted_cert.get_printable_subject()))
-                    return trusted_cert
-                else:
-                    logger.debug("verify_chain: NO. Cert %s is signed by trusted_cert %s, but that signer is expired..."%(
-                            self.get_printable_subject(),trusted_cert.get_printable_subject()))
-                    raise CertExpired(self.get_printable_subject()," signer trusted_cert %s"%trusted_cert.get_printable_subject())
+        for trusted_cert in self._trusted_signers(trusted_certs):
+            # verify expiration of trusted_cert ?
+            if not trusted_cert.cert.has_expired():
+                logger.debug("verify_chain: YES. Cert %s signed by trusted cert %s"%(
+                        self.get_printable_subject(), trusted_cert.get_printable_subject()))
+                if store is not None:
+                    store.remember_verified_chain(self, trusted_cert, version)
+                return trusted_cert
+            else:
+                logger.debug("verify_chain: NO. Cert %s is signed by trusted_cert %s, but that signer is expired..."%(
+                        self.get_printable_subject(),trusted_cert.get_printable_subject()))
+                raise CertExpired(self.get_printable_subject()," signer trusted_cert %s"%trusted_cert.get_printable_subject())
 
         # if there is no parent, then no way to verify the chain
         if not self.parent:
@@ -767,8 +778,25 @@ class Certificate:
                          (self.get_printable_subject(),self.parent.get_printable_subject()))
         self.parent.verify_chain(trusted_certs)
 
+        if store is not None:
+            store.remember_verified_chain(self, None, version)
         return
 
+    ##
+    # Generate the trusted certs that signed this certificate.
+    # A TrustRootStore only checks the root(s) named as this cert's issuer;
+    # otherwise every trusted cert is tried.
+
+    def _trusted_signers(self, trusted_certs):
+        if hasattr(trusted_certs, 'find_signer'):
+            signer = trusted_certs.find_signer(self)
+            if signer is not None:
+                yield signer
+            return
+        for trusted_cert in trusted_certs:
+            if self.is_signed_by_cert(trusted_cert):
+                yield trusted_cert
+
     ### more introspection
     def get_extensions(self):
         # pyOpenSSL does not have a way to get extensions
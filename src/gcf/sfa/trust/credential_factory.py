@@ -38,10 +38,21 @@ class CredentialFactory:
 
     UNKNOWN_CREDENTIAL_TYPE = 'geni_unknown'
 
+    # Contents of each type element, found without copying the whole credential
+    TYPE_RE = re.compile(r'<type\s*>(.*?)</type\s*>', re.DOTALL)
+
     # Static Credential class method to determine the type of a credential
     # string depending on its contents
     @staticmethod
     def getType(credString):
+        types = [re.sub('\s', '', t) for t in CredentialFactory.TYPE_RE.findall(credString)]
+        if 'abac' in types:
+            return ABACCredential.ABAC_CREDENTIAL_TYPE
+        elif 'privilege' in types:
+            return Credential.SFA_CREDENTIAL_TYPE
+        elif len(types) > 0:
+            return types[0]
+        # No type element as such: search ignoring all whitespace, as this used to
         credString_nowhitespace = re.sub('\s', '', credString)
         if credString_nowhitespace.find('<type>abac</type>') > -1:
             return ABACCredential.ABAC_CREDENTIAL_TYPE
@@ -0,0 +1,206 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# XML digital signature verification for credentials.
+#
+# Two backends verify the Signature elements of a signed credential
+# against a set of trusted root certificates:
+#  - Xmlsec1Verifier runs the xmlsec1 program once per signature (the
+#    original implementation), from a temporary file.
+#  - PyXmlsecVerifier verifies in process using the python-xmlsec
+#    binding to libxmlsec1 (plus lxml), parsing the credential once
+#    from memory and checking all the signatures in one pass.
+# get_verifier() returns the in process verifier when the python
+# modules are installed, and otherwise falls back to xmlsec1.
+
+from __future__ import absolute_import
+
+import os
+import subprocess
+import tempfile
+import threading
+
+HAVEPYXMLSEC = False
+try:
+    from lxml import etree
+    import xmlsec
+    HAVEPYXMLSEC = True
+except:
+    pass
+
+XML_ID = '{http://www.w3.org/XML/1998/namespace}id'
+DSIG_SIGNATURE = '{http://www.w3.org/2000/09/xmldsig#}Signature'
+
+class SignatureNotVerified(Exception):
+    '''A signature in the credential did not verify.
+    ref is the ID of the Signature, msg the short reason, detail any full verifier output.'''
+    def __init__(self, ref, msg, detail=""):
+        Exception.__init__(self, "Signature %s: %s" % (ref, msg))
+        self.ref = ref
+        self.msg = msg
+        self.detail = detail
+
+def _to_bytes(xml):
+    if isinstance(xml, unicode):
+        return xml.encode('utf-8')
+    return xml
+
+def find_xmlsec1():
+    '''Find an xmlsec1 path, or return empty string'''
+    paths = ['/usr/bin','/usr/local/bin','/bin','/opt/bin','/opt/local/bin']
+    for path in paths:
+        if os.path.isfile(path + '/' + 'xmlsec1'):
+            return path + '/' + 'xmlsec1'
+    return ''
+
+class Xmlsec1Verifier(object):
+    '''Verify signatures by running the xmlsec1 program'''
+
+    name = "xmlsec1"
+
+    def __init__(self, xmlsec_path=None):
+        if xmlsec_path is None:
+            xmlsec_path = find_xmlsec1()
+        self.xmlsec_path = xmlsec_path
+
+    def verify(self, xml, refs, trusted_cert_files):
+        '''Verify the Signatures with the given IDs in the xml string, using
+        the given trusted root certificate files.
+        If refs is None, verify the first Signature in the document.
+        Raise SignatureNotVerified on failure.'''
+        xml = _to_bytes(xml)
+        cert_args = []
+        for x in trusted_cert_files:
+            cert_args += ['--trusted-pem', x]
+
+        fd, filename = tempfile.mkstemp()
+        try:
+            os.write(fd, xml)
+            os.close(fd)
+            if refs is None:
+                refs = [None]
+            for ref in refs:
+                cmd = [self.xmlsec_path, '--verify']
+                if ref is not None:
+                    cmd += ['--node-id', ref]
+                cmd += cert_args + [filename]
+                try:
+                    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                    verified = proc.communicate()[0]
+                except Exception, e:
+                    raise SignatureNotVerified(ref, "Failed to run xmlsec1: %s" % e)
+                if not verified.strip().startswith("OK"):
+                    # xmlsec errors have a msg= which is the interesting bit.
+                    mstart = verified.find("msg=")
+                    msg = ""
+                    if mstart > -1 and len(verified) > 4:
+                        mstart = mstart + 4
+                        mend = verified.find('\\', mstart)
+                        msg = verified[mstart:mend]
+                    raise SignatureNotVerified(ref, msg, verified.strip())
+        finally:
+            os.remove(filename)
+
+class PyXmlsecVerifier(object):
+    '''Verify signatures in process with the python-xmlsec binding'''
+
+    name = "python-xmlsec"
+
+    def __init__(self):
+        # libxmlsec1 keys managers are not safe to share between threads,
+        # so keep one per thread per set of trusted roots
+        self._local = threading.local()
+
+    def _keys_manager(self, trusted_cert_files):
+        managers = getattr(self._local, 'managers', None)
+        if managers is None:
+            managers = dict()
+            self._local.managers = managers
+        key = []
+        for f in trusted_cert_files:
+            try:
+                key.append((f, os.path.getmtime(f)))
+            except OSError:
+                key.append((f, None))
+        key = tuple(key)
+        if not managers.has_key(key):
+            manager = xmlsec.KeysManager()
+            for f in trusted_cert_files:
+                manager.load_cert(f, xmlsec.constants.KeyDataFormatPem,
+                                  xmlsec.constants.KeyDataTypeTrusted)
+            # Only keep the managers for the current trust roots
+            managers.clear()
+            managers[key] = manager
+        return managers[key]
+
+    def verify(self, xml, refs, trusted_cert_files):
+        '''Verify the Signatures with the given IDs in the xml string, using
+        the given trusted root certificate files.
+        If refs is None, verify the first Signature in the document.
+        Raise SignatureNotVerified on failure.'''
+        try:
+            root = etree.fromstring(_to_bytes(xml))
+        except Exception, e:
+            raise SignatureNotVerified(None, "Malformed XML: %s" % e)
+        sigs = dict()
+        first = None
+        for sig in root.iter(DSIG_SIGNATURE):
+            if first is None:
+                first = sig
+            sigs[sig.get(XML_ID)] = sig
+        if refs is None:
+            if first is None:
+                raise SignatureNotVerified(None, "No Signature found")
+            refs = [first.get(XML_ID)]
+
+        manager = self._keys_manager(trusted_cert_files)
+        for ref in refs:
+            if not sigs.has_key(ref):
+                raise SignatureNotVerified(ref, "No Signature with this ID")
+            ctx = xmlsec.SignatureContext(manager)
+            try:
+                ctx.verify(sigs[ref])
+            except Exception, e:
+                raise SignatureNotVerified(ref, str(e))
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+def get_verifier(xmlsec_path=None):
+    '''Return the signature verifier to use: a shared PyXmlsecVerifier if the
+    python-xmlsec and lxml modules are available, else an Xmlsec1Verifier.'''
+    global _verifier
+    with _verifier_lock:
+        if _verifier is None:
+            if HAVEPYXMLSEC:
+                _verifier = PyXmlsecVerifier()
+            else:
+                _verifier = Xmlsec1Verifier(xmlsec_path)
+        return _verifier
+
+def set_verifier(verifier):
+    '''Use the given verifier (say an Xmlsec1Verifier to force the old behavior).
+    None means pick one again on the next get_verifier.'''
+    global _verifier
+    with _verifier_lock:
+        _verifier = verifier
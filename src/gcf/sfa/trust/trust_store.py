@@ -0,0 +1,285 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+##
+# A TrustRootStore holds the trusted root certificates loaded once from
+# a file or directory, indexed by subject name and key identifier, so
+# that verifying a certificate chain needs at most one signature check
+# per link. It also remembers which chains have already verified.
+#
+# The store can be passed anywhere a list of trusted certs is accepted
+# (it iterates over the loaded GIDs). Certificate.verify_chain and
+# Credential.verify use the index and the memo when given a store.
+#
+# The store reloads when the root files change (checked at most every
+# checkInterval seconds), or on SIGHUP once a server has called
+# reload_on_sighup().
+##
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+import signal
+import threading
+import time
+import weakref
+
+from .gid import GID
+from ..util.sfalogging import logger
+
+def _key_ids(x509):
+    '''Return the (subjectKeyIdentifier, authorityKeyIdentifier keyid) of a pyOpenSSL X509, or None for each missing'''
+    ski = None
+    aki = None
+    try:
+        for i in range(x509.get_extension_count()):
+            ext = x509.get_extension(i)
+            name = ext.get_short_name()
+            if name == 'subjectKeyIdentifier':
+                ski = str(ext).strip().upper()
+            elif name == 'authorityKeyIdentifier':
+                for line in str(ext).splitlines():
+                    if line.startswith('keyid:'):
+                        aki = line[len('keyid:'):].strip().upper()
+    except Exception, e:
+        logger.debug("Could not read key identifiers: %s" % e)
+    return ski, aki
+
+# All live stores, for the SIGHUP handler to flag
+_stores = weakref.WeakValueDictionary()
+_sighupInstalled = False
+
+##
+# Reload all trusted root stores on SIGHUP. Servers call this once at
+# startup; it must be called from the main thread. Any previously
+# installed handler is still called.
+
+def reload_on_sighup():
+    global _sighupInstalled
+    if _sighupInstalled or not hasattr(signal, 'SIGHUP'):
+        return
+    try:
+        previous = signal.getsignal(signal.SIGHUP)
+        def handler(signum, frame):
+            # Just flag them: the next reload_if_changed does the work
+            for store in _stores.values():
+                store._reloadRequested = True
+            if callable(previous):
+                previous(signum, frame)
+        signal.signal(signal.SIGHUP, handler)
+        _sighupInstalled = True
+    except ValueError, e:
+        logger.warn("Cannot reload trusted roots on SIGHUP: %s" % e)
+
+class TrustRootStore(object):
+
+    # Name of the concatenated roots file made for the SSL library, which is not itself a root
+    CATEDCERTSFNAME = 'CATedCACerts.pem'
+
+    ##
+    # @param root_cert_fileordir A trusted root cert file, or a directory of them
+    # @param checkInterval Seconds between checks of whether the root files have changed
+    # @param maxVerified Number of verified chains to remember
+
+    def __init__(self, root_cert_fileordir, checkInterval=5, maxVerified=10000):
+        if root_cert_fileordir is None:
+            raise Exception("Missing Root certs argument")
+        self.root_cert_fileordir = os.path.expanduser(root_cert_fileordir)
+        self.checkInterval = checkInterval
+        self.maxVerified = maxVerified
+        self.lock = threading.RLock()
+        self.version = 0
+        self.files = []
+        self.certs = []
+        self.bySubject = {}
+        self.pubkeys = {}
+        self.keyIds = {}
+        self.verified = {}
+        self.hits = 0
+        self.misses = 0
+        self._signature = None
+        self._lastCheck = 0
+        self._reloadRequested = False
+        self.reload()
+        _stores[id(self)] = self
+
+    def _list_files(self):
+        if os.path.isdir(self.root_cert_fileordir):
+            files = []
+            for file in sorted(os.listdir(self.root_cert_fileordir)):
+                if file == TrustRootStore.CATEDCERTSFNAME:
+                    continue
+                path = os.path.join(self.root_cert_fileordir, file)
+                if os.path.isfile(path):
+                    files.append(path)
+            return files
+        elif os.path.isfile(self.root_cert_fileordir):
+            return [self.root_cert_fileordir]
+        else:
+            raise Exception("Couldn't find Root certs in %s" % self.root_cert_fileordir)
+
+    def _files_signature(self, files):
+        sig = []
+        for f in files:
+            try:
+                st = os.stat(f)
+                sig.append((f, st.st_mtime, st.st_size))
+            except OSError:
+                sig.append((f, None, None))
+        return tuple(sig)
+
+    ##
+    # Load (or reload) the trusted roots, forgetting all verified chains
+
+    def reload(self):
+        files = self._list_files()
+        signature = self._files_signature(files)
+        okFiles = []
+        certs = []
+        bySubject = {}
+        pubkeys = {}
+        keyIds = {}
+        for f in files:
+            try:
+                # Failures here include unreadable files
+                # or non PEM files
+                root = GID(filename=f)
+                pubkeys[id(root)] = root.get_pubkey()
+            except Exception, exc:
+                logger.error("Failed to load trusted cert from %s: %r" % (f, exc))
+                continue
+            okFiles.append(f)
+            certs.append(root)
+            bySubject.setdefault(root.cert.get_subject().der(), []).append(root)
+            keyIds[id(root)] = _key_ids(root.cert)[0]
+        with self.lock:
+            self.files = okFiles
+            self.certs = certs
+            self.bySubject = bySubject
+            self.pubkeys = pubkeys
+            self.keyIds = keyIds
+            self.verified = {}
+            self.version += 1
+            self._signature = signature
+            self._lastCheck = time.time()
+            self._reloadRequested = False
+        logger.info("Loaded %d trusted roots from %s (version %d)" % (len(certs), self.root_cert_fileordir, self.version))
+
+    ##
+    # Reload if SIGHUP was received, or if it has been checkInterval
+    # seconds since the last check and the root files have changed.
+    # Return True if the roots were reloaded.
+
+    def reload_if_changed(self):
+        if not self._reloadRequested:
+            if time.time() - self._lastCheck < self.checkInterval:
+                return False
+            self._lastCheck = time.time()
+            try:
+                if self._files_signature(self._list_files()) == self._signature:
+                    return False
+            except Exception, e:
+                logger.warn("Cannot check trusted roots in %s: %s" % (self.root_cert_fileordir, e))
+                return False
+        self.reload()
+        return True
+
+    def __iter__(self):
+        return iter(self.certs)
+
+    def __len__(self):
+        return len(self.certs)
+
+    ##
+    # Return the trusted root whose key signed the given Certificate, or None.
+    # Only roots whose subject is the cert's issuer are checked, those with a
+    # matching key identifier first.
+
+    def find_signer(self, cert):
+        with self.lock:
+            candidates = self.bySubject.get(cert.cert.get_issuer().der(), [])
+            pubkeys = self.pubkeys
+            keyIds = self.keyIds
+        if len(candidates) > 1:
+            aki = _key_ids(cert.cert)[1]
+            if aki is not None:
+                candidates = sorted(candidates, key=lambda root: keyIds.get(id(root)) != aki)
+        for root in candidates:
+            if cert.verify(pubkeys[id(root)]):
+                return root
+        return None
+
+    def _chain_key(self, cert):
+        return hashlib.sha1(cert.save_to_string(save_parents=True)).hexdigest()
+
+    def _chain_certs(self, cert):
+        chain = []
+        while cert is not None:
+            chain.append(cert)
+            cert = cert.parent
+        return chain
+
+    ##
+    # Has this cert chain already verified against this version of the store?
+    # Return a (found, result) tuple, where result is what verify_chain returned.
+
+    def get_verified_chain(self, cert):
+        key = self._chain_key(cert)
+        with self.lock:
+            entry = self.verified.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+        result, certs = entry
+        # Anything in the chain may have expired since it verified
+        for c in certs:
+            if c.cert.has_expired():
+                with self.lock:
+                    self.verified.pop(key, None)
+                    self.misses += 1
+                return False, None
+        with self.lock:
+            self.hits += 1
+        return True, result
+
+    ##
+    # Remember that this cert chain verified, with the given verify_chain result.
+    # version is the store version when verification started: if the roots
+    # have been reloaded since, the result is not kept.
+
+    def remember_verified_chain(self, cert, result, version):
+        certs = self._chain_certs(cert)
+        if result is not None:
+            certs.append(result)
+        key = self._chain_key(cert)
+        with self.lock:
+            if version != self.version:
+                return
+            if len(self.verified) >= self.maxVerified:
+                self.verified = {}
+            self.verified[key] = (result, certs)
+
+    def stats(self):
+        return "%d trusted roots (version %d), %d verified chains, %d hits, %d misses" % \
+            (len(self.certs), self.version, len(self.verified), self.hits, self.misses)
@@ -101,17 +101,9 @@
        [string dictionary] = omni.py print_sliver_expirations SLICENAME
 """
 
-# Explicitly import framework files so py2exe is happy
-import gcf.omnilib.frameworks.framework_apg
-import gcf.omnilib.frameworks.framework_base
-import gcf.omnilib.frameworks.framework_gcf
-import gcf.omnilib.frameworks.framework_gch
-import gcf.omnilib.frameworks.framework_gib
-import gcf.omnilib.frameworks.framework_of
-import gcf.omnilib.frameworks.framework_pg
-import gcf.omnilib.frameworks.framework_pgch
-import gcf.omnilib.frameworks.framework_sfa
-import gcf.omnilib.frameworks.framework_chapi
+# The framework modules are imported only when used (see
+# gcf.oscript.load_framework), so py2exe is told about them in
+# windows_install/setup.py
 
 if __name__ == '__main__':
   import gcf.oscript
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+""" Unit tests for VLANRange (gcf.omnilib.stitch.VLANRange): the bitmap
+    must behave like the set of ints it replaced"""
+
+import pickle
+import random
+import unittest
+
+from gcf.omnilib.stitch.VLANRange import VLAN, VLANRange
+
+def randomTags(rand, count=None):
+    '''Return a random set of VLAN tags, with some runs of consecutive tags'''
+    tags = set()
+    for i in range(rand.randint(0, 8) if count is None else count):
+        first = rand.randint(VLAN.minvlan(), VLAN.maxvlan())
+        last = min(first + rand.choice([0, 0, 1, 2, 50]), VLAN.maxvlan())
+        tags.update(range(first, last + 1))
+    return tags
+
+class VLANRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rand = random.Random(4094)
+
+    def assertSameTags(self, vlans, tags):
+        self.assertTrue(isinstance(vlans, VLANRange), "%r is not a VLANRange" % (vlans,))
+        self.assertEqual(set(vlans), tags)
+        self.assertEqual(list(vlans), sorted(tags))
+        self.assertEqual(len(vlans), len(tags))
+        self.assertEqual(bool(vlans), bool(tags))
+        self.assertTrue(vlans == tags)
+
+    def test_ranges(self):
+        self.assertSameTags(VLANRange(), set())
+        self.assertSameTags(VLANRange(7), set([7]))
+        self.assertSameTags(VLANRange(VLAN(7)), set([7]))
+        self.assertSameTags(VLANRange([1, 2, 3]), set([1, 2, 3]))
+        self.assertSameTags(VLANRange(set([4, 9])), set([4, 9]))
+        self.assertSameTags(VLANRange(VLANRange([4, 9])), set([4, 9]))
+        self.assertRaises(TypeError, VLANRange, "1-3")
+        for i in range(50):
+            tags = randomTags(self.rand)
+            vlans = VLANRange(list(tags))
+            self.assertSameTags(vlans, tags)
+            self.assertSameTags(vlans.copy(), tags)
+            self.assertSameTags(pickle.loads(pickle.dumps(vlans)), tags)
+            for tag in range(VLAN.minvlan(), VLAN.maxvlan() + 1, 7):
+                self.assertEqual(tag in vlans, tag in tags)
+        self.assertFalse(-1 in VLANRange([0]))
+        self.assertFalse("1" in VLANRange([1]))
+
+    def test_intersection_and_difference(self):
+        for i in range(100):
+            a = randomTags(self.rand)
+            b = randomTags(self.rand)
+            c = randomTags(self.rand)
+            va, vb, vc = VLANRange(list(a)), VLANRange(list(b)), VLANRange(list(c))
+            self.assertSameTags(va & vb, a & b)
+            self.assertSameTags(va - vb, a - b)
+            self.assertSameTags(va | vb, a | b)
+            self.assertSameTags(va ^ vb, a ^ b)
+            self.assertSameTags(va.intersection(vb, c), a.intersection(b, c))
+            self.assertSameTags(va.difference(vb, c), a.difference(b, c))
+            self.assertSameTags(va.union(b, vc), a.union(b, c))
+            self.assertSameTags(va.symmetric_difference(b), a.symmetric_difference(b))
+            # Against a plain set on either side
+            self.assertSameTags(va & b, a & b)
+            self.assertSameTags(va - b, a - b)
+            self.assertEqual(a & vb, a & b)
+            self.assertEqual(a - vb, a - b)
+            self.assertEqual(va <= vb, a <= b)
+            self.assertEqual(va < va | vb, a < a | b)
+            self.assertEqual(va >= va & vb, a >= a & b)
+            self.assertEqual(va.isdisjoint(vb), a.isdisjoint(b))
+            self.assertEqual(va == vb, a == b)
+            self.assertEqual(va != vb, a != b)
+
+            # In place forms, checking the count after each change
+            v = va.copy()
+            s = set(a)
+            v &= vb
+            s &= b
+            self.assertSameTags(v, s)
+            v |= vc
+            s |= c
+            self.assertSameTags(v, s)
+            v -= vb
+            s -= b
+            self.assertSameTags(v, s)
+            v ^= va
+            s ^= a
+            self.assertSameTags(v, s)
+            v.intersection_update(b, vc)
+            s.intersection_update(b, c)
+            self.assertSameTags(v, s)
+            v.update(a)
+            s.update(a)
+            v.difference_update(c)
+            s.difference_update(c)
+            self.assertSameTags(v, s)
+
+        # Items that cannot be VLAN tags are never in a VLANRange
+        self.assertSameTags(VLANRange([1, 2]) & set([1, 'x']), set([1]))
+        self.assertSameTags(VLANRange([1, 2]) - set([1, 'x']), set([2]))
+        self.assertFalse(VLANRange([1]) == set([1, 'x']))
+        self.assertFalse(VLANRange([1]) >= set([1, 'x']))
+        self.assertTrue(VLANRange([1]) <= set([1, 'x']))
+
+    def test_changes(self):
+        vlans = VLANRange()
+        tags = set()
+        for i in range(200):
+            tag = self.rand.randint(VLAN.minvlan(), VLAN.maxvlan())
+            if self.rand.random() < 0.6:
+                vlans.add(tag)
+                tags.add(tag)
+            else:
+                vlans.discard(tag)
+                tags.discard(tag)
+            self.assertEqual(len(vlans), len(tags))
+        self.assertSameTags(vlans, tags)
+        while tags:
+            self.assertEqual(vlans.pop(), min(tags))
+            tags.remove(min(tags))
+            self.assertEqual(len(vlans), len(tags))
+        self.assertRaises(KeyError, vlans.pop)
+        self.assertRaises(KeyError, vlans.remove, 5)
+        vlans.add(5)
+        vlans.remove(5)
+        self.assertSameTags(vlans, set())
+        vlans = VLANRange.fromString("any")
+        vlans.clear()
+        self.assertSameTags(vlans, set())
+
+    def test_from_and_to_string(self):
+        self.assertSameTags(VLANRange.fromString("1-20, 454, 700-801"),
+                            set(range(1, 21) + [454] + range(700, 802)))
+        self.assertSameTags(VLANRange.fromString(""), set())
+        self.assertSameTags(VLANRange.fromString(" 5 "), set([5]))
+        self.assertSameTags(VLANRange.fromString("3,1,2"), set([1, 2, 3]))
+        self.assertSameTags(VLANRange.fromString("9-7"), set())
+        self.assertRaises(ValueError, VLANRange.fromString, "a-b")
+        self.assertRaises(ValueError, VLANRange.fromString, "1-2-3")
+        self.assertRaises(ValueError, VLANRange.fromString, "none")
+        self.assertEqual(str(VLANRange()), "")
+        self.assertEqual(str(VLANRange([5])), "5")
+        self.assertEqual(str(VLANRange([5, 6])), "5,6")
+        self.assertEqual(str(VLANRange([5, 6, 7, 9])), "5-7,9")
+        for i in range(100):
+            tags = randomTags(self.rand)
+            vlans = VLANRange(list(tags))
+            string = str(vlans)
+            self.assertSameTags(VLANRange.fromString(string), tags)
+            # As the set of ints class wrote it
+            runs = []
+            for tag in sorted(tags):
+                if runs and runs[-1][1] == tag - 1:
+                    runs[-1][1] = tag
+                else:
+                    runs.append([tag, tag])
+            expected = []
+            for (first, last) in runs:
+                if last > first + 1:
+                    expected.append("%d-%d" % (first, last))
+                elif last > first:
+                    expected.append("%d,%d" % (first, last))
+                else:
+                    expected.append("%d" % first)
+            self.assertEqual(string, ','.join(expected))
+
+    def test_edge_tags(self):
+        everything = set(range(VLAN.minvlan(), VLAN.maxvlan() + 1))
+        self.assertEqual((VLAN.minvlan(), VLAN.maxvlan()), (0, 4095))
+        for string in ("any", "ANY", "*", "0-4095", "0-100,101-4095"):
+            vlans = VLANRange.fromString(string)
+            self.assertSameTags(vlans, everything)
+            self.assertEqual(str(vlans), "any")
+        self.assertSameTags(VLANRange.fromString("0"), set([0]))
+        self.assertSameTags(VLANRange.fromString("4095"), set([4095]))
+        self.assertSameTags(VLANRange.fromString("0,4095"), set([0, 4095]))
+        self.assertEqual(str(VLANRange([0, 4095])), "0,4095")
+        self.assertEqual(str(VLANRange([0, 1, 4094, 4095])), "0,1,4094,4095")
+        self.assertEqual(str(VLANRange(range(1, 4095))), "1-4094")
+        vlans = VLANRange.fromString("any")
+        self.assertEqual(vlans.pop(), 0)
+        self.assertEqual(len(vlans), 4095)
+        self.assertEqual(str(vlans), "1-4095")
+        vlans.discard(4095)
+        self.assertSameTags(vlans, set(range(1, 4095)))
+        self.assertSameTags(VLANRange.fromString("any") - VLANRange([0, 4095]), set(range(1, 4095)))
+        self.assertSameTags(VLANRange.fromString("any") & VLANRange.fromString("4090-4095"),
+                            set(range(4090, 4096)))
+        self.assertRaises(TypeError, VLAN, -1)
+        self.assertRaises(TypeError, VLAN, 4096)
+        self.assertRaises(TypeError, VLANRange, [4096])
+
+if __name__ == '__main__':
+    unittest.main()
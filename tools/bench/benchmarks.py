@@ -0,0 +1,632 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+"""Benchmarks for gcf and omni, each timing a change against what it replaced.
+
+Run from a source tree:
+    python tools/bench/benchmarks.py <benchmark> [options]
+Give a benchmark --help for its options. Benchmarks:
+    credentials  credential signature verification backends
+    slivers      reference AM sliver lookups and expiry
+    policy       ABAC policy evaluation
+    launch       stitcher launches, one aggregate at a time and in parallel
+    vlanrange    VLANRange operations
+    combine      combining stitched manifest RSpecs
+    paths        GENI in a Box routing path search
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import logging
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Use the gcf in this source tree
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+
+
+def bench_credentials(argv):
+    '''Time verifying credentials with each available signature
+    verification backend (the xmlsec1 command, and python-xmlsec if installed).'''
+    from gcf.sfa.trust.credential import Credential
+    from gcf.sfa.trust.signature_verifier import Xmlsec1Verifier, PyXmlsecVerifier, HAVEPYXMLSEC
+
+    parser = optparse.OptionParser(usage="%prog credentials [options] credfile [credfile ...]")
+    parser.add_option('--trusted_roots_directory',
+                      help='Directory of trusted root certs')
+    parser.add_option('-n', '--iterations', type='int', default=50,
+                      help='Times to verify each credential (default %default)')
+    options, args = parser.parse_args(argv)
+    if not args or not options.trusted_roots_directory:
+        parser.error("Specify credential files and --trusted_roots_directory")
+
+    roots = [os.path.join(options.trusted_roots_directory, f)
+             for f in os.listdir(options.trusted_roots_directory)
+             if f.endswith('.pem') or f.endswith('.crt')]
+
+    backends = [Xmlsec1Verifier()]
+    if HAVEPYXMLSEC:
+        backends.append(PyXmlsecVerifier())
+    else:
+        print "python-xmlsec not available: timing only xmlsec1"
+
+    for credfile in args:
+        cred = Credential(filename=credfile)
+        xml = cred.save_to_string()
+        refs = ["Sig_%s" % cred.get_refid()]
+        refs += ["Sig_%s" % ref for ref in cred.updateRefID()]
+        print "%s: %d signature(s)" % (credfile, len(refs))
+        for backend in backends:
+            start = time.time()
+            for i in range(options.iterations):
+                backend.verify(xml, refs, roots)
+            elapsed = time.time() - start
+            print "  %-15s %8.2f ms per credential" % (backend.name, 1000.0 * elapsed / options.iterations)
+
+def bench_slivers(argv):
+    '''Time sliver URN lookups and expiry checks at the reference AM
+    with many slivers, against the linear scans they replace.'''
+    from gcf.geni.am.am3 import ReferenceAggregateManager, Slice, STATE_GENI_ALLOCATED
+    from gcf.geni.am.fakevm import FakeVM
+    from gcf.geni.util.urn_util import publicid_to_urn
+
+    parser = optparse.OptionParser(usage="%prog slivers [options]")
+    parser.add_option('-n', '--slivers', type='int', default=10000,
+                      help='Number of slivers (default %default)')
+    parser.add_option('--per-slice', type='int', default=10,
+                      help='Slivers per slice (default %default)')
+    parser.add_option('-l', '--lookups', type='int', default=1000,
+                      help='Sliver URNs to look up (default %default)')
+    options, args = parser.parse_args(argv)
+
+    rootdir = tempfile.mkdtemp()
+    try:
+        ram = ReferenceAggregateManager(rootdir, 'geni//gpo//gcf', 'https://localhost:8001')
+    finally:
+        shutil.rmtree(rootdir)
+    ram.logger.setLevel(logging.WARN)
+    ram._agg.add_resources([FakeVM(ram._agg) for _ in range(options.slivers)])
+    resources = ram.resources(available=True)
+    now = datetime.datetime.utcnow()
+    user_urn = publicid_to_urn('IDN geni//gpo//gcf user bench')
+    start = time.time()
+    for i in range(options.slivers):
+        slice_urn = publicid_to_urn('IDN geni//gpo//gcf slice bench%d' % (i / options.per_slice))
+        the_slice = ram._slices.setdefault(slice_urn, Slice(slice_urn))
+        resource = resources[i]
+        resource.available = False
+        sliver = the_slice.add_resource(resource)
+        sliver.setStartTime(now)
+        sliver.setEndTime(now + ram.max_lease)
+        sliver.setAllocationState(STATE_GENI_ALLOCATED)
+        ram._add_sliver(sliver, user_urn, now + datetime.timedelta(seconds=i + 60))
+        ram._agg.allocate(slice_urn, [resource])
+        ram._agg.allocate(user_urn, [resource])
+    print "Allocated %d slivers in %d slices in %.2f s" % \
+        (options.slivers, len(ram._slices), time.time() - start)
+
+    all_slivers = [s for a_slice in ram._slices.values() for s in a_slice.slivers()]
+    step = max(1, len(all_slivers) / options.lookups)
+    wanted = [s.urn() for s in all_slivers[::step]][:options.lookups]
+
+    def linear_find(urn_str):
+        for a_slice in ram._slices.values():
+            for sliver in a_slice.slivers():
+                if sliver.urn() == urn_str:
+                    return sliver
+
+    start = time.time()
+    for urn_str in wanted:
+        linear_find(urn_str)
+    linear = time.time() - start
+    start = time.time()
+    for urn_str in wanted:
+        ram.decode_urns([urn_str])
+    indexed = time.time() - start
+    print "Decode %d sliver URNs: linear scan %.3f s, index %.3f s" % \
+        (len(wanted), linear, indexed)
+
+    start = time.time()
+    for a_slice in ram._slices.values():
+        for sliver in a_slice.slivers():
+            sliver.expiration() < now
+    linear = time.time() - start
+    start = time.time()
+    ram.expire_slivers()
+    indexed = time.time() - start
+    print "Check expiry with nothing due: linear scan %.4f s, heap %.4f s" % \
+        (linear, indexed)
+
+    # Make the first tenth of the slivers due
+    due = options.slivers / 10
+    for sliver in all_slivers[:due]:
+        ram._set_expiration(sliver, now - datetime.timedelta(seconds=1))
+    start = time.time()
+    ram.expire_slivers()
+    print "Expire %d of %d slivers: %.3f s (%d left)" % \
+        (due, options.slivers, time.time() - start, len(ram._slivers))
+
+def bench_policy(argv):
+    '''Time evaluating an ABAC policy on one call as the number of
+    conditional assertions and of credential assertions grows, compiled
+    and with the text substitution and eval it replaces.'''
+    from gcf.geni.auth.abac_policy import CompiledPolicy, split_assertion
+
+    parser = optparse.OptionParser(usage="%prog policy [options]")
+    parser.add_option('-n', '--iterations', type='int', default=200,
+                      help='Calls to time per case (default %default)')
+    options, args = parser.parse_args(argv)
+
+    def textual(clause_sets, queries, bindings, assertions):
+        def bind(expr):
+            for name, value in bindings.items():
+                expr = expr.replace(name, value)
+            return expr
+        generated = []
+        for clause_set in clause_sets:
+            if not eval(bind(clause_set['precondition'])): continue
+            for ca in clause_set['clauses']:
+                if '$' in bind(ca['condition']) or not eval(bind(ca['condition'])): continue
+                generated.append(bind(ca['assertion']))
+        assertions = generated + assertions
+        def prove(lhs, target, seen):
+            for a in assertions:
+                a_lhs, a_rhs = split_assertion(a)
+                if a_lhs == lhs and a_rhs not in seen:
+                    if a_rhs == target or prove(a_rhs, target, seen | set([a_rhs])):
+                        return True
+            return False
+        for q in queries:
+            lhs, rhs = split_assertion(bind(q))
+            prove(lhs, rhs, set())
+
+    logging.getLogger('gcf.abac_auth').setLevel(logging.WARN)
+    caller = 'urn:publicid:IDN+example.com+user+alice'
+    print "%8s %8s %12s %12s" % ("clauses", "creds", "compiled ms", "textual ms")
+    for num_clauses in (10, 100, 1000):
+        for num_creds in (1, 10, 100):
+            clauses = [{'condition' : "'$CALLER_AUTHORITY' in $AUTHS and $COUNT%d > %d" % (i, i),
+                        'assertion' : "AM.ROLE%d<-$CALLER" % i}
+                       for i in range(num_clauses)]
+            clause_sets = [{'precondition' : 'True', 'clauses' : clauses}]
+            queries = ["AM.IS_AUTHORIZED<-$CALLER", "AM.ROLE0<-$CALLER"]
+            constants = {'$AUTHS' : "['urn:publicid:IDN+example.com+authority+ca']"}
+            policy = CompiledPolicy(clause_sets, [], queries[:1], queries[1:],
+                                    dict((q, q) for q in queries), {}, constants)
+            bindings = {'$CALLER' : caller,
+                        '$CALLER_AUTHORITY' : 'urn:publicid:IDN+example.com+authority+ca'}
+            for i in range(num_clauses):
+                bindings['$COUNT%d' % i] = str(num_clauses - i)
+            # A chain of delegations from AM.IS_AUTHORIZED to the caller
+            creds = ["AM.IS_AUTHORIZED<-PA.MEMBER0"]
+            creds += ["PA.MEMBER%d<-PA.MEMBER%d" % (i, i + 1) for i in range(num_creds - 1)]
+            creds.append("PA.MEMBER%d<-%s" % (num_creds - 1, caller))
+
+            start = time.time()
+            for i in range(options.iterations):
+                policy.evaluate_queries(bindings, policy.generate_assertions(bindings) + creds)
+            compiled = (time.time() - start) / options.iterations
+
+            all_bindings = dict(bindings.items() + constants.items())
+            iterations = max(1, options.iterations / 20)
+            start = time.time()
+            for i in range(iterations):
+                textual(clause_sets, queries, all_bindings, creds)
+            text = (time.time() - start) / iterations
+            print "%8d %8d %12.3f %12.3f" % (num_clauses, num_creds, 1000 * compiled, 1000 * text)
+
+def bench_launch(argv):
+    '''Compare one-at-a-time and parallel stitcher launches over simulated
+    topologies. Each simulated aggregate takes as long to reserve as a
+    stitcher --fakeModeDir call with no saved result (a random 1 to 5
+    seconds), times --scale. Some first reservations fail and must retry.
+    The simulated aggregates only stand in for Aggregate.allocate (and lock
+    the stitching state as it does), so this times the launcher scheduling,
+    not the rest of stitch/objects.'''
+    from gcf.omnilib.stitch.launcher import Launcher
+    from gcf.omnilib.stitch.objects import Aggregate, stateLocked, stateUnlocked
+    from gcf.omnilib.stitch.utils import StitchingRetryAggregateNewVlanImmediatelyError
+
+    class _FakeAggregate(object):
+        def __init__(self, name, dependsOn, latency, failFirst):
+            self.nick = name
+            self.urn = name
+            self._dependsOn = dependsOn
+            self.latency = latency
+            self.failFirst = failFirst
+            self.completed = False
+            self.inProcess = False
+            self.userRequested = True
+            self.manifestDom = None
+            self.api_version = 3
+            self.triedRes = False
+            self.dcn = False
+
+        def __repr__(self):
+            return "<Aggregate %s>" % self.nick
+
+        @property
+        def dependencies_complete(self):
+            return reduce(lambda a, b: a and b, [agg.completed for agg in self._dependsOn], True)
+
+        @property
+        def ready(self):
+            return not self.completed and not self.inProcess and self.dependencies_complete
+
+        def allocate(self, opts, slicename, rspecDom, scsCallCount):
+            # Lock the stitching state as Aggregate.allocate does,
+            # letting go only during the (simulated) AM call
+            with stateLocked():
+                self.inProcess = True
+                self.triedRes = True
+                with stateUnlocked():
+                    time.sleep(self.latency)
+                self.inProcess = False
+                if self.failFirst:
+                    self.failFirst = False
+                    raise StitchingRetryAggregateNewVlanImmediatelyError("VLAN unavailable at %s" % self.nick)
+                self.completed = True
+
+    class _FakeRSpec(object):
+        dom = None
+
+    def topology(kind, n, rand, scale, failRate):
+        '''Return n fake aggregates wired as a chain, a star or a binary tree'''
+        aggs = []
+        for i in range(n):
+            if i == 0:
+                deps = []
+            elif kind == 'chain':
+                deps = [aggs[i - 1]]
+            elif kind == 'star':
+                deps = [aggs[0]]
+            else:
+                deps = [aggs[(i - 1) / 2]]
+            aggs.append(_FakeAggregate("am%d" % i, deps, rand.randrange(1, 6) * scale,
+                                       rand.random() < failRate))
+        return aggs
+
+    parser = optparse.OptionParser(usage="%prog launch [options]")
+    parser.add_option('-n', '--aggregates', type='int', default=8,
+                      help='Aggregates per topology (default %default)')
+    parser.add_option('--parallel', type='int', default=8,
+                      help='Aggregates to reserve at once in the parallel launch (default %default)')
+    parser.add_option('--scale', type='float', default=0.1,
+                      help='Multiply simulated AM latency and retry pauses by this (default %default)')
+    parser.add_option('--failRate', type='float', default=0.2,
+                      help='Fraction of aggregates whose first reservation must retry (default %default)')
+    parser.add_option('--seed', type='int', default=1)
+    options, args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARN)
+    Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS = 15 * options.scale
+
+    for kind in ('chain', 'star', 'tree'):
+        times = []
+        for parallel in (1, options.parallel):
+            opts = optparse.Values(dict(parallel=parallel, noTransitAMs=False, timeout=60))
+            aggs = topology(kind, options.aggregates, random.Random(options.seed), options.scale, options.failRate)
+            launcher = Launcher(opts, "bench", aggs)
+            start = time.time()
+            launcher.launch(_FakeRSpec(), 0)
+            times.append(time.time() - start)
+        print "%-5s %3d AMs: one at a time %6.2fs, up to %d at a time %6.2fs (%.1fx)" % \
+            (kind, options.aggregates, times[0], options.parallel, times[1], times[0] / max(times[1], 0.001))
+
+def bench_vlanrange(argv):
+    '''Time the VLAN range operations the stitcher does most, against the
+    same operations on a python set of ints (what a VLANRange used to be).'''
+    from gcf.omnilib.stitch.VLANRange import VLANRange
+
+    parser = optparse.OptionParser(usage="%prog vlanrange")
+    options, args = parser.parse_args(argv)
+
+    def timeit(func, n=2000):
+        start = time.time()
+        for i in xrange(n):
+            func()
+        return (time.time() - start) * 1000000.0 / n
+
+    def setFromString(stringIn):
+        newSet = set()
+        for item in stringIn.split(","):
+            parts = [int(p) for p in item.split("-")]
+            for tag in xrange(parts[0], parts[-1]+1):
+                newSet.add(tag)
+        return newSet
+
+    avail = "2-1000,1200-3000,3500-4000"
+    sug = "1210"
+    anyStr = "0-4095"
+    vAny, vAvail, vSug = VLANRange.fromString(anyStr), VLANRange.fromString(avail), VLANRange.fromString(sug)
+    sAny, sAvail, sSug = setFromString(anyStr), setFromString(avail), setFromString(sug)
+    ops = [
+        ("fromString('any')", lambda: VLANRange.fromString("any"), lambda: setFromString(anyStr)),
+        ("fromString(avail)", lambda: VLANRange.fromString(avail), lambda: setFromString(avail)),
+        ("avail & any", lambda: vAvail & vAny, lambda: sAvail & sAny),
+        ("avail - sug", lambda: vAvail - vSug, lambda: sAvail - sSug),
+        ("avail | any", lambda: vAvail.union(vAny), lambda: sAvail.union(sAny)),
+        ("sug <= avail", lambda: vSug <= vAvail, lambda: sSug <= sAvail),
+        ("avail == any", lambda: vAvail == vAny, lambda: sAvail == sAny),
+        ("1210 in avail", lambda: 1210 in vAvail, lambda: 1210 in sAvail),
+        ("len(avail)", lambda: len(vAvail), lambda: len(sAvail)),
+        # The old __str__ started by sorting the set
+        ("str(avail)", lambda: str(vAvail), lambda: sorted(sAvail)),
+        ]
+    print "\n%-20s %12s %12s" % ("Operation", "VLANRange", "set")
+    for (name, bitmapOp, setOp) in ops:
+        print "%-20s %10.1fus %10.1fus" % (name, timeit(bitmapOp), timeit(setOp))
+
+def bench_combine(argv):
+    '''Time combining synthetic manifests from a chain of aggregates, each
+    with many nodes and links, and one stitched link (path) to the next
+    aggregate.'''
+    from xml.dom.minidom import parseString
+    from gcf.omnilib.stitch import defs
+    from gcf.omnilib.stitch.ManifestRSpecCombiner import combineManifestRSpecs
+
+    RSPEC_NS = "http://www.geni.net/resources/rspec/3"
+
+    class _FakeHopLink(object):
+        def __init__(self, urn, vlan):
+            self.urn = urn
+            self.vlan_suggested_manifest = vlan
+            self.vlan_suggested_request = vlan
+            self.vlan_range_request = vlan
+            self.ofAMUrl = None
+            self.controllerUrl = None
+
+    class _FakePath(object):
+        def __init__(self, pathId):
+            self.id = pathId
+
+    class _FakeHop(object):
+        def __init__(self, agg, hopId, pathId, linkUrn, vlan):
+            self.aggregate = agg
+            self._id = hopId
+            self.path = _FakePath(pathId)
+            self._hop_link = _FakeHopLink(linkUrn, vlan)
+            self.globalId = None
+            self.import_vlans_from = None
+            self.vlans_unavailable = None
+
+    class _FakeAggregate(object):
+        def __init__(self, i):
+            self.urn = "urn:publicid:IDN+am%d.example.net+authority+am" % i
+            self.urn_syns = [self.urn]
+            self.url = "https://am%d.example.net/" % i
+            self.nick = "am%d" % i
+            self.api_version = 3
+            self.userRequested = True
+            self.dependsOn = []
+            self.hops = []
+            self._hops = self.hops
+            self.isEG = False
+            self.dcn = False
+            self.pgLogUrl = None
+            self.lastError = None
+            self.manifestDom = None
+            self.requestDom = None
+
+        def __str__(self):
+            return "<Aggregate %s>" % self.nick
+
+    def makeRSpec(aggs, numNodes, numLinks, manifestOf=None):
+        '''The request RSpec for all aggregates, or the manifest from one of them'''
+        out = ['<rspec xmlns="%s" type="%s">' % (RSPEC_NS, manifestOf and "manifest" or "request")]
+        def mine(i):
+            return manifestOf is None or manifestOf == i
+        def sliver(i, name):
+            if manifestOf == i:
+                return ' sliver_id="%s+sliver+%s"' % (aggs[i].urn[:-len("+authority+am")], name)
+            return ''
+        for i, agg in enumerate(aggs):
+            if not mine(i):
+                continue
+            for n in range(numNodes):
+                out.append('<node client_id="n%d-%d" component_manager_id="%s"%s><interface client_id="n%d-%d:if0"/></node>' %
+                           (i, n, agg.urn, sliver(i, "n%d-%d" % (i, n)), i, n))
+            for l in range(numLinks):
+                out.append('<link client_id="lan%d-%d"%s><component_manager name="%s"/><interface_ref client_id="n%d-%d:if0"%s/><interface_ref client_id="n%d-%d:if0"%s/></link>' %
+                           (i, l, sliver(i, "lan%d-%d" % (i, l)), agg.urn, i, l % numNodes, sliver(i, "if%d-%da" % (i, l)), i, (l+1) % numNodes, sliver(i, "if%d-%db" % (i, l))))
+        for i in range(1, len(aggs)):
+            if not (mine(i - 1) or mine(i)):
+                continue
+            vlan = ''
+            if manifestOf is not None:
+                vlan = ' vlantag="%d"%s' % (100 + i, sliver(manifestOf, "stitch%d" % i))
+            out.append('<link client_id="stitch%d"%s><component_manager name="%s"/><component_manager name="%s"/><interface_ref client_id="n%d-0:if0"%s/><interface_ref client_id="n%d-0:if0"%s/></link>' %
+                       (i, vlan, aggs[i-1].urn, aggs[i].urn, i-1, sliver(i-1, "sif%da" % i), i, sliver(i, "sif%db" % i)))
+        out.append('<stitching xmlns="%s" lastUpdateTime="now">' % defs.STITCH_V2_NS)
+        for i in range(1, len(aggs)):
+            if not (mine(i - 1) or mine(i)):
+                continue
+            out.append('<path id="stitch%d">' % i)
+            for h, j in ((1, i - 1), (2, i)):
+                vlan = "any"
+                if manifestOf == j:
+                    vlan = str(100 + i)
+                out.append('<hop id="%d"><link id="%s+interface+stitch%d"><suggestedVLANRange>%s</suggestedVLANRange></link></hop>' % (h, aggs[j].urn, i, vlan))
+            out.append('</path>')
+        out.append('</stitching></rspec>')
+        return "".join(out)
+
+    parser = optparse.OptionParser(usage="%prog combine [options]")
+    parser.add_option('--nodes', type='int', default=50,
+                      help='Nodes per aggregate (default %default)')
+    parser.add_option('--links', type='int', default=50,
+                      help='Links within each aggregate (default %default)')
+    parser.add_option('--aggregates', default="2,4,8,16",
+                      help='Comma separated numbers of aggregates to time (default %default)')
+    options, args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARN)
+
+    print "%4s %8s %10s %10s" % ("AMs", "elements", "seconds", "us/element")
+    for numAggs in [int(n) for n in options.aggregates.split(",")]:
+        aggs = [_FakeAggregate(i) for i in range(numAggs)]
+        for i in range(1, numAggs):
+            for h, j in ((1, i - 1), (2, i)):
+                aggs[j].hops.append(_FakeHop(aggs[j], str(h), "stitch%d" % i, "%s+interface+stitch%d" % (aggs[j].urn, i), str(100 + i)))
+        for i, agg in enumerate(aggs):
+            agg.manifestDom = parseString(makeRSpec(aggs, options.nodes, options.links, i))
+        template = parseString(makeRSpec(aggs, options.nodes, options.links))
+        elements = len(template.getElementsByTagName('*'))
+        start = time.time()
+        combineManifestRSpecs(aggs, template)
+        elapsed = time.time() - start
+        print "%4d %8d %10.2f %10.1f" % (numAggs, elements, elapsed, elapsed * 1000000.0 / elements)
+
+def bench_paths(argv):
+    '''Time finding the route from every host to every link (subnet), as
+    the GENI in a Box aggregate does when setting up routing, on generated
+    topologies.'''
+    from gcf.geni.am.gibaggregate.graphUtils import GraphNode, PathFinder, findShortestPath
+
+    class _Host(GraphNode) :
+        def __init__(self, name) :
+            self.name = name
+            self.NICs = []
+        def getNeighbors(self) :
+            return self.NICs
+        def getNodeName(self) :
+            return self.name
+
+    class _NIC(GraphNode) :
+        def __init__(self, host, link) :
+            self.myHost = host
+            self.link = link
+        def getNeighbors(self) :
+            return [self.link, self.myHost]
+        def getNodeName(self) :
+            return "%s:%s" % (self.myHost.name, self.link.name)
+
+    class _Link(GraphNode) :
+        def __init__(self, name) :
+            self.name = name
+            self.endPoints = []
+        def getNeighbors(self) :
+            return self.endPoints
+        def getNodeName(self) :
+            return self.name
+
+    def makeTopology(kind, size) :
+        """ Return the hosts and links of a ring, mesh (grid) or star
+            of about size hosts, with point to point links.
+        """
+        if kind == "mesh" :
+            side = max(2, int(round(size ** 0.5)))
+            names = ["h%d-%d" % (i, j) for i in range(side) for j in range(side)]
+            pairs = []
+            for i in range(side) :
+                for j in range(side) :
+                    if j + 1 < side :
+                        pairs.append((i * side + j, i * side + j + 1))
+                    if i + 1 < side :
+                        pairs.append((i * side + j, (i + 1) * side + j))
+        elif kind == "star" :
+            names = ["h%d" % i for i in range(size)]
+            pairs = [(0, i) for i in range(1, size)]
+        else :
+            names = ["h%d" % i for i in range(size)]
+            pairs = [(i, (i + 1) % size) for i in range(size)]
+        hosts = [_Host(name) for name in names]
+        links = []
+        for (a, b) in pairs :
+            link = _Link("link-%d-%d" % (a, b))
+            for host in (hosts[a], hosts[b]) :
+                nic = _NIC(host, link)
+                host.NICs.append(nic)
+                link.endPoints.append(nic)
+            links.append(link)
+        return hosts, links
+
+    def exhaustiveShortestPath(startNode, endNode, pathSoFar =[]) :
+        # The depth first search of every path this module used to do
+        pathSoFar = pathSoFar + [startNode]
+        if startNode == endNode :
+            return pathSoFar
+        pathFromHere = None
+        for neighbor in startNode.getNeighbors() :
+            if neighbor not in pathSoFar :
+                pathThruNeighbor = exhaustiveShortestPath(neighbor, endNode, pathSoFar)
+                if pathThruNeighbor != None :
+                    if (pathFromHere == None) or (len(pathThruNeighbor) < len(pathFromHere)) :
+                        pathFromHere = pathThruNeighbor
+        return pathFromHere
+
+    parser = optparse.OptionParser(usage="%prog paths [options]")
+    parser.add_option('--sizes', default="4,6,8,16,32,64",
+                      help='Comma separated numbers of hosts (default %default)')
+    parser.add_option('--max-exhaustive-seconds', type='float', default=2.0,
+                      dest='maxExhaustive',
+                      help='Stop timing the old depth first search for a topology ' +
+                      'once a size takes longer than this (default %default)')
+    options, args = parser.parse_args(argv)
+
+    print "%-5s %5s %6s %12s %12s %12s" % ("topo", "hosts", "paths", "exhaustive", "per path", "PathFinder")
+    for kind in ("ring", "mesh", "star") :
+        exhaustiveTooSlow = False
+        for size in [int(n) for n in options.sizes.split(",")] :
+            hosts, links = makeTopology(kind, size)
+            start = time.time()
+            perPath = {}
+            for host in hosts :
+                for link in links :
+                    perPath[(host, link)] = findShortestPath(host, link)
+            perPathTime = time.time() - start
+            start = time.time()
+            allPairs = PathFinder().allPairs(hosts, links)
+            allPairsTime = time.time() - start
+            assert allPairs == perPath
+            exhaustive = "-"
+            if not exhaustiveTooSlow :
+                start = time.time()
+                for host in hosts :
+                    for link in links :
+                        assert exhaustiveShortestPath(host, link) == perPath[(host, link)]
+                elapsed = time.time() - start
+                exhaustive = "%.4f" % elapsed
+                exhaustiveTooSlow = elapsed > options.maxExhaustive
+            print "%-5s %5d %6d %12s %12.4f %12.4f" % (kind, len(hosts), len(perPath), exhaustive, perPathTime, allPairsTime)
+
+BENCHMARKS = [('credentials', bench_credentials), ('slivers', bench_slivers), ('policy', bench_policy), ('launch', bench_launch), ('vlanrange', bench_vlanrange), ('combine', bench_combine), ('paths', bench_paths)]
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    benchmarks = dict(BENCHMARKS)
+    if not argv or argv[0] not in benchmarks:
+        print __doc__
+        return 2
+    benchmarks[argv[0]](argv[1:])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
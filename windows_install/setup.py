@@ -41,11 +41,14 @@ setup(console=['..\src\omni.py','..\src\omni-configure.py', '..\src\stitcher.py'
 
       options={
           'py2exe':{
+              # omni imports the framework files by name when used,
+              # so list them explicitly for py2exe
               'includes':'gcf.omnilib.frameworks.framework_apg, gcf.omnilib.frameworks.framework_base,\
 gcf.omnilib.frameworks.framework_gcf, gcf.omnilib.frameworks.framework_gch,\
 gcf.omnilib.frameworks.framework_gib, gcf.omnilib.frameworks.framework_of,\
 gcf.omnilib.frameworks.framework_pg, gcf.omnilib.frameworks.framework_pgch,\
- gcf.omnilib.frameworks.framework_sfa,gcf.omnilib,gcf.sfa,dateutil,gcf.geni,\
+ gcf.omnilib.frameworks.framework_sfa, gcf.omnilib.frameworks.framework_chapi,\
+gcf.omnilib,gcf.sfa,dateutil,gcf.geni,\
  copy,ConfigParser,logging,optparse,os,sys,string,re,platform,shutil,zipfile,logging,subprocess',
               }
             },